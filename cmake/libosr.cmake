@@ -15,6 +15,9 @@ target_link_libraries(osr PRIVATE ${ODE_LIBRARIES})
 
 target_link_libraries(osr PUBLIC OpenMP::OpenMP_CXX)
 
+## Micro-benchmarks of the collision checking primitives
+EASYADD(collisionbench osr)
+
 ## OPTIONAL FUNCTION 1: rendering
 if (USE_GPU)
 	target_compile_definitions(osr PUBLIC GPU_ENABLED=1)
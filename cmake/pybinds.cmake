@@ -1,7 +1,7 @@
 PYADD(pyosr osr)
 use_fcl(pyosr)
 
-PYADD(pyse3ompl ompl ompl_app_base)
+PYADD(pyse3ompl ompl ompl_app_base ${CMAKE_THREAD_LIBS_INIT})
 add_dependencies(pyse3ompl ext_ompl_app)
 use_fcl(pyse3ompl)
 
@@ -1,7 +1,11 @@
 #include "cdmodel.h"
 #include "scene.h"
+#include "mesh_cache.h"
 #include <iostream>
+#include <stdexcept>
 #include <fcl/fcl.h>
+#include <fcl/narrowphase/detail/traversal/collision_node.h>
+#include <fcl/narrowphase/detail/traversal/collision/mesh_collision_traversal_node.h>
 #include <igl/per_face_normals.h>
 #include <glm/gtx/io.hpp>
 
@@ -30,7 +34,7 @@ struct CDModel::CDModelData {
 	FMatrix eig_cache_findices; // Face INDICES -> findices
 	VMatrix eig_cache_fnormals;
 
-	void cache_eig_forms()
+	void cache_eig_forms(bool with_normals = true)
 	{
 		int NV = model.num_vertices;
 		int NF = model.num_tris;
@@ -44,6 +48,8 @@ struct CDModel::CDModelData {
 			eig_cache_findices(i, 1) = model.tri_indices[i][1];
 			eig_cache_findices(i, 2) = model.tri_indices[i][2];
 		}
+		if (!with_normals)
+			return;
 		igl::per_face_normals(eig_cache_vertices,
 		                      eig_cache_findices,
 		                      eig_cache_fnormals);
@@ -51,6 +57,13 @@ struct CDModel::CDModelData {
 
 	Eigen::Matrix<Scalar, 3, 3> MI_world, MI_center;
 	double volume;
+	double radius = 0.0;
+
+	void cache_radius()
+	{
+		if (eig_cache_vertices.rows() > 0)
+			radius = eig_cache_vertices.rowwise().norm().maxCoeff();
+	}
 
 	void cache_MI(const Vector3& center)
 	{
@@ -100,12 +113,43 @@ CDModel::CDModel(const Scene& scene)
 	std::cerr << "SC AABB size: " << scaabb.width() << ' ' << scaabb.height() << ' ' << scaabb.depth() << std::endl;
 	std::cerr << "SC AABB's should match AABB's" << std::endl;
 
-	// Cache libigl form of (V, F) to CDModelData
-	model_->cache_eig_forms();
 	Eigen::Matrix<Scalar, 3, 1> ecenter;
 	auto gcenter = scene.getCenter();
 	ecenter << gcenter[0], gcenter[1], gcenter[2];
+
+	// Face normals and the moment of inertia only depend on the mesh,
+	// its transform and its center
+	uint64_t hash = scene.getContentHash();
+	uint64_t xform_hash = 0;
+	MeshCache::CDData cached;
+	if (hash != 0) {
+		glm::mat4 xform = scene.getCalibrationTransform();
+		xform_hash = MeshCache::hashBytes(&xform[0][0], sizeof(float) * 16, hash);
+		xform_hash = MeshCache::hashBytes(ecenter.data(), sizeof(Scalar) * 3, xform_hash);
+		if (MeshCache::loadCD(hash, xform_hash, cached) &&
+		    cached.fnormals.rows() == model_->model.num_tris) {
+			model_->cache_eig_forms(false);
+			model_->eig_cache_fnormals = cached.fnormals;
+			model_->MI_world = cached.MI_world;
+			model_->MI_center = cached.MI_center;
+			model_->volume = cached.volume;
+			model_->cache_radius();
+			return;
+		}
+	}
+
+	// Cache libigl form of (V, F) to CDModelData
+	model_->cache_eig_forms();
 	model_->cache_MI(ecenter);
+	model_->cache_radius();
+
+	if (hash != 0) {
+		cached.fnormals = model_->eig_cache_fnormals;
+		cached.MI_world = model_->MI_world;
+		cached.MI_center = model_->MI_center;
+		cached.volume = model_->volume;
+		MeshCache::storeCD(hash, xform_hash, cached);
+	}
 }
 
 CDModel::~CDModel()
@@ -192,6 +236,19 @@ bool CDModel::collideBB(const CDModel& env,
 }
 
 
+double CDModel::distance(const CDModel& env,
+                          const Transform& envTf,
+                          const CDModel& rob,
+                          const Transform& robTf)
+{
+	fcl::DistanceRequest<CDModelData::Scalar> req;
+	fcl::DistanceResult<CDModelData::Scalar> res;
+	return fcl::distance(&env.model_->model, envTf,
+	                     &rob.model_->model, robTf,
+	                     req, res);
+}
+
+
 bool
 CDModel::collideForDetails(const CDModel& env,
                            const Transform& envTf,
@@ -224,6 +281,36 @@ CDModel::collideForDetails(const CDModel& env,
 }
 
 
+bool
+CDModel::collideWithStatistics(const CDModel& env,
+                               const Transform& envTf,
+                               const CDModel& rob,
+                               const Transform& robTf,
+                               unsigned long& bv_tests,
+                               unsigned long& leaf_tests)
+{
+	/*
+	 * fcl::collide does not return the traversal node, so run the
+	 * traversal it uses for OBBRSS meshes by ourselves
+	 */
+	fcl::CollisionRequest<CDModelData::Scalar> req;
+	fcl::CollisionResult<CDModelData::Scalar> res;
+	fcl::detail::MeshCollisionTraversalNodeOBBRSS<CDModelData::Scalar> node;
+	bv_tests = 0;
+	leaf_tests = 0;
+	if (!fcl::detail::initialize(node,
+	                             env.model_->model, envTf,
+	                             rob.model_->model, robTf,
+	                             req, res))
+		throw std::runtime_error("CDModel::collideWithStatistics: cannot initialize the traversal");
+	node.enable_statistics = true;
+	fcl::detail::collide(&node);
+	bv_tests = node.num_bv_tests;
+	leaf_tests = node.num_leaf_tests;
+	return res.isCollision();
+}
+
+
 const Eigen::Ref<Eigen::Matrix<CDModel::Scalar, -1, 3>>
 CDModel::vertices() const
 {
@@ -288,4 +375,10 @@ CDModel::volume() const
 	return model_->volume;
 }
 
+double
+CDModel::boundingRadius() const
+{
+	return model_->radius;
+}
+
 }
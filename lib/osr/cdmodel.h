@@ -37,6 +37,15 @@ public:
 			      const CDModel& rob,
 			      const Transform& robTf);
 
+	/*
+	 * Minimal distance b/w env and rob. Only meaningful if they do not
+	 * collide
+	 */
+	static double distance(const CDModel& env,
+			       const Transform& envTf,
+			       const CDModel& rob,
+			       const Transform& robTf);
+
 	static bool collideForDetails(
 	                    const CDModel& env,
 			    const Transform& envTf,
@@ -44,6 +53,19 @@ public:
 			    const Transform& robTf,
 			    Eigen::Matrix<int, -1, 2>& facePairs);
 
+	/*
+	 * Same as collide, but also reports the number of BV overlap tests and
+	 * triangle (leaf) tests in the BVH traversal, to measure the cost of
+	 * collision queries.
+	 */
+	static bool collideWithStatistics(
+	                    const CDModel& env,
+			    const Transform& envTf,
+			    const CDModel& rob,
+			    const Transform& robTf,
+			    unsigned long& bv_tests,
+			    unsigned long& leaf_tests);
+
 	using VMatrix = Eigen::Matrix<Scalar, -1, 3>;
 	using FMatrix = Eigen::Matrix<int, -1, 3>;
 
@@ -70,6 +92,10 @@ public:
 
 	double
 	volume() const;
+
+	// Maximal distance from the origin of the local frame to any vertex
+	double
+	boundingRadius() const;
 };
 
 }
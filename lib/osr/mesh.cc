@@ -57,6 +57,17 @@ Mesh::Mesh(aiMesh* mesh, glm::vec3 color)
 	empty_mesh_ = (indices_.size() == 0);
 }
 
+Mesh::Mesh(std::vector<Vertex> vertices,
+           std::vector<uint32_t> indices,
+           Eigen::Matrix<float, -1, 2, Eigen::RowMajor> uv)
+	:vertices_(std::move(vertices)),
+	 indices_(std::move(indices)),
+	 shared_from_(nullptr),
+	 uv_(std::move(uv))
+{
+	empty_mesh_ = (indices_.size() == 0);
+}
+
 Mesh::~Mesh()
 {
 }
@@ -29,6 +29,10 @@ class Mesh {
 public:
 	Mesh(std::shared_ptr<Mesh> other);
 	Mesh(aiMesh* mesh, glm::vec3 color);
+	// Used by MeshCache
+	Mesh(std::vector<Vertex> vertices,
+	     std::vector<uint32_t> indices,
+	     Eigen::Matrix<float, -1, 2, Eigen::RowMajor> uv);
 	virtual ~Mesh();
 
 	std::vector<Vertex>& getVertices();
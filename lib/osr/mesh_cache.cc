@@ -0,0 +1,383 @@
+#include "mesh_cache.h"
+#include "scene.h"
+#include "mesh.h"
+#include "node.h"
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <fstream>
+#include <iostream>
+#include <sstream>
+#include <stdexcept>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+
+namespace osr {
+
+namespace {
+
+// Bump this when the layout or the Assimp flags of Scene::load change.
+const char kSceneMagic[8] = {'O', 'S', 'R', 'M', 'E', 'S', 'H', '1'};
+const char kCDMagic[8] = {'O', 'S', 'R', 'C', 'D', 'A', 'T', '1'};
+const uint64_t kFNVOffset = 14695981039346656037ULL;
+const uint64_t kFNVPrime = 1099511628211ULL;
+
+bool dir_initialized = false;
+std::string cache_dir;
+MeshCache::Statistics stats;
+
+/*
+ * Read-only mapping of a whole file
+ */
+class MappedFile {
+	void* addr_ = MAP_FAILED;
+	size_t size_ = 0;
+public:
+	MappedFile(const std::string& fn)
+	{
+		int fd = ::open(fn.c_str(), O_RDONLY);
+		if (fd < 0)
+			return;
+		struct stat st;
+		if (::fstat(fd, &st) == 0 && st.st_size > 0) {
+			size_ = st.st_size;
+			addr_ = ::mmap(nullptr, size_, PROT_READ, MAP_PRIVATE, fd, 0);
+		}
+		::close(fd);
+	}
+
+	~MappedFile()
+	{
+		if (addr_ != MAP_FAILED)
+			::munmap(addr_, size_);
+	}
+
+	bool good() const { return addr_ != MAP_FAILED; }
+	const char* data() const { return static_cast<const char*>(addr_); }
+	size_t size() const { return size_; }
+};
+
+class Writer {
+	std::string buf_;
+public:
+	template<typename T>
+	void put(const T& v) { putArray(&v, 1); }
+
+	template<typename T>
+	void putArray(const T* p, size_t n)
+	{
+		buf_.append(reinterpret_cast<const char*>(p), sizeof(T) * n);
+	}
+
+	// Write to a temporary file and rename it, so readers never see a
+	// partial file.
+	void commit(const std::string& fn) const
+	{
+		std::string tmp = fn + ".tmp." + std::to_string(::getpid());
+		{
+			std::ofstream fout(tmp, std::ios::binary);
+			fout.write(buf_.data(), buf_.size());
+			if (!fout.good()) {
+				std::remove(tmp.c_str());
+				std::cerr << "[MeshCache] Cannot write " << tmp << std::endl;
+				return;
+			}
+		}
+		if (std::rename(tmp.c_str(), fn.c_str()) != 0) {
+			std::remove(tmp.c_str());
+			std::cerr << "[MeshCache] Cannot rename " << tmp << " to " << fn << std::endl;
+		}
+	}
+};
+
+class Reader {
+	const char* p_;
+	const char* end_;
+public:
+	Reader(const MappedFile& f)
+		:p_(f.data()), end_(f.data() + f.size())
+	{
+	}
+
+	template<typename T>
+	T get()
+	{
+		T v;
+		getArray(&v, 1);
+		return v;
+	}
+
+	template<typename T>
+	void getArray(T* p, size_t n)
+	{
+		size_t bytes = sizeof(T) * n;
+		if (size_t(end_ - p_) < bytes)
+			throw std::runtime_error("truncated cache file");
+		std::memcpy(p, p_, bytes);
+		p_ += bytes;
+	}
+
+	bool atEnd() const { return p_ == end_; }
+};
+
+std::string
+hex(uint64_t v)
+{
+	char buf[17];
+	std::snprintf(buf, sizeof(buf), "%016llx", (unsigned long long)v);
+	return buf;
+}
+
+std::string
+scene_path(uint64_t hash)
+{
+	return MeshCache::getDirectory() + "/" + hex(hash) + ".osrmesh";
+}
+
+std::string
+cd_path(uint64_t hash, uint64_t xform_hash)
+{
+	return MeshCache::getDirectory() + "/" + hex(hash) + "-" + hex(xform_hash) + ".osrcd";
+}
+
+void
+write_node(Writer& w, const Node& node)
+{
+	w.putArray(&node.xform[0][0], 16);
+	w.put<uint32_t>(node.meshes.size());
+	w.putArray(node.meshes.data(), node.meshes.size());
+	w.put<uint32_t>(node.nodes.size());
+	for (const auto& child : node.nodes)
+		write_node(w, *child);
+}
+
+std::shared_ptr<Node>
+read_node(Reader& r, size_t nmesh, int depth = 0)
+{
+	if (depth > 1024)
+		throw std::runtime_error("node tree is too deep");
+	std::shared_ptr<Node> node(new Node());
+	r.getArray(&node->xform[0][0], 16);
+	node->meshes.resize(r.get<uint32_t>());
+	r.getArray(node->meshes.data(), node->meshes.size());
+	for (auto m : node->meshes)
+		if (m >= nmesh)
+			throw std::runtime_error("invalid mesh index");
+	uint32_t nchild = r.get<uint32_t>();
+	for (uint32_t i = 0; i < nchild; i++)
+		node->nodes.emplace_back(read_node(r, nmesh, depth + 1));
+	return node;
+}
+
+void
+make_dirs(const std::string& dir)
+{
+	for (size_t pos = 1; pos != std::string::npos; ) {
+		pos = dir.find('/', pos + 1);
+		::mkdir(dir.substr(0, pos).c_str(), 0755);
+	}
+}
+
+}
+
+void
+MeshCache::setDirectory(const std::string& dir)
+{
+	dir_initialized = true;
+	cache_dir = dir;
+	if (!cache_dir.empty())
+		make_dirs(cache_dir);
+}
+
+std::string
+MeshCache::getDirectory()
+{
+	if (!dir_initialized) {
+		const char* env = std::getenv("OSR_MESH_CACHE_DIR");
+		setDirectory(env ? env : "");
+	}
+	return cache_dir;
+}
+
+uint64_t
+MeshCache::hashBytes(const void* data, size_t size, uint64_t seed)
+{
+	// FNV-1a
+	uint64_t h = seed;
+	auto p = static_cast<const unsigned char*>(data);
+	for (size_t i = 0; i < size; i++) {
+		h ^= p[i];
+		h *= kFNVPrime;
+	}
+	return h;
+}
+
+uint64_t
+MeshCache::hashFile(const std::string& fn)
+{
+	uint64_t h = hashBytes(kSceneMagic, sizeof(kSceneMagic), kFNVOffset);
+	MappedFile f(fn);
+	if (!f.good())
+		throw std::runtime_error("MeshCache: cannot read " + fn);
+	return hashBytes(f.data(), f.size(), h);
+}
+
+bool
+MeshCache::loadScene(uint64_t hash, Scene& scene, const glm::vec3* model_color)
+{
+	MappedFile f(scene_path(hash));
+	if (!f.good()) {
+		stats.misses++;
+		return false;
+	}
+	try {
+		Reader r(f);
+		char magic[8];
+		r.getArray(magic, 8);
+		if (std::memcmp(magic, kSceneMagic, 8) != 0 || r.get<uint64_t>() != hash)
+			throw std::runtime_error("cache key mismatch");
+		uint32_t nmesh = r.get<uint32_t>();
+		bool has_vertex_normal = r.get<uint32_t>() != 0;
+		glm::vec3 mean;
+		r.getArray(&mean[0], 3);
+
+		std::vector<std::shared_ptr<Mesh>> meshes;
+		for (uint32_t i = 0; i < nmesh; i++) {
+			uint32_t NV = r.get<uint32_t>();
+			uint32_t NI = r.get<uint32_t>();
+			bool has_uv = r.get<uint32_t>() != 0;
+			glm::vec3 color = Scene::meshColor(i, model_color);
+			std::vector<float> pos(3 * NV), normals(3 * NV);
+			r.getArray(pos.data(), pos.size());
+			r.getArray(normals.data(), normals.size());
+			std::vector<Vertex> vertices;
+			vertices.reserve(NV);
+			for (uint32_t j = 0; j < NV; j++) {
+				vertices.emplace_back(glm::vec3(pos[3 * j], pos[3 * j + 1], pos[3 * j + 2]),
+				                      color,
+				                      glm::vec3(normals[3 * j], normals[3 * j + 1], normals[3 * j + 2]));
+			}
+			Eigen::Matrix<float, -1, 2, Eigen::RowMajor> uv;
+			if (has_uv) {
+				uv.resize(NV, 2);
+				r.getArray(uv.data(), uv.size());
+			} else {
+				uv.resize(0, Eigen::NoChange);
+			}
+			std::vector<uint32_t> indices(NI);
+			r.getArray(indices.data(), indices.size());
+			for (auto vi : indices)
+				if (vi >= NV)
+					throw std::runtime_error("invalid vertex index");
+			meshes.emplace_back(new Mesh(std::move(vertices), std::move(indices), std::move(uv)));
+		}
+		auto root = read_node(r, nmesh);
+		if (!r.atEnd())
+			throw std::runtime_error("trailing data");
+
+		scene.clear();
+		scene.has_vertex_normal_ = has_vertex_normal;
+		scene.meshes_ = std::move(meshes);
+		scene.root_ = root;
+		scene.mean_of_vertices_ = mean;
+	} catch (std::runtime_error& e) {
+		std::cerr << "[MeshCache] Ignoring " << scene_path(hash) << ": " << e.what() << std::endl;
+		stats.misses++;
+		return false;
+	}
+	stats.hits++;
+	return true;
+}
+
+void
+MeshCache::storeScene(uint64_t hash, const Scene& scene)
+{
+	Writer w;
+	w.putArray(kSceneMagic, 8);
+	w.put<uint64_t>(hash);
+	w.put<uint32_t>(scene.meshes_.size());
+	w.put<uint32_t>(scene.has_vertex_normal_ ? 1 : 0);
+	w.putArray(&scene.mean_of_vertices_[0], 3);
+	for (const auto& mesh : scene.meshes_) {
+		const auto& vertices = mesh->getVertices();
+		const auto& indices = mesh->getIndices();
+		const auto& uv = mesh->getUV();
+		w.put<uint32_t>(vertices.size());
+		w.put<uint32_t>(indices.size());
+		w.put<uint32_t>(mesh->hasUV() ? 1 : 0);
+		for (const auto& v : vertices)
+			w.putArray(&v.position[0], 3);
+		for (const auto& v : vertices)
+			w.putArray(&v.normal[0], 3);
+		if (mesh->hasUV())
+			w.putArray(uv.data(), uv.size());
+		w.putArray(indices.data(), indices.size());
+	}
+	write_node(w, *scene.root_);
+	w.commit(scene_path(hash));
+}
+
+bool
+MeshCache::loadCD(uint64_t hash, uint64_t xform_hash, CDData& data)
+{
+	MappedFile f(cd_path(hash, xform_hash));
+	if (!f.good())
+		return false;
+	try {
+		Reader r(f);
+		char magic[8];
+		r.getArray(magic, 8);
+		if (std::memcmp(magic, kCDMagic, 8) != 0 ||
+		    r.get<uint64_t>() != hash ||
+		    r.get<uint64_t>() != xform_hash)
+			throw std::runtime_error("cache key mismatch");
+		data.fnormals.resize(r.get<uint32_t>(), 3);
+		r.getArray(data.fnormals.data(), data.fnormals.size());
+		r.getArray(data.MI_world.data(), 9);
+		r.getArray(data.MI_center.data(), 9);
+		data.volume = r.get<double>();
+		if (!r.atEnd())
+			throw std::runtime_error("trailing data");
+	} catch (std::runtime_error& e) {
+		std::cerr << "[MeshCache] Ignoring " << cd_path(hash, xform_hash) << ": " << e.what() << std::endl;
+		return false;
+	}
+	return true;
+}
+
+void
+MeshCache::storeCD(uint64_t hash, uint64_t xform_hash, const CDData& data)
+{
+	Writer w;
+	w.putArray(kCDMagic, 8);
+	w.put<uint64_t>(hash);
+	w.put<uint64_t>(xform_hash);
+	w.put<uint32_t>(data.fnormals.rows());
+	w.putArray(data.fnormals.data(), data.fnormals.size());
+	w.putArray(data.MI_world.data(), 9);
+	w.putArray(data.MI_center.data(), 9);
+	w.put<double>(data.volume);
+	w.commit(cd_path(hash, xform_hash));
+}
+
+MeshCache::Statistics
+MeshCache::getStatistics()
+{
+	return stats;
+}
+
+void
+MeshCache::addLoadTime(double ms)
+{
+	stats.load_time += ms;
+}
+
+void
+MeshCache::addParseTime(double ms)
+{
+	stats.parse_time += ms;
+}
+
+}
@@ -0,0 +1,76 @@
+#ifndef OSR_MESH_CACHE_H
+#define OSR_MESH_CACHE_H
+
+#include <string>
+#include <stdint.h>
+#include <Eigen/Core>
+#include <glm/glm.hpp>
+
+namespace osr {
+class Scene;
+
+/*
+ * MeshCache
+ *
+ *      Content-hashed binary cache of meshes parsed by Assimp.
+ *
+ *      Every process used to parse the OBJ/PLY files with Assimp, which
+ *      dominates the creation of UnitWorld objects for large puzzles. The
+ *      parsed meshes (vertices, normals, UVs, faces and the node tree) are
+ *      now written to <dir>/<hash>.osrmesh, and later processes map the file
+ *      instead of parsing the mesh again. The hash covers the content of the
+ *      mesh file and the cache format, so a modified mesh gets a new entry.
+ *
+ *      CDModel also caches its derived data (face normals, moment of inertia
+ *      and volume) to <dir>/<hash>-<xform hash>.osrcd. The FCL BVH itself is
+ *      rebuilt from the cached vertices because FCL does not allow to restore
+ *      its node arrays.
+ *
+ *      The cache is disabled until a directory is set, either with
+ *      setDirectory or with the OSR_MESH_CACHE_DIR environment variable.
+ *      Files are written to a temporary file and renamed, so concurrent
+ *      processes (e.g. HTCondor tasks) can share the directory.
+ */
+class MeshCache {
+public:
+	static void setDirectory(const std::string& dir);
+	static std::string getDirectory();
+	static bool enabled() { return !getDirectory().empty(); }
+
+	static uint64_t hashFile(const std::string& fn);
+	static uint64_t hashBytes(const void* data, size_t size, uint64_t seed);
+
+	/*
+	 * Scene::load calls these
+	 */
+	static bool loadScene(uint64_t hash, Scene& scene, const glm::vec3* model_color);
+	static void storeScene(uint64_t hash, const Scene& scene);
+
+	struct CDData {
+		Eigen::Matrix<double, -1, 3> fnormals;
+		Eigen::Matrix<double, 3, 3> MI_world;
+		Eigen::Matrix<double, 3, 3> MI_center;
+		double volume;
+	};
+
+	/*
+	 * CDModel calls these. xform_hash identifies the transform applied to
+	 * the scene (e.g. the scaling to unit world).
+	 */
+	static bool loadCD(uint64_t hash, uint64_t xform_hash, CDData& data);
+	static void storeCD(uint64_t hash, uint64_t xform_hash, const CDData& data);
+
+	struct Statistics {
+		unsigned long hits = 0;
+		unsigned long misses = 0;
+		double load_time = 0; // in ms, including the hash
+		double parse_time = 0; // in ms, Assimp parsing on misses
+	};
+	static Statistics getStatistics();
+	static void addLoadTime(double ms);
+	static void addParseTime(double ms);
+};
+
+}
+
+#endif
@@ -2,6 +2,11 @@
 #include "scene.h"
 
 namespace osr {
+Node::Node()
+	:xform(1.0)
+{
+}
+
 Node::Node(aiNode* node)
 	:xform(1.0)
 {
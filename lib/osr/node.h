@@ -20,6 +20,7 @@ struct Node {
 	std::vector<uint32_t> meshes;
 	glm::mat4 xform;
 
+	Node();
 	Node(aiNode* node);
 	virtual ~Node();
 };
@@ -1,5 +1,7 @@
 #include "scene.h"
 #include "cdmodel.h"
+#include "mesh_cache.h"
+#include <chrono>
 #include <fstream>
 #include <glm/gtx/io.hpp>
 #include <glm/gtx/transform.hpp>
@@ -61,6 +63,7 @@ Scene::Scene(std::shared_ptr<Scene> other)
 	bbox_ = other->bbox_;
 	meshes_ = other->meshes_;
 	center_ = other->center_;
+	content_hash_ = other->content_hash_;
 }
 
 Scene::~Scene()
@@ -70,9 +73,38 @@ Scene::~Scene()
 }
 
 
+glm::vec3 Scene::meshColor(size_t mesh_index, const glm::vec3* model_color)
+{
+	const static std::vector<glm::vec3> meshColors = {
+	    glm::vec3(1.0, 0.0, 0.0), glm::vec3(0.0, 1.0, 0.0),
+	    glm::vec3(0.0, 0.0, 1.0), glm::vec3(1.0, 1.0, 0.0),
+	    glm::vec3(1.0, 0.0, 1.0), glm::vec3(0.0, 1.0, 1.0),
+	    glm::vec3(0.2, 0.3, 0.6), glm::vec3(0.6, 0.0, 0.8),
+	    glm::vec3(0.8, 0.5, 0.2), glm::vec3(0.1, 0.4, 0.7),
+	    glm::vec3(0.0, 0.7, 0.2), glm::vec3(1.0, 0.5, 1.0)};
+	if (model_color)
+		return *model_color;
+	return meshColors[mesh_index % meshColors.size()];
+}
+
 void Scene::load(std::string filename, const glm::vec3* model_color)
 {
+	using hclock = std::chrono::high_resolution_clock;
 	assert(std::ifstream(filename.c_str()).good());
+	content_hash_ = 0;
+	if (MeshCache::enabled()) {
+		auto load_start = hclock::now();
+		content_hash_ = MeshCache::hashFile(filename);
+		bool hit = MeshCache::loadScene(content_hash_, *this, model_color);
+		std::chrono::duration<double, std::milli> load_dur = hclock::now() - load_start;
+		MeshCache::addLoadTime(load_dur.count());
+		if (hit) {
+			finishLoading();
+			std::cerr << "[Scene::load] " << filename << " loaded from MeshCache" << std::endl;
+			return;
+		}
+	}
+	auto parse_start = hclock::now();
 	clear();
 	has_vertex_normal_ = true;
 
@@ -99,21 +131,9 @@ void Scene::load(std::string filename, const glm::vec3* model_color)
 #endif
 	const aiScene* scene = importer.ReadFile(filename, flags);
 
-	const static std::vector<glm::vec3> meshColors = {
-	    glm::vec3(1.0, 0.0, 0.0), glm::vec3(0.0, 1.0, 0.0),
-	    glm::vec3(0.0, 0.0, 1.0), glm::vec3(1.0, 1.0, 0.0),
-	    glm::vec3(1.0, 0.0, 1.0), glm::vec3(0.0, 1.0, 1.0),
-	    glm::vec3(0.2, 0.3, 0.6), glm::vec3(0.6, 0.0, 0.8),
-	    glm::vec3(0.8, 0.5, 0.2), glm::vec3(0.1, 0.4, 0.7),
-	    glm::vec3(0.0, 0.7, 0.2), glm::vec3(1.0, 0.5, 1.0)};
-
 	// generate all meshes
 	for (size_t i = 0; i < scene->mNumMeshes; i++) {
-		glm::vec3 color(1.0);
-		if (model_color)
-			color = *model_color;
-		else
-			color = meshColors[i % meshColors.size()];
+		glm::vec3 color = meshColor(i, model_color);
 #if 0
 		if (!scene->mMeshes[i]->HasNormals()) {
 			throw std::runtime_error(filename + " does not contain per vertex normal");
@@ -127,16 +147,29 @@ void Scene::load(std::string filename, const glm::vec3* model_color)
 	// construct scene graph
 	root_.reset(new Node(scene->mRootNode));
 
+	auto ompl_center = getSceneCenter(scene);
+	mean_of_vertices_[0] = ompl_center[0];
+	mean_of_vertices_[1] = ompl_center[1];
+	mean_of_vertices_[2] = ompl_center[2];
+	finishLoading();
+	std::chrono::duration<double, std::milli> parse_dur = hclock::now() - parse_start;
+	MeshCache::addParseTime(parse_dur.count());
+	if (content_hash_ != 0)
+		MeshCache::storeScene(content_hash_, *this);
+}
+
+/*
+ * Common part of loading from the file and from MeshCache.
+ * meshes_, root_ and mean_of_vertices_ must be ready.
+ */
+void Scene::finishLoading()
+{
 	center_ = glm::vec3(0.0f);
 	vertex_total_number_ = 0;
 	face_total_number_ = 0;
 	updateBoundingBox(root_.get(), glm::mat4(1.0));
 	// center_ = center_ / vertex_total_number_;
 	// mean_of_vertices_ = center_;
-	auto ompl_center = getSceneCenter(scene);
-	mean_of_vertices_[0] = ompl_center[0];
-	mean_of_vertices_[1] = ompl_center[1];
-	mean_of_vertices_[2] = ompl_center[2];
 	center_ = mean_of_vertices_;
 
 	std::cerr.precision(20);
@@ -21,6 +21,7 @@ namespace osr {
 class Camera;
 class SceneRenderer;
 class CDModel;
+class MeshCache;
 /*
  * Scene
  *
@@ -36,6 +37,7 @@ class CDModel;
  */
 class Scene {
 	friend class SceneRenderer;
+	friend class MeshCache;
 
 	size_t vertex_total_number_;
 	size_t face_total_number_;
@@ -48,6 +50,7 @@ class Scene {
 	std::vector<std::shared_ptr<Mesh>> meshes_;
 	std::shared_ptr<Scene> shared_from_;
 	bool has_vertex_normal_;
+	uint64_t content_hash_ = 0; // Set by load() if MeshCache is enabled
 public:
 	Scene();
 	Scene(std::shared_ptr<Scene> other);
@@ -58,6 +61,7 @@ public:
 	void overrideCenter(glm::vec3 c) { center_ = c; }
 	glm::vec3 getCenter() const { return center_; }
 	glm::vec3 getOMPLCenter() const { return mean_of_vertices_; }
+	uint64_t getContentHash() const { return content_hash_; }
 
 	/*
 	 * Calibration transform matrix shall centralize the scene and scale
@@ -96,6 +100,8 @@ public:
 	std::shared_ptr<const Mesh> getUniqueMesh() const;
 private:
 	void updateBoundingBox(Node* node, glm::mat4 m);
+	void finishLoading();
+	static glm::vec3 meshColor(size_t mesh_index, const glm::vec3* model_color);
 };
 }
 
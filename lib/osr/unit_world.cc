@@ -4,7 +4,11 @@
 #include <iostream>
 #include <glm/gtx/io.hpp>
 #include <atomic>
+#include <algorithm>
+#include <chrono>
+#include <mutex>
 #include <stdexcept>
+#include <deque>
 #include <queue>
 #include <random>
 #include <omp.h>
@@ -16,6 +20,9 @@
 #include <tritri/tritri_cop.h>
 #if PYOSR_HAS_MESHBOOL
 #include <meshbool/join.h>
+#include <igl/facet_components.h>
+#include <igl/winding_number.h>
+#include <unordered_map>
 #endif
 
 #include "ode_data.h"
@@ -84,6 +91,7 @@ UnitWorld::copyFrom(const UnitWorld* other)
 	calib_mat_ = glm2Eigen(scene_->getCalibrationTransform());
 	inv_calib_mat_ = calib_mat_.inverse();
 	perturbate_ = other->perturbate_;
+	motion_check_mode_ = other->motion_check_mode_;
 }
 
 void
@@ -259,6 +267,33 @@ bool UnitWorld::isDisentangled(const StateVector& state) const
 }
 
 
+Eigen::Matrix<int8_t, -1, 1>
+UnitWorld::areValid(const ArrayOfStates& qs, bool enable_mt) const
+{
+	int N = qs.rows();
+	Eigen::Matrix<int8_t, -1, 1> ret(N);
+#pragma omp parallel for schedule(dynamic, 64) if (enable_mt)
+	for (int i = 0; i < N; i++)
+		ret(i) = isValid(qs.row(i).transpose());
+	return ret;
+}
+
+
+Eigen::Matrix<int8_t, -1, 1>
+UnitWorld::areDisentangled(const ArrayOfStates& qs, bool enable_mt) const
+{
+	// isDisentangled throws, which must not happen in the parallel region
+	if (!cd_scene_ || !cd_robot_)
+		throw std::runtime_error("UnitWorld::areDisentangled: models not loaded");
+	int N = qs.rows();
+	Eigen::Matrix<int8_t, -1, 1> ret(N);
+#pragma omp parallel for schedule(dynamic, 64) if (enable_mt)
+	for (int i = 0; i < N; i++)
+		ret(i) = isDisentangled(qs.row(i).transpose());
+	return ret;
+}
+
+
 std::tuple<StateVector, bool, float>
 UnitWorld::transitState(const StateVector& state,
                        int action,
@@ -437,6 +472,18 @@ UnitWorld::transitStateToWithContact(const StateVector& from,
 		}
 	}
 #else
+	return sweepLinearly(from, to, verify_delta, nullptr);
+#endif
+}
+
+
+std::tuple<StateVector, StateVector, bool, float, float>
+UnitWorld::sweepLinearly(const StateVector& from,
+                         const StateVector& to,
+                         double verify_delta,
+                         unsigned long* nchecks) const
+{
+	double dist = distance(from, to);
 	if (verify_delta >= dist) {
 		return std::make_tuple(from, to, false, 0.0, 1.0);
 	}
@@ -449,6 +496,8 @@ UnitWorld::transitStateToWithContact(const StateVector& from,
 	while (delta <= dist) {
 		double tau = delta * inv_dist;
 		state = interpolate(from, to, tau);
+		if (nchecks)
+			(*nchecks)++;
 		if (!isValid(state)) {
 			return std::make_tuple(last_free, state, false, last_tau, tau);
 		}
@@ -463,7 +512,6 @@ UnitWorld::transitStateToWithContact(const StateVector& from,
 			delta += verify_delta;
 		}
 	}
-#endif
 	// We may assert (delta > dist) == true
 	return std::make_tuple(last_free, state, delta > dist, last_tau, tau);
 }
@@ -476,8 +524,123 @@ UnitWorld::isValidTransition(const StateVector& from,
 {
 	double d = distance(from, to);
 	auto vdelta = std::min(d / 2.0, initial_verify_delta);
-	auto tup = transitStateTo(from, to, vdelta);
-	return std::get<1>(tup);
+	unsigned long nchecks = 0;
+	bool ret;
+	switch (motion_check_mode_) {
+		case MOTION_CHECK_BISECTION:
+		case MOTION_CHECK_DISTANCE:
+			ret = bisectMotion(from, to, vdelta,
+			                   motion_check_mode_ == MOTION_CHECK_DISTANCE,
+			                   &nchecks);
+			break;
+		default:
+			ret = std::get<2>(sweepLinearly(from, to, vdelta, &nchecks));
+			break;
+	}
+	discrete_checks_ += nchecks;
+	return ret;
+}
+
+
+void
+UnitWorld::setMotionCheckMode(int mode)
+{
+	if (mode < MOTION_CHECK_LINEAR || mode > MOTION_CHECK_DISTANCE) {
+		throw std::runtime_error("UnitWorld::setMotionCheckMode: invalid mode "
+		                         + std::to_string(mode));
+	}
+	motion_check_mode_ = mode;
+}
+
+
+double
+UnitWorld::clearance(const StateVector& state) const
+{
+	if (!isValid(state))
+		return -1.0;
+	Transform envTf;
+	Transform robTf;
+	std::tie(envTf, robTf) = getCDTransforms(state);
+	return CDModel::distance(*cd_scene_, envTf, *cd_robot_, robTf);
+}
+
+
+/*
+ * Checks the states of sweepLinearly, i.e.
+ *
+ *      tau_k = min(k * verify_delta, dist) / dist, k = 1, ..., n
+ *
+ * but the last state first, and then the midpoints of the unchecked
+ * intervals in breadth-first order.
+ *
+ * With use_clearance, no robot vertex moves farther than
+ * (tau_hi - tau_lo) * K within [tau_lo, tau_hi], in which
+ *
+ *      K = |translation of the motion| + radius of robot * rotation angle
+ *
+ * because the translation is linear and the rotation is slerp. Hence the
+ * whole interval is free if clearance(lo) + clearance(hi) exceeds this
+ * bound.
+ */
+bool
+UnitWorld::bisectMotion(const StateVector& from,
+                        const StateVector& to,
+                        double verify_delta,
+                        bool use_clearance,
+                        unsigned long* nchecks) const
+{
+	double dist = distance(from, to);
+	// Same as sweepLinearly
+	if (verify_delta >= dist)
+		return false;
+	if (!cd_scene_ || !cd_robot_)
+		return true;
+	long n = long(std::ceil(dist / verify_delta));
+	auto tau_of = [verify_delta, dist](long k) -> double {
+		return std::min(k * verify_delta, dist) / dist;
+	};
+	double K = 0.0;
+	std::vector<double> clearances;
+	if (use_clearance) {
+		StateTrans tr0, tr1;
+		StateQuat rot0, rot1;
+		std::tie(tr0, rot0) = decompose(from);
+		std::tie(tr1, rot1) = decompose(to);
+		K = (tr1 - tr0).norm() + cd_robot_->boundingRadius() * rot0.angularDistance(rot1);
+		clearances.resize(n + 1, 0.0);
+		// The initial state is not checked by sweepLinearly, so its
+		// clearance must not reject the motion.
+		(*nchecks)++;
+		clearances[0] = std::max(0.0, clearance(from));
+	}
+	auto check = [&](long k) -> bool {
+		(*nchecks)++;
+		auto state = interpolate(from, to, tau_of(k));
+		if (!use_clearance)
+			return isValid(state);
+		clearances[k] = clearance(state);
+		return clearances[k] >= 0.0;
+	};
+	if (!check(n))
+		return false;
+	std::deque<std::pair<long, long>> intervals;
+	intervals.emplace_back(0, n);
+	while (!intervals.empty()) {
+		long lo, hi;
+		std::tie(lo, hi) = intervals.front();
+		intervals.pop_front();
+		if (hi - lo < 2)
+			continue;
+		if (use_clearance &&
+		    clearances[lo] + clearances[hi] > (tau_of(hi) - tau_of(lo)) * K)
+			continue;
+		long mid = (lo + hi) / 2;
+		if (!check(mid))
+			return false;
+		intervals.emplace_back(lo, mid);
+		intervals.emplace_back(mid, hi);
+	}
+	return true;
 }
 
 
@@ -732,27 +895,130 @@ UnitWorld::unapplyPertubation(const StateVector& state) const
 	return compose(tret, qret);
 }
 
+namespace {
+
+/*
+ * The visibility engine splits the M x N motions into tiles of
+ * kTileRows x kTileCols, and OpenMP threads take the tiles one by one in
+ * row-major order (schedule(dynamic, 1)). The cost of a motion check varies
+ * by orders of magnitude, so the static scheduling of rows left most
+ * threads idle at the tail.
+ */
+const int kTileRows = 8;
+const int kTileCols = 64;
+
+struct Tiling {
+	int M, N;
+	int row_size, col_size;
+	int ncol_tiles;
+
+	Tiling(int M_, int N_, int tile_rows = kTileRows, int tile_cols = kTileCols)
+		:M(M_), N(N_), row_size(tile_rows), col_size(tile_cols)
+	{
+		ncol_tiles = (N + col_size - 1) / col_size;
+	}
+
+	long count() const
+	{
+		return long((M + row_size - 1) / row_size) * ncol_tiles;
+	}
+
+	void get(long t, int& r0, int& r1, int& c0, int& c1) const
+	{
+		r0 = int(t / ncol_tiles) * row_size;
+		c0 = int(t % ncol_tiles) * col_size;
+		r1 = std::min(M, r0 + row_size);
+		c1 = std::min(N, c0 + col_size);
+	}
+};
+
+/*
+ * Thread-safe progress report, at most once per interval seconds
+ */
+class Progress {
+	const char* what_;
+	long total_;
+	int64_t interval_ns_;
+	std::atomic<long> done_{0};
+	std::atomic<int64_t> last_report_;
+
+	static int64_t now()
+	{
+		using namespace std::chrono;
+		return duration_cast<nanoseconds>(steady_clock::now().time_since_epoch()).count();
+	}
+public:
+	Progress(const char* what, long total, double interval)
+		:what_(what), total_(total), interval_ns_(int64_t(interval * 1e9)), last_report_(now())
+	{
+	}
+
+	void add(long n)
+	{
+		long done = (done_ += n);
+		if (interval_ns_ <= 0)
+			return;
+		int64_t t = now();
+		int64_t last = last_report_.load();
+		if (t - last < interval_ns_)
+			return;
+		// Only one thread wins
+		if (!last_report_.compare_exchange_strong(last, t))
+			return;
+		std::cerr << "[" << what_ << "] Progress: " << done << "/" << total_
+		          << " (" << 100 * done / std::max(total_, 1L) << "%)" << std::endl;
+	}
+};
+
+void
+to_unit_states(const UnitWorld& uw, ArrayOfStates& qs, bool enable_mt)
+{
+	int N = qs.rows();
+#pragma omp parallel for if (enable_mt)
+	for (int i = 0; i < N; i++)
+		qs.row(i) = uw.translateToUnitState(qs.row(i)).transpose();
+}
+
+void
+check_cancelled(const std::atomic<bool>& cancel, const char* what)
+{
+	if (cancel.load())
+		throw std::runtime_error(std::string(what) + ": cancelled");
+}
+
+}
+
 Eigen::Matrix<int8_t, -1, -1>
 UnitWorld::calculateVisibilityMatrix(ArrayOfStates qs,
                                      bool is_unit_states,
                                      double verify_magnitude)
 {
 	int N = qs.rows();
-	if (!is_unit_states) {
-#pragma omp parallel for
-		for (int i = 0; i < N; i++)
-			qs.row(i) = translateToUnitState(qs.row(i)).transpose();
-	}
+	if (!is_unit_states)
+		to_unit_states(*this, qs, true);
 	Eigen::Matrix<int8_t, -1, -1> ret;
-	ret.resize(N, N);
-#pragma omp parallel for
-	for (int fi = 0; fi < N; fi++) {
-		for (int ti = fi + 1; ti < N; ti++) {
-			int8_t valid = !!isValidTransition(qs.row(fi), qs.row(ti), verify_magnitude);
-			ret(fi, ti) = valid;
-			ret(ti, fi) = valid;
+	ret.setZero(N, N);
+	// Tiles above the diagonal are skipped
+	Tiling tiling(N, N);
+	Progress prog("calculateVisibilityMatrix", long(N) * (N - 1) / 2, progress_interval_);
+#pragma omp parallel for schedule(dynamic, 1)
+	for (long t = 0; t < tiling.count(); t++) {
+		int r0, r1, c0, c1;
+		tiling.get(t, r0, r1, c0, c1);
+		if (c1 <= r0 + 1)
+			continue;
+		long n = 0;
+		for (int fi = r0; fi < r1 && !cancel_visibility_.load(); fi++) {
+			for (int ti = std::max(c0, fi + 1); ti < c1; ti++) {
+				int8_t valid = !!isValidTransition(qs.row(fi), qs.row(ti), verify_magnitude);
+				ret(fi, ti) = valid;
+				ret(ti, fi) = valid;
+				n++;
+			}
 		}
+		prog.add(n);
 	}
+	check_cancelled(cancel_visibility_, "calculateVisibilityMatrix");
 	return ret;
 }
 
@@ -767,27 +1033,26 @@ UnitWorld::calculateVisibilityMatrix2(ArrayOfStates qs0,
 	int M = qs0.rows();
 	int N = qs1.rows();
 	if (!qs0_is_unit_states)
-#pragma omp parallel for if (enable_mt)
-		for (int i = 0; i < M; i++)
-			qs0.row(i) = translateToUnitState(qs0.row(i)).transpose();
+		to_unit_states(*this, qs0, enable_mt);
 	if (!qs1_is_unit_states)
-#pragma omp parallel for if (enable_mt)
-		for (int i = 0; i < N; i++)
-			qs1.row(i) = translateToUnitState(qs1.row(i)).transpose();
+		to_unit_states(*this, qs1, enable_mt);
 	Eigen::Matrix<int8_t, -1, -1> ret;
 	ret.resize(M, N);
-	std::atomic<int> prog(0);
-#pragma omp parallel for if (enable_mt)
-	for (int fi = 0; fi < M; fi++) {
-		for (int ti = 0; ti < N; ti++) {
-			int8_t valid = isValidTransition(qs0.row(fi), qs1.row(ti), verify_magnitude);
-			ret(fi, ti) = valid;
-		}
-		prog++;
-		if (omp_get_thread_num() == 0) {
-			std::cerr << "Progress: " << prog << "/" << M << std::endl;
+	Tiling tiling(M, N);
+	Progress prog("calculateVisibilityMatrix2", long(M) * N, progress_interval_);
+#pragma omp parallel for schedule(dynamic, 1) if (enable_mt)
+	for (long t = 0; t < tiling.count(); t++) {
+		int r0, r1, c0, c1;
+		tiling.get(t, r0, r1, c0, c1);
+		for (int fi = r0; fi < r1 && !cancel_visibility_.load(); fi++) {
+			for (int ti = c0; ti < c1; ti++) {
+				int8_t valid = isValidTransition(qs0.row(fi), qs1.row(ti), verify_magnitude);
+				ret(fi, ti) = valid;
+			}
 		}
+		prog.add(long(r1 - r0) * (c1 - c0));
 	}
+	check_cancelled(cancel_visibility_, "calculateVisibilityMatrix2");
 	return ret;
 }
 
@@ -803,66 +1068,190 @@ UnitWorld::calculateVisibilityPair(ArrayOfStates qs0,
 	int N = qs1.rows();
 	int Max = std::max(M, N);
 	if (!qs0_is_unit_states)
-#pragma omp parallel for if (enable_mt)
-		for (int i = 0; i < M; i++)
-			qs0.row(i) = translateToUnitState(qs0.row(i)).transpose();
+		to_unit_states(*this, qs0, enable_mt);
 	if (!qs1_is_unit_states)
-#pragma omp parallel for if (enable_mt)
-		for (int i = 0; i < N; i++)
-			qs1.row(i) = translateToUnitState(qs1.row(i)).transpose();
+		to_unit_states(*this, qs1, enable_mt);
 	Eigen::Matrix<int8_t, -1, 1> ret;
 	ret.resize(Max, 1);
-	std::atomic<int> prog(0);
-	std::atomic<int> last_pc(0);
-#pragma omp parallel for if (enable_mt)
+	Progress prog("calculateVisibilityPair", Max, progress_interval_);
+#pragma omp parallel for schedule(dynamic, kTileCols) if (enable_mt)
 	for (int i = 0; i < Max; i++) {
+		if (cancel_visibility_.load())
+			continue;
 		int fi = i;
 		int ti = i;
 		int8_t valid = isValidTransition(qs0.row(fi), qs1.row(ti), verify_magnitude);
 		ret(i) = valid;
-		prog++;
-#if 1
-		if (omp_get_thread_num() == 0) {
-			int pc = 100 * prog / Max;
-			if (pc != last_pc) {
-				std::cerr << "Progress: " << pc << "%" << std::endl;
-				last_pc = pc;
+		prog.add(1);
+	}
+	check_cancelled(cancel_visibility_, "calculateVisibilityPair");
+	return ret;
+}
+
+/*
+ * With max_hits > 0, cutoff[fi] is the column of the max_hits-th visible
+ * partner found so far, and columns after it are skipped. It only
+ * decreases, so no column before the final cutoff is ever skipped, and the
+ * result is the first max_hits partners regardless of the scheduling.
+ */
+Eigen::Matrix<int, -1, 2>
+UnitWorld::calculateVisibilitySparse(ArrayOfStates qs0,
+                                     bool qs0_is_unit_states,
+                                     ArrayOfStates qs1,
+                                     bool qs1_is_unit_states,
+                                     double verify_magnitude,
+                                     int max_hits,
+                                     bool enable_mt)
+{
+	int M = qs0.rows();
+	int N = qs1.rows();
+	if (!qs0_is_unit_states)
+		to_unit_states(*this, qs0, enable_mt);
+	if (!qs1_is_unit_states)
+		to_unit_states(*this, qs1, enable_mt);
+
+	const bool early_exit = max_hits > 0;
+	std::vector<std::vector<int>> hits(M);
+	std::unique_ptr<std::atomic<int>[]> cutoff(new std::atomic<int>[early_exit ? M : 0]);
+	for (int i = 0; early_exit && i < M; i++)
+		cutoff[i].store(N);
+	const int kLocks = 64;
+	std::mutex locks[kLocks];
+
+	// Early exit makes rows cheap, so take one row per tile
+	Tiling tiling(M, N, early_exit ? 1 : kTileRows, kTileCols);
+	Progress prog("calculateVisibilitySparse", long(M) * N, progress_interval_);
+#pragma omp parallel for schedule(dynamic, 1) if (enable_mt)
+	for (long t = 0; t < tiling.count(); t++) {
+		int r0, r1, c0, c1;
+		tiling.get(t, r0, r1, c0, c1);
+		for (int fi = r0; fi < r1 && !cancel_visibility_.load(); fi++) {
+			for (int ti = c0; ti < c1; ti++) {
+				if (early_exit && ti > cutoff[fi].load())
+					break;
+				if (!isValidTransition(qs0.row(fi), qs1.row(ti), verify_magnitude))
+					continue;
+				std::lock_guard<std::mutex> guard(locks[fi % kLocks]);
+				auto& row = hits[fi];
+				row.insert(std::upper_bound(row.begin(), row.end(), ti), ti);
+				if (early_exit && int(row.size()) >= max_hits)
+					cutoff[fi].store(row[max_hits - 1]);
 			}
 		}
-#endif
+		prog.add(long(r1 - r0) * (c1 - c0));
+	}
+	check_cancelled(cancel_visibility_, "calculateVisibilitySparse");
+
+	size_t total = 0;
+	for (auto& row : hits) {
+		if (early_exit && int(row.size()) > max_hits)
+			row.resize(max_hits);
+		total += row.size();
+	}
+	Eigen::Matrix<int, -1, 2> ret;
+	ret.resize(total, 2);
+	size_t k = 0;
+	for (int fi = 0; fi < M; fi++) {
+		for (int ti : hits[fi]) {
+			ret(k, 0) = fi;
+			ret(k, 1) = ti;
+			k++;
+		}
 	}
 	return ret;
 }
 
 
 #if PYOSR_HAS_MESHBOOL
+namespace {
+
+using VMatrix = UnitWorld::VMatrix;
+using FMatrix = UnitWorld::FMatrix;
+using AABB = Eigen::AlignedBox<StateScalar, 3>;
+
+/*
+ * Connected components of a mesh, with their bounding boxes in the frame of
+ * the mesh.
+ */
+struct MeshComponents {
+	std::vector<std::vector<int>> faces;
+	std::vector<AABB> boxes;
+
+	MeshComponents(const VMatrix& V, const FMatrix& F)
+	{
+		Eigen::MatrixXi FI = F;
+		Eigen::VectorXi C;
+		igl::facet_components(FI, C);
+		int n = C.size() > 0 ? C.maxCoeff() + 1 : 0;
+		faces.resize(n);
+		boxes.resize(n);
+		for (int f = 0; f < C.size(); f++) {
+			faces[C(f)].emplace_back(f);
+			for (int j = 0; j < 3; j++)
+				boxes[C(f)].extend(V.row(F(f, j)).transpose());
+		}
+	}
+};
+
+/*
+ * Submesh of the given faces, with vertices transformed by tf
+ */
+void
+extract_submesh(const VMatrix& V,
+                const FMatrix& F,
+                const std::vector<int>& faces,
+                const Transform& tf,
+                VMatrix& SV,
+                FMatrix& SF)
+{
+	std::unordered_map<int, int> remap;
+	SF.resize(faces.size(), 3);
+	for (size_t i = 0; i < faces.size(); i++) {
+		for (int j = 0; j < 3; j++) {
+			int v = F(faces[i], j);
+			auto iter = remap.emplace(v, int(remap.size())).first;
+			SF(i, j) = iter->second;
+		}
+	}
+	SV.resize(remap.size(), 3);
+	for (const auto& kv : remap) {
+		Eigen::Matrix<StateScalar, 3, 1> p = V.row(kv.first).transpose();
+		SV.row(kv.second) = (tf * p).transpose();
+	}
+}
+
+bool
+inside(const VMatrix& V, const FMatrix& F, const Eigen::Matrix<StateScalar, 1, 3>& p)
+{
+	Eigen::MatrixXd VD = V;
+	Eigen::MatrixXi FI = F;
+	Eigen::MatrixXd O = p;
+	Eigen::VectorXd W;
+	igl::winding_number(VD, FI, O, W);
+	return std::abs(W(0)) > 0.5;
+}
+
+}
+
 Eigen::Matrix<StateScalar, -1, 1>
 UnitWorld::intersectionRegionSurfaceAreas(ArrayOfStates qs,
                                           bool qs_are_unit_states)
 {
-	ArrayOfStates qsu = ppToUnitStates(qs, qs_are_unit_states);
 	int Nq = qs.rows();
 	Eigen::Matrix<StateScalar, -1, 1> ret;
 	ret.setZero(Nq);
 
-	Transform envTf = std::get<0>(getCDTransforms(robot_state_));
-
-	CDModel::VMatrix env_V = (envTf * cd_scene_->vertices().transpose()).transpose();
-	auto env_F = cd_scene_->faces();
-
-	auto rob_F = cd_robot_->faces();
+	VMatrix V;
+	FMatrix F;
+	Eigen::VectorXi voff, foff;
+	std::tie(V, F, voff, foff) = intersectingGeometryBatch(qs, qs_are_unit_states);
 
 	for (int i = 0; i < Nq; i++) {
-		StateVector state = qsu.row(i).transpose();
-		Transform robTf = translate_state_to_transform(state);
-		CDModel::VMatrix rob_V = (robTf * cd_robot_->vertices().transpose()).transpose();
-
-		CDModel::VMatrix RV;
-		CDModel::FMatrix RF;
-		mesh_bool(env_V, env_F,
-			  rob_V, rob_F,
-			  igl::MESH_BOOLEAN_TYPE_INTERSECT,
-			  RV, RF);
+		int nf = foff(i + 1) - foff(i);
+		if (nf == 0)
+			continue;
+		VMatrix RV = V.block(voff(i), 0, voff(i + 1) - voff(i), 3);
+		FMatrix RF = F.block(foff(i), 0, nf, 3);
 		Eigen::VectorXd areas;
 		igl::doublearea(RV, RF, areas);
 		ret(i) = areas.sum();
@@ -870,6 +1259,104 @@ UnitWorld::intersectionRegionSurfaceAreas(ArrayOfStates qs,
 	return ret;
 }
 
+std::tuple<UnitWorld::VMatrix, UnitWorld::FMatrix, Eigen::VectorXi, Eigen::VectorXi>
+UnitWorld::intersectingGeometryBatch(ArrayOfStates qs,
+                                     bool qs_are_unit_states,
+                                     bool enable_mt)
+{
+	if (!cd_scene_ || !cd_robot_)
+		throw std::runtime_error("UnitWorld::intersectingGeometryBatch: models not loaded");
+	ArrayOfStates qsu = ppToUnitStates(qs, qs_are_unit_states);
+	int Nq = qsu.rows();
+
+	// Shared by all states, in the frame of the models
+	VMatrix env_V = cd_scene_->vertices();
+	FMatrix env_F = cd_scene_->faces();
+	VMatrix rob_V0 = cd_robot_->vertices();
+	FMatrix rob_F = cd_robot_->faces();
+	MeshComponents env_comps(env_V, env_F);
+
+	std::vector<VMatrix> RVs(Nq);
+	std::vector<FMatrix> RFs(Nq);
+	std::atomic<bool> failed(false);
+	std::string what;
+
+#pragma omp parallel for schedule(dynamic, 1) if (enable_mt)
+	for (int i = 0; i < Nq; i++) {
+		if (failed.load())
+			continue;
+		try {
+			Transform envTf, robTf;
+			std::tie(envTf, robTf) = getCDTransforms(qsu.row(i).transpose());
+			Eigen::Matrix<int, -1, 2> pairs;
+			bool touching = CDModel::collideForDetails(*cd_scene_, envTf, *cd_robot_, robTf, pairs);
+
+			VMatrix rob_V = (robTf * rob_V0.transpose()).transpose();
+			// Bounding box of the robot, in the frame of the scene
+			AABB rob_box;
+			Transform inv = envTf.inverse();
+			for (int j = 0; j < rob_V.rows(); j++) {
+				Eigen::Matrix<StateScalar, 3, 1> p = rob_V.row(j).transpose();
+				rob_box.extend(inv * p);
+			}
+
+			std::vector<int> faces;
+			std::vector<int> firsts;
+			for (size_t c = 0; c < env_comps.faces.size(); c++) {
+				if (!env_comps.boxes[c].intersects(rob_box))
+					continue;
+				firsts.emplace_back(faces.size());
+				faces.insert(faces.end(), env_comps.faces[c].begin(), env_comps.faces[c].end());
+			}
+			if (faces.empty())
+				continue;
+
+			VMatrix SV;
+			FMatrix SF;
+			extract_submesh(env_V, env_F, faces, envTf, SV, SF);
+			if (!touching) {
+				// No surface intersects, so the intersection is
+				// either empty or one mesh is inside the other.
+				bool contained = inside(SV, SF, rob_V.row(0));
+				for (int first : firsts) {
+					if (contained)
+						break;
+					contained = inside(rob_V, rob_F, SV.row(SF(first, 0)));
+				}
+				if (!contained)
+					continue;
+			}
+			mesh_bool(SV, SF,
+			          rob_V, rob_F,
+			          igl::MESH_BOOLEAN_TYPE_INTERSECT,
+			          RVs[i], RFs[i]);
+		} catch (std::exception& e) {
+#pragma omp critical
+			{
+				if (!failed.load())
+					what = e.what();
+				failed.store(true);
+			}
+		}
+	}
+	if (failed.load())
+		throw std::runtime_error("UnitWorld::intersectingGeometryBatch: " + what);
+
+	Eigen::VectorXi voff(Nq + 1), foff(Nq + 1);
+	voff(0) = foff(0) = 0;
+	for (int i = 0; i < Nq; i++) {
+		voff(i + 1) = voff(i) + RVs[i].rows();
+		foff(i + 1) = foff(i) + RFs[i].rows();
+	}
+	VMatrix V(voff(Nq), 3);
+	FMatrix F(foff(Nq), 3);
+	for (int i = 0; i < Nq; i++) {
+		V.block(voff(i), 0, RVs[i].rows(), 3) = RVs[i];
+		F.block(foff(i), 0, RFs[i].rows(), 3) = RFs[i];
+	}
+	return std::make_tuple(V, F, voff, foff);
+}
+
 // FIXME: too much duplicated code here
 std::tuple<UnitWorld::VMatrix, UnitWorld::FMatrix>
 UnitWorld::intersectingGeometry(const StateVector& q,
@@ -1006,6 +1493,44 @@ UnitWorld::intersectingSegments(StateVector unitq)
 	return std::tie(ret_pos, ret_vec, ret_mag, face_pairs);
 }
 
+std::tuple<
+	ArrayOfPoints,
+	ArrayOfPoints,
+	Eigen::Matrix<StateScalar, -1, 1>,
+	Eigen::Matrix<int, -1, 2>,
+	Eigen::VectorXi
+>
+UnitWorld::intersectingSegmentsBatch(const ArrayOfStates& unitqs,
+                                     bool enable_mt)
+{
+	if (!cd_scene_ || !cd_robot_)
+		throw std::runtime_error("UnitWorld::intersectingSegmentsBatch: models not loaded");
+	int Nq = unitqs.rows();
+	std::vector<ArrayOfPoints> poses(Nq), vecs(Nq);
+	std::vector<Eigen::Matrix<StateScalar, -1, 1>> mags(Nq);
+	std::vector<Eigen::Matrix<int, -1, 2>> pairs(Nq);
+#pragma omp parallel for schedule(dynamic, 16) if (enable_mt)
+	for (int i = 0; i < Nq; i++)
+		std::tie(poses[i], vecs[i], mags[i], pairs[i]) = intersectingSegments(unitqs.row(i).transpose());
+
+	Eigen::VectorXi off(Nq + 1);
+	off(0) = 0;
+	for (int i = 0; i < Nq; i++)
+		off(i + 1) = off(i) + poses[i].rows();
+	int M = off(Nq);
+	ArrayOfPoints ret_pos(M, 3), ret_vec(M, 3);
+	Eigen::Matrix<StateScalar, -1, 1> ret_mag(M);
+	Eigen::Matrix<int, -1, 2> ret_pairs(M, 2);
+	for (int i = 0; i < Nq; i++) {
+		int m = poses[i].rows();
+		ret_pos.block(off(i), 0, m, 3) = poses[i];
+		ret_vec.block(off(i), 0, m, 3) = vecs[i];
+		ret_mag.segment(off(i), m) = mags[i];
+		ret_pairs.block(off(i), 0, m, 2) = pairs[i];
+	}
+	return std::make_tuple(ret_pos, ret_vec, ret_mag, ret_pairs, off);
+}
+
 ArrayOfPoints
 UnitWorld::getRobotFaceNormalsFromIndices(const Eigen::Matrix<int, -1, 1>& faces)
 {
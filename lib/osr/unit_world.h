@@ -3,6 +3,7 @@
 
 #include <glm/mat4x4.hpp>
 
+#include <atomic>
 #include <memory>
 #include <tuple>
 #include "osr_state.h"
@@ -50,6 +51,12 @@ public:
 	bool isValid(const StateVector& state) const;
 	bool isDisentangled(const StateVector& state) const;
 
+	// isValid and isDisentangled of many unit states, in parallel
+	Eigen::Matrix<int8_t, -1, 1>
+	areValid(const ArrayOfStates& qs, bool enable_mt = true) const;
+	Eigen::Matrix<int8_t, -1, 1>
+	areDisentangled(const ArrayOfStates& qs, bool enable_mt = true) const;
+
 	/*
 	 * State transition
 	 *
@@ -106,6 +113,35 @@ public:
 	                  const StateVector& to,
 	                  double initial_verify_delta) const;
 
+	/*
+	 * Motion validation engines of isValidTransition, and hence of
+	 * calculateVisibilityMatrix* and calculateVisibilityPair.
+	 * transitStateTo* always sweep linearly because they report the first
+	 * contact.
+	 *
+	 *      MOTION_CHECK_LINEAR: check the states from `from` to `to`
+	 *      MOTION_CHECK_BISECTION: check the same states in bisection
+	 *              (van der Corput) order, starting from `to`. Collisions
+	 *              in the middle of the motion are found much earlier.
+	 *      MOTION_CHECK_DISTANCE: bisection, and skip the intervals that
+	 *              the clearance (FCL distance) at their ends proves
+	 *              collision free (conservative advancement)
+	 *
+	 * All engines return the same results.
+	 */
+	enum {
+		MOTION_CHECK_LINEAR = 0,
+		MOTION_CHECK_BISECTION = 1,
+		MOTION_CHECK_DISTANCE = 2,
+	};
+	void setMotionCheckMode(int mode);
+	int getMotionCheckMode() const { return motion_check_mode_; }
+
+	// Number of states checked by isValidTransition, to measure the
+	// engines. Distance queries are also counted.
+	unsigned long getDiscreteCheckCount() const { return discrete_checks_.load(); }
+	void resetDiscreteCheckCount() { discrete_checks_.store(0); }
+
 	std::tuple<StateVector, bool, float>
 	transitStateBy(const StateVector& from,
 	               const StateTrans& tr,
@@ -171,6 +207,45 @@ public:
 	                        double verify_magnitude,
 				bool enable_mt = true);
 
+	/*
+	 * Visible pairs b/w qs0 and qs1, without the M x N matrix
+	 *
+	 * Returns a K x 2 matrix of (row in qs0, row in qs1), sorted.
+	 *
+	 *      max_hits: if positive, a row of qs0 stops at its first max_hits
+	 *                visible partners (in the order of qs1), so only
+	 *                these are returned.
+	 *
+	 * Like calculateVisibilityMatrix*, the motions are checked in tiles
+	 * which are dynamically scheduled to the OpenMP threads.
+	 */
+	Eigen::Matrix<int, -1, 2>
+	calculateVisibilitySparse(ArrayOfStates qs0,
+	                          bool qs0_is_unit_states,
+	                          ArrayOfStates qs1,
+	                          bool qs1_is_unit_states,
+	                          double verify_magnitude,
+	                          int max_hits = 0,
+	                          bool enable_mt = true);
+
+	/*
+	 * calculateVisibility* report their progress to std::cerr at most once
+	 * per this many seconds. Zero or negative disables the report.
+	 */
+	void setProgressInterval(double seconds) { progress_interval_ = seconds; }
+	double getProgressInterval() const { return progress_interval_; }
+
+	/*
+	 * Stop the running calculateVisibility* calls, which can be called
+	 * from another thread. The cancelled calls throw std::runtime_error.
+	 *
+	 * The flag stays set, so calls started after the cancel throw too,
+	 * until the caller clears it with resetVisibilityCancel().
+	 */
+	void cancelVisibility() { cancel_visibility_.store(true); }
+	void resetVisibilityCancel() { cancel_visibility_.store(false); }
+	bool isVisibilityCancelled() const { return cancel_visibility_.load(); }
+
 	using VMatrix = Eigen::Matrix<StateScalar, -1, 3>;
 	using FMatrix = Eigen::Matrix<int, -1, 3>;
 
@@ -182,6 +257,28 @@ public:
 	std::tuple<VMatrix, FMatrix>
 	intersectingGeometry(const StateVector& q,
 	                     bool q_is_unit);
+
+	/*
+	 * intersectingGeometry of many states, in parallel.
+	 *
+	 * Return:
+	 *      1) Vertices of all intersecting regions
+	 *      2) Faces of all intersecting regions
+	 *      3) Vertex offsets, N + 1 rows
+	 *      4) Face offsets, N + 1 rows
+	 *      The region of state i is V[voff(i):voff(i+1)] and
+	 *      F[foff(i):foff(i+1)], and its faces index its own vertices, i.e.
+	 *      the same (V, F) as intersectingGeometry would return.
+	 *
+	 * States that do not touch the scene are culled by the BVH, and only
+	 * the connected components of the scene that overlap the bounding box
+	 * of the robot are passed to the mesh boolean. The components are
+	 * closed, so the result is exact.
+	 */
+	std::tuple<VMatrix, FMatrix, Eigen::VectorXi, Eigen::VectorXi>
+	intersectingGeometryBatch(ArrayOfStates qs,
+	                          bool qs_are_unit_states,
+	                          bool enable_mt = true);
 #endif
 #if 1
 	std::tuple<VMatrix, FMatrix>
@@ -221,6 +318,21 @@ public:
 	>
 	intersectingSegments(StateVector unitq);
 
+	/*
+	 * intersectingSegments of many unit states, in parallel. The results
+	 * are concatenated, and the segments of state i are rows
+	 * [offsets(i), offsets(i+1)).
+	 */
+	std::tuple<
+		ArrayOfPoints,
+		ArrayOfPoints,
+		Eigen::Matrix<StateScalar, -1, 1>,
+		Eigen::Matrix<int, -1, 2>,
+		Eigen::VectorXi                                   // Offsets, N + 1 rows
+	>
+	intersectingSegmentsBatch(const ArrayOfStates& unitqs,
+	                          bool enable_mt = true);
+
 	ArrayOfPoints
 	getRobotFaceNormalsFromIndices(const Eigen::Matrix<int, -1, 1>&);
 	ArrayOfPoints
@@ -377,6 +489,27 @@ protected:
 	                Eigen::Vector3d *fn) const;
 
 	double recCres_;
+
+	int motion_check_mode_ = MOTION_CHECK_BISECTION;
+	double progress_interval_ = 10.0;
+	std::atomic<bool> cancel_visibility_{false};
+	mutable std::atomic<unsigned long> discrete_checks_{0};
+
+	std::tuple<StateVector, StateVector, bool, float, float>
+	sweepLinearly(const StateVector& from,
+	              const StateVector& to,
+	              double verify_delta,
+	              unsigned long* nchecks) const;
+
+	bool
+	bisectMotion(const StateVector& from,
+	             const StateVector& to,
+	             double verify_delta,
+	             bool use_clearance,
+	             unsigned long* nchecks) const;
+
+	// Distance b/w robot and env, negative if they collide
+	double clearance(const StateVector& state) const;
 };
 
 auto glm2Eigen(const glm::mat4& m);
@@ -4,6 +4,7 @@
 #include <osr/osr_render.h>
 #include <osr/osr_init.h>
 #include <osr/gtgenerator.h>
+#include <osr/mesh_cache.h>
 #include <pybind11/pybind11.h>
 #include <pybind11/eigen.h>
 #include <iostream>
@@ -92,6 +93,21 @@ PYBIND11_PLUGIN(pyosr) {
 	      "Apply a continuous action to one state vector", py::call_guard<py::gil_scoped_release>());
 	m.def("get_permutation_to_world", &osr::get_permutation_to_world);
 	m.def("extract_rotation_matrix", &osr::extract_rotation_matrix);
+	m.def("set_mesh_cache_dir", &osr::MeshCache::setDirectory,
+	      py::arg("dir"),
+	      "Cache parsed meshes in this directory. Empty string disables the cache");
+	m.def("get_mesh_cache_dir", &osr::MeshCache::getDirectory);
+	m.def("get_mesh_cache_statistics",
+	      []() {
+		auto stats = osr::MeshCache::getStatistics();
+		py::dict ret;
+		ret["hits"] = stats.hits;
+		ret["misses"] = stats.misses;
+		ret["load_time"] = stats.load_time;
+		ret["parse_time"] = stats.parse_time;
+		return ret;
+	      },
+	      "Cache hits/misses, and the time (ms) spent on loading from the cache and on parsing");
 	m.def("save_obj_1", &osr::saveOBJ1);
 	m.def("save_obj_2", &osr::saveOBJ2,
 	      py::arg("V"),
@@ -119,6 +135,9 @@ PYBIND11_PLUGIN(pyosr) {
 	m.attr("MESH_BOOL_RESOLVE") = py::int_(osr::MESH_BOOL_RESOLVE);
 	m.def("tritri_cop", &osr::tritriCop);
 	using osr::UnitWorld;
+	m.attr("MOTION_CHECK_LINEAR") = py::int_(int(UnitWorld::MOTION_CHECK_LINEAR));
+	m.attr("MOTION_CHECK_BISECTION") = py::int_(int(UnitWorld::MOTION_CHECK_BISECTION));
+	m.attr("MOTION_CHECK_DISTANCE") = py::int_(int(UnitWorld::MOTION_CHECK_DISTANCE));
 	py::class_<UnitWorld>(m, "UnitWorld")
 		.def(py::init<>())
 		.def("setupFrom", &UnitWorld::copyFrom)
@@ -132,6 +151,14 @@ PYBIND11_PLUGIN(pyosr) {
 		.def_property("state", &UnitWorld::getRobotState, &UnitWorld::setRobotState)
 		.def("is_valid_state", &UnitWorld::isValid, py::call_guard<py::gil_scoped_release>())
 		.def("is_disentangled", &UnitWorld::isDisentangled, py::call_guard<py::gil_scoped_release>())
+		.def("are_valid_states", &UnitWorld::areValid,
+		     py::arg("qs"),
+		     py::arg("enable_mt") = true,
+		     py::call_guard<py::gil_scoped_release>())
+		.def("are_disentangled", &UnitWorld::areDisentangled,
+		     py::arg("qs"),
+		     py::arg("enable_mt") = true,
+		     py::call_guard<py::gil_scoped_release>())
 		.def("transit_state", &UnitWorld::transitState, py::call_guard<py::gil_scoped_release>())
 		.def("transit_state_to", &UnitWorld::transitStateTo,
 		     py::arg("from"),
@@ -149,6 +176,9 @@ PYBIND11_PLUGIN(pyosr) {
 		     py::arg("initial_verify_delta"),
 		     py::call_guard<py::gil_scoped_release>())
 		.def("transit_state_by", &UnitWorld::transitStateBy, py::call_guard<py::gil_scoped_release>())
+		.def_property("motion_check_mode", &UnitWorld::getMotionCheckMode, &UnitWorld::setMotionCheckMode)
+		.def_property_readonly("discrete_check_count", &UnitWorld::getDiscreteCheckCount)
+		.def("reset_discrete_check_count", &UnitWorld::resetDiscreteCheckCount)
 		.def("translate_to_unit_state", &UnitWorld::translateToUnitState, py::call_guard<py::gil_scoped_release>())
 		.def("translate_from_unit_state", &UnitWorld::translateFromUnitState, py::call_guard<py::gil_scoped_release>())
 		.def("translate_unit_to_ompl", &UnitWorld::translateUnitStateToOMPLState,
@@ -177,15 +207,37 @@ PYBIND11_PLUGIN(pyosr) {
 				py::arg("verify_magnitude"),
 				py::arg("enable_mt") = true,
 				py::call_guard<py::gil_scoped_release>())
+		.def("calculate_visibility_sparse", &UnitWorld::calculateVisibilitySparse,
+				py::arg("qs0"),
+				py::arg("qs0_are_unit_states"),
+				py::arg("qs1"),
+				py::arg("qs1_are_unit_states"),
+				py::arg("verify_magnitude"),
+				py::arg("max_hits") = 0,
+				py::arg("enable_mt") = true,
+				py::call_guard<py::gil_scoped_release>())
+		.def_property("progress_interval", &UnitWorld::getProgressInterval, &UnitWorld::setProgressInterval)
+		.def("cancel_visibility", &UnitWorld::cancelVisibility)
+		.def("reset_visibility_cancel", &UnitWorld::resetVisibilityCancel)
+		.def_property_readonly("visibility_cancelled", &UnitWorld::isVisibilityCancelled)
 #if PYOSR_HAS_MESHBOOL
 		.def("intersection_region_surface_areas", &UnitWorld::intersectionRegionSurfaceAreas, py::call_guard<py::gil_scoped_release>())
 		.def("intersecting_geometry", &UnitWorld::intersectingGeometry, py::call_guard<py::gil_scoped_release>())
+		.def("intersecting_geometry_batch", &UnitWorld::intersectingGeometryBatch,
+		     py::arg("qs"),
+		     py::arg("qs_are_unit_states"),
+		     py::arg("enable_mt") = true,
+		     py::call_guard<py::gil_scoped_release>())
 #endif
 		.def("intersecting_to_robot_surface", &UnitWorld::intersectingToRobotSurface, py::call_guard<py::gil_scoped_release>())
 		.def("intersecting_to_model_surface", &UnitWorld::intersectingToModelSurface, py::call_guard<py::gil_scoped_release>())
 		.def("get_robot_geometry", &UnitWorld::getRobotGeometry, py::call_guard<py::gil_scoped_release>())
 		.def("get_scene_geometry", &UnitWorld::getSceneGeometry, py::call_guard<py::gil_scoped_release>())
 		.def("intersecting_segments", &UnitWorld::intersectingSegments, py::call_guard<py::gil_scoped_release>())
+		.def("intersecting_segments_batch", &UnitWorld::intersectingSegmentsBatch,
+		     py::arg("unitqs"),
+		     py::arg("enable_mt") = true,
+		     py::call_guard<py::gil_scoped_release>())
 		.def("robot_face_normals_from_indices", py::overload_cast<const Eigen::Matrix<int, -1, 1>&>(&UnitWorld::getRobotFaceNormalsFromIndices), py::call_guard<py::gil_scoped_release>())
 		.def("scene_face_normals_from_indices", py::overload_cast<const Eigen::Matrix<int, -1, 1>&>(&UnitWorld::getSceneFaceNormalsFromIndices), py::call_guard<py::gil_scoped_release>())
 		.def("robot_face_normals_from_index_pairs", py::overload_cast<const Eigen::Matrix<int, -1, 2>&>(&UnitWorld::getRobotFaceNormalsFromIndices), py::call_guard<py::gil_scoped_release>())
@@ -1,14 +1,129 @@
 #include "ompldriver.h"
 #include <ompl/geometric/PathSimplifier.h>
 
+#include <atomic>
 #include <chrono>
+#include <cmath>
 #include <ctime>
+#include <random>
+#include <thread>
+#include <type_traits>
 #include <unordered_set>
 
 using hclock = std::chrono::high_resolution_clock;
 using GraphV = OmplDriver::GraphV;
 using GraphE = OmplDriver::GraphE;
 
+namespace {
+
+/*
+ * The ReRRT fork (third-party/ompl.app) declares the PDS setters on
+ * ompl::base::Planner. Only a parameter of Eigen::Ref<const M> can read a
+ * view in place; a const M& parameter turns the view into a temporary that
+ * dangles once the call returns if the planner keeps a pointer to it.
+ */
+template<typename MemFn, typename Arg>
+struct FirstParamIs : std::false_type {};
+
+template<typename C, typename R, typename A0, typename... Rest, typename Arg>
+struct FirstParamIs<R (C::*)(A0, Rest...), Arg>
+	: std::is_same<typename std::decay<A0>::type, Arg> {};
+
+template<typename MemFn, typename M>
+using TakesRef = std::integral_constant<bool,
+	FirstParamIs<MemFn, Eigen::Ref<const M>>::value>;
+
+using QByRef = TakesRef<decltype(&ompl::base::Planner::setSampleSet), GraphV>;
+using QFByRef = TakesRef<decltype(&ompl::base::Planner::setSampleSetFlags), OmplDriver::GraphVFlags>;
+using EdgesByRef = TakesRef<decltype(&ompl::base::Planner::setSampleSetEdges), Eigen::MatrixXi>;
+
+/*
+ * Copy of a view for planners that take const M&, made once when the view
+ * is set. Owned matrices and views read through Eigen::Ref need none.
+ */
+template<typename M>
+void preparePlannerCopy(const SharedMatrix<M>&, M& copy, std::true_type)
+{
+	copy = M();
+}
+
+template<typename M>
+void preparePlannerCopy(const SharedMatrix<M>& m, M& copy, std::false_type)
+{
+	copy = m.isView() ? M(m.get()) : M();
+}
+
+/*
+ * Argument of the planner's setter, see preparePlannerCopy
+ */
+template<typename M>
+Eigen::Map<const M> plannerArg(const SharedMatrix<M>& m, const M&, std::true_type)
+{
+	return m.get();
+}
+
+template<typename M>
+const M& plannerArg(const SharedMatrix<M>& m, const M& copy, std::false_type)
+{
+	return m.isView() ? copy : m.owned();
+}
+
+}
+
+void
+OmplDriver::setSampleSet(GraphV Q)
+{
+	predefined_sample_set_.assign(std::move(Q));
+	preparePlannerCopy(predefined_sample_set_, planner_pds_.Q, QByRef());
+}
+
+void
+OmplDriver::setSampleSetEdges(Eigen::MatrixXi QB, Eigen::MatrixXi QE, Eigen::MatrixXi QEB)
+{
+	pds_tree_bases_.assign(std::move(QB));
+	pds_edges_.assign(std::move(QE));
+	pds_edge_bases_.assign(std::move(QEB));
+	prepareEdgeCopies();
+}
+
+void
+OmplDriver::setSampleSetFlags(GraphVFlags QF)
+{
+	pds_flags_.assign(std::move(QF));
+	preparePlannerCopy(pds_flags_, planner_pds_.QF, QFByRef());
+}
+
+void
+OmplDriver::setSampleSetView(ConstBuffer<double> Q)
+{
+	predefined_sample_set_.assign(std::move(Q));
+	preparePlannerCopy(predefined_sample_set_, planner_pds_.Q, QByRef());
+}
+
+void
+OmplDriver::setSampleSetEdgesView(ConstBuffer<int> QB, ConstBuffer<int> QE, ConstBuffer<int> QEB)
+{
+	pds_tree_bases_.assign(std::move(QB));
+	pds_edges_.assign(std::move(QE));
+	pds_edge_bases_.assign(std::move(QEB));
+	prepareEdgeCopies();
+}
+
+void
+OmplDriver::setSampleSetFlagsView(ConstBuffer<uint32_t> QF)
+{
+	pds_flags_.assign(std::move(QF));
+	preparePlannerCopy(pds_flags_, planner_pds_.QF, QFByRef());
+}
+
+void
+OmplDriver::prepareEdgeCopies()
+{
+	preparePlannerCopy(pds_tree_bases_, planner_pds_.QB, EdgesByRef());
+	preparePlannerCopy(pds_edges_, planner_pds_.QE, EdgesByRef());
+	preparePlannerCopy(pds_edge_bases_, planner_pds_.QEB, EdgesByRef());
+}
+
 std::tuple<GraphV, GraphE>
 OmplDriver::solve(double days,
                   const std::string& output_fn,
@@ -19,8 +134,7 @@ OmplDriver::solve(double days,
 {
 	using namespace ompl;
 
-	ompl::app::SE3RigidBodyPlanning setup;
-	configSE3RigidBodyPlanning(setup, continuous);
+	auto& setup = acquireContext(continuous);
 	std::cout << "Trying to solve "
 		<< model_files_[MODEL_PART_ROB]
 		<< " v.s. "
@@ -35,14 +149,14 @@ OmplDriver::solve(double days,
 	}
 	if (predefined_sample_set_.rows() > 0) {
 		auto planner = setup.getPlanner();
-		planner->setSampleSet(predefined_sample_set_);
+		planner->setSampleSet(plannerArg(predefined_sample_set_, planner_pds_.Q, QByRef()));
 		if (pds_flags_.rows() > 0) {
-			planner->setSampleSetFlags(pds_flags_);
+			planner->setSampleSetFlags(plannerArg(pds_flags_, planner_pds_.QF, QFByRef()));
 		}
 		if (pds_tree_bases_.rows() > 0) {
-			planner->setSampleSetEdges(pds_tree_bases_,
-					pds_edges_,
-					pds_edge_bases_);
+			planner->setSampleSetEdges(plannerArg(pds_tree_bases_, planner_pds_.QB, EdgesByRef()),
+					plannerArg(pds_edges_, planner_pds_.QE, EdgesByRef()),
+					plannerArg(pds_edge_bases_, planner_pds_.QEB, EdgesByRef()));
 		}
 	} else {
 		if (record_compact_tree) {
@@ -52,20 +166,36 @@ OmplDriver::solve(double days,
 	latest_solution_.resize(0, 0);
 	latest_solution_status_ = ompl::base::PlannerStatus::UNKNOWN;
 	auto plan_start = hclock::now();
+	auto tlm_start = std::chrono::steady_clock::now();
+	std::unique_ptr<Telemetry> telemetry;
+	if (!telemetry_fn_.empty()) {
+		telemetry.reset(new Telemetry(telemetry_fn_, telemetry_interval_, telemetry_attempt_, telemetry_calls_++));
+		telemetry->write(Telemetry::SAMPLE, sampleTelemetry(setup, tlm_start));
+	}
+	bool stagnated = false;
+	bool exhausted = false;
 	ompl::base::PlannerStatus status;
-	if (ec_budget > 0) {
+	if (ec_budget > 0 || telemetry) {
 		auto si = setup.getSpaceInformation();
 		auto validator = si->getMotionValidator();
-		auto last_mc_count = validator->getCheckedMotionCount();
+		// The validator is shared with previous calls
+		auto mc_base = validator->getCheckedMotionCount();
+		auto last_mc_count = validator->getCheckedMotionCount() - mc_base;
 		auto last_mc_change = hclock::now();
 		auto last_minute_change = hclock::now();
+		std::chrono::duration<double> stagnation_limit(stagnation_limit_);
+		std::chrono::duration<double> time_limit(3600 * 24 * days);
 		ompl::base::PlannerTerminationConditionFn ptc;
-		ptc = [&validator, ec_budget, &last_mc_count, &last_mc_change, &last_minute_change]() -> bool {
-			auto mc_count = validator->getCheckedMotionCount();
+		ptc = [&]() -> bool {
+			auto mc_count = validator->getCheckedMotionCount() - mc_base;
 			auto now = hclock::now();
+			if (telemetry && telemetry->due(std::chrono::steady_clock::now()))
+				telemetry->write(Telemetry::SAMPLE, sampleTelemetry(setup, tlm_start));
+			if (ec_budget <= 0)
+				return now - plan_start > time_limit;
 			auto delta_from_last_minute_change = now - last_minute_change;
 			if (delta_from_last_minute_change > std::chrono::minutes(1)) {
-				std::time_t ctime_now = std::chrono::system_clock::to_time_t(now);
+				std::time_t ctime_now = std::chrono::system_clock::to_time_t(std::chrono::system_clock::now());
 				std::string tstr = std::ctime(&ctime_now);
 				tstr[tstr.size() - 1] = '\0'; // remove the trailing \n
 				std::cerr << '\r'
@@ -78,24 +208,40 @@ OmplDriver::solve(double days,
 			}
 			if (mc_count == last_mc_count) {
 				auto delta = hclock::now() - last_mc_change;
-				if (delta > std::chrono::minutes(15)) {
+				if (delta > stagnation_limit) {
 					std::cout << "FATAL: DETECTED STAGNATIATION OF MOTION CHECK."
 					          << " THE COUNTER STAYED AT " << last_mc_count
-					          << " FOR MORE THAN 15 MINUTES. "
+					          << " FOR MORE THAN " << stagnation_limit_ << " SECONDS. "
 					          << " CANCELLING FUTURE EXECUTION"
 					          << std::endl;
+					if (telemetry)
+						telemetry->write(Telemetry::STAGNATION, sampleTelemetry(setup, tlm_start));
+					stagnated = true;
 					return true;
 				}
 			} else {
 				last_mc_count = mc_count;
 				last_mc_change = hclock::now();
 			}
-			return mc_count > ec_budget;
+			exhausted = mc_count > ec_budget;
+			if (exhausted && telemetry)
+				telemetry->write(Telemetry::BUDGET, sampleTelemetry(setup, tlm_start));
+			return exhausted;
 		};
 		status = setup.solve(ptc);
 	} else {
 		status = setup.solve(3600 * 24 * days);
 	}
+	if (status == ompl::base::PlannerStatus::EXACT_SOLUTION)
+		latest_pn_.termination = "solved";
+	else if (stagnated)
+		latest_pn_.termination = "stagnation";
+	else if (exhausted)
+		latest_pn_.termination = "budget";
+	else
+		latest_pn_.termination = "time";
+	if (telemetry)
+		telemetry->write(Telemetry::FINAL, sampleTelemetry(setup, tlm_start));
 	std::chrono::duration<uint64_t, std::nano> plan_dur = hclock::now() - plan_start;
 	latest_pn_.planning_time = plan_dur.count() * 1e-6;
 	if (status) {
@@ -143,26 +289,126 @@ OmplDriver::solve(double days,
 }
 
 
+namespace {
+
+// splitmix64, to derive independent seeds of blocks
+uint64_t
+mix_seed(uint64_t x)
+{
+	x += 0x9E3779B97F4A7C15ULL;
+	x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9ULL;
+	x = (x ^ (x >> 27)) * 0x94D049BB133111EBULL;
+	return x ^ (x >> 31);
+}
+
+}
+
+constexpr size_t OmplDriver::kPresampleBlock;
+
 GraphV
-OmplDriver::presample(size_t nsamples)
+OmplDriver::presample(size_t nsamples,
+                      int64_t seed,
+                      bool valid_only,
+                      int nthreads)
 {
+	if (nsamples == 0)
+		return GraphV(0, 7);
+	uint64_t useed = seed >= 0 ? uint64_t(seed) : uint64_t(ompl::RNG::getSeed());
+	int hw = std::max(1, int(std::thread::hardware_concurrency()));
+	size_t nblocks = (nsamples + kPresampleBlock - 1) / kPresampleBlock;
+	// Valid states are rarer, draw enough blocks to keep all threads busy
+	size_t step = valid_only ? std::max<size_t>(nblocks, nthreads > 0 ? nthreads : hw) : nblocks;
+	std::vector<GraphV> parts;
+	size_t total = 0;
+	size_t block = 0;
+	while (total < nsamples) {
+		parts.emplace_back(presampleBlocks(block, step, useed, valid_only, nthreads));
+		total += parts.back().rows();
+		block += step;
+		if (valid_only && total == 0 && block >= 64 * step)
+			throw std::runtime_error("OmplDriver::presample: cannot find any valid state");
+	}
 	GraphV ret;
-	ompl::app::SE3RigidBodyPlanning setup;
-	configSE3RigidBodyPlanning(setup);
-	auto ss = setup.getGeometricComponentStateSpace();
-	auto sampler = ss->allocStateSampler();
-	auto state = ss->allocState();
-
-	std::vector<double> reals;
-	ss->copyToReals(reals, state);
-	ret.resize(nsamples, reals.size());
-	for (size_t i = 0; i < nsamples; i++) {
-		sampler->sampleUniform(state);
-		ss->copyToReals(reals, state);
-		ret.row(i) = Eigen::Map<Eigen::VectorXd>(reals.data(), reals.size());
+	ret.resize(nsamples, parts.front().cols());
+	size_t row = 0;
+	for (const auto& part : parts) {
+		size_t n = std::min<size_t>(part.rows(), nsamples - row);
+		ret.block(row, 0, n, ret.cols()) = part.topRows(n);
+		row += n;
+		if (row >= nsamples)
+			break;
 	}
+	return ret;
+}
+
 
-	ss->freeState(state);
+GraphV
+OmplDriver::presampleBlocks(size_t first_block,
+                            size_t nblocks,
+                            uint64_t seed,
+                            bool valid_only,
+                            int nthreads)
+{
+	auto& setup = acquireContext(false, false);
+	auto si = setup.getSpaceInformation();
+	auto ss = setup.getGeometricComponentStateSpace();
+	const auto& bounds = ss->as<ompl::base::SE3StateSpace>()->getBounds();
+	if (nthreads <= 0)
+		nthreads = std::max(1, int(std::thread::hardware_concurrency()));
+	nthreads = std::min<size_t>(nthreads, std::max<size_t>(nblocks, 1));
+
+	// Row (x, y, z, qx, qy, qz, qw), i.e. ss->copyToReals
+	using Block = Eigen::Matrix<double, -1, 7, Eigen::RowMajor>;
+	std::vector<Block> blocks(nblocks);
+	std::atomic<size_t> next(0);
+	// Like the parallel planners of OMPL, this assumes the state validity
+	// checker is thread-safe, which holds for the FCL checker of OMPL.app
+	auto worker = [&]() {
+		auto state = si->allocState();
+		std::vector<double> reals(7);
+		std::uniform_real_distribution<double> dis(0.0, 1.0);
+		for (size_t b = next++; b < nblocks; b = next++) {
+			std::mt19937_64 gen(mix_seed(seed ^ mix_seed(first_block + b)));
+			Block& out = blocks[b];
+			out.resize(kPresampleBlock, 7);
+			size_t n = 0;
+			for (size_t i = 0; i < kPresampleBlock; i++) {
+				for (int j = 0; j < 3; j++)
+					reals[j] = bounds.low[j] + (bounds.high[j] - bounds.low[j]) * dis(gen);
+				// Uniform quaternion (Shoemake), same as SO3 sampleUniform
+				double u1 = dis(gen), u2 = 2 * M_PI * dis(gen), u3 = 2 * M_PI * dis(gen);
+				reals[3] = std::sqrt(1 - u1) * std::sin(u2);
+				reals[4] = std::sqrt(1 - u1) * std::cos(u2);
+				reals[5] = std::sqrt(u1) * std::sin(u3);
+				reals[6] = std::sqrt(u1) * std::cos(u3);
+				if (valid_only) {
+					ss->copyFromReals(state, reals);
+					if (!si->isValid(state))
+						continue;
+				}
+				out.row(n++) = Eigen::Map<Eigen::Matrix<double, 1, 7>>(reals.data());
+			}
+			out.conservativeResize(n, Eigen::NoChange);
+		}
+		si->freeState(state);
+	};
+	std::vector<std::thread> threads;
+	for (int i = 1; i < nthreads; i++)
+		threads.emplace_back(worker);
+	worker();
+	for (auto& t : threads)
+		t.join();
+
+	size_t total = 0;
+	for (const auto& b : blocks)
+		total += b.rows();
+	GraphV ret;
+	ret.resize(total, 7);
+	size_t row = 0;
+	for (const auto& b : blocks) {
+		ret.block(row, 0, b.rows(), 7) = b;
+		row += b.rows();
+	}
 	return ret;
 }
 
@@ -175,13 +421,14 @@ OmplDriver::mergeExistingGraph(int KNN,
 {
 	// We do not really need an SE3RigidBodyPlanning object,
 	// but this make things much easier
-	ompl::app::SE3RigidBodyPlanning setup;
+	ompl::app::SE3RigidBodyPlanning* setup_ptr;
 	{
 		auto bak = planner_id_;
 		planner_id_ = PLANNER_ReRRT;
-		configSE3RigidBodyPlanning(setup, false);
+		setup_ptr = &acquireContext(false);
 		planner_id_ = bak;
 	}
+	auto& setup = *setup_ptr;
 	auto generic_planner = setup.getPlanner();
 	auto real_planner = std::dynamic_pointer_cast<ompl::geometric::ReRRT>(generic_planner);
 	if (!real_planner) {
@@ -561,13 +808,14 @@ OmplDriver::mergeExistingGraph(int KNN,
 Eigen::VectorXi
 OmplDriver::validateStates(const Eigen::MatrixXd& qs0)
 {
-	ompl::app::SE3RigidBodyPlanning setup;
+	ompl::app::SE3RigidBodyPlanning* setup_ptr;
 	{
 		auto bak = planner_id_;
 		planner_id_ = PLANNER_ReRRT;
-		configSE3RigidBodyPlanning(setup, false);
+		setup_ptr = &acquireContext(false, false);
 		planner_id_ = bak;
 	}
+	auto& setup = *setup_ptr;
 	auto generic_planner = setup.getPlanner();
 	auto si = generic_planner->getSpaceInformation();
 	auto ss = si->getStateSpace();
@@ -588,13 +836,14 @@ Eigen::VectorXi
 OmplDriver::validateMotionPairs(const Eigen::MatrixXd& qs0,
                                 const Eigen::MatrixXd& qs1)
 {
-	ompl::app::SE3RigidBodyPlanning setup;
+	ompl::app::SE3RigidBodyPlanning* setup_ptr;
 	{
 		auto bak = planner_id_;
 		planner_id_ = PLANNER_ReRRT;
-		configSE3RigidBodyPlanning(setup, false);
+		setup_ptr = &acquireContext(false, false);
 		planner_id_ = bak;
 	}
+	auto& setup = *setup_ptr;
 	auto generic_planner = setup.getPlanner();
 	auto si = generic_planner->getSpaceInformation();
 	auto ss = si->getStateSpace();
@@ -620,8 +869,7 @@ Eigen::MatrixXd
 OmplDriver::optimize(Eigen::MatrixXd eigen3_path,
                      double days)
 {
-	ompl::app::SE3RigidBodyPlanning setup;
-	configSE3RigidBodyPlanning(setup, false);
+	auto& setup = acquireContext(false, false);
 	ompl::geometric::PathGeometric path(setup.getSpaceInformation());
 	path.appendFromMatrix(eigen3_path);
 	ompl::geometric::PathSimplifier ps(setup.getSpaceInformation());
@@ -649,25 +897,7 @@ OmplDriver::configSE3RigidBodyPlanning(ompl::app::SE3RigidBodyPlanning& setup,
 		throw std::runtime_error("Failed to load rob/env gemoetry");
 	}
 
-	auto& ist = problem_states_[INIT_STATE];
-	base::ScopedState<base::SE3StateSpace> start(setup.getSpaceInformation());
-	start->setX(ist.tr(0));
-	start->setY(ist.tr(1));
-	start->setZ(ist.tr(2));
-	start->rotation().setAxisAngle(ist.rot_axis(0),
-			ist.rot_axis(1),
-			ist.rot_axis(2),
-			ist.rot_angle);
-	auto& gst = problem_states_[GOAL_STATE];
-	base::ScopedState<base::SE3StateSpace> goal(start);
-	goal->setX(gst.tr(0));
-	goal->setY(gst.tr(1));
-	goal->setZ(gst.tr(2));
-	goal->rotation().setAxisAngle(gst.rot_axis(0),
-			gst.rot_axis(1),
-			gst.rot_axis(2),
-			gst.rot_angle);
-	setup.setStartAndGoalStates(start, goal);
+	configStartAndGoal(setup);
 	if (!continuous)
 		setup.getSpaceInformation()->setStateValidityCheckingResolution(cdres_);
 
@@ -693,6 +923,101 @@ OmplDriver::configSE3RigidBodyPlanning(ompl::app::SE3RigidBodyPlanning& setup,
 }
 
 
+void
+OmplDriver::configStartAndGoal(ompl::app::SE3RigidBodyPlanning& setup)
+{
+	using namespace ompl;
+
+	auto& ist = problem_states_[INIT_STATE];
+	base::ScopedState<base::SE3StateSpace> start(setup.getSpaceInformation());
+	start->setX(ist.tr(0));
+	start->setY(ist.tr(1));
+	start->setZ(ist.tr(2));
+	start->rotation().setAxisAngle(ist.rot_axis(0),
+			ist.rot_axis(1),
+			ist.rot_axis(2),
+			ist.rot_angle);
+	auto& gst = problem_states_[GOAL_STATE];
+	base::ScopedState<base::SE3StateSpace> goal(start);
+	goal->setX(gst.tr(0));
+	goal->setY(gst.tr(1));
+	goal->setZ(gst.tr(2));
+	goal->rotation().setAxisAngle(gst.rot_axis(0),
+			gst.rot_axis(1),
+			gst.rot_axis(2),
+			gst.rot_angle);
+	setup.setStartAndGoalStates(start, goal);
+}
+
+
+bool
+OmplDriver::contextMatches(bool continuous) const
+{
+	if (!ctx_)
+		return false;
+	for (int i = 0; i < TOTAL_MODEL_PARTS; i++)
+		if (ctx_->model_files[i] != model_files_[i])
+			return false;
+	bool same_cdres = (ctx_->cdres == cdres_) ||
+	                  (std::isnan(ctx_->cdres) && std::isnan(cdres_));
+	return same_cdres &&
+	       ctx_->continuous == continuous &&
+	       ctx_->sampler_id == vs_sampler_id_ &&
+	       ctx_->sample_inj_fn == sample_inj_fn_ &&
+	       ctx_->mins == mins_ &&
+	       ctx_->maxs == maxs_;
+}
+
+
+ompl::app::SE3RigidBodyPlanning&
+OmplDriver::acquireContext(bool continuous, bool reset_planner)
+{
+	auto setup_start = hclock::now();
+	bool reused = reuse_context_ && contextMatches(continuous);
+	if (!reused) {
+		// Release the old meshes before loading new ones
+		ctx_.reset();
+		std::unique_ptr<PlanningContext> ctx(new PlanningContext);
+		for (int i = 0; i < TOTAL_MODEL_PARTS; i++)
+			ctx->model_files[i] = model_files_[i];
+		ctx->mins = mins_;
+		ctx->maxs = maxs_;
+		ctx->cdres = cdres_;
+		ctx->continuous = continuous;
+		ctx->sampler_id = vs_sampler_id_;
+		ctx->sample_inj_fn = sample_inj_fn_;
+		ctx->setup = std::make_shared<ompl::app::SE3RigidBodyPlanning>();
+		configSE3RigidBodyPlanning(*ctx->setup, continuous);
+		ctx_ = std::move(ctx);
+	} else if (reset_planner) {
+		// Meshes, collision hierarchy, bounds and motion validator are
+		// kept. SimpleSetup::setup() only sets up the new planner.
+		auto& setup = *ctx_->setup;
+		setup.clear();
+		config_planner(setup,
+				planner_id_,
+				vs_sampler_id_,
+				sample_inj_fn_.c_str(),
+				rdt_k_nearest_);
+		configStartAndGoal(setup);
+		if (!option_vector_.empty())
+			setup.getPlanner()->setOptionVector(option_vector_);
+		setup.setup();
+	}
+	auto validator = ctx_->setup->getSpaceInformation()->getMotionValidator();
+	ctx_->motion_check_base = validator->getCheckedMotionCount();
+	ctx_->motion_check_time_base = validator->getMotionCheckTime();
+	ctx_->motion_discrete_state_check_base = validator->getCheckedDiscreteStateCount();
+	ctx_->motion_valid_base = validator->getValidMotionCount();
+	ctx_->motion_invalid_base = validator->getInvalidMotionCount();
+
+	std::chrono::duration<uint64_t, std::nano> setup_dur = hclock::now() - setup_start;
+	latest_pn_.setup_time = setup_dur.count() * 1e-6;
+	latest_pn_.context_reused = reused;
+	return *ctx_->setup;
+}
+
+
 void
 OmplDriver::updatePerformanceNumbers(ompl::app::SE3RigidBodyPlanning& setup)
 {
@@ -706,7 +1031,32 @@ OmplDriver::updatePerformanceNumbers(ompl::app::SE3RigidBodyPlanning& setup)
 	} else {
 		latest_pn_.knn_query_time = 0.0;
 	}
-	latest_pn_.motion_check = validator->getCheckedMotionCount();
-	latest_pn_.motion_check_time = validator->getMotionCheckTime() * 1e-6;
-	latest_pn_.motion_discrete_state_check = validator->getCheckedDiscreteStateCount();
+	// Only count the current call
+	latest_pn_.motion_check = validator->getCheckedMotionCount() - ctx_->motion_check_base;
+	latest_pn_.motion_check_time = (validator->getMotionCheckTime() - ctx_->motion_check_time_base) * 1e-6;
+	latest_pn_.motion_discrete_state_check = validator->getCheckedDiscreteStateCount() - ctx_->motion_discrete_state_check_base;
+}
+
+
+TelemetrySample
+OmplDriver::sampleTelemetry(ompl::app::SE3RigidBodyPlanning& setup,
+                            std::chrono::steady_clock::time_point start) const
+{
+	TelemetrySample s;
+	std::chrono::duration<double> dur = std::chrono::steady_clock::now() - start;
+	s.time = dur.count();
+	auto validator = setup.getSpaceInformation()->getMotionValidator();
+	auto real_planner = std::dynamic_pointer_cast<ompl::geometric::ReRRT>(setup.getPlanner());
+	if (real_planner) {
+		auto nn = real_planner->_accessNearestNeighbors();
+		s.tree_size = nn->size();
+		s.knn_query_time = nn->getTimeCounter() * 1e-6;
+	}
+	s.motion_check = validator->getCheckedMotionCount() - ctx_->motion_check_base;
+	s.motion_valid = validator->getValidMotionCount() - ctx_->motion_valid_base;
+	s.motion_invalid = validator->getInvalidMotionCount() - ctx_->motion_invalid_base;
+	s.motion_check_time = (validator->getMotionCheckTime() - ctx_->motion_check_time_base) * 1e-6;
+	s.discrete_check = validator->getCheckedDiscreteStateCount() - ctx_->motion_discrete_state_check_base;
+	s.rss_mb = Telemetry::residentMemoryMB();
+	return s;
 }
@@ -15,6 +15,8 @@
 #include <omplapp/geometry/detail/FCLContinuousMotionValidator.h>
 #include <omplapp/config.h>
 #include "config_planner.h"
+#include "telemetry.h"
+#include "shared_matrix.h"
 #include <iostream>
 #include <vector>
 
@@ -52,6 +54,11 @@ public:
 		unsigned long motion_discrete_state_check = 0;
 		double knn_query_time = 0;
 		double knn_delete_time = 0;
+		// Time to create or reset the planning context, in ms
+		double setup_time = 0;
+		bool context_reused = false;
+		// Why solve returned: solved, time, budget or stagnation
+		std::string termination;
 	};
 
 	OmplDriver()
@@ -110,6 +117,38 @@ public:
 	// Collision detection resolution
 	void setCDRes(double cdres) { cdres_ = cdres; }
 
+	// Reuse the planning context (meshes, collision hierarchy and
+	// SpaceInformation) across calls. Enabled by default.
+	//
+	// The context is rebuilt if the model files, bounding box, CD
+	// resolution or the motion validator type changed since the last call.
+	void setContextReuse(bool enable)
+	{
+		reuse_context_ = enable;
+		if (!enable)
+			ctx_.reset();
+	}
+
+	// Release the meshes and the collision hierarchy
+	void clearContext() { ctx_.reset(); }
+
+	// Sample the counters of solve calls into fn (see telemetry.h) every
+	// interval seconds. An empty fn disables the telemetry.
+	//
+	// With ec_budget, solve also gives up after the motion check counter
+	// stays the same for stagnation_limit seconds.
+	void setTelemetry(const std::string& fn,
+	                  double interval = 10.0,
+	                  double stagnation_limit = 900.0)
+	{
+		telemetry_fn_ = fn;
+		telemetry_interval_ = interval;
+		stagnation_limit_ = stagnation_limit;
+		// Reruns append to the same file with call numbers from 0
+		std::chrono::duration<double> epoch = std::chrono::system_clock::now().time_since_epoch();
+		telemetry_attempt_ = epoch.count();
+	}
+
 	// Set the option vector.
 	// Option vector is a list of strings designed to pass arguments to
 	// motion planners in an end-to-end manner
@@ -124,8 +163,34 @@ public:
 	      bool record_compact_tree = false,
 	      bool continuous = false);
 
-	// Sample nsamples uniformly within C-space
-	GraphV presample(size_t nsamples);
+	/*
+	 * Sample nsamples uniformly within C-space
+	 *
+	 * The samples are drawn in blocks of kPresampleBlock candidates. Each
+	 * block has its own PRNG seeded from (seed, block index), and the
+	 * blocks are drawn by nthreads threads (0 means all cores). Hence the
+	 * result only depends on seed, not on the number of threads.
+	 *
+	 *      seed: negative to use the seed of OMPL's RNG
+	 *      valid_only: only keep the candidates that pass si->isValid
+	 */
+	GraphV presample(size_t nsamples,
+	                 int64_t seed = -1,
+	                 bool valid_only = false,
+	                 int nthreads = 0);
+
+	/*
+	 * The samples of blocks [first_block, first_block + nblocks) of the
+	 * sequence drawn by presample, in order. Callers can stream very large
+	 * sample sets with bounded memory by calling this repeatedly.
+	 */
+	GraphV presampleBlocks(size_t first_block,
+	                       size_t nblocks,
+	                       uint64_t seed,
+	                       bool valid_only = false,
+	                       int nthreads = 0);
+
+	static constexpr size_t kPresampleBlock = 4096;
 
 	// NOTE: TRANSLATION + W-LAST QUATERNION
 	void substituteState(int state_type, const Eigen::VectorXd& state)
@@ -184,22 +249,19 @@ public:
 	// Only one set is supported. If multiple ones present, users are
 	// supposed to call to merge them together in python side, which is
 	// eaiser
-	void setSampleSet(GraphV Q)
-	{
-		predefined_sample_set_ = std::move(Q);
-	}
+	void setSampleSet(GraphV Q);
+	void setSampleSetEdges(Eigen::MatrixXi QB, Eigen::MatrixXi QE, Eigen::MatrixXi QEB);
+	void setSampleSetFlags(GraphVFlags QF);
 
-	void setSampleSetEdges(Eigen::MatrixXi QB, Eigen::MatrixXi QE, Eigen::MatrixXi QEB)
-	{
-		pds_tree_bases_ = std::move(QB);
-		pds_edges_ = std::move(QE);
-		pds_edge_bases_ = std::move(QEB);
-	}
-
-	void setSampleSetFlags(GraphVFlags QF)
-	{
-		pds_flags_ = std::move(QF);
-	}
+	// Zero-copy variants of the setters above. The buffers are
+	// column-major and read-only, and their owners are kept alive until
+	// the sample set is replaced or the driver is destroyed.
+	//
+	// This allows solver processes on the same host to share one PDS,
+	// see src/GP/pipeline/pds_share.py
+	void setSampleSetView(ConstBuffer<double> Q);
+	void setSampleSetEdgesView(ConstBuffer<int> QB, ConstBuffer<int> QE, ConstBuffer<int> QEB);
+	void setSampleSetFlagsView(ConstBuffer<uint32_t> QF);
 
 	Eigen::SparseMatrix<int>
 	getSampleSetConnectivity() const
@@ -266,15 +328,62 @@ private:
 	std::vector<GraphV> ex_graph_v_;
 	std::vector<GraphE> ex_graph_e_;
 
-	GraphV predefined_sample_set_;
-	Eigen::MatrixXi pds_tree_bases_;
-	Eigen::MatrixXi pds_edges_;
-	Eigen::MatrixXi pds_edge_bases_;
-	GraphVFlags pds_flags_;
+	SharedMatrix<GraphV> predefined_sample_set_;
+	SharedMatrix<Eigen::MatrixXi> pds_tree_bases_;
+	SharedMatrix<Eigen::MatrixXi> pds_edges_;
+	SharedMatrix<Eigen::MatrixXi> pds_edge_bases_;
+	SharedMatrix<GraphVFlags> pds_flags_;
+	// Copies of views for planner setters that take const M& rather
+	// than Eigen::Ref<const M>, made once by the setters above (see
+	// preparePlannerCopy in ompldriver.cc) and empty otherwise.
+	struct {
+		GraphV Q;
+		GraphVFlags QF;
+		Eigen::MatrixXi QB, QE, QEB;
+	} planner_pds_;
+	void prepareEdgeCopies();
 	Eigen::SparseMatrix<int> predefined_set_connectivity_;
 	std::vector<std::string> option_vector_;
 
 	void configSE3RigidBodyPlanning(ompl::app::SE3RigidBodyPlanning& setup, bool continuous = false);
+	void configStartAndGoal(ompl::app::SE3RigidBodyPlanning& setup);
+
+	// Planning context shared by solve, presample, validateStates, etc.
+	struct PlanningContext {
+		std::shared_ptr<ompl::app::SE3RigidBodyPlanning> setup;
+
+		// Key
+		std::string model_files[TOTAL_MODEL_PARTS];
+		Eigen::Vector3d mins, maxs;
+		double cdres;
+		bool continuous;
+		// config_planner installs the samplers into the state space
+		// and the SpaceInformation, which outlive the planner
+		int sampler_id;
+		std::string sample_inj_fn;
+
+		// Counters of the motion validator when the current call
+		// started. The validator is shared by all calls.
+		unsigned long motion_check_base = 0;
+		double motion_check_time_base = 0;
+		unsigned long motion_discrete_state_check_base = 0;
+		unsigned long motion_valid_base = 0;
+		unsigned long motion_invalid_base = 0;
+	};
+	std::unique_ptr<PlanningContext> ctx_;
+	bool reuse_context_ = true;
+
+	bool contextMatches(bool continuous) const;
+
+	// Return the planning context of the current model files, bounding
+	// box, CD resolution and sampler, which is created on the first call.
+	//
+	// When the context is reused, the planner (planner_id_) and the
+	// start/goal states are replaced if reset_planner is true, and kept
+	// otherwise. Calls that only need the SpaceInformation should not
+	// reset the planner.
+	ompl::app::SE3RigidBodyPlanning&
+	acquireContext(bool continuous = false, bool reset_planner = true);
 
 	Eigen::Matrix<int64_t, -1, 1> compact_nouveau_vertex_id_;
 	Eigen::MatrixXd compact_nouveau_vertices_;
@@ -313,6 +422,15 @@ private:
 	PerformanceNumbers latest_pn_;
 
 	void updatePerformanceNumbers(ompl::app::SE3RigidBodyPlanning& setup);
+
+	std::string telemetry_fn_;
+	double telemetry_interval_ = 10.0;
+	double stagnation_limit_ = 900.0;
+	int telemetry_calls_ = 0;
+	double telemetry_attempt_ = 0;
+
+	TelemetrySample sampleTelemetry(ompl::app::SE3RigidBodyPlanning& setup,
+	                                std::chrono::steady_clock::time_point start) const;
 };
 
 #endif
@@ -5,6 +5,42 @@
 
 namespace py = pybind11;
 
+namespace {
+
+/*
+ * Wrap a column-major numpy array without copying. The array object is
+ * referenced by the returned buffer, and released with the GIL held.
+ */
+template<typename Scalar>
+ConstBuffer<Scalar>
+as_buffer(py::array a, const char* name)
+{
+	if (!py::isinstance<py::array_t<Scalar>>(a))
+		throw py::value_error(std::string(name) + ": unexpected dtype " +
+		                      std::string(py::str(a.dtype())));
+	if (a.ndim() < 1 || a.ndim() > 2)
+		throw py::value_error(std::string(name) + ": expect a vector or a matrix");
+	ConstBuffer<Scalar> ret;
+	ret.rows = a.shape(0);
+	ret.cols = a.ndim() == 2 ? a.shape(1) : 1;
+	const ssize_t itemsize = sizeof(Scalar);
+	bool contiguous = ret.rows <= 1 || a.strides(0) == itemsize;
+	if (a.ndim() == 2 && ret.cols > 1)
+		contiguous = contiguous && a.strides(1) == itemsize * ret.rows;
+	if (ret.rows * ret.cols > 0 && !contiguous)
+		throw py::value_error(std::string(name) + ": expect a Fortran-ordered array, "
+		                      "load it with pipeline.pds_share");
+	ret.data = static_cast<const Scalar*>(a.data());
+	ret.owner = std::shared_ptr<const void>(new py::object(a),
+		[](const void* p) {
+			py::gil_scoped_acquire gil;
+			delete static_cast<const py::object*>(p);
+		});
+	return ret;
+}
+
+}
+
 PYBIND11_MODULE(pyse3ompl, m) {
 	m.attr("PLANNER_RRT_CONNECT") = py::int_(int(PLANNER_RRT_CONNECT));
 	m.attr("PLANNER_RRT"        ) = py::int_(int(PLANNER_RRT        ));
@@ -36,6 +72,7 @@ PYBIND11_MODULE(pyse3ompl, m) {
 	m.attr("INIT_STATE") = py::int_(int(INIT_STATE));
 	m.attr("GOAL_STATE") = py::int_(int(GOAL_STATE));
 	m.attr("EXACT_SOLUTION") = py::int_(int(ompl::base::PlannerStatus::EXACT_SOLUTION));
+	m.attr("PRESAMPLE_BLOCK") = py::int_(int(OmplDriver::kPresampleBlock));
 	py::class_<OmplDriver::PerformanceNumbers>(m, "PerformanceNumbers")
 		.def(py::init<>())
 		.def_readonly("planning_time", &OmplDriver::PerformanceNumbers::planning_time)
@@ -44,6 +81,9 @@ PYBIND11_MODULE(pyse3ompl, m) {
 		.def_readonly("motion_discrete_state_check", &OmplDriver::PerformanceNumbers::motion_discrete_state_check)
 		.def_readonly("knn_query_time", &OmplDriver::PerformanceNumbers::knn_query_time)
 		.def_readonly("knn_delete_time", &OmplDriver::PerformanceNumbers::knn_delete_time)
+		.def_readonly("setup_time", &OmplDriver::PerformanceNumbers::setup_time)
+		.def_readonly("context_reused", &OmplDriver::PerformanceNumbers::context_reused)
+		.def_readonly("termination", &OmplDriver::PerformanceNumbers::termination)
 		;
 	py::class_<OmplDriver>(m, "OmplDriver")
 		.def(py::init<>())
@@ -53,6 +93,12 @@ PYBIND11_MODULE(pyse3ompl, m) {
 		.def("set_state", &OmplDriver::setState)
 		.def("set_cdres", &OmplDriver::setCDRes)
 		.def("set_option_vector", &OmplDriver::setOptionVector)
+		.def("set_context_reuse", &OmplDriver::setContextReuse)
+		.def("clear_context", &OmplDriver::clearContext)
+		.def("set_telemetry", &OmplDriver::setTelemetry,
+		     py::arg("fn"),
+		     py::arg("interval") = 10.0,
+		     py::arg("stagnation_limit") = 900.0)
 		.def("solve", &OmplDriver::solve,
 		     py::arg("days"),
 		     py::arg("output_fn") = std::string(),
@@ -81,8 +127,41 @@ PYBIND11_MODULE(pyse3ompl, m) {
 		     py::arg("QEB")
 		    )
 		.def("set_sample_set_flags", &OmplDriver::setSampleSetFlags)
+		.def("set_sample_set_view",
+		     [](OmplDriver& d, py::array Q) {
+		         d.setSampleSetView(as_buffer<double>(Q, "Q"));
+		     },
+		     py::arg("Q"))
+		.def("set_sample_set_edges_view",
+		     [](OmplDriver& d, py::array QB, py::array QE, py::array QEB) {
+		         d.setSampleSetEdgesView(as_buffer<int>(QB, "QB"),
+		                                 as_buffer<int>(QE, "QE"),
+		                                 as_buffer<int>(QEB, "QEB"));
+		     },
+		     py::arg("QB"),
+		     py::arg("QE"),
+		     py::arg("QEB"))
+		.def("set_sample_set_flags_view",
+		     [](OmplDriver& d, py::array QF) {
+		         d.setSampleSetFlagsView(as_buffer<uint32_t>(QF, "QF"));
+		     },
+		     py::arg("QF"))
 		.def("get_sample_set_connectivity", &OmplDriver::getSampleSetConnectivity)
-		.def("presample", &OmplDriver::presample)
+		.def("presample", &OmplDriver::presample,
+		     py::arg("nsamples"),
+		     py::arg("seed") = -1,
+		     py::arg("valid_only") = false,
+		     py::arg("nthreads") = 0,
+		     py::call_guard<py::gil_scoped_release>()
+		    )
+		.def("presample_blocks", &OmplDriver::presampleBlocks,
+		     py::arg("first_block"),
+		     py::arg("nblocks"),
+		     py::arg("seed"),
+		     py::arg("valid_only") = false,
+		     py::arg("nthreads") = 0,
+		     py::call_guard<py::gil_scoped_release>()
+		    )
 		.def("get_compact_graph", &OmplDriver::getCompactGraph)
 		.def("get_graph_istate_indices", &OmplDriver::getGraphIStateIndices)
 		.def("get_graph_gstate_indices", &OmplDriver::getGraphGStateIndices)
@@ -0,0 +1,78 @@
+#ifndef PYSE3OMPL_SHARED_MATRIX_H
+#define PYSE3OMPL_SHARED_MATRIX_H
+
+#include <memory>
+#include <new>
+#include <Eigen/Core>
+
+/*
+ * Column-major buffer owned by owner
+ */
+template<typename Scalar>
+struct ConstBuffer {
+	const Scalar* data = nullptr;
+	Eigen::Index rows = 0;
+	Eigen::Index cols = 0;
+	std::shared_ptr<const void> owner;
+};
+
+/*
+ * SharedMatrix
+ *
+ *      Read-only matrix that either owns its coefficients, or views a
+ *      column-major buffer owned by someone else, e.g. a memory mapped .npy
+ *      file under /dev/shm shared by all solver processes of a host.
+ *
+ *      The owner handle is kept alive until the matrix is replaced or
+ *      destroyed. Views are never written through.
+ */
+template<typename MatrixType>
+class SharedMatrix {
+public:
+	using Scalar = typename MatrixType::Scalar;
+	using ConstMap = Eigen::Map<const MatrixType>;
+
+	SharedMatrix()
+		:map_(nullptr, 0, MatrixType::ColsAtCompileTime == 1 ? 1 : 0)
+	{
+	}
+
+	// The map points to own_ or to the owner's buffer
+	SharedMatrix(const SharedMatrix&) = delete;
+	SharedMatrix& operator=(const SharedMatrix&) = delete;
+
+	void assign(MatrixType m)
+	{
+		owner_.reset();
+		own_ = std::move(m);
+		remap(own_.data(), own_.rows(), own_.cols());
+	}
+
+	void assign(ConstBuffer<Scalar> buf)
+	{
+		own_ = MatrixType();
+		owner_ = std::move(buf.owner);
+		remap(buf.data, buf.rows, buf.cols);
+	}
+
+	const ConstMap& get() const { return map_; }
+	Eigen::Index rows() const { return map_.rows(); }
+	Eigen::Index cols() const { return map_.cols(); }
+	bool isView() const { return owner_ != nullptr; }
+
+	// Coefficients owned by this matrix, empty for views
+	const MatrixType& owned() const { return own_; }
+private:
+	void remap(const Scalar* data, Eigen::Index rows, Eigen::Index cols)
+	{
+		// Eigen::Map is not assignable, see "Changing the mapped array"
+		// in the Eigen manual
+		new (&map_) ConstMap(data, rows, cols);
+	}
+
+	MatrixType own_;
+	std::shared_ptr<const void> owner_;
+	ConstMap map_;
+};
+
+#endif
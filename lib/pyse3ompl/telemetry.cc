@@ -0,0 +1,102 @@
+#include "telemetry.h"
+#include <cstdio>
+#include <cstring>
+#include <stdexcept>
+#include <stdint.h>
+#include <unistd.h>
+
+namespace {
+
+const char kMagic[8] = {'O', 'S', 'R', 'T', 'L', 'M', '1', '\0'};
+const char* kColumns[] = {
+	"attempt",
+	"call",
+	"event",
+	"time",
+	"tree_size",
+	"motion_check",
+	"motion_valid",
+	"motion_invalid",
+	"motion_check_time",
+	"discrete_check",
+	"knn_query_time",
+	"rss_mb",
+};
+const uint32_t kNColumns = sizeof(kColumns) / sizeof(kColumns[0]);
+
+std::string header()
+{
+	std::string ret(kMagic, sizeof(kMagic));
+	ret.append(reinterpret_cast<const char*>(&kNColumns), sizeof(kNColumns));
+	for (auto name : kColumns)
+		ret.append(name, std::strlen(name) + 1);
+	return ret;
+}
+
+}
+
+Telemetry::Telemetry(const std::string& fn, double interval, double attempt, int call)
+	:interval_(interval), attempt_(attempt), call_(call), last_(std::chrono::steady_clock::now())
+{
+	const std::string hdr = header();
+	bool fresh;
+	{
+		std::ifstream fin(fn, std::ios::binary);
+		std::string existing(hdr.size(), '\0');
+		fresh = !fin.read(&existing[0], existing.size()) && fin.gcount() == 0;
+		if (!fresh && existing != hdr) {
+			// Written with other columns, do not mix the layouts
+			fin.close();
+			std::rename(fn.c_str(), (fn + ".old").c_str());
+			fresh = true;
+		}
+	}
+	fout_.open(fn, std::ios::binary | std::ios::app);
+	if (!fout_.good())
+		throw std::runtime_error("Telemetry: cannot open " + fn);
+	if (fresh) {
+		fout_.write(hdr.data(), hdr.size());
+		fout_.flush();
+	}
+}
+
+bool
+Telemetry::due(std::chrono::steady_clock::time_point now) const
+{
+	return interval_.count() > 0 && now - last_ >= interval_;
+}
+
+void
+Telemetry::write(Event event, const TelemetrySample& s)
+{
+	double rec[] = {
+		attempt_,
+		double(call_),
+		double(event),
+		s.time,
+		s.tree_size,
+		s.motion_check,
+		s.motion_valid,
+		s.motion_invalid,
+		s.motion_check_time,
+		s.discrete_check,
+		s.knn_query_time,
+		s.rss_mb,
+	};
+	static_assert(sizeof(rec) / sizeof(rec[0]) == sizeof(kColumns) / sizeof(kColumns[0]),
+	              "Telemetry records must match the columns");
+	fout_.write(reinterpret_cast<const char*>(rec), sizeof(rec));
+	// Jobs may be killed at any time
+	fout_.flush();
+	last_ = std::chrono::steady_clock::now();
+}
+
+double
+Telemetry::residentMemoryMB()
+{
+	std::ifstream fin("/proc/self/statm");
+	unsigned long size = 0, resident = 0;
+	if (!(fin >> size >> resident))
+		return 0.0;
+	return resident * double(::sysconf(_SC_PAGESIZE)) / (1 << 20);
+}
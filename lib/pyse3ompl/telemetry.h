@@ -0,0 +1,67 @@
+#ifndef PYSE3OMPL_TELEMETRY_H
+#define PYSE3OMPL_TELEMETRY_H
+
+#include <chrono>
+#include <fstream>
+#include <string>
+
+/*
+ * Counters of one solve call. Counts and times only cover the current
+ * call, and times are in ms like OmplDriver::PerformanceNumbers.
+ */
+struct TelemetrySample {
+	double time = 0;                // seconds since the solve call started
+	double tree_size = 0;           // vertices in the NN structure of RDT
+	double motion_check = 0;
+	double motion_valid = 0;
+	double motion_invalid = 0;
+	double motion_check_time = 0;
+	double discrete_check = 0;
+	double knn_query_time = 0;
+	double rss_mb = 0;              // resident memory of the process
+};
+
+/*
+ * Telemetry
+ *
+ *      Time series of TelemetrySample, sampled by OmplDriver::solve from the
+ *      planner termination condition, i.e. in the planner thread, at most
+ *      once per interval.
+ *
+ *      File layout (native byte order, i.e. little-endian on our nodes):
+ *              char magic[8] = "OSRTLM1"
+ *              uint32 ncolumns
+ *              ncolumns NUL-terminated column names
+ *              records of ncolumns doubles, flushed one by one
+ *
+ *      The columns are (attempt, call, event, <fields of TelemetrySample>).
+ *      Solve calls of the same driver append to the file with increasing
+ *      call numbers. attempt is the UNIX time of OmplDriver::setTelemetry,
+ *      which tells the calls of a rerun from the ones of earlier runs.
+ *      Files with other columns are moved to <fn>.old rather than appended
+ *      to. The reader is src/GP/pipeline/telemetry.py.
+ */
+class Telemetry {
+public:
+	enum Event {
+		SAMPLE = 0,
+		STAGNATION = 1,   // the motion check counter stopped
+		BUDGET = 2,       // ec_budget exhausted
+		FINAL = 3,        // end of the solve call
+	};
+
+	Telemetry(const std::string& fn, double interval, double attempt, int call);
+
+	bool due(std::chrono::steady_clock::time_point now) const;
+	void write(Event event, const TelemetrySample& sample);
+
+	static double residentMemoryMB();
+private:
+	std::ofstream fout_;
+	std::chrono::duration<double> interval_;
+	double attempt_;
+	int call_;
+	std::chrono::steady_clock::time_point last_;
+};
+
+#endif
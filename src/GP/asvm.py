@@ -24,6 +24,24 @@ def fn_gen(fvm_dir, block_size):
         else:
             return
 
+'''
+Store the visible pairs of a sparse fragment into giant.
+
+With max_hits > 0, a row that reached max_hits visible pairs stopped at its
+last one, so the columns after it were never checked and stay undefined (-1).
+Other rows of the block were fully checked.
+'''
+def store_pairs(giant, pairs, max_hits, loc):
+    [q0start, q0end, q1start, q1end] = loc
+    giant[q0start:q0end, q1start:q1end] = 0
+    if max_hits > 0 and pairs.shape[0] > 0:
+        # pairs are sorted by row then column
+        rows, first, counts = np.unique(pairs[:,0], return_index=True, return_counts=True)
+        for row, f, c in zip(rows, first, counts):
+            if c >= max_hits:
+                giant[row, pairs[f + c - 1, 1] + 1:q1end] = -1
+    giant[pairs[:,0], pairs[:,1]] = 1
+
 def main():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('dir', help='Directory of segmented visibility matrix', nargs=None, type=str)
@@ -39,16 +57,24 @@ def main():
     q1end = 0
     for fn in progressbar(fn_gen(fvm_dir, block_size)):
         d = np.load(fn)
-        vmfrags.append(d['VMFrag'])
+        # Sparse fragments (condor-visibility-matrix2.py calc --sparse) only have the visible pairs
+        if 'VMPairs' in d:
+            max_hits = int(d['MaxHits']) if 'MaxHits' in d else 0
+            vmfrags.append(('pairs', (d['VMPairs'], max_hits)))
+        else:
+            vmfrags.append(('dense', d['VMFrag']))
         vmlocators.append(d['Locator'])
         # print("Load {}".format(fn))
         q0end = max(q0end, vmlocators[-1][1])
         q1end = max(q1end, vmlocators[-1][3])
     giant = np.full((q0end, q1end), -1, dtype=np.int8)
-    for i,(m,loc) in enumerate(zip(vmfrags, vmlocators)):
+    for i,((kind,m),loc) in enumerate(zip(vmfrags, vmlocators)):
         [q0start, q0end, q1start, q1end] = loc
         # print("Store Block {}".format(i))
-        giant[q0start:q0end, q1start:q1end] = m
+        if kind == 'pairs':
+            store_pairs(giant, m[0], m[1], loc)
+        else:
+            giant[q0start:q0end, q1start:q1end] = m
     if np.min(giant) < 0:
         print("Caveat: the assembled visibility matrix has undefined coefficients")
     if out.endswith('.mat'):
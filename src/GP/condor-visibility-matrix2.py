@@ -39,6 +39,8 @@ def get_parser():
     info_parser = subparsers.add_parser("info", parents=[common])
     calc_parser = subparsers.add_parser("calc", help='Calculate the visibility matrix between path (axis 0) and prm (axis 1)', parents=[common])
     calc_parser.add_argument('--puzzlename', help='Puzzle')
+    calc_parser.add_argument('--sparse', help='Store the visible pairs (VMPairs) instead of the matrix fragment', action='store_true')
+    calc_parser.add_argument('--max_hits', help='With --sparse, only find the first MAX_HITS visible PRM vertices of each path vertex within the PRM block of the task. 0 means all', type=int, default=0)
     calc_parser.add_argument('out', help='Output Directory', nargs=None, type=str)
     return parser
 
@@ -76,7 +78,9 @@ def calc(args):
                                 q0start, q0end, q1start, q1end,
                                 args.out,
                                 index=args.task_id,
-                                block_size=args.block_size)
+                                block_size=args.block_size,
+                                sparse=args.sparse,
+                                max_hits=args.max_hits)
 
 def main():
     args = parse()
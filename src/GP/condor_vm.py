@@ -26,17 +26,34 @@ def index_to_ranges(V0, V1, block_size, index):
         total_tasks += 1 if rem !=0  else 0
         return q0start, q0end, q1start, q1end, total_tasks
 
-def visibilty_matrix_calculator(aniconf, V0, V1, q0start, q0end, q1start, q1end, out_dir, index=None, block_size=None):
+'''
+sparse: store the visible pairs as VMPairs (indices into V0 and V1) instead
+        of the dense VMFrag
+max_hits: with sparse, only keep the first max_hits visible partners of
+          each row within this block of V1, i.e. per task rather than per
+          row of the assembled matrix. The unchecked pairs after the cutoff
+          are undefined (-1) in asvm.py.
+'''
+def visibilty_matrix_calculator(aniconf, V0, V1, q0start, q0end, q1start, q1end, out_dir, index=None, block_size=None,
+                                sparse=False, max_hits=0):
     r = pyosr.UnitWorld() # pyosr.Renderer is not avaliable in HTCondor
     r.loadModelFromFile(aniconf.env_fn)
     r.loadRobotFromFile(aniconf.rob_fn)
     r.scaleToUnit()
     r.angleModel(0.0, 0.0)
 
-    VM = r.calculate_visibility_matrix2(V0[q0start:q0end], False,
-                                        V1[q1start:q1end], False,
-                                        0.0125 * 4 / 8,
-                                        enable_mt=False)
+    if sparse:
+        VM = r.calculate_visibility_sparse(V0[q0start:q0end], False,
+                                           V1[q1start:q1end], False,
+                                           0.0125 * 4 / 8,
+                                           max_hits=max_hits,
+                                           enable_mt=False)
+        VM += np.array([q0start, q1start], dtype=VM.dtype)
+    else:
+        VM = r.calculate_visibility_matrix2(V0[q0start:q0end], False,
+                                            V1[q1start:q1end], False,
+                                            0.0125 * 4 / 8,
+                                            enable_mt=False)
     if out_dir == '-':
         print(VM)
     else:
@@ -44,5 +61,8 @@ def visibilty_matrix_calculator(aniconf, V0, V1, q0start, q0end, q1start, q1end,
             fn = '{}/q0-{}T{}-q1-{}T{}.npz'.format(out_dir, q0start, q0end, q1start, q1end)
         else:
             fn = '{}/index-{}-under-bs-{}.npz'.format(out_dir, index, block_size) # Second naming scheme
-        np.savez(fn, VMFrag=VM, Locator=[q0start, q0end, q1start, q1end])
+        if sparse:
+            np.savez(fn, VMPairs=VM, MaxHits=max_hits, Locator=[q0start, q0end, q1start, q1end])
+        else:
+            np.savez(fn, VMFrag=VM, Locator=[q0start, q0end, q1start, q1end])
 
@@ -41,42 +41,17 @@ def main():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     subparsers = parser.add_subparsers(dest='command', metavar='<name of submodule>')
     subparsers.required = True
-    # In the order that users general use
-    pipeline.init.setup_parser(subparsers)
-    pipeline.mimic.setup_parser(subparsers)
-    pipeline.add_puzzle.setup_parser(subparsers)
-    pipeline.add_extra.setup_parser(subparsers)
-    pipeline.autorun.setup_parser(subparsers)
-    pipeline.autorun2.setup_parser(subparsers)
-    # pipeline.autorun3.setup_parser(subparsers)
-    pipeline.autorun4.setup_parser(subparsers)
-    pipeline.autorun5.setup_parser(subparsers)
-    pipeline.autorun5_1.setup_parser(subparsers)
-    pipeline.autorun6.setup_parser(subparsers)
-    pipeline.autorun7.setup_parser(subparsers)
-    pipeline.copy_training_data.setup_parser(subparsers)
-    # Occationally users want to run pipeline stages individually
-    # This also provides the interface for remoters in autorun*
-    pipeline.preprocess_key.setup_parser(subparsers)
-    pipeline.preprocess_surface.setup_parser(subparsers)
-    pipeline.geometrik.setup_parser(subparsers)
-    pipeline.geometrik2.setup_parser(subparsers)
-    pipeline.train.setup_parser(subparsers)
-    pipeline.keyconf.setup_parser(subparsers)
-    pipeline.solve.setup_parser(subparsers)
-    pipeline.solve1.setup_parser(subparsers)
-    pipeline.solve2.setup_parser(subparsers)
-    # Modules not a part of the auto pipeline
-    pipeline.baseline.setup_parser(subparsers)
-    pipeline.baseline_pwrdtc.setup_parser(subparsers)
-    pipeline.tools.setup_parser(subparsers)
-    pipeline.stats.setup_parser(subparsers)
+    # Only the requested subcommand is imported, see pipeline/commands.py
+    # argcomplete needs the complete parser of all subcommands.
+    full = USE_ARGCOMPLETE and '_ARGCOMPLETE' in os.environ
+    command = pipeline.commands.requested_command(sys.argv[1:])
+    pipeline.commands.setup_parsers(subparsers, command, full=full)
 
     if USE_ARGCOMPLETE:
         argcomplete.autocomplete(parser)
     args = parser.parse_args()
-    assert args.command in dir(pipeline), 'Cannot find command {} in {}'.format(args.command, dir(pipeline))
-    getattr(pipeline, args.command).run(args)
+    assert args.command in pipeline.COMMANDS, 'Cannot find command {} in {}'.format(args.command, list(pipeline.COMMANDS.keys()))
+    pipeline.commands.load(args.command).run(args)
 
 if __name__ == '__main__':
     # Disable this to avoid weird MemoryError exceptions
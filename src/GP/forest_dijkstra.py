@@ -16,6 +16,7 @@ import itertools
 import os
 import networkx as nx
 from pipeline import matio
+from pipeline import forest_store
 
 VIRTUAL_OPEN_SPACE_NODE = 1j
 
@@ -34,15 +35,15 @@ def _load(fefn, ds_name='E'):
     return d[ds_name] if ds_name in d else None
 
 class TreePathFinder(object):
-    def __init__(self, root, ssc_fn, ct_fn, pds, pds_ids, pds_flags, bloom_range, bloom_fn):
-        print("Loading data from {} {}".format(ssc_fn, ct_fn))
+    def __init__(self, root, forest, root_index, pds, pds_ids, pds_flags, bloom_range, bloom_fn):
+        print("Loading data of root {} from {}".format(root_index, self._forest_name(forest)))
         self._root_conf = root
-        self._ssc = loadmat(ssc_fn)['C'] # Note: no flatten for sparse matrix
-        d = loadmat(ct_fn)
-        self._ct_fn = ct_fn
-        self._ct_nouveau_indices = d['CNVI'].flatten() # In case it's stored as 1xN or Nx1 matrix
-        self._ct_nouveau_vertices = d['CNV']
-        self._ct_edges = d['CE']
+        self._ssc = forest.connectivity(root_index) # Note: no flatten for sparse matrix
+        self._ct_fn = '{} root {}'.format(self._forest_name(forest), root_index)
+        CNVI, CNV, CE = forest.compact_tree(root_index)
+        self._ct_nouveau_indices = CNVI
+        self._ct_nouveau_vertices = CNV
+        self._ct_edges = CE
         self._pds = pds
         self._pds_flags = pds_flags
         self._bloom_range = bloom_range
@@ -55,6 +56,10 @@ class TreePathFinder(object):
 
         self._bloom_G = None
 
+    @staticmethod
+    def _forest_name(forest):
+        return forest.fn if hasattr(forest, 'fn') else forest.indir
+
     def get_node_conf(self, node):
         if node < 0:
             assert node == -1, 'Only support single initial state'
@@ -138,17 +143,19 @@ class ForestPathFinder(object):
         #d = np.load(args.rootf)
         #self._roots = d[list(d.keys())[0]]
         self._roots = _load(args.rootf, ds_name='KEYQ_OMPL')
-        self._ssc_files = _lsv(args.indir, args.prefix_ssc, '.mat')
-        self._pds_size = loadmat(self._ssc_files[0])['C'].shape[1]
+        self._forest = forest_store.open_forest(args.indir, prefix_ssc=args.prefix_ssc, prefix_ct=args.prefix_ct)
+        self._pds_size = self._forest.pds_size
         self._pds_ids = [i for i in range(self._pds_size)]
         self._pds = _load(args.pdsf, 'Q')
         self._pds_flags = _load(args.pdsf, 'QF')
-        self._ct_files = _lsv(args.indir, args.prefix_ct, '.mat')
-        nssc = len(self._ssc_files)
-        nct = len(self._ct_files)
-        assert nssc == nct, 'number of compact tree files ({}) should match number of sample set connectivity files ({})'.format(nct, nssc)
+        nssc = len(self._forest)
+        if isinstance(self._forest, forest_store.MatForest):
+            nct = self._forest.ntrees
+            assert nssc == nct, 'number of compact tree files ({}) should match number of sample set connectivity files ({})'.format(nct, nssc)
+        assert self._forest.roots == list(range(nssc)), 'roots {} are missing in {}'.format(
+                sorted(set(range(max(self._forest.roots) + 1)) - set(self._forest.roots)), args.indir)
         self._nroots = int(self._roots.shape[0])
-        assert self._nroots == nct, 'number of roots ({}) should match number of sample set connectivity files ({})'.format(self._nroots, nssc)
+        assert self._nroots == nssc, 'number of roots ({}) should match number of trees in the forest ({})'.format(self._nroots, nssc)
         self._bloom_range = None
         self._bloom_files = None
         if args.bloom_dir is not None:
@@ -244,8 +251,8 @@ class ForestPathFinder(object):
             bloom_range = None if self._bloom_range is None else self._bloom_range[root]
             bloom_fn = None if self._bloom_files is None else self._bloom_files[root]
             tree = TreePathFinder(root=self._roots[root],
-                                  ssc_fn=self._ssc_files[root],
-                                  ct_fn=self._ct_files[root],
+                                  forest=self._forest,
+                                  root_index=root,
                                   pds=self._pds,
                                   pds_ids=self._pds_ids,
                                   pds_flags=self._pds_flags,
@@ -276,9 +283,8 @@ class ForestPathFinder(object):
             if isinstance(root, complex) or root >= 0:
                 continue
             index = -(root + 1)
-            ct_fn = self._ct_files[index]
-            d = loadmat(ct_fn)
-            if np.min(d['CE']) != -1:
+            _, _, CE = self._forest.compact_tree(index)
+            if np.min(CE) != -1:
                 bugnode.append(index)
         if bugnode:
             print("These nodes are buggy:\n{}".format(bugnode))
@@ -306,7 +312,7 @@ class ForestPathFinder(object):
 
 def main():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument('--indir', help='input directory for ssc-*.mat and file', required=True)
+    parser.add_argument('--indir', help='input directory for forest.fst, or ssc-*.mat and compact_tree-*.mat files', required=True)
     parser.add_argument('--rootf', help='Roots of forest file', required=True)
     parser.add_argument('--pdsf', help='PreDefined sample Set File', required=True)
     parser.add_argument('--forest_edge', help='Pre-processed edge file from pds_edge.py', required=True)
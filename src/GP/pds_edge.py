@@ -16,6 +16,7 @@ import h5py
 import scipy.sparse as sparse
 from progressbar import progressbar, ProgressBar
 from pipeline import matio
+from pipeline import forest_store
 from psutil import virtual_memory
 
 _OPENSPACE_FLAG = 1
@@ -23,18 +24,48 @@ _OPENSPACE_FLAG = 1
 def _total_memory():
     return virtual_memory().total
 
-def collect_ITE(files, buf, ITE, low, high, pbar=None, QF=None, roots_to_open=None):
+class _MatRows(object):
+    '''
+    Rows of ssc-*.mat files
+    '''
+    def __init__(self, files):
+        self._files = files
+        self.nrows = len(files)
+
+    def ncols(self):
+        return matio.load(self._files[0])['C'].shape[1]
+
+    def load(self, buf, low, high, pbar=None):
+        for i,fn in enumerate(self._files):
+            buf[i, 0:high-low] = matio.load(fn)['C'].todense()[:, low:high]
+            if pbar is not None:
+                pbar += high - low
+
+class _StoreRows(object):
+    '''
+    Rows of a forest store, one per root
+    '''
+    def __init__(self, fn):
+        self._store = forest_store.ForestStore(fn)
+        self._C = self._store.connectivity_matrix()
+        self.nrows = self._C.shape[0]
+
+    def ncols(self):
+        return self._C.shape[1]
+
+    def load(self, buf, low, high, pbar=None):
+        buf[:, 0:high-low] = self._C[:, low:high].todense()
+        if pbar is not None:
+            pbar += (high - low) * self.nrows
+
+def collect_ITE(rows, buf, ITE, low, high, pbar=None, QF=None, roots_to_open=None):
     # print("low {}".format(low))
     batch = high - low
     '''
     Load data into buffer
     '''
-    N = len(files)
-    for i,fn in enumerate(files):
-        row_data = matio.load(fn)['C'].todense()[:, low:high]
-        buf[i, 0:batch] = row_data
-        if pbar is not None:
-            pbar += batch
+    N = rows.nrows
+    rows.load(buf, low, high, pbar)
     col_sum = np.sum(buf, axis=0)
     for i in range(batch):
         local_col = batch - 1 - i
@@ -56,14 +87,18 @@ def print_edge(args):
         QF = np.load(args.pdsflags)['QF']
     else:
         QF = None
+    if len(args.files) == 1 and args.files[0].endswith(forest_store.STORE_FILE):
+        rows = _StoreRows(args.files[0])
+    else:
+        rows = _MatRows(args.files)
     f = h5py.File(args.out, mode='a')
-    N = len(args.files)                     # N: number of roots
+    N = rows.nrows                          # N: number of roots
     # Guessing K: PDS size
     # QF is the most reliable source
     if QF is not None:
         K = QF.shape[0]
     else:
-        K = matio.load(args.files[0])['C'].shape[1]
+        K = rows.ncols()
 
     #inter_tree_dtype = np.uint32 if K < np.iinfo(np.uint32).max else np.uint64
     inter_tree_dtype = np.int64
@@ -87,7 +122,7 @@ def print_edge(args):
     for high,low in zip(sep[:-1], sep[1:]):
         if high == low:
             continue
-        collect_ITE(args.files, per_run_buffer, ITE, low, high, pbar,
+        collect_ITE(rows, per_run_buffer, ITE, low, high, pbar,
                     QF=QF, roots_to_open=roots_to_open)
     del per_run_buffer
 
@@ -102,7 +137,7 @@ def print_edge(args):
 
 def main():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument('files', help='ssc-*.mat file', nargs='+')
+    parser.add_argument('files', help='ssc-*.mat files, or a single forest.fst written by se3solver.py solve', nargs='+')
     parser.add_argument('--out', help='output edge file in .hdf5', required=True)
     parser.add_argument('--pdsflags', help='File that stores PDS Flags, usually in the same npz file that also stores PDS', default=None)
     args = parser.parse_args()
@@ -1,31 +1,19 @@
-from . import util
-from . import init
-from . import mimic
-from . import add_puzzle
-from . import add_extra
-from . import envconfig
-from . import autorun
-from . import matio
-from . import preprocess_key
-from . import preprocess_surface
-try:
-    from . import hg_launcher
-except ImportError as e:
-    util.warn("[WARNING] CANNOT IMPORT hg_launcher. This node is incapable of training/prediction")
-from . import train
-from . import solve
-from . import se3solver
-from . import baseline
-from . import baseline_pwrdtc
-from . import tools
-from . import stats
-from . import keyconf
-from . import autorun2
-# from . import autorun3
-# from . import robogeok
-from . import copy_training_data
-from . import autorun4
-from . import autorun5
-from . import autorun5_1
-from . import autorun6
-from . import autorun7
+'''
+Modules of this package are imported on first access, e.g. pipeline.solve2,
+so that facade.py only loads what the requested subcommand needs.
+See commands.py
+'''
+import importlib
+
+from .commands import COMMANDS
+
+def __getattr__(name):
+    try:
+        return importlib.import_module('.' + name, __name__)
+    except ModuleNotFoundError as e:
+        if e.name != '{}.{}'.format(__name__, name):
+            raise
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(COMMANDS.keys()))
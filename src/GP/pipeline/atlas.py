@@ -9,6 +9,7 @@ from imageio import imwrite as imsave
 import texture_format
 
 from . import matio
+from . import atlas_kernels
 
 def _save_green(ofn, ns):
     gatex = np.zeros(shape=(ns.shape[0], ns.shape[1], 3))
@@ -30,25 +31,11 @@ def _uv_to_pix(u, v, raster_shape):
     Similarity
         y_r = v * height
     '''
-    sizes = np.array(raster_shape)
-    # print("halves {} raster_shape {}".format(halves, raster_shape))
-    return np.array([u, v]) * sizes
+    return atlas_kernels.uv_to_pix([u, v], raster_shape)
 
 def _bilinear(raster, u, v):
-    pix = _uv_to_pix(u, v, raster.shape)
-    # print("UV to Pix {} {} -> {}".format(u, v, pix))
-    pixi = np.floor(pix).astype(int) # Pix Integer
-    r = pix - pixi # Remainder
-    def _sample(x, y, no_data=0.0):
-        if x < 0 or x >= raster.shape[0]:
-            return no_data
-        if y < 0 or y >= raster.shape[1]:
-            return no_data
-        return raster[x, y]
-    return _sample(pixi[0], pixi[1]) * (1.0 - r[0]) * (1.0 - r[1]) + \
-           _sample(pixi[0] + 1, pixi[1]) * r[0] * (1.0 - r[1]) + \
-           _sample(pixi[0], pixi[1]+1) * (1.0 - r[0]) * r[1] + \
-           _sample(pixi[0] + 1, pixi[1] + 1) * r[0] * r[1]
+    # See atlas_kernels.bilinear for sampling many UV points at once
+    return atlas_kernels.bilinear(raster, [u, v])
 
 class AtlasSamplerInterface(ABC):
     def __init__(self):
@@ -91,22 +78,16 @@ class SingleChannelAtlasSampler(object):
             np.std(self._atlas)
             ))
         #self._atlas -= np.min(self._atlas) # All elements must be non-negative
-        np.clip(self._atlas, a_min=0.0, a_max=None, out=self._atlas) # All elements must be non-negative
-        # Match the visualization results
-        self._atlas /= np.max(self._atlas)
-        self._atlas *= 255.0
-        self._atlas = self._atlas.astype(np.uint).astype(np.float32)
-        self._atlas[self._atlas < 32.0] = 0.0
+        # Clips out negative weights, and match the visualization results
+        self._atlas = atlas_kernels.normalize_weights(self._atlas, cutoff=32.0)
         print("Atlas2Prim resolution {}".format(self._atlas2prim.shape))
         print("Atlas resolution {}".format(self._atlas.shape))
-        self._nzpix = np.nonzero(self._atlas)
-        self._nzpixweight = self._atlas[self._nzpix]
-        nzsum = np.sum(self._nzpixweight)
+        self._nzpix, self._nzpixweight, nzsum = atlas_kernels.nonzero_distribution(self._atlas)
         print("NZ pix num {} {} sum {}".format(self._nzpix[0].shape, self._nzpix[1].shape, nzsum))
         print("NZ pix coord maxs {} {}".format(np.max(self._nzpix[0]), np.max(self._nzpix[1])))
         print("NZ pix coord mins {} {}".format(np.min(self._nzpix[0]), np.min(self._nzpix[1])))
-        self._nzpixweight /= nzsum
-        self._nzpix_idx = np.array([i for i in range(len(self._nzpix[0]))], dtype=np.int32)
+        self._nzpix_idx = np.arange(len(self._nzpix[0]), dtype=np.int32)
+        self._nzpix_sampler = atlas_kernels.DiscreteSampler(self._nzpixweight)
         print("ATLAS Sum {} Max {} Min {} Mean {} Stddev {}".format(
             np.sum(self._atlas),
             np.max(self._atlas),
@@ -174,9 +155,8 @@ class SingleChannelAtlasSampler(object):
                 np.median(fatlas),
                 np.std(fatlas)
                 ))
-            nzmedian = np.median(fatlas[fatlas.nonzero()])
-            fatlas[fatlas < nzmedian] = 0.0
-            print("{} fatlas nz {}".format(i, len(np.nonzero(fatlas)[0])))
+            atlas_kernels.screen(fatlas, threshold='median')
+            print("{} fatlas nz {}".format(i, np.count_nonzero(fatlas)))
         ns = np.zeros(shape=self._atlas.shape, dtype=np.int32)
         ns[fatlas.nonzero()] = 255
         _save_green(ofn, ns)
@@ -231,7 +211,9 @@ class SingleChannelAtlasSampler(object):
         # print('NZPIX {}'.format(self._nzpixweight))
         while True:
         #for idx in range(len(self._nzpix[0])):
-            idx = np.random.choice(self._nzpix_idx, p=self._nzpixweight)
+            # Same as np.random.choice(self._nzpix_idx, p=self._nzpixweight)
+            # without rebuilding the CDF for every sample
+            idx = self._nzpix_idx[self._nzpix_sampler.draw()]
             pert = pres * np.random.uniform(low=-0.5, high=0.5, size=(2))
             # pert = pres * 0
             pix = np.array([self._nzpix[0][idx], self._nzpix[1][idx]])
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+atlas_kernels.py -- vectorized kernels over atlas textures
+
+Used by atlas.py (surface sampler) and preprocess_surface.screen_weight.
+All kernels operate on whole arrays; numba is used for bilinear sampling if
+it is available, and the results are identical to the NumPy path.
+'''
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+'''
+Vectorized atlas._uv_to_pix
+
+uv: (N, 2) array of UV coordinates in the numpy order (see texture_format)
+Return: (N, 2) float pixel coordinates
+'''
+def uv_to_pix(uv, raster_shape):
+    return np.asarray(uv, dtype=np.float64) * np.array(raster_shape[:2])
+
+def _bilinear_numpy(raster, pix, no_data):
+    pixi = np.floor(pix).astype(int)
+    r = pix - pixi
+    ret = None
+    for dx, dy in [(0, 0), (1, 0), (0, 1), (1, 1)]:
+        x = pixi[:, 0] + dx
+        y = pixi[:, 1] + dy
+        valid = (x >= 0) & (x < raster.shape[0]) & (y >= 0) & (y < raster.shape[1])
+        s = np.full(x.shape, no_data, dtype=np.result_type(raster.dtype, np.float64))
+        s[valid] = raster[x[valid], y[valid]]
+        wx = r[:, 0] if dx else 1.0 - r[:, 0]
+        wy = r[:, 1] if dy else 1.0 - r[:, 1]
+        term = s * wx * wy
+        ret = term if ret is None else ret + term
+    return ret
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _bilinear_compiled(raster, pix, no_data):
+        n = pix.shape[0]
+        ret = np.empty(n, dtype=np.float64)
+        for i in range(n):
+            fx = np.floor(pix[i, 0])
+            fy = np.floor(pix[i, 1])
+            x = int(fx)
+            y = int(fy)
+            rx = pix[i, 0] - fx
+            ry = pix[i, 1] - fy
+            acc = 0.0
+            # Same summation order as _bilinear_numpy
+            for dy in range(2):
+                for dx in range(2):
+                    sx = x + dx
+                    sy = y + dy
+                    if sx < 0 or sx >= raster.shape[0] or sy < 0 or sy >= raster.shape[1]:
+                        s = no_data
+                    else:
+                        s = raster[sx, sy]
+                    wx = rx if dx else 1.0 - rx
+                    wy = ry if dy else 1.0 - ry
+                    if dx == 0 and dy == 0:
+                        acc = s * wx * wy
+                    else:
+                        acc = acc + s * wx * wy
+            ret[i] = acc
+        return ret
+else:
+    _bilinear_compiled = None
+
+'''
+Bilinear sampling of a 2D raster at many UV points at once.
+Texels outside of the raster contribute no_data.
+
+uv: (N, 2) or (2,)
+Return: (N,) float64 array, or a scalar if uv is (2,)
+'''
+def bilinear(raster, uv, no_data=0.0):
+    uv = np.asarray(uv, dtype=np.float64)
+    scalar = uv.ndim == 1
+    pix = uv_to_pix(uv.reshape(-1, 2), raster.shape)
+    if _bilinear_compiled is not None and raster.ndim == 2:
+        ret = _bilinear_compiled(raster, pix, float(no_data))
+    else:
+        ret = _bilinear_numpy(raster, pix, no_data)
+    return ret[0] if scalar else ret
+
+'''
+Threshold of the non-zero elements
+
+threshold: 'mean', 'median', or a float in [0, 1] as the quantile
+'''
+def nonzero_threshold(img, threshold='mean'):
+    nz = img[img != 0]
+    if nz.size == 0:
+        return 0.0
+    if threshold == 'mean':
+        return np.mean(nz)
+    if threshold == 'median':
+        return np.median(nz)
+    return np.quantile(nz, float(threshold))
+
+'''
+Repeatedly zero out elements below the threshold of the non-zero elements, in place.
+
+callback(i, img, threshold) is called before each loop, for logging.
+Return: img
+'''
+def screen(img, threshold='mean', loops=1, callback=None):
+    for i in range(loops):
+        m = nonzero_threshold(img, threshold)
+        if callback is not None:
+            callback(i, img, m)
+        img[img < m] = 0.0
+    return img
+
+'''
+Normalize the raw atlas to match the visualization results:
+    1. clip negative weights
+    2. scale to [0, 255] and quantize
+    3. zero out texels below cutoff
+
+Return: new float32 array
+'''
+def normalize_weights(atlas, cutoff=32.0):
+    atlas = np.clip(atlas, a_min=0.0, a_max=None)
+    atlas /= np.max(atlas)
+    atlas *= 255.0
+    atlas = atlas.astype(np.uint).astype(np.float32)
+    atlas[atlas < cutoff] = 0.0
+    return atlas
+
+'''
+Return the non-zero texels of the atlas, their weights normalized to 1, and
+the sum of weights before the normalization.
+'''
+def nonzero_distribution(atlas):
+    nzpix = np.nonzero(atlas)
+    nzweight = atlas[nzpix]
+    nzsum = np.sum(nzweight)
+    nzweight /= nzsum
+    return nzpix, nzweight, nzsum
+
+class DiscreteSampler(object):
+    '''
+    Draw indices from a discrete distribution with a precomputed CDF.
+
+    np.random.choice(a, p=p) rebuilds the CDF in every call, which is O(N)
+    for a 2048x2048 atlas. The CDF here is built the same way, and the same
+    random number is consumed from np.random, so the drawn indices are
+    identical to np.random.choice(len(p), p=p).
+    '''
+    def __init__(self, p):
+        self._cdf = np.asarray(p, dtype=np.float64).cumsum()
+        self._cdf /= self._cdf[-1]
+
+    def draw(self, size=None):
+        u = np.random.random_sample(size)
+        return self._cdf.searchsorted(u, side='right')
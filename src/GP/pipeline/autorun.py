@@ -35,6 +35,7 @@ def run_pipeline(ppl_stages, args):
     if args.condor_host:
         ws.override_condor_host(args.condor_host)
     ws.override_config(args.override_config)
+    ws.force_sync = args.force_sync
     nstage = []
     if args.stage_list:
         stage_list = []
@@ -104,6 +105,7 @@ def setup_autorun_parser(subparsers, name, pdesc, helptext='Run all pipelines au
     p.add_argument('--condor_host', help='Override the CondorHost option provided by config File in workspace', type=str, default=None)
     p.add_argument('--override_config', help='Override configurations by config file in workspace. Syntax: SECTION.OPTION=VALUE. Separated by semicolon (;)',
                    type=str, default=None)
+    p.add_argument('--force_sync', help='Ignore the upload manifests under .wsync/ and let rsync compare every file, e.g. after the remote workspace was modified', action='store_true')
     # print('Total Stages: ' + str(len(stage_names)))
 
 
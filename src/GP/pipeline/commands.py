@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+commands.py -- lazy registry of facade.py subcommands
+
+facade.py used to import every pipeline module to build its argument parser,
+and with them pyosr, TensorFlow, h5py, scipy, etc. Every HTCondor task paid
+for this before doing any work.
+
+Now only the module of the requested subcommand is imported, and the other
+subcommands are registered as placeholders with their help texts, so that
+`facade.py -h` still lists all of them. Bash completion (argcomplete) needs
+the full parser, so all modules are loaded in that case.
+
+The startup cost can be measured with `facade.py startup`, which imports each
+subcommand in a fresh interpreter and reports the import time and the heavy
+dependencies it loaded. With --forbid, it fails if a subcommand loads any of
+the listed modules, e.g.
+
+    ./facade.py startup --forbid tensorflow,pyosr solve2
+'''
+
+import os
+import sys
+import json
+import importlib
+import subprocess
+from collections import OrderedDict
+
+# In the order that users general use
+COMMANDS = OrderedDict([
+        ('init', 'Initialize a directory as workspace'),
+        ('mimic', 'Initialize a workspace with a template workspace'),
+        ('add_puzzle', 'Add a puzzle to solve, the puzzle will be named after its file name'),
+        ('add_extra', 'Add more ground truth to train'),
+        ('autorun', 'NN pipeline'),
+        ('autorun2', 'GK pipeline'),
+        ('autorun4', 'GK+NN combined pipeline'),
+        ('autorun5', 'autorun4 with another planner design, which uses blooming tree in Phase 2. Note this should be run AFTER autorun4.'),
+        ('autorun5_1', 'autorun4 with yet another algorithm substituting forest_rdt. Note this should be run AFTER autorun4.'),
+        ('autorun6', 'GK+NN combined pipeline'),
+        ('autorun7', 'GK+NN combined pipeline'),
+        ('copy_training_data', 'Copy the training data from one workspace to another one'),
+        # Occationally users want to run pipeline stages individually
+        # This also provides the interface for remoters in autorun*
+        ('preprocess_key', 'Preprocessing step, to figure out the key configuration in the training puzzle'),
+        ('preprocess_surface', 'Preprocessing step, to generate training data'),
+        ('geometrik', 'Sample Key configuration from Geometric features'),
+        ('geometrik2', 'Sample Key configuration from Geometric features'),
+        ('train', 'Training/Prediction'),
+        ('keyconf', 'Sample key configuration from surface distribution'),
+        ('solve', 'Final step to solve the puzzle'),
+        ('solve1', 'Final step to solve the puzzle'),
+        ('solve2', 'Solve the puzzle with path planner'),
+        # Modules not a part of the auto pipeline
+        ('baseline', 'Solve all testing puzzle with baseline algorithms'),
+        ('baseline_pwrdtc', 'Pairwise RDT-Connect'),
+        ('tools', 'Various Tools.'),
+        ('stats', 'Various Statistic Tools.'),
+        ('condor_worker', 'Run HTCondor tasks from a queue in one process (used by worker mode of local_submit)'),
+        ('startup', 'Measure the startup cost of subcommands'),
+])
+
+# Reported by the startup benchmark
+HEAVY_MODULES = ['pyosr', 'pyse3ompl', 'pygeokey', 'tensorflow', 'h5py',
+                 'scipy', 'networkx', 'matplotlib', 'imageio']
+
+def load(command):
+    '''
+    Import the module that implements the subcommand
+    '''
+    if command == 'startup':
+        return sys.modules[__name__]
+    return importlib.import_module('.' + command, __package__)
+
+def requested_command(argv):
+    '''
+    The subcommand in the command line, or None
+    '''
+    for arg in argv:
+        if arg.startswith('-'):
+            continue
+        return arg if arg in COMMANDS else None
+    return None
+
+def setup_parsers(subparsers, command=None, full=False):
+    '''
+    Register all subcommands. Only the parser of command is complete, or all
+    of them if full is True.
+    '''
+    for name, helptext in COMMANDS.items():
+        if full or name == command:
+            load(name).setup_parser(subparsers)
+        else:
+            subparsers.add_parser(name, help=helptext)
+
+def _measure(command):
+    '''
+    Import the subcommand in a fresh interpreter, return its report
+    '''
+    code = ('import sys, time, json\n'
+            'base = set(sys.modules)\n'
+            't = time.perf_counter()\n'
+            'import pipeline.commands as c\n'
+            'c.load({!r})\n'
+            'd = time.perf_counter() - t\n'
+            'json.dump({{"seconds": d, "modules": sorted(set(sys.modules) - base)}}, sys.stdout)\n').format(command)
+    # Same sys.path as facade.py, which runs from src/GP
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    p = subprocess.run([sys.executable, '-c', code], cwd=cwd,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if p.returncode != 0:
+        return {'command': command, 'error': p.stderr.strip().split('\n')[-1]}
+    ret = json.loads(p.stdout.strip().split('\n')[-1])
+    top = set([m.split('.')[0] for m in ret['modules']])
+    ret['command'] = command
+    ret['heavy'] = [m for m in HEAVY_MODULES if m in top]
+    return ret
+
+def benchmark(command_list, repeat=3):
+    '''
+    Return per-command reports with the best import time of repeat runs.
+    '''
+    ret = []
+    for command in command_list:
+        best = None
+        for _ in range(repeat):
+            rep = _measure(command)
+            if 'error' in rep:
+                best = rep
+                break
+            if best is None or rep['seconds'] < best['seconds']:
+                best = rep
+        ret.append(best)
+    return ret
+
+def setup_parser(subparsers):
+    p = subparsers.add_parser('startup', help=COMMANDS['startup'])
+    p.add_argument('--repeat', help='Import each subcommand this many times and report the best', type=int, default=3)
+    p.add_argument('--forbid', help='Comma separated modules that must not be imported. Exit with 1 otherwise', default='')
+    p.add_argument('--out', help='Also save the reports as JSON', default=None)
+    p.add_argument('commands', help='Subcommands to measure, default to all', nargs='*')
+
+def run(args):
+    command_list = args.commands if args.commands else [c for c in COMMANDS if c != 'startup']
+    forbid = [m.strip() for m in args.forbid.split(',') if m.strip()]
+    reports = benchmark(command_list, repeat=args.repeat)
+    failed = False
+    print('{:<20} {:>10}  {}'.format('Command', 'Import (s)', 'Heavy modules'))
+    for rep in reports:
+        if 'error' in rep:
+            print('{:<20} {:>10}  {}'.format(rep['command'], 'N/A', rep['error']))
+            failed = failed or bool(forbid)
+            continue
+        print('{:<20} {:>10.3f}  {}'.format(rep['command'], rep['seconds'], ' '.join(rep['heavy'])))
+        loaded = set([m.split('.')[0] for m in rep['modules']])
+        bad = [m for m in forbid if m in loaded]
+        if bad:
+            print('[startup] {} imports forbidden modules {}'.format(rep['command'], bad))
+            failed = True
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(reports, f, indent=2)
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+compress.py -- background xz compression of pipeline outputs
+
+Service.submit(fn) returns immediately, and fn is compressed to fn.xz by a
+background thread while the stage continues. Each job:
+    1. runs xz (multithreaded with -T) into fn.xz.tmp-<pid>,
+    2. tests the integrity of the temporary file with `xz -t`,
+    3. renames it to fn.xz, so a killed job never leaves a truncated fn.xz,
+    4. removes the source only after the rename,
+    5. records the size ratio and time in the performance trace.
+
+The output is a standard .xz file, so matio.load reads old and new outputs
+alike. matio.load also waits for a pending job if it is asked to load its
+output. All jobs are finished at stage end (Workspace.timekeeper_finish) and
+at exit, so Condor tasks do not exit with half-written files.
+
+If the xz executable is not available, the lzma module is used instead
+(single threaded).
+'''
+
+import os
+import time
+import lzma
+import shutil
+import atexit
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from . import perftrace
+
+XZ = 'xz'
+SUFFIX = '.xz'
+DEFAULT_LEVEL = 6
+DEFAULT_THREADS = 1
+DEFAULT_WORKERS = 2
+
+class CompressionError(Exception):
+    pass
+
+def _tmp_name(fn):
+    # Never matches *.xz, so readers do not pick up partial outputs
+    return '{}{}.tmp-{}'.format(fn, SUFFIX, os.getpid())
+
+def _xz_cli(fn, level, threads):
+    tmp = _tmp_name(fn)
+    try:
+        with open(tmp, 'wb') as fout:
+            ret = subprocess.call([XZ, '-c', '-{}'.format(level), '-T{}'.format(threads), fn], stdout=fout)
+        if ret != 0:
+            raise CompressionError('xz -{} {} failed with {}'.format(level, fn, ret))
+        with open(tmp, 'rb') as fin:
+            ret = subprocess.call([XZ, '-t'], stdin=fin)
+        if ret != 0:
+            raise CompressionError('{} failed the integrity test'.format(fn + SUFFIX))
+        os.replace(tmp, fn + SUFFIX)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+def _xz_module(fn, level, threads):
+    tmp = _tmp_name(fn)
+    try:
+        with open(fn, 'rb') as fin, lzma.open(tmp, 'wb', preset=level) as fout:
+            shutil.copyfileobj(fin, fout, 1 << 20)
+        # Integrity test
+        with lzma.open(tmp, 'rb') as f:
+            while f.read(1 << 20):
+                pass
+        os.replace(tmp, fn + SUFFIX)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+def compress_file(fn, level=DEFAULT_LEVEL, threads=DEFAULT_THREADS):
+    '''
+    Compress fn to fn.xz and remove fn after the output is verified.
+    Return (source size, compressed size, seconds)
+    '''
+    fn = str(fn)
+    t_start = time.monotonic()
+    in_size = os.path.getsize(fn)
+    if shutil.which(XZ) is not None:
+        _xz_cli(fn, level, threads)
+    else:
+        try:
+            _xz_module(fn, level, threads)
+        except (OSError, lzma.LZMAError) as e:
+            raise CompressionError('compressing {}: {}'.format(fn, e))
+    out_size = os.path.getsize(fn + SUFFIX)
+    os.unlink(fn)
+    return in_size, out_size, time.monotonic() - t_start
+
+class Service(object):
+    '''
+    workers: number of files compressed at the same time
+    '''
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='xz')
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._errors = []
+
+    def submit(self, fn, level=DEFAULT_LEVEL, threads=DEFAULT_THREADS, stage=None):
+        fn = os.path.abspath(str(fn))
+        tracer = perftrace.active()
+        parent = tracer.current_id() if tracer is not None else None
+        def job():
+            wall_start = time.time()
+            try:
+                in_size, out_size, duration = compress_file(fn, level, threads)
+            except Exception as e:
+                with self._lock:
+                    self._errors.append(e)
+                raise
+            finally:
+                with self._lock:
+                    self._pending.pop(fn, None)
+            if tracer is not None:
+                tracer.event('xz', wall_start, duration, parent=parent,
+                             file=os.path.basename(fn), stage=stage, level=level, threads=threads,
+                             in_bytes=in_size, out_bytes=out_size,
+                             ratio=out_size / in_size if in_size > 0 else 1.0)
+            return fn + SUFFIX
+        with self._lock:
+            future = self._executor.submit(job)
+            self._pending[fn] = future
+        return future
+
+    def wait_for(self, fn):
+        '''
+        Wait for the job that compresses fn, or produces fn if it ends with .xz
+        '''
+        fn = os.path.abspath(str(fn))
+        if fn.endswith(SUFFIX):
+            fn = fn[:-len(SUFFIX)]
+        with self._lock:
+            future = self._pending.get(fn)
+        if future is not None:
+            future.result()
+
+    def flush(self):
+        '''
+        Wait for all submitted jobs.
+        Raise the error of the first failed job, if any.
+        '''
+        with self._lock:
+            futures = list(self._pending.values())
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                pass
+        with self._lock:
+            errors, self._errors = self._errors, []
+        if errors:
+            raise errors[0]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+_service = None
+
+def _at_exit():
+    try:
+        _service.flush()
+    except Exception as e:
+        # Otherwise the process (e.g. a Condor task) would exit with 0
+        # while its output is left uncompressed
+        print('[compress] {}'.format(e), flush=True)
+        os._exit(1)
+    _service.shutdown()
+
+def service():
+    global _service
+    if _service is None:
+        _service = Service()
+        atexit.register(_at_exit)
+    return _service
+
+def wait_for(fn):
+    if _service is not None:
+        _service.wait_for(fn)
+
+def flush():
+    if _service is not None:
+        _service.flush()
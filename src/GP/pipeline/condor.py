@@ -5,7 +5,12 @@ import re
 import subprocess
 import os
 import shutil
+import time
 from . import util
+from . import condor_log
+from . import perftrace
+from . import condor_worker
+from . import condor_profile
 
 TEMPLATE_EXCLUDE = [
         re.compile('^Executable\s*=', flags=re.IGNORECASE),
@@ -28,16 +33,67 @@ def extract_template(fin, fout):
         if do_write:
             print(line, end='', file=fout)
 
-def local_wait(iodir):
+'''
+Wait for all jobs in iodir/log to finish, by parsing the HTCondor user log.
+
+Jobs held by on_exit_hold (see local_submit) are released (i.e. rerun) up to
+max_release times. Jobs held for exceeding their memory limit get a larger
+RequestMemory (condor_qedit) before the release. Jobs that are still held
+after that are reported, and need to be released or removed
+(condor_release/condor_rm) by hand.
+
+Return the condor_log.UserLog object
+'''
+def local_wait(iodir, max_release=3, poll_interval=30):
     log_fn = os.path.join(iodir, 'log')
     util.log('[condor] waiting on condor log file {}'.format(log_fn))
-    ret = 1
-    while ret != 0:
-        ret = util.shell(['condor_wait' , '-wait', '3600', log_fn])
+    ulog = condor_log.UserLog(log_fn)
+    sidecar = condor_profile.load_sidecar(iodir) or {}
+    reported = set()
+    last_progress = None
+    last_report_time = 0
+    with perftrace.span('condor_wait', iodir=iodir):
+        while True:
+            ulog.poll()
+            if ulog.all_finished():
+                break
+            for job in ulog.jobs_to_release(max_release):
+                util.warn('[condor] job {} is held ({}), release it ({}/{})'.format(
+                          job.job_id, job.hold_reason, job.releases + 1, max_release))
+                # Otherwise it would be held again for the same reason
+                if condor_profile.held_for_memory(job):
+                    mb = condor_profile.raised_memory(job, sidecar.get('memory_mb'), sidecar.get('margin', 1.25))
+                    util.warn('[condor] raising request_memory of job {} to {} MiB'.format(job.job_id, mb))
+                    if util.shell(['condor_qedit', job.job_id, 'RequestMemory', str(mb)]) == 0:
+                        job.memory_request_mb = mb
+                # Releases are counted from the log. Until the release event
+                # shows up, the job is still HELD in the log, and must not be
+                # released again
+                if util.shell(['condor_release', job.job_id]) == 0:
+                    job.release_pending = True
+            for job in ulog.exhausted_jobs(max_release):
+                if job.job_id not in reported:
+                    util.warn('[condor] job {} is still held after {} releases: {}'.format(
+                              job.job_id, job.releases, job.hold_reason))
+                    reported.add(job.job_id)
+            progress = ulog.progress()
+            if progress != last_progress or time.time() - last_report_time > 600:
+                util.log('[condor] {}'.format(progress))
+                last_progress = progress
+                last_report_time = time.time()
+            time.sleep(poll_interval)
+    util.log('[condor] {}'.format(ulog.progress()))
+    n = condor_profile.record_wave(iodir, ulog)
+    if n > 0:
+        util.log('[condor] recorded resource usage of {} jobs'.format(n))
+    return ulog
 
 '''
 Side effect:
     iodir will be created if not exist
+
+worker_mode: run the tasks in persistent workers (see condor_worker.py)
+             instead of one job per task. Default to [SYSTEM] CondorWorkerMode
 '''
 def local_submit(ws,
                  xfile,
@@ -46,7 +102,8 @@ def local_submit(ws,
                  instances,
                  wait=True,
                  dryrun=False,
-                 local_scratch=None
+                 local_scratch=None,
+                 worker_mode=None
                  ):
     if xfile is None or xfile == '':
         msg = "[condor.local_submit] xfile is None or empty, current value {}".format(xfile)
@@ -57,13 +114,33 @@ def local_submit(ws,
         local_scratch = ws.local_ws(iodir_rel)
     os.makedirs(local_scratch, exist_ok=True)
     util.log("[local_submit] using scratch directory {}".format(local_scratch))
+    request = condor_profile.request_for(ws, arguments)
+    util.log("[local_submit] {}@{}: request_memory = {} MiB, request_cpus = {} ({} samples)".format(
+             request.stage, request.puzzle, request.memory_mb, request.cpus, request.nsamples))
+    if worker_mode is None:
+        worker_mode = ws.config.getboolean('SYSTEM', 'CondorWorkerMode', fallback=False)
+    # Only python tasks parameterized by $(Process) can run in the workers
+    if worker_mode and xfile == util.PYTHON and any([condor_worker.PROCESS_MACRO in str(a) for a in arguments]):
+        ntask = int(instances)
+        nworker = min(ntask, ws.config.getint('SYSTEM', 'CondorWorkers',
+                                              fallback=ws.config.getint('SYSTEM', 'CondorQuota', fallback=150)))
+        queue_dir = os.path.join(local_scratch, condor_worker.QUEUE_DIR)
+        condor_worker.init_queue(queue_dir, ntask, dryrun=dryrun)
+        util.log("[local_submit] worker mode: {} tasks on {} workers".format(ntask, nworker))
+        arguments = ['facade.py', 'condor_worker',
+                     '--queue', queue_dir,
+                     '--worker', '$(Process)',
+                     '--'] + condor_worker.escape_arguments(arguments)
+        instances = nworker
     local_sub = os.path.join(local_scratch, SUBMISSION_FILE)
     shutil.copy(ws.condor_template, local_sub)
     with open(local_sub, 'a') as f:
         print('Executable = {}'.format(xfile), file=f)
-        print('environment = "OMP_NUM_THREADS=1"', file=f)
+        print('environment = "OMP_NUM_THREADS={}"'.format(request.cpus), file=f)
         print('getenv = True', file=f) # We need it because
-        print('request_memory = 3072', file=f) # 3G memory
+        print('request_memory = {}'.format(request.memory_mb), file=f) # See condor_profile.py
+        if request.cpus > 1:
+            print('request_cpus = {}'.format(request.cpus), file=f)
         print('on_exit_hold = (ExitBySignal != False) || (ExitCode != 0)', file=f) # hold the job for reruning when error occurs
         print('Output = {}/$(Process).out'.format(local_scratch), file=f)
         print('Error = {}/$(Process).err'.format(local_scratch), file=f)
@@ -77,32 +154,31 @@ def local_submit(ws,
         util.log("[local_submit] dryrun, existing without submitting")
         util.log("[local_submit] HTCondor file has been written to {}".format(local_sub))
         return local_sub
+    # The sidecar of the previous wave in this directory is overwritten
+    condor_profile.collect(local_scratch)
+    request.write_sidecar(local_scratch)
     util.log("[local_submit] submitting {}".format(local_sub))
-    util.shell(['condor_submit', local_sub])
-    if wait:
-        local_wait(local_scratch)
+    with perftrace.span('condor_wave', iodir=local_scratch, instances=instances):
+        util.shell(['condor_submit', local_sub])
+        if wait:
+            local_wait(local_scratch,
+                       max_release=ws.config.getint('SYSTEM', 'CondorMaxRelease', fallback=3))
     return local_sub
 
+'''
+Total CPU time of all jobs in the log (Total Remote Usage of terminated jobs).
+Return it as D+HH:MM like condor_userlog, or in milliseconds
+'''
 def query_last_cputime_from_log(log_fn, translate_to_msecs=False):
     if not os.path.isfile(log_fn):
         return None
-    logbytes = subprocess.check_output(f'condor_userlog {log_fn} | tail -n 1', shell=True)
-    logstr = logbytes.decode('utf-8')
-    util.log(f"[logstr] {logstr}")
-    sp = logstr.split()
-    if sp[0] != 'Total':
+    ulog = condor_log.parse(log_fn)
+    if not ulog.jobs:
         return None
-    condor_str = sp[3]
+    cpu = ulog.total_cpu_time()
     if not translate_to_msecs:
-        return condor_str
-    day_break = condor_str.find('+')
-    hr_break = condor_str.find(':')
-    days = int(condor_str[:day_break])
-    hrs = int(condor_str[day_break+1:hr_break])
-    mins = int(condor_str[hr_break+1])
-    ret = 1e3 * 60 * (mins + 60 * (hrs + 24 * days))
-    print(f"translate {condor_str} to {ret} msecs")
-    return ret
+        return condor_log.format_condor_time(cpu)
+    return 1e3 * cpu
 
 def query_last_cputime(ws,
                        iodir_rel):
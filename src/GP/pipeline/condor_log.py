@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+condor_log.py -- HTCondor user log (event log) parser
+
+A pure-Python replacement of condor_wait/condor_userlog for our usage.
+UserLog parses the classic (non-XML) event log incrementally, i.e. poll()
+only reads events appended since the last call. Parsed events:
+
+    000 submitted, 001 executing, 004 evicted, 005 terminated,
+    006 image size updated, 009 aborted, 012 held, 013 released
+
+Other events are skipped. An event is a header line
+    <code> (<cluster>.<proc>.<subproc>) <date> <time> <text>
+followed by body lines, and terminated by a line of '...'
+'''
+
+import os
+import re
+import time
+from datetime import datetime
+
+_HEADER = re.compile(r'^(\d{3}) \((\d+)\.(\d+)\.(\d+)\) (\S+) (\S+) (.*)$')
+_USAGE = re.compile(r'Usr (\d+) (\d+):(\d+):(\d+), Sys (\d+) (\d+):(\d+):(\d+)\s+-\s+(.*)$')
+_RETURN_VALUE = re.compile(r'\(return value (-?\d+)\)')
+_SIGNAL = re.compile(r'\(signal (\d+)\)')
+_HOST = re.compile(r'<([^:>?]+)')
+_HOLD_CODE = re.compile(r'Code (\d+) Subcode (-?\d+)')
+_RESOURCE = re.compile(r'^\s*(Cpus|Disk \(KB\)|Memory \(MB\))\s*:\s*(.*)$')
+_MEMORY_USAGE = re.compile(r'^\s*(\d+)\s+-\s+MemoryUsage of job \(MB\)')
+_RSS = re.compile(r'^\s*(\d+)\s+-\s+ResidentSetSize of job \(KB\)')
+
+IDLE = 'idle'
+RUNNING = 'running'
+HELD = 'held'
+DONE = 'done'
+FAILED = 'failed'
+ABORTED = 'aborted'
+
+TERMINAL_STATES = [DONE, FAILED, ABORTED]
+
+def _parse_time(date_str, time_str, year_hint=None):
+    '''
+    Date is either YYYY-MM-DD (HTCondor >= 8.8) or MM/DD (older, no year)
+    '''
+    if '-' in date_str:
+        return datetime.strptime(date_str + ' ' + time_str, '%Y-%m-%d %H:%M:%S').timestamp()
+    year = datetime.now().year if year_hint is None else year_hint
+    return datetime.strptime('{}/{} {}'.format(year, date_str, time_str), '%Y/%m/%d %H:%M:%S').timestamp()
+
+def _usage_seconds(days, hrs, mins, secs):
+    return int(secs) + 60 * (int(mins) + 60 * (int(hrs) + 24 * int(days)))
+
+def format_condor_time(seconds):
+    '''
+    Same format as condor_userlog: D+HH:MM
+    '''
+    minutes = int(seconds) // 60
+    return '{}+{:02d}:{:02d}'.format(minutes // (24 * 60), minutes // 60 % 24, minutes % 60)
+
+class JobRecord(object):
+    def __init__(self, cluster, proc):
+        self.cluster = cluster
+        self.proc = proc
+        self.state = IDLE
+        self.submit_time = None
+        self.start_time = None      # Last execution
+        self.end_time = None
+        self.run_seconds = 0.0      # Accumulated over all executions
+        self.executions = 0
+        self.host = None
+        self.return_value = None
+        self.signal = None
+        self.user_cpu = 0.0         # Total Remote Usage
+        self.sys_cpu = 0.0
+        self.memory_mb = None       # Peak, from image size updates and the termination event
+        self.memory_request_mb = None
+        self.rss_kb = None
+        self.hold_reason = None
+        self.hold_code = None
+        self.holds = 0
+        self.releases = 0           # Counted from the release events only
+        self.release_pending = False # condor_release issued, event not logged yet
+
+    @property
+    def job_id(self):
+        return '{}.{}'.format(self.cluster, self.proc)
+
+    @property
+    def cpu_time(self):
+        return self.user_cpu + self.sys_cpu
+
+    def wall_time(self, now=None):
+        if self.state == RUNNING and self.start_time is not None:
+            now = time.time() if now is None else now
+            return self.run_seconds + max(0.0, now - self.start_time)
+        return self.run_seconds
+
+    def _stop(self, t):
+        if self.start_time is not None:
+            self.run_seconds += max(0.0, t - self.start_time)
+            self.start_time = None
+
+    def _update_memory(self, mb):
+        if self.memory_mb is None or mb > self.memory_mb:
+            self.memory_mb = mb
+
+class UserLog(object):
+    def __init__(self, log_fn):
+        self.log_fn = log_fn
+        self.jobs = {}
+        self._offset = 0
+        self._pending = ''
+        self.first_submit = None
+
+    def _job(self, cluster, proc):
+        key = (cluster, proc)
+        if key not in self.jobs:
+            self.jobs[key] = JobRecord(cluster, proc)
+        return self.jobs[key]
+
+    def poll(self):
+        '''
+        Parse events appended since the last call.
+        Return the number of parsed events.
+        '''
+        if not os.path.isfile(self.log_fn):
+            return 0
+        with open(self.log_fn, 'r', errors='replace') as f:
+            f.seek(self._offset)
+            data = f.read()
+            self._offset = f.tell()
+        return self.feed(data)
+
+    def feed(self, data):
+        '''
+        Parse log text. Incomplete events are kept until the next call.
+        '''
+        data = self._pending + data
+        # Only events terminated by '...' are complete
+        end = data.rfind('\n...\n')
+        if end < 0:
+            self._pending = data
+            return 0
+        complete, self._pending = data[:end + 5], data[end + 5:]
+        n = 0
+        for block in complete.split('\n...\n'):
+            lines = [l for l in block.split('\n') if l.strip() and l.strip() != '...']
+            if lines:
+                n += self._parse_event(lines)
+        return n
+
+    def _parse_event(self, lines):
+        m = _HEADER.match(lines[0])
+        if m is None:
+            return 0
+        code = int(m.group(1))
+        job = self._job(int(m.group(2)), int(m.group(3)))
+        t = _parse_time(m.group(5), m.group(6))
+        text = m.group(7)
+        body = lines[1:]
+        if code == 0:
+            job.submit_time = t
+            job.state = IDLE
+            if self.first_submit is None or t < self.first_submit:
+                self.first_submit = t
+        elif code == 1:
+            job.state = RUNNING
+            job.start_time = t
+            job.executions += 1
+            hm = _HOST.search(text)
+            if hm:
+                job.host = hm.group(1)
+        elif code == 4:
+            job._stop(t)
+            job.state = IDLE
+        elif code == 5:
+            job._stop(t)
+            job.end_time = t
+            self._parse_termination(job, body)
+        elif code == 6:
+            for line in body:
+                mm = _MEMORY_USAGE.match(line)
+                if mm:
+                    job._update_memory(int(mm.group(1)))
+                mm = _RSS.match(line)
+                if mm:
+                    job.rss_kb = int(mm.group(1))
+        elif code == 9:
+            job._stop(t)
+            job.end_time = t
+            job.state = ABORTED
+        elif code == 12:
+            job._stop(t)
+            job.state = HELD
+            job.holds += 1
+            job.hold_reason = body[0].strip() if body else text
+            for line in body:
+                hm = _HOLD_CODE.search(line)
+                if hm:
+                    job.hold_code = (int(hm.group(1)), int(hm.group(2)))
+        elif code == 13:
+            job.state = IDLE
+            job.releases += 1
+            job.release_pending = False
+        else:
+            return 0
+        return 1
+
+    def _parse_termination(self, job, body):
+        job.state = FAILED
+        for line in body:
+            rm = _RETURN_VALUE.search(line)
+            if rm and 'Normal termination' in line:
+                job.return_value = int(rm.group(1))
+                if job.return_value == 0:
+                    job.state = DONE
+            sm = _SIGNAL.search(line)
+            if sm and 'Abnormal termination' in line:
+                job.signal = int(sm.group(1))
+            um = _USAGE.search(line)
+            if um and um.group(9).strip() == 'Total Remote Usage':
+                job.user_cpu = float(_usage_seconds(*um.group(1, 2, 3, 4)))
+                job.sys_cpu = float(_usage_seconds(*um.group(5, 6, 7, 8)))
+            rm = _RESOURCE.match(line)
+            if rm and rm.group(1) == 'Memory (MB)':
+                cols = rm.group(2).split()
+                # Usage column is empty if HTCondor did not measure it
+                if len(cols) >= 3:
+                    job._update_memory(int(cols[0]))
+                    job.memory_request_mb = int(cols[1])
+                elif len(cols) == 2:
+                    job.memory_request_mb = int(cols[0])
+
+    def count(self):
+        ret = {s: 0 for s in [IDLE, RUNNING, HELD] + TERMINAL_STATES}
+        for job in self.jobs.values():
+            ret[job.state] += 1
+        return ret
+
+    def all_finished(self):
+        return len(self.jobs) > 0 and all(job.state in TERMINAL_STATES for job in self.jobs.values())
+
+    def held_jobs(self):
+        return [job for job in self.jobs.values() if job.state == HELD]
+
+    def jobs_to_release(self, max_release):
+        '''
+        Held jobs that can be released once more. Jobs with a pending
+        release are skipped until its event is logged.
+        '''
+        return [job for job in self.held_jobs() if not job.release_pending and job.releases < max_release]
+
+    def exhausted_jobs(self, max_release):
+        '''
+        Held jobs that used up their releases
+        '''
+        return [job for job in self.held_jobs() if not job.release_pending and job.releases >= max_release]
+
+    def total_cpu_time(self):
+        return sum([job.cpu_time for job in self.jobs.values()])
+
+    def eta(self, now=None):
+        '''
+        Estimated seconds to finish all jobs, from the throughput so far.
+        None if nothing has finished yet.
+        '''
+        now = time.time() if now is None else now
+        counts = self.count()
+        finished = sum([counts[s] for s in TERMINAL_STATES])
+        if finished == 0 or self.first_submit is None:
+            return None
+        rate = finished / max(1.0, now - self.first_submit)
+        return (len(self.jobs) - finished) / rate
+
+    def progress(self, now=None):
+        counts = self.count()
+        finished = sum([counts[s] for s in TERMINAL_STATES])
+        eta = self.eta(now)
+        eta_str = 'N/A' if eta is None else format_condor_time(eta)
+        return '{}/{} finished ({} failed, {} aborted), {} running, {} idle, {} held, ETA {}'.format(
+                finished, len(self.jobs), counts[FAILED], counts[ABORTED],
+                counts[RUNNING], counts[IDLE], counts[HELD], eta_str)
+
+    def rows(self):
+        '''
+        Per-job summary, ordered by job id
+        '''
+        yield ['Job', 'State', 'Host', 'Wall (s)', 'CPU (s)', 'Memory (MB)', 'Requested (MB)', 'Holds', 'Hold Reason']
+        for key in sorted(self.jobs.keys()):
+            job = self.jobs[key]
+            yield [job.job_id, job.state, job.host,
+                   '{:.0f}'.format(job.wall_time()), '{:.0f}'.format(job.cpu_time),
+                   job.memory_mb, job.memory_request_mb, job.holds, job.hold_reason]
+
+def parse(log_fn):
+    ulog = UserLog(log_fn)
+    ulog.poll()
+    return ulog
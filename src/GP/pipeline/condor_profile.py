@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+condor_profile.py -- resource requests of HTCondor submissions from past runs
+
+local_submit used to request 3072 MiB and one CPU for every task. Now each
+submission is keyed by (stage, puzzle), and the peak memory, CPU time and
+wall time of its jobs are recorded from the HTCondor user log when the wave
+finishes (local_wait), or for waves submitted with wait=False, when their
+outputs are collected (collect). The next submission with the same key requests
+
+    request_memory = quantile of the recorded peaks * margin, rounded up
+
+Jobs held for exceeding their memory limit only tell that the request was too
+small, so they are recorded as margin * request, and local_wait raises their
+RequestMemory the same way before releasing them. Keys without history fall
+back to the same stage on any puzzle, and then to the default of 3072 MiB.
+
+request_cpus (and OMP_NUM_THREADS) is 1, unless the stage is listed in the
+[CondorThreads] section, which means it can use more threads. In that case
+it is reduced to the measured CPU utilization (CPU time / wall time) if the
+history shows the threads are not used.
+
+Profiles are stored in performance_log/condor_profiles.json of the workspace,
+across all trials. The estimator works on condor_log.UserLog objects, so it
+can be checked offline against recorded logs with `facade.py stats condor_profile`.
+'''
+
+import os
+import json
+import math
+
+from . import util
+from . import condor_log
+
+PROFILE_FILE = 'condor_profiles.json'
+# Written into the iodir of each submission, so local_wait knows the key
+SIDECAR_FILE = 'profile.json'
+
+DEFAULT_MEMORY_MB = 3072
+MIN_MEMORY_MB = 512
+ROUND_MB = 256
+MAX_SAMPLES = 2000
+
+def stage_key(arguments):
+    '''
+    (stage, puzzle) of the task arguments.
+
+    stage: the value of --stage, or <script>.<subcommand> like se3solver.solve
+    puzzle: the value of --puzzle_name, or the directory name of the puzzle
+            file, or '*' if unknown
+    '''
+    arguments = [str(a) for a in arguments]
+    stage = None
+    puzzle = '*'
+    for i, a in enumerate(arguments):
+        if a == '--stage' and i + 1 < len(arguments):
+            stage = arguments[i + 1]
+        elif a == '--puzzle_name' and i + 1 < len(arguments):
+            puzzle = arguments[i + 1]
+    if stage is None and arguments:
+        script = os.path.splitext(os.path.basename(arguments[0]))[0]
+        stage = script if len(arguments) < 2 or arguments[1].startswith('-') else '{}.{}'.format(script, arguments[1])
+    if puzzle == '*':
+        for a in arguments:
+            if a.endswith('.cfg'):
+                puzzle = os.path.basename(os.path.dirname(a))
+                break
+    return stage, puzzle
+
+def _key_str(stage, puzzle):
+    return '{}@{}'.format(stage, puzzle)
+
+def held_for_memory(job):
+    return job.hold_reason is not None and 'memory' in job.hold_reason.lower()
+
+def raised_memory(job, request_mb=None, margin=1.25):
+    '''
+    request_memory for rerunning a job held for exceeding its memory limit:
+    the larger of its request and its measured peak, times margin
+    '''
+    base = max(job.memory_request_mb or request_mb or DEFAULT_MEMORY_MB, job.memory_mb or 0)
+    return int(math.ceil(base * margin / ROUND_MB)) * ROUND_MB
+
+def _job_samples(ulog, margin, request_mb):
+    for job in ulog.jobs.values():
+        if job.state == condor_log.HELD and held_for_memory(job):
+            request = job.memory_request_mb or request_mb or job.memory_mb
+            if request is None:
+                continue
+            yield job, {'memory_mb': request * margin, 'cpu_time': job.cpu_time,
+                        'wall_time': job.wall_time(), 'held': True}
+        elif job.state == condor_log.DONE and job.memory_mb is not None:
+            yield job, {'memory_mb': job.memory_mb, 'cpu_time': job.cpu_time,
+                        'wall_time': job.wall_time(), 'held': False}
+
+def samples_from_log(ulog, margin=1.25, request_mb=None):
+    '''
+    Per-job samples {memory_mb, cpu_time, wall_time} of finished or held jobs
+
+    request_mb: request_memory of the submission, for held jobs that never
+                reported it
+    '''
+    return [sample for _, sample in _job_samples(ulog, margin, request_mb)]
+
+def _quantile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    pos = q * (len(values) - 1)
+    lo = int(math.floor(pos))
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+def estimate_memory(samples, margin=1.25, quantile=0.99, ceiling=None, default=DEFAULT_MEMORY_MB):
+    '''
+    request_memory in MiB from the samples
+    '''
+    peak = _quantile([s['memory_mb'] for s in samples], quantile)
+    if peak is None:
+        return default
+    mb = max(MIN_MEMORY_MB, int(math.ceil(peak * margin / ROUND_MB)) * ROUND_MB)
+    if ceiling is not None:
+        mb = min(mb, ceiling)
+    return mb
+
+def estimate_cpus(samples, max_cpus=1, quantile=0.9):
+    '''
+    request_cpus, at most max_cpus
+    '''
+    if max_cpus <= 1:
+        return 1
+    usage = [s['cpu_time'] / s['wall_time'] for s in samples if not s['held'] and s['wall_time'] > 0]
+    measured = _quantile(usage, quantile)
+    if measured is None:
+        return max_cpus
+    return max(1, min(max_cpus, int(math.ceil(measured))))
+
+class ProfileStore(object):
+    def __init__(self, fn):
+        self.fn = fn
+
+    def _load(self):
+        try:
+            with open(self.fn, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def samples(self, stage, puzzle):
+        '''
+        Samples of (stage, puzzle), or of the stage on all puzzles if there
+        are none
+        '''
+        profiles = self._load()
+        key = _key_str(stage, puzzle)
+        if profiles.get(key):
+            return profiles[key]
+        ret = []
+        prefix = _key_str(stage, '')
+        for k, v in profiles.items():
+            if k.startswith(prefix):
+                ret += v
+        return ret
+
+    def record(self, stage, puzzle, samples):
+        if not samples:
+            return
+        import fcntl
+        os.makedirs(os.path.dirname(self.fn), exist_ok=True)
+        with open(self.fn + '.lock', 'w') as lockf:
+            fcntl.flock(lockf, fcntl.LOCK_EX)
+            profiles = self._load()
+            key = _key_str(stage, puzzle)
+            profiles[key] = (profiles.get(key, []) + samples)[-MAX_SAMPLES:]
+            tmp = self.fn + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(profiles, f)
+            os.replace(tmp, self.fn)
+
+class Request(object):
+    '''
+    Resource request of one submission
+    '''
+    def __init__(self, store_fn, stage, puzzle, memory_mb, cpus, nsamples, margin):
+        self.store_fn = store_fn
+        self.stage = stage
+        self.puzzle = puzzle
+        self.memory_mb = memory_mb
+        self.cpus = cpus
+        self.nsamples = nsamples
+        self.margin = margin
+
+    def write_sidecar(self, iodir):
+        with open(os.path.join(iodir, SIDECAR_FILE), 'w') as f:
+            json.dump({'store': self.store_fn, 'stage': self.stage, 'puzzle': self.puzzle,
+                       'memory_mb': self.memory_mb, 'cpus': self.cpus, 'margin': self.margin}, f)
+
+def request_for(ws, arguments):
+    store_fn = ws.local_ws(util.PERFORMANCE_LOG_DIR, PROFILE_FILE)
+    stage, puzzle = stage_key(arguments)
+    margin = ws.config.getfloat('SYSTEM', 'CondorMemoryMargin', fallback=1.25)
+    if not ws.config.getboolean('SYSTEM', 'CondorAdaptiveMemory', fallback=True):
+        memory_mb = DEFAULT_MEMORY_MB
+        samples = []
+    else:
+        samples = ProfileStore(store_fn).samples(stage, puzzle)
+        memory_mb = estimate_memory(samples, margin=margin,
+                                    ceiling=ws.config.getint('SYSTEM', 'CondorMemoryCeiling', fallback=None))
+    max_cpus = ws.config.getint('CondorThreads', stage, fallback=1)
+    cpus = estimate_cpus(samples, max_cpus)
+    return Request(store_fn, stage, puzzle, memory_mb, cpus, len(samples), margin)
+
+RECORDED_FILE = 'profile.recorded.json'
+
+def load_sidecar(iodir):
+    try:
+        with open(os.path.join(iodir, SIDECAR_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def record_wave(iodir, ulog):
+    '''
+    Record the jobs in ulog with the key written by local_submit into iodir.
+    Jobs recorded before (listed in iodir/profile.recorded.json) are
+    skipped, so this can be called by local_wait and again when the outputs
+    of a wave submitted with wait=False are collected.
+    Return the number of recorded samples.
+    '''
+    sidecar = load_sidecar(iodir)
+    if sidecar is None:
+        return 0
+    recorded_fn = os.path.join(iodir, RECORDED_FILE)
+    try:
+        with open(recorded_fn, 'r') as f:
+            recorded = set(json.load(f))
+    except (OSError, ValueError):
+        recorded = set()
+    samples = []
+    for job, sample in _job_samples(ulog, sidecar.get('margin', 1.25), sidecar.get('memory_mb')):
+        # A job held for memory is recorded again when its rerun finishes
+        key = job.job_id + ('.held' if sample['held'] else '')
+        if key in recorded:
+            continue
+        samples.append(sample)
+        recorded.add(key)
+    if not samples:
+        return 0
+    ProfileStore(sidecar['store']).record(sidecar['stage'], sidecar['puzzle'], samples)
+    with open(recorded_fn, 'w') as f:
+        json.dump(sorted(recorded), f)
+    return len(samples)
+
+def collect(iodir):
+    '''
+    Record the finished jobs of the submission in iodir from its user log.
+    For waves submitted with wait=False, whose results are collected by a
+    later stage without local_wait.
+    '''
+    if not os.path.isfile(os.path.join(iodir, 'log')) or load_sidecar(iodir) is None:
+        return 0
+    return record_wave(iodir, condor_log.parse(os.path.join(iodir, 'log')))
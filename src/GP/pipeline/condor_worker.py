@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+condor_worker.py -- persistent HTCondor workers
+
+Normally local_submit queues one HTCondor job per task, and each job starts
+a new interpreter, imports the pipeline modules, reads the workspace and
+loads the puzzle meshes before working on its small chunk.
+
+In worker mode (see condor.local_submit), a few long-lived jobs are queued
+instead, and each of them runs
+
+    facade.py condor_worker --queue <iodir>/queue --worker $(Process) -- <task arguments>
+
+which takes task ids from a file-based queue under the (shared) iodir and
+runs the original task arguments with $(Process) replaced by the task id, in
+the same interpreter. Tasks write the same output files as separate jobs
+would.
+
+Third-party and extension modules (numpy, pyosr, ...) stay imported across
+tasks, and puzzle meshes are loaded once (util.enable_world_cache). Anything
+a task could leave behind is reset after it: sys.path and sys.argv are
+restored, modules of this source tree imported by the task are dropped so
+their globals start afresh, and each task receives its own copy of the
+cached UnitWorld.
+
+Queue layout:
+    total: number of tasks
+    next: id of the next task to hand out, protected by lockf
+    worker-<worker>.jsonl: per-worker task log {"task", "status", "seconds"}
+    running-<worker>: the task in progress. A worker restarted by HTCondor
+                      (eviction, or release after on_exit_hold) resumes it,
+                      and retries the tasks it failed before.
+
+A new submission moves the queue of the previous one to <iodir>/queue.<n>
+rather than deleting its logs.
+
+A worker exits with 1 if any of its tasks failed, so HTCondor holds it and
+local_wait releases it like a failed task.
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import runpy
+import argparse
+import traceback
+
+from . import util
+from . import perftrace
+from . import compress
+from . import commands
+
+QUEUE_DIR = 'queue'
+PROCESS_MACRO = '$(Process)'
+_EXPRESSION = re.compile(r'\$\$\(\[([0-9+\-*/() ]*)\]\)')
+# Task arguments are passed to workers through condor_submit, which would
+# expand the macros with the id of the worker
+_ESCAPES = [('$$(', '@@EXPR@@('), (PROCESS_MACRO, '@@PROCESS@@')]
+
+def escape_arguments(arguments):
+    ret = []
+    for a in arguments:
+        a = str(a)
+        for macro, escaped in _ESCAPES:
+            a = a.replace(macro, escaped)
+        ret.append(a)
+    return ret
+
+def init_queue(queue_dir, total, dryrun=False):
+    '''
+    Create an empty queue of total tasks. An existing queue is moved aside to
+    queue_dir.<n>. With dryrun, only log what would be done.
+    '''
+    if os.path.isdir(queue_dir) and os.listdir(queue_dir):
+        n = 1
+        while os.path.exists('{}.{}'.format(queue_dir, n)):
+            n += 1
+        archive = '{}.{}'.format(queue_dir, n)
+        util.log('[condor_worker] {}moving the previous queue {} to {}'.format(
+                 '[dryrun] ' if dryrun else '', queue_dir, archive))
+        if not dryrun:
+            os.rename(queue_dir, archive)
+    util.log('[condor_worker] {}creating queue {} of {} tasks'.format(
+             '[dryrun] ' if dryrun else '', queue_dir, total))
+    if dryrun:
+        return
+    os.makedirs(queue_dir, exist_ok=True)
+    with open(os.path.join(queue_dir, 'next'), 'w') as f:
+        print(0, file=f)
+    with open(os.path.join(queue_dir, 'total'), 'w') as f:
+        print(total, file=f)
+
+def _claim(queue_dir, total):
+    '''
+    Return the next task id, or None if all tasks have been handed out
+    '''
+    import fcntl
+    with open(os.path.join(queue_dir, 'next'), 'r+') as f:
+        fcntl.lockf(f, fcntl.LOCK_EX)
+        try:
+            text = f.read().strip()
+            task_id = int(text) if text else 0
+            if task_id >= total:
+                return None
+            f.seek(0)
+            f.truncate()
+            print(task_id + 1, file=f)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            fcntl.lockf(f, fcntl.LOCK_UN)
+    return task_id
+
+def _previous_failures(log_fn):
+    status = {}
+    if os.path.isfile(log_fn):
+        with open(log_fn, 'r') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                status[rec['task']] = rec['status']
+    return [task_id for task_id, st in sorted(status.items()) if st != 'done']
+
+def expand_arguments(arguments, task_id):
+    '''
+    Substitute $(Process), and evaluate $$([...]) as condor_submit would
+    '''
+    ret = []
+    for a in arguments:
+        a = str(a)
+        for macro, escaped in _ESCAPES:
+            a = a.replace(escaped, macro)
+        a = a.replace(PROCESS_MACRO, str(task_id))
+        a = _EXPRESSION.sub(lambda m: str(int(eval(m.group(1), {'__builtins__': {}}))), a)
+        ret.append(a)
+    return ret
+
+def _own_modules(root, names):
+    '''
+    Modules in names loaded from source files under root
+    '''
+    ret = []
+    for name in names:
+        fn = getattr(sys.modules.get(name), '__file__', None)
+        if fn and os.path.abspath(fn).startswith(root + os.sep) and fn.endswith(('.py', '.pyc')):
+            ret.append(name)
+    return ret
+
+def run_task(arguments, task_id):
+    '''
+    Run the task script (facade.py, se3solver.py, ...) in this interpreter.
+    Return the exit code.
+
+    sys.argv and sys.path are restored afterwards, and modules of the
+    script's source tree imported by the task are removed from sys.modules.
+    '''
+    argv = expand_arguments(arguments, task_id)
+    script = os.path.abspath(argv[0])
+    saved_argv = sys.argv
+    saved_path = list(sys.path)
+    saved_modules = set(sys.modules)
+    sys.argv = [script] + argv[1:]
+    try:
+        runpy.run_path(script, run_name='__main__')
+        ret = 0
+    except SystemExit as e:
+        ret = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Exception:
+        traceback.print_exc()
+        ret = 1
+    finally:
+        sys.argv = saved_argv
+        sys.path[:] = saved_path
+    try:
+        compress.flush()
+    except Exception:
+        traceback.print_exc()
+        ret = ret or 1
+    root = os.path.dirname(script)
+    for name in _own_modules(root, set(sys.modules) - saved_modules):
+        del sys.modules[name]
+    return ret
+
+def work(queue_dir, worker, arguments):
+    with open(os.path.join(queue_dir, 'total'), 'r') as f:
+        total = int(f.read().strip())
+    log_fn = os.path.join(queue_dir, 'worker-{}.jsonl'.format(worker))
+    running_fn = os.path.join(queue_dir, 'running-{}'.format(worker))
+    pending = _previous_failures(log_fn)
+    if os.path.isfile(running_fn):
+        with open(running_fn, 'r') as f:
+            text = f.read().strip()
+        if text and int(text) not in pending:
+            pending.insert(0, int(text))
+    if pending:
+        util.log('[condor_worker {}] resuming tasks {}'.format(worker, pending))
+    util.enable_world_cache()
+    failed = 0
+    ntask = 0
+    t_start = time.time()
+    while True:
+        task_id = pending.pop(0) if pending else _claim(queue_dir, total)
+        if task_id is None:
+            break
+        with open(running_fn, 'w') as f:
+            print(task_id, file=f)
+        util.log('[condor_worker {}] task {}/{}'.format(worker, task_id, total))
+        t_task = time.time()
+        with perftrace.span('condor_task', task=task_id, worker=worker):
+            ret = run_task(arguments, task_id)
+        status = 'done' if ret == 0 else 'failed'
+        with open(log_fn, 'a') as f:
+            print(json.dumps({'task': task_id, 'status': status, 'seconds': time.time() - t_task}), file=f)
+        if ret != 0:
+            util.warn('[condor_worker {}] task {} failed with {}'.format(worker, task_id, ret))
+            failed += 1
+        ntask += 1
+        os.unlink(running_fn)
+    util.log('[condor_worker {}] {} tasks in {:.3f} sec., {} failed'.format(worker, ntask, time.time() - t_start, failed))
+    return 1 if failed else 0
+
+def setup_parser(subparsers):
+    p = subparsers.add_parser('condor_worker', help=commands.COMMANDS['condor_worker'])
+    p.add_argument('--queue', help='Queue directory created by local_submit', required=True)
+    p.add_argument('--worker', help='Worker id, i.e. $(Process) of the worker job', type=int, required=True)
+    p.add_argument('arguments', help='Task arguments, after --', nargs=argparse.REMAINDER)
+
+def run(args):
+    arguments = args.arguments
+    if arguments and arguments[0] == '--':
+        arguments = arguments[1:]
+    sys.exit(work(args.queue, args.worker, arguments))
@@ -70,6 +70,30 @@ CondorWorkspacePath = {CondorWorkspacePath}
 # How many jobs are you authroized to run in parallel on HTCondor
 # This is a hint for tasks partitioning
 CondorQuota = 150
+# Jobs held by errors are released (i.e. rerun) automatically for this many
+# times before asking for manual intervention
+CondorMaxRelease = 3
+# request_memory of each submission is estimated from the peak memory of the
+# same stage and puzzle in past runs (performance_log/condor_profiles.json)
+# times this margin. Use 3072 MiB for all submissions if disabled
+CondorAdaptiveMemory = yes
+CondorMemoryMargin = 1.25
+# Upper bound of the estimated request_memory in MiB
+# CondorMemoryCeiling = 32768
+# Run the tasks of each submission in a few long-lived worker jobs, which
+# keep modules and puzzle meshes loaded across tasks, instead of one job per task
+CondorWorkerMode = no
+# Number of worker jobs per submission in worker mode, default to CondorQuota
+# CondorWorkers = 150
+# Commands and transfers to each host share one multiplexed ssh connection,
+# which is kept alive for this many seconds after the last use
+SSHControlPersist = 600
+# Hosts listed here (comma separated) are executed with the local shell
+# instead of ssh, to run the full remote code path on this machine
+LoopbackHosts =
+# glvnd vendor file of Mesa, for the software rasterizer of hosts without GPU
+# render nodes (see renderer_pool.py). Unset means the glvnd default
+# EGLVendorFile = /usr/share/glvnd/egl_vendor.d/50_mesa.json
 
 ChartReslution = 2048
 
@@ -80,6 +104,25 @@ mailto = SHOULD_NOT_BE_HERE_AND_KEEP_IT_PRIVATE
 # Sometimes we do not have access to mail locally
 mailfrom_host = SHOULD_NOT_BE_HERE_AND_KEEP_IT_PRIVATE
 
+[Compression]
+# HDF5 outputs are compressed with xz in the background while the task
+# continues. Threads of each xz process, 0 means all CPUs of the node
+Threads = 1
+# Default compression level (0-9)
+Level = 6
+# Per-stage levels
+isect_geometry = 6
+uvproject = 6
+isect_uvproject = 6
+interpolate_trajectory = 6
+estimate_clearance_volume = 6
+
+[CondorThreads]
+# Stages that can use multiple threads (OMP_NUM_THREADS), and the maximal
+# request_cpus of their HTCondor tasks. Stages not listed use 1 CPU.
+# The stage name is the value of --stage, or <script>.<subcommand>, e.g.
+# se3solver.solve = 4
+
 [TrainingTrajectory]
 # RDT algorithm. This is usually the best choice among classical algorithms
 PlannerAlgorithmID = 15
@@ -113,8 +156,14 @@ TouchSample = 32768
 TouchSampleGranularity = 32768
 # Minimal task size hint: mesh boolean
 MeshBoolGranularity = 1024
+# Number of touch configurations passed to each call of the batched mesh
+# boolean, which culls the non-touching configurations and runs in parallel
+MeshBoolBatch = 64
 # Minimal task size hint: mesh boolean
 # UVProjectGranularity = 1024
+# Project the intersecting geometry to UV space right after the mesh boolean
+# in the same worker, which skips the intermediate isect_batch-*.hdf5.xz files
+FusedUVProject = no
 
 [TrainingCluster]
 # Format Group# = <puzzle name>.piece1,<puzzle name>.piece2
@@ -136,6 +185,14 @@ Margin                      = 1e-6
 ReuseWorkspace              = {ReuseWorkspace}
 OversamplingRatio           = 10
 OversamplingClearanceSample = 128
+# Predict with a frozen inference graph (see train --stage freeze_*)
+# Possible values: fp32, fp16, int8. Empty means restoring checkpoints directly
+FrozenGraphWeights          =
+# 0 means the batch size of the network profile
+PredictionBatchSize         = 0
+# TensorFlow thread pools, 0 lets TensorFlow decide
+IntraOpThreads              = 0
+InterOpThreads              = 0
 
 
 [GeometriK]
@@ -164,6 +221,16 @@ PDSBloom = 3072
 
 # In day(s), 0.01 ~= 14 minutes, 0.02 ~= 0.5 hour
 TimeThreshold = 0.02
+# Sample the solver counters of blooming and find_trajectory tasks into .tlm
+# files next to their outputs, see 'facade.py stats telemetry'
+Telemetry = yes
+# In seconds
+TelemetryInterval = 10
+# Map the PDS of forest_rdt tasks from one copy per host, see pipeline/pds_share.py
+# The copies take RAM in /dev/shm until `se3solver.py pds_purge` or a reboot
+PDSShare = no
+# Directory of the shared copies, default to /dev/shm
+# PDSShareRoot = /dev/shm
 
 '''
 
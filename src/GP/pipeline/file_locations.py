@@ -3,6 +3,8 @@
 
 from . import matio
 from . import util
+from . import taskindex
+from . import condor_profile
 import os
 from os.path import join, isdir, isfile
 import pathlib
@@ -215,6 +217,12 @@ class FileLocations(object):
                 yield i, join(self.bloom, f'bloom-from_{i}.npz')
         return gen()
 
+    @property
+    def bloom_outputs(self):
+        # Submitted with wait=False, record the resource usage on collection
+        condor_profile.collect(self.bloom)
+        return taskindex.discover(self.bloom, 'bloom-from_', '.npz')
+
     @property
     def pds_fn(self):
         fn ='{}.npz'.format(self.trial)
@@ -241,6 +249,12 @@ class FileLocations(object):
                 yield i, join(self.knn, f'pairwise_knn_edges-{i}.npz')
         return gen()
 
+    @property
+    def knn_outputs(self):
+        # Submitted with wait=False, record the resource usage on collection
+        condor_profile.collect(self.knn)
+        return taskindex.discover(self.knn, 'pairwise_knn_edges-', '.npz')
+
     @property
     def ibte_fn(self):
         return join(self.knn, 'inter_blooming_tree_edges.npz')
@@ -265,6 +279,14 @@ class FileLocations(object):
     def performance_log(self):
         return self._ws.local_ws(util.PERFORMANCE_LOG_DIR, 'log.{}'.format(self.trial))
 
+    @property
+    def meta_index(self):
+        return self._ws.meta_index
+
+    @property
+    def performance_trace(self):
+        return self._ws.performance_trace_file(trial_override=self.trial)
+
     def get_baseline_dir(self, planner_id, trial_id, reference_scheme='cmb'):
         rel_scratch_dir = join(util.BASELINE_SCRATCH,
                                self._puzzle_name,
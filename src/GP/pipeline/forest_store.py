@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+forest_store.py -- columnar storage of the RDT forest
+
+Each root of the forest used to write two MATLAB files after its solve call,
+ssc-<root>.mat (sample set connectivity, a 1 x PDS sparse matrix) and
+compact_tree-<root>.mat (CNVI, CNV and CE), both zlib-compressed by savemat.
+Readers then loadmat every file, and merge_pdsc vstack-ed all of them.
+
+Now all roots append to one container, <dir>/forest.fst, and an index
+<dir>/forest.fst.idx. A record holds the arrays of one root:
+
+    header: magic, index itemsize, root, nrows, ncols, nnz, ncnv, cnv_dim, nce
+    CSR indptr (nrows + 1), indices (nnz), data (nnz, int32)
+    CNVI (ncnv, int64), CNV (ncnv x cnv_dim, float64), CE (nce x 2, int64)
+
+Arrays are little-endian and 8-byte aligned, so readers map the file and get
+zero-copy views of them. The index has one (root, offset, size) int64 triple
+per record. Records are written before their index entries under lockf, so
+concurrent HTCondor tasks can append to the same store, and readers never
+see partial records. A rerun of a root appends a new record, and the last
+one wins.
+
+Directories written before the store existed are read with MatForest, which
+has the same interface. `se3solver.py forest_to_mat` converts a store back to
+the MATLAB files.
+'''
+
+import os
+import mmap
+import struct
+import numpy as np
+import scipy.sparse as sparse
+
+STORE_FILE = 'forest.fst'
+INDEX_SUFFIX = '.idx'
+
+_MAGIC = b'FST1'
+_HEADER = struct.Struct('<4sI7q')
+_ALIGN = 8
+
+def store_file(indir):
+    return os.path.join(indir, STORE_FILE)
+
+def _padding(nbytes):
+    return -nbytes % _ALIGN
+
+def _index_dtype(nnz, ncols):
+    return np.dtype('<i4') if max(nnz, ncols) < np.iinfo(np.int32).max else np.dtype('<i8')
+
+def append(fn, root, C, CNVI=None, CNV=None, CE=None):
+    '''
+    Append the sample set connectivity C (sparse, nrows x PDS size) and the
+    compact tree (CNVI, CNV, CE) of root to the store fn.
+    '''
+    C = sparse.csr_matrix(C)
+    C.sort_indices()
+    nrows, ncols = C.shape
+    itype = _index_dtype(C.nnz, ncols)
+    CNVI = np.zeros(0, dtype=np.int64) if CNVI is None else np.asarray(CNVI).reshape(-1)
+    CNV = np.zeros((0, 0)) if CNV is None else np.asarray(CNV)
+    CE = np.zeros((0, 2), dtype=np.int64) if CE is None else np.asarray(CE).reshape(-1, 2)
+    cnv_dim = CNV.shape[1] if CNV.ndim == 2 else 0
+    arrays = [np.ascontiguousarray(C.indptr, dtype=itype),
+              np.ascontiguousarray(C.indices, dtype=itype),
+              np.ascontiguousarray(C.data, dtype='<i4'),
+              np.ascontiguousarray(CNVI, dtype='<i8'),
+              np.ascontiguousarray(CNV, dtype='<f8'),
+              np.ascontiguousarray(CE, dtype='<i8')]
+    header = _HEADER.pack(_MAGIC, itype.itemsize, int(root), nrows, ncols, C.nnz,
+                          CNVI.shape[0], cnv_dim, CE.shape[0])
+    import fcntl
+    os.makedirs(os.path.dirname(os.path.abspath(fn)), exist_ok=True)
+    # lockf (unlike flock) is also honored by NFS clients on other hosts
+    with open(fn + INDEX_SUFFIX, 'ab') as fidx:
+        fcntl.lockf(fidx, fcntl.LOCK_EX)
+        try:
+            with open(fn, 'ab') as f:
+                # Skip the leftover of a writer that died before its index entry
+                offset = f.seek(0, os.SEEK_END)
+                f.write(b'\0' * _padding(offset))
+                offset += _padding(offset)
+                f.write(header)
+                f.write(b'\0' * _padding(len(header)))
+                size = len(header) + _padding(len(header))
+                for a in arrays:
+                    if a.nbytes > 0:
+                        f.write(a.data)
+                    f.write(b'\0' * _padding(a.nbytes))
+                    size += a.nbytes + _padding(a.nbytes)
+                f.flush()
+                os.fsync(f.fileno())
+            fidx.write(np.array([root, offset, size], dtype='<i8').tobytes())
+            fidx.flush()
+        finally:
+            fcntl.lockf(fidx, fcntl.LOCK_UN)
+
+class ForestStore(object):
+    '''
+    Read-only view of a store. Arrays returned by the accessors are views of
+    the mapped file, and stay valid until close().
+    '''
+    def __init__(self, fn):
+        self.fn = fn
+        entries = np.fromfile(fn + INDEX_SUFFIX, dtype='<i8')
+        entries = entries[:entries.shape[0] // 3 * 3].reshape(-1, 3)
+        # Later records are from reruns
+        self._records = {int(root): (int(offset), int(size)) for root, offset, size in entries}
+        with open(fn, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Created but not appended yet, and mmap rejects empty files
+                self._mm = None
+                self._records = {}
+            else:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._cache = {}
+
+    def close(self):
+        self._cache = {}
+        if self._mm is not None:
+            self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, root):
+        return root in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    @property
+    def roots(self):
+        return sorted(self._records.keys())
+
+    @property
+    def pds_size(self):
+        if not self._records:
+            return 0
+        return self._record(self.roots[0])['ncols']
+
+    def missing_roots(self):
+        '''
+        Roots below the largest one that have no record, e.g. of failed tasks
+        '''
+        if not self._records:
+            return []
+        return sorted(set(range(max(self._records) + 1)) - set(self._records))
+
+    def _record(self, root):
+        if root in self._cache:
+            return self._cache[root]
+        offset, size = self._records[root]
+        if offset + size > len(self._mm):
+            raise ValueError('{}: record of root {} is beyond the end of file'.format(self.fn, root))
+        magic, isize, rec_root, nrows, ncols, nnz, ncnv, cnv_dim, nce = _HEADER.unpack_from(self._mm, offset)
+        if magic != _MAGIC or rec_root != root:
+            raise ValueError('{}: corrupted record of root {}'.format(self.fn, root))
+        pos = offset + _HEADER.size + _padding(_HEADER.size)
+        def view(dtype, count):
+            nonlocal pos
+            if count == 0:
+                return np.zeros(0, dtype=dtype)
+            a = np.frombuffer(self._mm, dtype=dtype, count=count, offset=pos)
+            pos += a.nbytes + _padding(a.nbytes)
+            return a
+        itype = '<i{}'.format(isize)
+        rec = {'nrows': nrows, 'ncols': ncols}
+        rec['indptr'] = view(itype, nrows + 1)
+        rec['indices'] = view(itype, nnz)
+        rec['data'] = view('<i4', nnz)
+        rec['CNVI'] = view('<i8', ncnv)
+        rec['CNV'] = view('<f8', ncnv * cnv_dim).reshape(ncnv, cnv_dim)
+        rec['CE'] = view('<i8', nce * 2).reshape(nce, 2)
+        self._cache[root] = rec
+        return rec
+
+    def connectivity(self, root):
+        '''
+        Sample set connectivity of root, as a csr_matrix over the mapped arrays
+        '''
+        rec = self._record(root)
+        return sparse.csr_matrix((rec['data'], rec['indices'], rec['indptr']),
+                                 shape=(rec['nrows'], rec['ncols']), copy=False)
+
+    def compact_tree(self, root):
+        '''
+        (CNVI, CNV, CE) of root
+        '''
+        rec = self._record(root)
+        return rec['CNVI'], rec['CNV'], rec['CE']
+
+    def connectivity_matrix(self, roots=None):
+        '''
+        Connectivity of roots (default to all roots in order) stacked into one
+        csr_matrix, which concatenates the arrays once instead of vstack-ing
+        one matrix per root.
+
+        Row i is root i by default, hence ValueError is raised if any root
+        below the largest one is missing.
+        '''
+        if roots is None:
+            missing = self.missing_roots()
+            if missing:
+                raise ValueError('{}: roots {} are missing'.format(self.fn, missing))
+            roots = self.roots
+        recs = [self._record(r) for r in roots]
+        if not recs:
+            return sparse.csr_matrix((0, 0), dtype=np.int32)
+        nnz = sum([rec['indices'].shape[0] for rec in recs])
+        ncols = recs[0]['ncols']
+        itype = _index_dtype(nnz, ncols)
+        indptr = [np.zeros(1, dtype=itype)]
+        base = 0
+        for rec in recs:
+            indptr.append(rec['indptr'][1:].astype(itype) + base)
+            base += rec['indices'].shape[0]
+        indptr = np.concatenate(indptr)
+        indices = np.concatenate([rec['indices'] for rec in recs]).astype(itype, copy=False)
+        data = np.concatenate([rec['data'] for rec in recs])
+        return sparse.csr_matrix((data, indices, indptr), shape=(indptr.shape[0] - 1, ncols), copy=False)
+
+class MatForest(object):
+    '''
+    ForestStore interface over ssc-<root>.mat and compact_tree-<root>.mat
+    files of tasks 0, 1, ...
+    '''
+    def __init__(self, indir, prefix_ssc='ssc-', prefix_ct='compact_tree-'):
+        from . import util
+        self.indir = indir
+        self._ssc_files = util.lsv(indir, prefix_ssc, '.mat')
+        try:
+            self._ct_files = util.lsv(indir, prefix_ct, '.mat')
+        except FileNotFoundError:
+            self._ct_files = []
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, root):
+        return 0 <= root < len(self._ssc_files)
+
+    def __len__(self):
+        return len(self._ssc_files)
+
+    @property
+    def roots(self):
+        return list(range(len(self._ssc_files)))
+
+    @property
+    def ntrees(self):
+        return len(self._ct_files)
+
+    @property
+    def pds_size(self):
+        return self.connectivity(0).shape[1]
+
+    def connectivity(self, root):
+        from scipy.io import loadmat
+        return sparse.csr_matrix(loadmat(self._ssc_files[root])['C'])
+
+    def compact_tree(self, root):
+        from scipy.io import loadmat
+        d = loadmat(self._ct_files[root])
+        return d['CNVI'].flatten(), d['CNV'], d['CE']
+
+    def connectivity_matrix(self, roots=None):
+        roots = self.roots if roots is None else roots
+        return sparse.vstack([self.connectivity(r) for r in roots], format='csr')
+
+def open_forest(indir, prefix_ssc='ssc-', prefix_ct='compact_tree-'):
+    '''
+    ForestStore of indir, or MatForest if indir has no store
+    '''
+    fn = store_file(indir)
+    if os.path.isfile(fn):
+        return ForestStore(fn)
+    return MatForest(indir, prefix_ssc=prefix_ssc, prefix_ct=prefix_ct)
+
+def export_mat(indir, outdir=None, roots=None):
+    '''
+    Write the store of indir as ssc-<root>.mat and compact_tree-<root>.mat
+    files under outdir (default to indir). Return the number of roots.
+    '''
+    from scipy.io import savemat
+    outdir = indir if outdir is None else outdir
+    os.makedirs(outdir, exist_ok=True)
+    with ForestStore(store_file(indir)) as store:
+        roots = store.roots if roots is None else roots
+        for root in roots:
+            savemat(os.path.join(outdir, 'ssc-{}.mat'.format(root)),
+                    dict(C=store.connectivity(root).tocsc()), do_compression=True)
+            CNVI, CNV, CE = store.compact_tree(root)
+            savemat(os.path.join(outdir, 'compact_tree-{}.mat'.format(root)),
+                    dict(CNVI=CNVI, CNV=CNV, CE=CE), do_compression=True)
+    return len(roots)
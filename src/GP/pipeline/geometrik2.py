@@ -70,7 +70,8 @@ def predict_geratio_key_worker(ws, wag_pair):
         ompl_q = kqs
 
     kfn = FMT_to_file(ws, wag1, util.GERATIO_KEY_FMT)
-    np.savez(kfn, KEYQ_OMPL=ompl_q, ENV_KEYID=keyid1, ROB_KEYID=keyid2)
+    matio.savez(kfn, KEYQ_OMPL=ompl_q, ENV_KEYID=keyid1, ROB_KEYID=keyid2)
+    ws.record_meta([kfn])
     return None
 
 def predict_notch_key_worker(ws, wag_pair):
@@ -116,11 +117,12 @@ def predict_notch_key_worker(ws, wag_pair):
     # Remind ge1 and nt1 come from env, and *2 come from rob
     assert wag1.geo_type == 'env'
     assert wag2.geo_type == 'rob'
-    np.savez(kfn, KEYQ_OMPL=ompl_q,
-             ENV_GEKEYID=keyid_ge1,
-             ROB_GEKEYID=keyid_ge2,
-             ENV_NTKEYID=keyid_nt1,
-             ROB_NTKEYID=keyid_nt2)
+    matio.savez(kfn, KEYQ_OMPL=ompl_q,
+                ENV_GEKEYID=keyid_ge1,
+                ROB_GEKEYID=keyid_ge2,
+                ENV_NTKEYID=keyid_nt1,
+                ROB_NTKEYID=keyid_nt2)
+    ws.record_meta([kfn])
     util.ack(f'[predict_geratio_key] save {ompl_q.shape} keys to {kfn}')
     return None
 
@@ -128,14 +130,16 @@ def _detect_geratio_feature_worker(ws, wag):
     ws.current_trial = wag.current_trial
     pts = detect_geratio_feature_worker(ws, wag)
     ge_fn = FMT_to_file(ws, wag, util.GERATIO_POINT_FMT)
-    np.savez(ge_fn, KEY_POINT_AMBIENT=pts)
+    matio.savez(ge_fn, KEY_POINT_AMBIENT=pts)
+    ws.record_meta([ge_fn])
     util.ack(f'[detect_geratio_feature][{wag.puzzle_name}][{wag.geo_type}] saving {pts.shape} to {ge_fn}')
 
 def _detect_notch_feature_worker(ws, wag):
     ws.current_trial = wag.current_trial
     pts = detect_notch_feature_worker(ws, wag)
     nt_fn = FMT_to_file(ws, wag, util.NOTCH_POINT_FMT)
-    np.savez(nt_fn, NOTCH_POINT_AMBIENT=pts)
+    matio.savez(nt_fn, NOTCH_POINT_AMBIENT=pts)
+    ws.record_meta([nt_fn])
     util.ack(f'[detect_notch_feature][{wag.puzzle_name}][{wag.geo_type}] saving {pts.shape} to {nt_fn}')
 
 def detect_geratio_feature(args, ws):
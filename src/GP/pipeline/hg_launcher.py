@@ -73,6 +73,14 @@ piece_ids: False
 [Prediction]
 prediction_epoch_size: 4096
 debug_predction: False
+# Frozen inference graph written by export_frozen_with_params.
+# Empty string means restoring the training graph from the checkpoint.
+frozen_graph: ''
+# 0 means using batch_size from [Train]
+prediction_batch_size: 0
+# 0 lets TensorFlow decide
+intra_op_threads: 0
+inter_op_threads: 0
 
 [Saver]
 # Obsoluted, we now save logs under subdirectories of ckpt_dir
@@ -177,7 +185,7 @@ def create_config_from_tagstring(tagstring):
     util.log("[create_config_from_tagstring] {} -> {} -> {}".format(tagstring, tags, ret))
     return ret, '.'.join(tags)
 
-def launch_with_params(params, do_training, load=False):
+def _create_model(params, do_training):
     print('--Creating Dataset')
     # According to workspace hierarchy, the foloder name is the actual puzzle name
     # Note: all traing data are named after 'train'
@@ -200,12 +208,20 @@ def launch_with_params(params, do_training, load=False):
         util.warn(str(e))
         raise e
     w_loss = params['weighted_loss'] or (params['multichannel'] and not params['multichannel_no_weight'])
+    batch_size = params['batch_size']
+    if not do_training and params.get('frozen_graph') and params.get('prediction_batch_size', 0) > 0:
+        """
+        Keep the number of predicted images unchanged when the batch grows.
+        """
+        images = params['prediction_epoch_size'] * batch_size
+        batch_size = params['prediction_batch_size']
+        params['prediction_epoch_size'] = max(1, images // batch_size)
     model = HourglassModel(nFeat=params['nfeats'],
                            nStack=params['nstacks'],
                            nModules=params['nmodules'],
                            nLow=params['nlow'],
                            outputDim=params['num_joints'],
-                           batch_size=params['batch_size'],
+                           batch_size=batch_size,
                            attention=params['mcam'],
                            training=do_training,
                            drop_rate=params['dropout_rate'],
@@ -222,7 +238,10 @@ def launch_with_params(params, do_training, load=False):
                            joints= params['joint_list'],
                            modif=False,
                            use_fp16=params['fp16'])
+    return model
 
+def launch_with_params(params, do_training, load=False):
+    model = _create_model(params, do_training)
     model.set_dump_to(params['dump_nn_input_data_to'])
     """
     Cached output
@@ -251,6 +270,18 @@ def launch_with_params(params, do_training, load=False):
             print(f"[hg_launcher][cache hit] {prediction_output} is a valid cached model prediction, leaving")
             return
 
+    if not do_training and params.get('frozen_graph'):
+        out_dir = params['checkpoint_dir'] if 'output_dir' not in params else params['output_dir']
+        return model.frozen_testing_init(params['frozen_graph'],
+                                         epochSize=params['prediction_epoch_size'],
+                                         load=params['checkpoint_dir'],
+                                         load_at=params['epoch_to_load'],
+                                         out_dir=out_dir,
+                                         prediction_output=prediction_output,
+                                         debug_predction=params['debug_predction'],
+                                         intra_op_threads=params.get('intra_op_threads', 0),
+                                         inter_op_threads=params.get('inter_op_threads', 0))
+
     model.generate_model()
     if do_training:
         # TODO: passing load= to continue if checkpoint presents
@@ -265,7 +296,7 @@ def launch_with_params(params, do_training, load=False):
                             continue_from=params['load_epoch'])
     else:
         out_dir = params['checkpoint_dir'] if 'output_dir' not in params else params['output_dir']
-        model.testing_init(nEpochs=1, epochSize=params['prediction_epoch_size'], saveStep=0,
+        return model.testing_init(nEpochs=1, epochSize=params['prediction_epoch_size'], saveStep=0,
                            dataset=None,
                            load=params['checkpoint_dir'],
                            load_at=params['epoch_to_load'],
@@ -273,6 +304,146 @@ def launch_with_params(params, do_training, load=False):
                            prediction_output=prediction_output,
                            debug_predction=params['debug_predction'])
 
+def latest_epoch(checkpoint_dir):
+    """
+    Epoch of the latest checkpoint according to the 'checkpoint' state file
+    written by tf.train.Saver, or None if there is no checkpoint.
+
+    Parsed by hand so that callers do not need to import TensorFlow.
+    """
+    import re
+    try:
+        with open(join(checkpoint_dir, 'checkpoint'), 'r') as f:
+            for line in f:
+                m = re.match(r'\s*model_checkpoint_path:\s*"(.*)"', line)
+                if m is None:
+                    continue
+                m = re.match(r'_(\d+)$', basename(m.group(1)))
+                return None if m is None else int(m.group(1))
+    except OSError:
+        pass
+    return None
+
+def resolve_epoch(checkpoint_dir, load_at):
+    """
+    load_at, or the latest epoch if load_at is None or negative
+    """
+    if load_at is None or load_at < 0:
+        return latest_epoch(checkpoint_dir)
+    return load_at
+
+def checkpoint_hash(checkpoint_dir, load_at):
+    """
+    Same as HourglassModel.hash_saved_model, i.e. the MODEL_BLAKE2B of the
+    predictions, as a hex string. load_at must be resolved already.
+    """
+    import hashlib
+    import pathlib
+    hasher = hashlib.blake2b()
+    for f in sorted(pathlib.Path(checkpoint_dir).glob(f'_{load_at}.*')):
+        hasher.update(f.read_bytes())
+    return hasher.hexdigest()
+
+FROZEN_HASH_SUFFIX = '.blake2b'
+
+def frozen_graph_file(checkpoint_dir, load_at=None, weight_type='fp32'):
+    epoch = resolve_epoch(checkpoint_dir, load_at)
+    epoch = 'latest' if epoch is None else str(epoch)
+    return join(checkpoint_dir, f'frozen-{epoch}-{weight_type}.pb')
+
+def frozen_graph_is_current(graph_fn, checkpoint_dir, load_at):
+    """
+    True if graph_fn exists and was exported from the checkpoint of load_at
+    as it is now, according to the hash stored next to graph_fn
+    """
+    epoch = resolve_epoch(checkpoint_dir, load_at)
+    if epoch is None or not isfile(graph_fn):
+        return False
+    try:
+        with open(graph_fn + FROZEN_HASH_SUFFIX, 'r') as f:
+            recorded = f.read().strip()
+    except OSError:
+        return False
+    return recorded == checkpoint_hash(checkpoint_dir, epoch)
+
+def export_frozen_with_params(params, output_fn=None, weight_type='fp32'):
+    """
+    Freeze the checkpoint at params['epoch_to_load'] under params['checkpoint_dir'].
+    The hash of the checkpoint is written to <output_fn>.blake2b.
+
+    The dataset is still created because the input channels are derived from it.
+    """
+    epoch = resolve_epoch(params['checkpoint_dir'], params['epoch_to_load'])
+    model = _create_model(params, do_training=False)
+    model.generate_model()
+    if output_fn is None:
+        output_fn = frozen_graph_file(params['checkpoint_dir'], epoch, weight_type)
+    model.export_frozen_graph(load=params['checkpoint_dir'],
+                              output_fn=output_fn,
+                              load_at=epoch,
+                              weight_type=weight_type)
+    if epoch is not None:
+        with open(output_fn + FROZEN_HASH_SUFFIX, 'w') as f:
+            print(checkpoint_hash(params['checkpoint_dir'], epoch), file=f)
+    return output_fn
+
+def _benchmark_worker(params, queue):
+    import resource
+    import time
+    t_start = time.time()
+    stats = launch_with_params(params, do_training=False)
+    stats['total_seconds'] = time.time() - t_start
+    # ru_maxrss is in KiB on Linux
+    stats['peak_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    queue.put(stats)
+
+def _wait_result(proc, queue, poll_interval=5.0):
+    """
+    Result put by proc into queue, or None if proc dies without putting it
+    """
+    from queue import Empty
+    while True:
+        try:
+            return queue.get(timeout=poll_interval)
+        except Empty:
+            if not proc.is_alive():
+                break
+    # The result may be flushed right before the process exits
+    try:
+        return queue.get(timeout=1.0)
+    except Empty:
+        return None
+
+def benchmark_with_params(params, frozen_graph):
+    """
+    Compare the restore path against the frozen graph.
+
+    Each path runs in its own process so the peak RSS numbers are not
+    polluted by each other.
+    """
+    import copy
+    import tempfile
+    from multiprocessing import Process, Queue
+    ret = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, graph in [('restore', ''), ('frozen', frozen_graph)]:
+            p = copy.deepcopy(params)
+            p['frozen_graph'] = graph
+            p['output_dir'] = tmp_dir
+            p['prediction_output'] = None
+            queue = Queue()
+            proc = Process(target=_benchmark_worker, args=(p, queue))
+            proc.start()
+            stats = _wait_result(proc, queue)
+            proc.join()
+            if stats is None:
+                raise RuntimeError(f'[benchmark_with_params] {name} worker exited with code {proc.exitcode} without results')
+            stats['images_per_second'] = stats['images'] / stats['seconds']
+            util.ack('[benchmark_with_params] {}: {:.2f} images/s, peak RSS {:.1f} MiB, total {:.2f} sec.'.format(
+                     name, stats['images_per_second'], stats['peak_rss'] / 1024.0 / 1024.0, stats['total_seconds']))
+            ret[name] = stats
+    return ret
+
 def main():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('hgcfg', help='Configure file of hourglass network')
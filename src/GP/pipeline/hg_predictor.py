@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Inference-only predictor for the hourglass network.
+
+HourglassModel.export_frozen_graph writes a constant-folded GraphDef that
+only contains the path from the input placeholder to the last stack's
+heatmap. FrozenPredictor loads this file without building the training
+graph (loss, optimizer, summaries, dropout) or restoring the checkpoint
+through tf.train.Saver, which makes prediction practical on GPU-less hosts.
+
+This module intentionally has no dependency on pyosr, so it can be used
+anywhere the predicted images are already available.
+"""
+
+import time
+import numpy as np
+
+from . import util
+try:
+    import tensorflow as tf
+except ImportError as e:
+    util.warn("[WARNING] CANNOT IMPORT tensorflow. This node is incapable of training/prediction")
+    raise e
+
+# Node names shared with HourglassModel.export_frozen_graph
+INPUT_NODE = 'inputs/input_img'
+OUTPUT_NODE = 'inference/prediction'
+
+WEIGHT_TYPES = ['fp32', 'fp16', 'int8']
+
+'''
+Store large float32 constants as float16 and cast them back at runtime.
+
+This halves the size of the frozen graph (and the resident weights) while
+keeping every kernel in float32, which is what CPU kernels are optimized for.
+'''
+def halve_weights(graph_def, min_elements=1024):
+    f32 = tf.float32.as_datatype_enum
+    f16 = tf.float16.as_datatype_enum
+    ret = tf.GraphDef()
+    ret.versions.CopyFrom(graph_def.versions)
+    ret.library.CopyFrom(graph_def.library)
+    for node in graph_def.node:
+        if node.op == 'Const' and node.attr['dtype'].type == f32:
+            value = tf.make_ndarray(node.attr['value'].tensor)
+            if value.size >= min_elements:
+                half = ret.node.add()
+                half.op = 'Const'
+                half.name = node.name + '/half'
+                half.device = node.device
+                half.attr['dtype'].type = f16
+                half.attr['value'].tensor.CopyFrom(tf.make_tensor_proto(value.astype(np.float16)))
+                cast = ret.node.add()
+                cast.op = 'Cast'
+                cast.name = node.name
+                cast.device = node.device
+                cast.input.append(half.name)
+                cast.attr['SrcT'].type = f16
+                cast.attr['DstT'].type = f32
+                continue
+        ret.node.add().CopyFrom(node)
+    return ret
+
+class FrozenPredictor(object):
+    '''
+    Arguments:
+        graph_fn: frozen GraphDef written by HourglassModel.export_frozen_graph
+        batch_size: maximal number of images sent to a single Session.run call.
+                    Larger inputs are split into chunks of this size.
+        intra_op_threads, inter_op_threads: TensorFlow thread pool sizes,
+                    0 lets TensorFlow decide.
+        use_gpu: set to False to hide all GPUs from this session.
+    '''
+    def __init__(self, graph_fn, batch_size=32,
+                 intra_op_threads=0, inter_op_threads=0,
+                 use_gpu=False):
+        t_start = time.time()
+        graph_def = tf.GraphDef()
+        with open(graph_fn, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.img = self.graph.get_tensor_by_name(INPUT_NODE + ':0')
+        self.output = self.graph.get_tensor_by_name(OUTPUT_NODE + ':0')
+        self.batch_size = int(batch_size)
+        config = tf.ConfigProto(allow_soft_placement=True,
+                                intra_op_parallelism_threads=int(intra_op_threads),
+                                inter_op_parallelism_threads=int(inter_op_threads))
+        if use_gpu:
+            config.gpu_options.allow_growth = True
+        else:
+            config.device_count['GPU'] = 0
+        self.session = tf.Session(graph=self.graph, config=config)
+        util.log('[FrozenPredictor] {} loaded in {:.3f} sec.'.format(graph_fn, time.time() - t_start))
+
+    @property
+    def input_dtype(self):
+        return self.img.dtype.as_numpy_dtype
+
+    @property
+    def c_dim(self):
+        return self.img.get_shape().as_list()[3]
+
+    def predict(self, images):
+        '''
+        images: (N, 256, 256, c_dim)
+
+        Return the heatmap of the last stack, i.e. output[:, nStack - 1]
+        '''
+        images = np.asarray(images, dtype=self.input_dtype)
+        n = images.shape[0]
+        if n <= self.batch_size:
+            return self.session.run(self.output, feed_dict={self.img: images})
+        ret = []
+        for i in range(0, n, self.batch_size):
+            ret.append(self.session.run(self.output, feed_dict={self.img: images[i:i+self.batch_size]}))
+        return np.concatenate(ret, axis=0)
+
+    def close(self):
+        self.session.close()
@@ -120,6 +120,7 @@ class HourglassModel():
         self._model_hash = b''
         self.fp_type = tf.float16 if use_fp16 else tf.float32
         self._dump_nn_input_to = ''
+        self._predictor = None
         assert self.njoints == dataset.d_dim, 'Number of joints ({}) does not match output dimensions ({})'.format(self.njoints, dataset.d_dim)
 
     # ACCESSOR
@@ -392,6 +393,67 @@ class HourglassModel():
             hasher.update(f.read_bytes())
         return hasher.digest()
 
+    def export_frozen_graph(self, load : str, output_fn : str, load_at : int = None, weight_type : str = 'fp32'):
+        """ Freeze a trained checkpoint into an inference-only graph
+        Args:
+            load            : Checkpoint directory
+            output_fn       : File to store the frozen GraphDef
+            load_at         : Epoch to load, None for the latest checkpoint
+            weight_type     : 'fp32', 'fp16' (weights stored as half), or 'int8' (quantized weights)
+        Warning:
+            Build the model with training = False, otherwise batch normalization
+            cannot be fused into the convolution kernels.
+        """
+        from . import hg_predictor
+        from tensorflow.tools.graph_transforms import TransformGraph
+        assert not self.training, 'export_frozen_graph requires a model built for prediction'
+        assert weight_type in hg_predictor.WEIGHT_TYPES, f'Unknown weight type {weight_type}'
+        with tf.name_scope('inference'):
+            tf.identity(self.output[:, self.nStack - 1], name='prediction')
+        self._init_session()
+        self._define_saver_summary(summary = False)
+        ckpt_fn = self.get_checkpoint_name(load, load_at)
+        print(f"Restore ckpt from {ckpt_fn}")
+        self.saver.restore(self.Session, ckpt_fn)
+        graph_def = self.Session.graph.as_graph_def()
+        for node in graph_def.node:
+            node.device = ''
+        graph_def = tf.graph_util.convert_variables_to_constants(self.Session, graph_def, [hg_predictor.OUTPUT_NODE])
+        transforms = ['strip_unused_nodes',
+                      'remove_nodes(op=Identity, op=CheckNumerics)',
+                      'fold_constants(ignore_errors=true)',
+                      'fold_batch_norms',
+                      'fold_old_batch_norms']
+        if weight_type == 'int8':
+            transforms.append('quantize_weights')
+        transforms.append('sort_by_execution_order')
+        graph_def = TransformGraph(graph_def, [hg_predictor.INPUT_NODE], [hg_predictor.OUTPUT_NODE], transforms)
+        if weight_type == 'fp16':
+            graph_def = hg_predictor.halve_weights(graph_def)
+        with open(output_fn, 'wb') as f:
+            f.write(graph_def.SerializeToString())
+        print(f"Frozen graph ({weight_type}, {len(graph_def.node)} nodes) written to {output_fn}")
+        self.Session.close()
+
+    def frozen_testing_init(self, frozen_graph, epochSize = 1000, load=None, load_at=-1, out_dir=None, prediction_output=None, debug_predction=False, intra_op_threads=0, inter_op_threads=0):
+        """ Predict with a frozen graph instead of the training graph
+        Note:
+            generate_model() is not needed (and should not be called) for this path.
+            load is still used to compute the model signature of the prediction.
+        """
+        from . import hg_predictor
+        self._predictor = hg_predictor.FrozenPredictor(frozen_graph,
+                                                       batch_size=self.batchSize,
+                                                       intra_op_threads=intra_op_threads,
+                                                       inter_op_threads=inter_op_threads)
+        if load is not None:
+            self._model_hash = self.hash_saved_model(load, load_at)
+        if out_dir is None:
+            out_dir = load
+        ret = self._test(nEpochs=1, epochSize=epochSize, saveStep=0, out_dir=out_dir, prediction_output=prediction_output, load_at=load_at, debug_predction=debug_predction)
+        self._predictor.close()
+        return ret
+
     def testing_init(self, nEpochs = 1, epochSize = 1000, saveStep = 0, dataset=None, load=None, load_at=-1, out_dir=None, prediction_output=None, debug_predction=False):
             with tf.name_scope('Session'):
                 with tf.device(self.gpu):
@@ -415,7 +477,7 @@ class HourglassModel():
                     self._model_hash = self.hash_saved_model(load, load_at);
                     if out_dir is None:
                         out_dir = load
-                    self._test(nEpochs=1, epochSize=epochSize, saveStep=0, out_dir=out_dir, prediction_output=prediction_output, load_at=load_at, debug_predction=debug_predction)
+                    return self._test(nEpochs=1, epochSize=epochSize, saveStep=0, out_dir=out_dir, prediction_output=prediction_output, load_at=load_at, debug_predction=debug_predction)
 
     def _test(self, nEpochs = 1, epochSize = 1000, saveStep = 500, out_dir=None, prediction_output=None, load_at=-1, debug_predction=False):
             assert nEpochs == 1
@@ -450,7 +512,11 @@ class HourglassModel():
             with tf.name_scope('Train'):
                 self.generator = self.dataset._aux_generator(self.batchSize, self.nStack, normalize = True, sample_set = 'test')
                 startTime = time.time()
-                pred = self.output[:, self.nStack - 1]
+                if self._predictor is None:
+                    pred = self.output[:, self.nStack - 1]
+                    predict = lambda img_test: self.Session.run(pred, feed_dict = {self.img : img_test})
+                else:
+                    predict = self._predictor.predict
 
                 '''
                 Notes about profiling (on 1080 Ti, 16384 * 4 samples, '~' means ETA from progressbar):
@@ -477,7 +543,7 @@ class HourglassModel():
                         img_test, batch_uv, _ = next(self.generator)
                         if PROFILING2:
                             continue
-                        [test_y] = self.Session.run([pred], feed_dict = {self.img : img_test})
+                        test_y = predict(img_test)
                         # np.savez(f'debug-test/{i}', img_test=img_test, batch_uv=batch_uv, test_y=test_y)
                         if PROFILING:
                             continue # Profiling, check the % of time used by prediction
@@ -536,8 +602,10 @@ class HourglassModel():
                             '''
                     epochfinishTime = time.time()
                     print('Epoch ' + str(epoch) + '/' + str(nEpochs) + ' done in ' + str(int(epochfinishTime-epochstartTime)) + ' sec.' + ' -avg_time/batch: ' + str(((epochfinishTime-epochstartTime)/epochSize))[:4] + ' sec.')
+                stats = {'images': nEpochs * epochSize * self.batchSize,
+                         'seconds': time.time() - startTime}
                 if PROFILING or PROFILING2: # Explicit better than implicit (PROFILING2 implies PROFILING)
-                    return
+                    return stats
                 npz_fn = '{}/{}-atex.npz'.format(out_dir, self.dataset_name) if prediction_output is None else prediction_output
                 avgnpz_fn = '{}/{}-atex-avg.npz'.format(out_dir, self.dataset_name)
                 print('Testing Done. Saving files to\n{}'.format(npz_fn))
@@ -555,6 +623,7 @@ class HourglassModel():
                     imsave(png_fn, natex)
                     natex = atex/atex_count
                     imsave(avgpng_fn, natex)
+                return stats
 
     def record_training(self, record):
         """ Record Training Data and Export them in CSV file
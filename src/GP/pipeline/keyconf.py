@@ -27,12 +27,20 @@ from . import matio
 from . import atlas
 from . import texture_format
 from . import parse_ompl
+from . import renderer_pool
+from . import taskindex
+
+def _render_atlas2prim(r, flags):
+    import pyosr
+    r.render_mvrgbd(pyosr.Renderer.UV_MAPPINNG_RENDERING|flags)
+    atlas2prim = np.copy(r.mvpid.reshape((r.pbufferWidth, r.pbufferHeight)))
+    atlas2uv = np.copy(r.mvuv.reshape((r.pbufferWidth, r.pbufferHeight, 2)))
+    return atlas2prim, atlas2uv
 
 def _predict_atlas2prim(tup):
     import pyosr
     import hashlib
     ws, puzzle_fn, puzzle_name = tup
-    r = None
     puzzle, config = parse_ompl.parse_simple(puzzle_fn)
     for geo_type,flags,model_fn in zip(['rob', 'env'], [pyosr.Renderer.NO_SCENE_RENDERING, pyosr.Renderer.NO_ROBOT_RENDERING], [puzzle.rob_fn, puzzle.env_fn]):
         tgt_file = ws.local_ws(util.TESTING_DIR, puzzle_name, geo_type+'-a2p.npz')
@@ -46,24 +54,22 @@ def _predict_atlas2prim(tup):
                 continue
         except:
             pass
-        if r is None:
-            r = util.create_offscreen_renderer(puzzle_fn, ws.chart_resolution)
-            r.avi = False
-        r.render_mvrgbd(pyosr.Renderer.UV_MAPPINNG_RENDERING|flags)
-        atlas2prim = np.copy(r.mvpid.reshape((r.pbufferWidth, r.pbufferHeight)))
+        # One request at a time, a second worker would only set up the same renderer again
+        pool = renderer_pool.pool_for(ws, 1)
+        [(atlas2prim, atlas2uv)] = pool.apply(puzzle_fn, _render_atlas2prim, [(flags,)],
+                                              resolution=ws.chart_resolution, avi=False)
         #imsave(geo_type+'-a2p-nt.png', atlas2prim) # This is for debugging
         atlas2prim = texture_format.framebuffer_to_file(atlas2prim)
-        atlas2uv = np.copy(r.mvuv.reshape((r.pbufferWidth, r.pbufferHeight, 2)))
         atlas2uv = texture_format.framebuffer_to_file(atlas2uv)
         if new_sha is None:
-            np.savez(tgt_file,
-                     PRIM=atlas2prim,
-                     UV=atlas2uv)
+            matio.savez(tgt_file,
+                        PRIM=atlas2prim,
+                        UV=atlas2uv)
         else:
-            np.savez(tgt_file,
-                     PRIM=atlas2prim,
-                     UV=atlas2uv,
-                     MODEL_BLAKE2B=new_sha)
+            matio.savez(tgt_file,
+                        PRIM=atlas2prim,
+                        UV=atlas2uv,
+                        MODEL_BLAKE2B=new_sha)
         imsave(ws.local_ws(util.TESTING_DIR, puzzle_name, geo_type+'-a2p.png'), atlas2prim) # This is for debugging
 
 def generate_atlas2prim(args, ws):
@@ -89,7 +95,8 @@ def export_keyconf(ws, uw, puzzle_fn, puzzle_name, key_conf, FMT=util.UNSCREENED
     util.log("[predict_keyconf(worker)] save to key file {}".format(key_fn))
     unit_q = uw.translate_ompl_to_unit(ompl_q)
     # np.savez(key_fn, KEYQ_OMPL=ompl_q, KEYQ_UNIT=unit_q)
-    np.savez(key_fn, KEYQ_OMPL=ompl_q)
+    matio.savez(key_fn, KEYQ_OMPL=ompl_q)
+    ws.record_meta([key_fn])
     matio.savetxt(key_fn + 'unit.txt', unit_q)
     return key_fn
 
@@ -312,6 +319,7 @@ def estimate_keyconf_clearance(args, ws):
                 distances_batch.append(distances)
             ofn = ws.local_ws(rel_scratch_dir, 'clearance_batch-{}.npz'.format(task_id))
             np.savez(ofn, DISTANCE_BATCH=distances_batch)
+            taskindex.record(ofn, task_id)
     if args.task_id is not None:
         return
     if args.no_wait:
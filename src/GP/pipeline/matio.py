@@ -1,8 +1,11 @@
 import numpy as np
-from scipy.io import loadmat,savemat
 import pathlib
 import lzma
 import io
+import os
+import json
+
+from . import compress
 
 def _load_csv(fn):
     return np.loadtxt(fn, delimiter=',')
@@ -12,6 +15,7 @@ def _load_hdf5(fn):
     return h5py.File(fn, 'r')
 
 def _load_xz(fn):
+    compress.wait_for(fn)
     p = pathlib.PosixPath(fn)
     memfile = io.BytesIO(lzma.open(str(fn), 'r').read())
     nest_suffix = p.with_suffix('').suffix
@@ -20,6 +24,7 @@ def _load_xz(fn):
     return _SUFFIX_TO_LOADER[nest_suffix](memfile)
 
 def _loadmat(fn):
+    from scipy.io import loadmat
     return loadmat(fn, verify_compressed_data_integrity=False)
 
 _SUFFIX_TO_LOADER = {
@@ -71,16 +76,185 @@ Return
     the shape of the np.ndarray stored in the file[key].
     [None] if the file does not exist or the key is not in the file.
 """
-def load_safeshape(fn, key):
+def load_safeshape(fn, key, index=None):
     p = pathlib.PosixPath(fn)
     if not p.is_file():
         return [None]
+    meta = load_meta(fn, index=index)
+    if meta is not None:
+        if key not in meta['arrays']:
+            return [None]
+        return tuple(meta['arrays'][key]['shape'])
     # print(f'loadding {fn}')
     d = load(fn)
     if key not in d:
         return [None]
     return d[key].shape
 
+"""
+Sidecar metadata manifest
+
+Files written by savez() come with a small <fn>.meta.json describing the
+shapes and dtypes of all arrays, the values of scalar entries (counters like
+PF_LOG_MCHECK_N), and optional extra information from the writer.
+
+The manifest records the size and mtime (in nanoseconds) of the data file,
+and load_meta() ignores manifests that do not match the data file anymore.
+Whole seconds would miss a rewrite of the same size within one second.
+
+Copies made by rsync, tar or network filesystems keep the mtime with second
+or microsecond precision only. If the mtime of the data file has no digits
+below such a precision, the recorded one is truncated to it before comparing.
+"""
+META_SUFFIX = '.meta.json'
+
+def meta_file(fn):
+    return str(fn) + META_SUFFIX
+
+def describe(arrays):
+    shapes = {}
+    values = {}
+    for k, v in arrays.items():
+        a = np.asarray(v)
+        shapes[k] = {'shape': list(a.shape), 'dtype': a.dtype.str}
+        if a.ndim == 0 and a.dtype.kind in 'biuf':
+            values[k] = a.item()
+    return {'arrays': shapes, 'values': values}
+
+def _stat_signature(fn):
+    st = os.stat(fn)
+    return st.st_size, st.st_mtime_ns
+
+# Coarsest first
+_COPY_MTIME_PRECISIONS_NS = [10**9, 10**3]
+
+def _same_mtime(mtime_ns, recorded_ns):
+    if mtime_ns == recorded_ns:
+        return True
+    for precision in _COPY_MTIME_PRECISIONS_NS:
+        if mtime_ns % precision == 0:
+            return mtime_ns == recorded_ns - recorded_ns % precision
+    return False
+
+def write_meta(fn, arrays, extra=None):
+    return _write_manifest(fn, describe(arrays), extra)
+
+def _write_manifest(fn, meta, extra=None):
+    meta['size'], meta['mtime_ns'] = _stat_signature(fn)
+    if extra:
+        meta['extra'] = extra
+    mfn = meta_file(fn)
+    tmp = mfn + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, mfn)
+    return meta
+
+def load_meta(fn, index=None):
+    """
+    Return the manifest of fn, or None if there is no valid manifest.
+
+    index: optional dict from absolute paths to manifests (see
+           load_meta_index), consulted before the sidecar file.
+    """
+    fn = str(fn)
+    meta = None
+    if index is not None:
+        meta = index.get(os.path.abspath(fn), None)
+    if meta is None:
+        try:
+            with open(meta_file(fn), 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+    try:
+        size, mtime_ns = _stat_signature(fn)
+    except OSError:
+        return None
+    if size != meta.get('size') or not isinstance(meta.get('mtime_ns'), int):
+        return None
+    if not _same_mtime(mtime_ns, meta['mtime_ns']):
+        return None
+    return meta
+
+def load_value(fn, key, index=None):
+    """
+    Load a scalar entry, from the manifest if possible.
+    Raise KeyError if the key does not exist.
+    """
+    meta = load_meta(fn, index=index)
+    if meta is not None and key in meta['values']:
+        return meta['values'][key]
+    return load(fn)[key]
+
+def load_counters(fn, index=None, safe=False):
+    """
+    Return a mapping that contains at least the scalar entries of fn, which
+    is the manifest if possible, or the loaded file otherwise.
+
+    safe: return {} instead of raising exceptions if fn cannot be loaded
+    """
+    meta = load_meta(fn, index=index)
+    if meta is not None:
+        return meta['values']
+    if safe:
+        return safeopen(fn)
+    return load(fn)
+
+def savez(fn, compressed=False, extra=None, **arrays):
+    """
+    np.savez (or np.savez_compressed) and then write the manifest.
+    Return the manifest.
+    """
+    fn = str(fn)
+    if not fn.endswith('.npz'):
+        fn += '.npz'
+    if compressed:
+        np.savez_compressed(fn, **arrays)
+    else:
+        np.savez(fn, **arrays)
+    return write_meta(fn, arrays, extra=extra)
+
+"""
+Aggregated manifests, as a JSON dict from paths relative to base_dir to
+manifests. Paths are relative so archived workspaces can still use it.
+"""
+def load_meta_index(index_fn, base_dir):
+    try:
+        with open(index_fn, 'r') as f:
+            rel_index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {os.path.abspath(os.path.join(base_dir, k)): v for k, v in rel_index.items()}
+
+def update_meta_index(index_fn, base_dir, fns):
+    """
+    Add the manifests of fns into the index. Files without valid manifests
+    are skipped.
+    Return the number of manifests added.
+    """
+    import fcntl
+    os.makedirs(os.path.dirname(index_fn), exist_ok=True)
+    with open(index_fn + '.lock', 'w') as lockf:
+        fcntl.flock(lockf, fcntl.LOCK_EX)
+        try:
+            with open(index_fn, 'r') as f:
+                rel_index = json.load(f)
+        except (OSError, ValueError):
+            rel_index = {}
+        n = 0
+        for fn in fns:
+            meta = load_meta(fn)
+            if meta is None:
+                continue
+            rel_index[os.path.relpath(os.path.abspath(str(fn)), base_dir)] = meta
+            n += 1
+        tmp = index_fn + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(rel_index, f)
+        os.replace(tmp, index_fn)
+    return n
+
 '''
 hdf5_safefile:
     The only way to ensure its safety is to overwite.
@@ -103,6 +277,81 @@ def hdf5_open(f, path, shape, dtype, **kwds):
         del f[path]
     return f.create_dataset(path, shape=shape, dtype=dtype, **kwds)
 
+"""
+StreamWriter:
+    Write a 2D array of known shape chunk by chunk, so arrays larger than the
+    memory can be produced. The file is written to <fn>.tmp and renamed when
+    closed, and comes with the manifest like savez().
+
+    .npz: an uncompressed NPZ with a single array, which np.load reads as
+          usual. Other suffixes are treated as .npz, like savez().
+    .hdf5: a chunked HDF5 dataset
+"""
+class StreamWriter(object):
+    def __init__(self, fn, key, shape, dtype=np.float64, extra=None):
+        fn = str(fn)
+        self.hdf5 = fn.endswith('.hdf5')
+        if not self.hdf5 and not fn.endswith('.npz'):
+            fn += '.npz'
+        self.fn = fn
+        self.key = key
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.extra = extra
+        self.rows = 0
+        self._tmp = fn + '.tmp'
+        if self.hdf5:
+            import h5py
+            self._file = h5py.File(self._tmp, 'w')
+            self._ds = self._file.create_dataset(key, shape=self.shape, dtype=self.dtype, chunks=True)
+        else:
+            import zipfile
+            self._file = zipfile.ZipFile(self._tmp, 'w', allowZip64=True)
+            self._ds = self._file.open(key + '.npy', 'w', force_zip64=True)
+            header = {'descr': np.lib.format.dtype_to_descr(self.dtype),
+                      'fortran_order': False,
+                      'shape': self.shape}
+            np.lib.format.write_array_header_1_0(self._ds, header)
+
+    def write(self, chunk):
+        chunk = np.ascontiguousarray(chunk, dtype=self.dtype)
+        if chunk.shape[1:] != self.shape[1:] or self.rows + chunk.shape[0] > self.shape[0]:
+            raise ValueError("StreamWriter: chunk of shape {} does not fit in {} after {} rows".format(chunk.shape, self.shape, self.rows))
+        if self.hdf5:
+            self._ds[self.rows:self.rows + chunk.shape[0]] = chunk
+        else:
+            self._ds.write(chunk.tobytes())
+        self.rows += chunk.shape[0]
+
+    def close(self):
+        if self.rows != self.shape[0]:
+            self.abort()
+            raise ValueError("StreamWriter: {} rows written to {}, expecting {}".format(self.rows, self.fn, self.shape[0]))
+        if not self.hdf5:
+            self._ds.close()
+        self._file.close()
+        os.replace(self._tmp, self.fn)
+        meta = {'arrays': {self.key: {'shape': list(self.shape), 'dtype': self.dtype.str}}, 'values': {}}
+        return _write_manifest(self.fn, meta, extra=self.extra)
+
+    def abort(self):
+        try:
+            if not self.hdf5:
+                self._ds.close()
+            self._file.close()
+        finally:
+            if os.path.exists(self._tmp):
+                os.unlink(self._tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
 def savetxt(fn, a):
     np.savetxt(fn, a, fmt='%.17g')
 
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+pds_share.py -- one copy of a predefined sample set (PDS) per host
+
+`se3solver.py solve --samset` used to np.load the PDS, and the driver copied
+Q, QF, QB, QE and QEB into its own Eigen matrices. Hence every forest_rdt
+task on a many-core node held two private copies of a multi-gigabyte PDS.
+
+With --pds_share ([Solver] PDSShare, off by default), the first task on a host converts the .npz into one
+Fortran-ordered .npy file per array under <root>/osr-pds/<name>-<key>/
+(root defaults to /dev/shm, i.e. POSIX shared memory). All tasks map these
+files read-only, and hand them to the driver with set_sample_set_view & co,
+which keep references instead of copies. The page cache holds the only copy.
+
+The key hashes the path, size and mtime of the .npz, so a regenerated PDS
+gets a new directory. Conversions are guarded by lockf and published with a
+rename, hence concurrent tasks never see partial files. Entries survive the
+tasks until the next reboot, or until `se3solver.py pds_purge`.
+
+Note: tmpfs pages cannot be evicted, and /dev/shm of containers is often
+capped at 64 MB. Hence the free space of root is checked, and the files are
+allocated with posix_fallocate before being written through the map, which
+otherwise dies of SIGBUS on a full tmpfs. load raises OSError(ENOSPC) if
+the copy does not fit, and the caller falls back to np.load.
+'''
+
+import os
+import errno
+import shutil
+import zipfile
+import hashlib
+import tempfile
+import numpy as np
+
+SUBDIR = 'osr-pds'
+# Free space left in root after a conversion
+HEADROOM = 256 * 1024 * 1024
+# dtypes expected by OmplDriver
+ARRAYS = {
+    'Q': np.float64,
+    'QF': np.uint32,
+    'QB': np.int32,
+    'QE': np.int32,
+    'QEB': np.int32,
+}
+
+def default_root():
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+def solver_arguments(ws):
+    '''
+    Arguments of se3solver.py solve that share the PDS among the tasks of a
+    host, according to [Solver] PDSShare and PDSShareRoot
+    '''
+    if not ws.config.getboolean('Solver', 'PDSShare', fallback=False):
+        return []
+    ret = ['--pds_share']
+    root = ws.config.get('Solver', 'PDSShareRoot', fallback='')
+    if root:
+        ret += ['--pds_share_root', root]
+    return ret
+
+def cache_dir(samset, root=None):
+    root = default_root() if not root else root
+    st = os.stat(samset)
+    tag = '{}:{}:{}'.format(os.path.abspath(samset), st.st_size, st.st_mtime_ns)
+    key = hashlib.sha1(tag.encode()).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(samset))[0]
+    return os.path.join(root, SUBDIR, '{}-{}'.format(name, key))
+
+def required_bytes(samset):
+    '''
+    Size of the shared copy of samset, read from the .npy headers of the
+    .npz members without decompressing them.
+    '''
+    total = 0
+    with zipfile.ZipFile(samset) as z:
+        for name, dtype in ARRAYS.items():
+            member = name + '.npy'
+            if member not in z.namelist():
+                continue
+            with z.open(member) as f:
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, _, _ = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, _, _ = np.lib.format.read_array_header_2_0(f)
+            total += int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+    return total
+
+def _check_space(samset, root):
+    need = required_bytes(samset) + HEADROOM
+    st = os.statvfs(root)
+    avail = st.f_bavail * st.f_frsize
+    if avail < need:
+        raise OSError(errno.ENOSPC,
+                      'sharing {} needs {} bytes in {} but only {} are available'.format(samset, need, root, avail))
+
+def _convert(samset, outdir):
+    tmp = '{}.tmp-{}'.format(outdir, os.getpid())
+    os.makedirs(tmp)
+    try:
+        d = np.load(samset)
+        for name, dtype in ARRAYS.items():
+            if name not in d:
+                continue
+            # Decompress one array at a time
+            a = d[name]
+            fn = os.path.join(tmp, name + '.npy')
+            out = np.lib.format.open_memmap(fn, mode='w+',
+                                            dtype=dtype, shape=a.shape, fortran_order=True)
+            # open_memmap creates a sparse file, allocate it to get ENOSPC
+            # here rather than SIGBUS while writing
+            with open(fn, 'r+b') as f:
+                os.posix_fallocate(f.fileno(), 0, os.fstat(f.fileno()).st_size)
+            out[...] = a
+            out.flush()
+            del out, a
+        os.rename(tmp, outdir)
+    except:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+def load(samset, root=None):
+    '''
+    Arrays of the PDS file samset as read-only memory maps, converting it on
+    the first call of the host.
+
+    Raise OSError if the copy cannot be created, e.g. ENOSPC if root does
+    not have room for it.
+    '''
+    root = default_root() if not root else root
+    outdir = cache_dir(samset, root=root)
+    if not os.path.isdir(outdir):
+        import fcntl
+        from . import util
+        os.makedirs(os.path.dirname(outdir), exist_ok=True)
+        with open(outdir + '.lock', 'a') as flock:
+            fcntl.lockf(flock, fcntl.LOCK_EX)
+            try:
+                if not os.path.isdir(outdir):
+                    _check_space(samset, root)
+                    util.log('[pds_share] converting {} to {}'.format(samset, outdir))
+                    _convert(samset, outdir)
+            finally:
+                fcntl.lockf(flock, fcntl.LOCK_UN)
+    ret = {}
+    for name in ARRAYS:
+        fn = os.path.join(outdir, name + '.npy')
+        if os.path.isfile(fn):
+            ret[name] = np.load(fn, mmap_mode='r')
+    return ret
+
+def purge(root=None, keep=()):
+    '''
+    Remove the shared copies under root, except the ones of PDS files in
+    keep. Return the removed directories.
+
+    Note: running tasks keep their mappings, the memory is released when
+    they exit.
+    '''
+    root = default_root() if not root else root
+    topdir = os.path.join(root, SUBDIR)
+    if not os.path.isdir(topdir):
+        return []
+    kept = set([os.path.basename(cache_dir(fn, root=root)) for fn in keep])
+    removed = []
+    for entry in sorted(os.listdir(topdir)):
+        path = os.path.join(topdir, entry)
+        if entry in kept or entry.endswith('.lock'):
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(path)
+    return removed
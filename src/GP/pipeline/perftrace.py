@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+perftrace.py -- structured performance trace
+
+Spans are appended to performance_log/trace.<trial>.jsonl of the workspace,
+one JSON object per line. Two kinds of records are written:
+
+    {"ph": "B", ...}: the span is started, written so that spans interrupted
+                      by crashes are still visible.
+    {"ph": "X", ...}: the span is completed, with all measurements.
+
+Fields of a completed span:
+    id, parent: span id and the id of the enclosing span (None at top level)
+    cat: 'stage' for pipeline stages, 'step' for their sub-steps
+    name, puzzle, trial, host, pid, attrs
+    wall_start, wall_end: UNIX time
+    mono_start, mono_end: time.monotonic() of this process
+    duration: seconds, measured by the monotonic clock
+    cpu_time: user + system time of this process and its reaped children
+    maxrss_lifetime: peak resident set size in KiB of this process or its
+                     children since they started, NOT the peak within the
+                     span (getrusage cannot tell). Older traces call it maxrss.
+    read_bytes, write_bytes: block I/O of this process and reaped children
+
+Pipeline stages are recorded by Workspace.timekeeper_start/finish. Sub-steps
+(Condor waves, rsync, ...) use span() from this module, which records into
+the tracer of the active workspace and is a no-op if there is none.
+
+Use export_chrome() (or `facade.py stats trace`) to convert trace files to
+the Chrome trace format, which can be loaded by chrome://tracing or Perfetto.
+'''
+
+import os
+import json
+import time
+import socket
+import itertools
+import contextlib
+from collections import OrderedDict
+try:
+    import resource
+except ImportError:
+    resource = None
+
+TRACE_FMT = 'trace.{}.jsonl'
+
+_HOST = socket.gethostname()
+
+def _rusage():
+    if resource is None:
+        return 0.0, 0, 0, 0
+    s = resource.getrusage(resource.RUSAGE_SELF)
+    c = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = s.ru_utime + s.ru_stime + c.ru_utime + c.ru_stime
+    maxrss = max(s.ru_maxrss, c.ru_maxrss)
+    # ru_inblock/ru_oublock are in 512-byte units
+    read_bytes = (s.ru_inblock + c.ru_inblock) * 512
+    write_bytes = (s.ru_oublock + c.ru_oublock) * 512
+    return cpu, maxrss, read_bytes, write_bytes
+
+class Tracer(object):
+    def __init__(self, fn, trial=None):
+        self.fn = fn
+        self.trial = trial
+        self._ids = itertools.count()
+        self._stack = []
+
+    def _write(self, rec):
+        os.makedirs(os.path.dirname(self.fn), exist_ok=True)
+        line = json.dumps(rec, default=str) + '\n'
+        # Single write() with O_APPEND, so concurrent writers do not interleave
+        fd = os.open(self.fn, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode('utf-8'))
+        finally:
+            os.close(fd)
+
+    def start(self, name, puzzle='*', cat='stage', **attrs):
+        cpu, _, read_bytes, write_bytes = _rusage()
+        span = {
+            'id': '{}:{}:{}'.format(_HOST, os.getpid(), next(self._ids)),
+            'parent': self._stack[-1]['id'] if self._stack else None,
+            'cat': cat,
+            'name': name,
+            'puzzle': puzzle,
+            'trial': self.trial,
+            'host': _HOST,
+            'pid': os.getpid(),
+            'attrs': attrs,
+            'wall_start': time.time(),
+            'mono_start': time.monotonic(),
+        }
+        self._stack.append(span)
+        self._write(dict(span, ph='B'))
+        span['_base'] = (cpu, read_bytes, write_bytes)
+        return span
+
+    def finish(self, name, puzzle='*', **attrs):
+        '''
+        Finish the innermost span with the given name and puzzle.
+        Spans started after it (but not finished) are finished as well.
+        '''
+        for depth in range(len(self._stack) - 1, -1, -1):
+            span = self._stack[depth]
+            if span['name'] == name and span['puzzle'] == puzzle:
+                break
+        else:
+            return None
+        while len(self._stack) > depth:
+            span = self._stack.pop()
+            if len(self._stack) == depth:
+                span['attrs'].update(attrs)
+            self._complete(span)
+        return span
+
+    def _complete(self, span):
+        cpu, maxrss, read_bytes, write_bytes = _rusage()
+        base_cpu, base_read, base_write = span.pop('_base')
+        span['wall_end'] = time.time()
+        span['mono_end'] = time.monotonic()
+        span['duration'] = span['mono_end'] - span['mono_start']
+        span['cpu_time'] = cpu - base_cpu
+        span['maxrss_lifetime'] = maxrss
+        span['read_bytes'] = read_bytes - base_read
+        span['write_bytes'] = write_bytes - base_write
+        self._write(dict(span, ph='X'))
+
+    def current_id(self):
+        return self._stack[-1]['id'] if self._stack else None
+
+    def event(self, name, wall_start, duration, parent=None, puzzle='*', cat='step', **attrs):
+        '''
+        Record a span measured elsewhere, e.g. in a background thread, where
+        the start/finish stack of this tracer cannot be used.
+        cpu_time and I/O counters are not available for such spans.
+        '''
+        rec = {
+            'id': '{}:{}:{}'.format(_HOST, os.getpid(), next(self._ids)),
+            'parent': parent,
+            'cat': cat,
+            'name': name,
+            'puzzle': puzzle,
+            'trial': self.trial,
+            'host': _HOST,
+            'pid': os.getpid(),
+            'attrs': attrs,
+            'wall_start': wall_start,
+            'wall_end': wall_start + duration,
+            'duration': duration,
+        }
+        self._write(dict(rec, ph='X'))
+
+    @contextlib.contextmanager
+    def span(self, name, puzzle='*', cat='step', **attrs):
+        self.start(name, puzzle, cat, **attrs)
+        try:
+            yield
+        finally:
+            self.finish(name, puzzle)
+
+_active = None
+
+def activate(tracer):
+    global _active
+    _active = tracer
+
+def active():
+    return _active
+
+@contextlib.contextmanager
+def span(name, puzzle='*', **attrs):
+    '''
+    Record a nested span in the active tracer, if any.
+    '''
+    tracer = _active
+    if tracer is None:
+        yield
+        return
+    with tracer.span(name, puzzle, **attrs):
+        yield
+
+def load(fn):
+    '''
+    Return completed spans in fn, ordered by the start time.
+    Spans that were started but never completed are returned with
+    duration = None.
+    '''
+    done = {}
+    started = {}
+    with open(fn, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                # Truncated by a crash
+                continue
+            if rec.get('ph') == 'X':
+                done[rec['id']] = rec
+            elif rec.get('ph') == 'B':
+                started[rec['id']] = rec
+    for sid, rec in started.items():
+        if sid not in done:
+            done[sid] = dict(rec, duration=None)
+    return sorted(done.values(), key=lambda rec: rec['wall_start'])
+
+def stage_costs(fn, single_puzzle=None, cat='stage'):
+    '''
+    Return {puzzle name: OrderedDict(stage name: seconds)}, from completed
+    spans of category cat (None for all).
+    Later spans of the same name overwrite earlier ones, like the legacy
+    parser of performance_log/log.<trial> does.
+    '''
+    ret = {}
+    for rec in load(fn):
+        if rec['duration'] is None:
+            continue
+        if cat is not None and rec.get('cat') != cat:
+            continue
+        puzzle = rec['puzzle']
+        if single_puzzle is not None and puzzle == '*':
+            puzzle = single_puzzle
+        ret.setdefault(puzzle, OrderedDict())[rec['name']] = rec['duration']
+    return ret
+
+def export_chrome(fns, out_fn):
+    '''
+    Convert trace files to the Chrome trace event format.
+    '''
+    events = []
+    processes = {}
+    for fn in fns:
+        for rec in load(fn):
+            args = dict(rec['attrs'])
+            args.update({k: rec[k] for k in ['puzzle', 'trial', 'cpu_time', 'maxrss_lifetime', 'maxrss',
+                                             'read_bytes', 'write_bytes'] if k in rec})
+            processes[rec['pid']] = '{}:{}'.format(rec['host'], rec['pid'])
+            ev = {
+                'name': rec['name'],
+                'cat': rec.get('cat', 'stage'),
+                'pid': rec['pid'],
+                'tid': rec['pid'],
+                'ts': rec['wall_start'] * 1e6,
+                'args': args,
+            }
+            if rec['duration'] is None:
+                ev['ph'] = 'B'
+            else:
+                ev['ph'] = 'X'
+                ev['dur'] = rec['duration'] * 1e6
+            events.append(ev)
+    for pid, pname in processes.items():
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': pid,
+                       'args': {'name': pname}})
+    with open(out_fn, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    return len(events)
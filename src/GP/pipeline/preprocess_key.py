@@ -18,6 +18,7 @@ from . import partt
 from . import touchq_util
 from . import parse_ompl
 from . import condor
+from . import telemetry
 
 hdf5_overwrite = matio.hdf5_overwrite
 
@@ -49,7 +50,7 @@ def find_trajectory(args, ws):
     condor_args = [se3solver_path,
                    'solve', ws.training_puzzle,
                    '--cdres', config.getfloat('problem', 'collision_resolution', fallback=0.0001),
-                   '--trajectory_out', '{}/traj_$(Process).npz'.format(scratch_dir),
+                   '--trajectory_out', '{}/traj_$(Process).npz'.format(scratch_dir)] + telemetry.solver_arguments(ws) + [
                    ws.config.get('TrainingTrajectory', 'PlannerAlgorithmID'),
                    ws.config.get('TrainingTrajectory', 'CondorTimeThreshold'),
                    ]
@@ -101,7 +102,7 @@ def interpolate_trajectory(args, ws):
     util.log('[interpolate_trajectory] saving the interpolation results to {}'.format(candidate_file))
     #np.savez(candidate_file, OMPL_CANDIDATES=Qs)
     f.close()
-    util.xz(candidate_file)
+    ws.xz(candidate_file, 'interpolate_trajectory')
 
 
 '''
@@ -190,7 +191,7 @@ def estimate_clearance_volume(args, ws):
                      TOUCH_TAU=touch_tau)
             '''
         f.close()
-        util.xz(out_fn)
+        ws.xz(out_fn, 'estimate_clearance_volume')
 
 def pickup_key_configuration_old(args, ws):
     import pyosr
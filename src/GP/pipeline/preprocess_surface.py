@@ -6,6 +6,9 @@ from os.path import join
 import os
 import subprocess
 import pathlib
+import json
+import shutil
+import time
 import numpy as np
 from imageio import imwrite as imsave
 import h5py
@@ -23,6 +26,8 @@ from . import matio
 from . import partt
 from . import touchq_util
 from . import texture_format
+from . import renderer_pool
+from . import atlas_kernels
 
 hdf5_overwrite = matio.hdf5_overwrite
 
@@ -31,6 +36,7 @@ hdf5_overwrite = matio.hdf5_overwrite
 _TOUCH_SCRATCH = util.PREP_TOUCH_SCRATCH
 _ISECT_SCRATCH = util.PREP_ISECT_SCRATCH
 _UVPROJ_SCRATCH = util.UV_DIR
+_UVRENDER_SCRATCH = join(util.CONDOR_SCRATCH, 'training_key_uvrender')
 
 def _get_keys(ws):
     key_fn = ws.local_ws(util.KEY_FILE)
@@ -112,6 +118,29 @@ def group_touch(args, ws):
     util.log("Merge touchq_batch files into {}".format(fn_out))
 
 
+def _isect_total_chunks(ws, task_shape):
+    return partt.guess_chunk_number(task_shape,
+            ws.config.getint('SYSTEM', 'CondorQuota') * 6,
+            ws.config.getint('TrainingWeightChart', 'MeshBoolGranularity'))
+
+def _fused_uvproject(ws):
+    return ws.config.getboolean('TrainingWeightChart', 'FusedUVProject', fallback=False)
+
+def _isect_batch_size(ws):
+    return ws.config.getint('TrainingWeightChart', 'MeshBoolBatch', fallback=64)
+
+def _batched_isect_geometry(uw, touch_v, sindices, batch_size):
+    '''
+    Yield (si, V, F) of the intersecting geometries of touch_v[si], computed
+    batch_size states at a time with UnitWorld.intersecting_geometry_batch
+    '''
+    sindices = list(sindices)
+    for begin in progressbar(range(0, len(sindices), batch_size)):
+        batch = sindices[begin:begin+batch_size]
+        V, F, voff, foff = uw.intersecting_geometry_batch(touch_v[batch], True)
+        for i, si in enumerate(batch):
+            yield si, V[voff[i]:voff[i+1]], F[foff[i]:foff[i+1]]
+
 def isect_geometry(args, ws):
     '''
     Mostly copied from sample_touch()
@@ -128,9 +157,7 @@ def isect_geometry(args, ws):
     touch_n = touch_v.shape[0]
     task_shape = (touch_n)
     util.log("[isect_geometry] Task shape {}".format(task_shape))
-    total_chunks = partt.guess_chunk_number(task_shape,
-            ws.config.getint('SYSTEM', 'CondorQuota') * 6,
-            ws.config.getint('TrainingWeightChart', 'MeshBoolGranularity'))
+    total_chunks = _isect_total_chunks(ws, task_shape)
     if total_chunks > 1 and args.task_id is None:
         # Submit a Condor job
         condor_args = ['facade.py',
@@ -158,11 +185,9 @@ def isect_geometry(args, ws):
         cache_tqs = touch_v
         cache_from = tq_dic['FROM_V']
         cache_fromi = tq_dic['FROM_VI']
-        for index, (si,) in enumerate(progressbar(tindices)):
-            if cache_inf[si]:
-                continue
+        sindices = [si for (si,) in tindices if not cache_inf[si]]
+        for si, V, F in _batched_isect_geometry(uw, cache_tqs, sindices, _isect_batch_size(ws)):
             tq = cache_tqs[si]
-            V, F = uw.intersecting_geometry(tq, True)
             index_id_str = util.padded(si, touch_n)
             hdf5_overwrite(f, '{}/V'.format(index_id_str), V)
             hdf5_overwrite(f, '{}/F'.format(index_id_str), F)
@@ -170,9 +195,8 @@ def isect_geometry(args, ws):
             hdf5_overwrite(f, '{}/from'.format(index_id_str), cache_from[si])
             hdf5_overwrite(f, '{}/fromi'.format(index_id_str), cache_fromi[si])
         f.close()
-        util.log('[isect_geometry] geometries written to {}.xz'.format(fn))
-        util.xz(fn)
-        util.log('[isect_geometry] geometries compressed as {}.xz'.format(fn))
+        util.log('[isect_geometry] geometries written to {}'.format(fn))
+        ws.xz(fn, 'isect_geometry')
 
 
 def uvproject(args, ws):
@@ -186,9 +210,7 @@ def uvproject(args, ws):
     touch_n = touch_v.shape[0]
     # Same task partition as isect_geometry
     task_shape = (touch_n)
-    total_chunks = partt.guess_chunk_number(task_shape,
-            ws.config.getint('SYSTEM', 'CondorQuota') * 6,
-            ws.config.getint('TrainingWeightChart', 'MeshBoolGranularity'))
+    total_chunks = _isect_total_chunks(ws, task_shape)
     fn_list = sorted(pathlib.Path(prev_scratch_dir).glob('isect_batch-*.hdf5.xz'))
     if total_chunks > 1 and args.task_id is None:
         # Submit a Condor job
@@ -236,30 +258,160 @@ def uvproject(args, ws):
             hdf5_overwrite(f, gpn+'fromi', fromi)
         f.close()
         util.log('[uvproject] projection data written to {}'.format(ofn))
-        util.xz(ofn)
-        util.log('[uvproject] data file {} compresses as {}.xz'.format(ofn, ofn))
+        ws.xz(ofn, 'uvproject')
+
+def isect_uvproject(args, ws):
+    '''
+    Fused isect_geometry and uvproject.
+
+    The intersecting geometry is projected to the UV space in the same worker
+    right after it is computed, so only the compact uv_batch-*.hdf5 files are
+    written. Intersection meshes are kept in isect_batch-*.hdf5 only if
+    --keep_isect is given (for debugging).
+
+    Uses the same task partition as isect_geometry, hence uvrender cannot tell
+    the difference.
+    '''
+    isect_scratch_dir = ws.local_ws(_ISECT_SCRATCH)
+    scratch_dir = ws.local_ws(_UVPROJ_SCRATCH)
+    if args.only_wait:
+        condor.local_wait(scratch_dir)
+        return
+    tq_dic = np.load(ws.local_ws(_TOUCH_SCRATCH, 'touchq_all.npz'))
+    touch_v = tq_dic['TOUCH_V']
+    touch_n = touch_v.shape[0]
+    task_shape = (touch_n)
+    total_chunks = _isect_total_chunks(ws, task_shape)
+    util.log("[isect_uvproject] Task shape {} total_chunks {}".format(task_shape, total_chunks))
+    if total_chunks > 1 and args.task_id is None:
+        # Submit a Condor job
+        condor_args = ['facade.py',
+                       'preprocess_surface',
+                       '--stage',
+                       'isect_uvproject',
+                       '--task_id',
+                       '$(Process)']
+        if args.keep_isect:
+            condor_args.append('--keep_isect')
+        condor_args.append(ws.local_ws())
+        condor.local_submit(ws,
+                            util.PYTHON,
+                            iodir_rel=_UVPROJ_SCRATCH,
+                            arguments=condor_args,
+                            instances=total_chunks,
+                            wait=True)
+    else:
+        os.makedirs(scratch_dir, exist_ok=True)
+        uw = util.create_unit_world(ws.local_ws(util.TRAINING_DIR, util.PUZZLE_CFG_FILE))
+        task_id = 0 if total_chunks == 1 else args.task_id
+        tindices = partt.get_task_chunk(task_shape, total_chunks, task_id)
+        task_id_str = util.padded(task_id, total_chunks)
+        ofn = join(scratch_dir, 'uv_batch-{}.hdf5'.format(task_id_str))
+        f = matio.hdf5_safefile(ofn)
+        if args.keep_isect:
+            os.makedirs(isect_scratch_dir, exist_ok=True)
+            ifn = join(isect_scratch_dir, 'isect_batch-{}.hdf5'.format(task_id_str))
+            fi = matio.hdf5_safefile(ifn)
+        else:
+            fi = None
+        cache_inf = tq_dic['IS_INF']
+        cache_from = tq_dic['FROM_V']
+        cache_fromi = tq_dic['FROM_VI']
+        t_start = time.time()
+        nproj = 0
+        sindices = [si for (si,) in tindices if not cache_inf[si]]
+        for si, V, F in _batched_isect_geometry(uw, touch_v, sindices, _isect_batch_size(ws)):
+            tq = touch_v[si]
+            gpn = '{}/'.format(util.padded(si, touch_n))
+            if fi is not None:
+                hdf5_overwrite(fi, gpn+'V', V)
+                hdf5_overwrite(fi, gpn+'F', F)
+                hdf5_overwrite(fi, gpn+'tq', tq)
+                hdf5_overwrite(fi, gpn+'from', cache_from[si])
+                hdf5_overwrite(fi, gpn+'fromi', cache_fromi[si])
+            IF, IBV = uw.intersecting_to_robot_surface(tq, True, V, F)
+            hdf5_overwrite(f, gpn+'V.rob', IBV)
+            hdf5_overwrite(f, gpn+'F.rob', IF)
+            IF, IBV = uw.intersecting_to_model_surface(tq, True, V, F)
+            hdf5_overwrite(f, gpn+'V.env', IBV)
+            hdf5_overwrite(f, gpn+'F.env', IF)
+            hdf5_overwrite(f, gpn+'tq', tq)
+            hdf5_overwrite(f, gpn+'fromi', cache_fromi[si])
+            nproj += 1
+        f.close()
+        util.log('[isect_uvproject] {} projections in {:.3f} sec., written to {}'.format(
+                 nproj, time.time() - t_start, ofn))
+        ws.xz(ofn, 'isect_uvproject')
+        if fi is not None:
+            fi.close()
+            ws.xz(ifn, 'isect_uvproject')
+            util.log('[isect_uvproject] intersection meshes kept as {}.xz'.format(ifn))
 
 # DUMMY = True
 DUMMY = False
 
-def _uvrender_worker(uv_args):
+def _uvrender_accumulate(afb, afb_uw, w, uniform_weight):
+    if w is None:
+        return afb, afb_uw
+    if afb is None:
+        return np.copy(w), np.copy(uniform_weight)
+    afb += w
+    afb_uw += uniform_weight
+    np.clip(afb_uw, 0, 1.0, out=afb_uw) # afb_uw is supposed to be binary
+    return afb, afb_uw
+
+def _uvrender_add(afb, afb_uw, fb, uniform_weight):
+    if afb is None:
+        return fb, uniform_weight
+    afb += fb
+    afb_uw += uniform_weight
+    afb_uw[np.nonzero(afb_uw)] = 1.0
+    return afb, afb_uw
+
+def _uvrender_load_partial(fn):
+    if not os.path.isfile(fn):
+        return None, None, 0
+    d = np.load(fn)
+    if 'WEIGHTED' not in d:
+        return None, None, int(d['DONE'])
+    return d['WEIGHTED'], d['UNIFORM_WEIGHTED'], int(d['DONE'])
+
+def _uvrender_save_partial(fn, afb, afb_uw, done):
+    # Write-then-rename, a killed job never leaves a truncated checkpoint
+    tmp = fn + '.tmp.npz'
+    if afb is None:
+        np.savez(tmp, DONE=done)
+    else:
+        np.savez(tmp, WEIGHTED=afb, UNIFORM_WEIGHTED=afb_uw, DONE=done)
+    os.replace(tmp, fn)
+
+"""
+Render the uvproject output files in uvproj_list into the chart of rname.
+
+The accumulated textures are checkpointed to ckpt_fn after each file, and
+the worker resumes from the first unfinished file if ckpt_fn exists.
+
+Return the checkpoint file, number of rendered faces, and the time used.
+"""
+def _uvrender_worker(r, args_dir, uvproj_list, rname, ckpt_fn):
     import pyosr
-    args_dir, uvproj_list, rname = uv_args
     ws = util.Workspace(args_dir)
-    r = util.create_offscreen_renderer(ws.local_ws(util.TRAINING_DIR, util.PUZZLE_CFG_FILE))
     TYPE_TO_FLAG = {'rob' : r.BARY_RENDERING_ROBOT,
                     'env' : r.BARY_RENDERING_SCENE }
     keys = _get_keys(ws)
     rflag = TYPE_TO_FLAG[rname]
     chart_resolution = np.array([ws.chart_resolution, ws.chart_resolution], dtype=np.int32)
-    afb = None
-    afb_uw = None # Uniform weight
-    util.log('[uvrender_worker] rendering {} {}'.format(rname, uvproj_list))
-    for fn in progressbar(uvproj_list):
+    afb, afb_uw, done = _uvrender_load_partial(ckpt_fn)
+    if done > 0:
+        util.log('[uvrender_worker] resuming {} from {}, {} of {} files finished'.format(rname, ckpt_fn, done, len(uvproj_list)))
+    util.log('[uvrender_worker] rendering {} {}'.format(rname, uvproj_list[done:]))
+    t_start = time.time()
+    nface = 0
+    for fn in progressbar(uvproj_list[done:]):
+        done += 1
         if DUMMY:
             continue
         f = matio.load(fn)
-        i = 0
         buffed = 0
         try:
             for grn, grp in f.items():
@@ -271,78 +423,103 @@ def _uvrender_worker(uv_args):
                 w = 1.0 / distance
                 r.add_barycentric(IF, IBV, rflag, w)
                 buffed += IF.shape[0]
+                nface += IF.shape[0]
                 # util.log("Buffered {}".format(buffed))
                 if buffed > 32 * 1024:
                     fb = r.render_barycentric(rflag, chart_resolution, svg_fn='')
                     fb = texture_format.texture_to_file(fb)
                     uniform_weight = fb.astype(np.float32)
-                    if afb is None:
-                        afb = fb
-                        afb_uw = uniform_weight
-                    else:
-                        afb += fb
-                        afb_uw += uniform_weight
-                        afb_uw[np.nonzero(afb_uw)] = 1.0
+                    afb, afb_uw = _uvrender_add(afb, afb_uw, fb, uniform_weight)
                     r.clear_barycentric(rflag)
                     buffed = 0
-                '''
-                if i > 16:
-                    break
-                i += 1
-                '''
         except RuntimeError as e:
             util.warn("Cannot access file {}".format(fn))
-        # break
         if buffed > 0:
             fb = r.render_barycentric(rflag, chart_resolution, svg_fn='')
             uniform_weight = texture_format.texture_to_file(fb.astype(np.float32))
-            if afb is None:
-                afb = fb
-                afb_uw = uniform_weight
-            else:
-                afb += fb
-                afb_uw += uniform_weight
-                afb_uw[np.nonzero(afb_uw)] = 1.0
-    ret = {}
-    ret[rname] = (afb, afb_uw)
-    return ret
+            afb, afb_uw = _uvrender_add(afb, afb_uw, fb, uniform_weight)
+            # The renderer is reused by later requests of the pool
+            r.clear_barycentric(rflag)
+        _uvrender_save_partial(ckpt_fn, afb, afb_uw, done)
+    elapsed = time.time() - t_start
+    if elapsed > 0:
+        util.log('[uvrender_worker] {}: {} faces in {:.2f} sec. ({:.1f} faces/s)'.format(rname, nface, elapsed, nface / elapsed))
+    return ckpt_fn, nface, elapsed
+
+def _uvrender_merge(r, fn0, fn1, out_fn):
+    afb, afb_uw, _ = _uvrender_load_partial(fn0)
+    w, uniform_weight, _ = _uvrender_load_partial(fn1)
+    afb, afb_uw = _uvrender_accumulate(afb, afb_uw, w, uniform_weight)
+    _uvrender_save_partial(out_fn, afb, afb_uw, 0)
+    return out_fn
+
+def _uvrender_reduce(mapper, fns, prefix):
+    """
+    Pairwise reduction tree over partial textures stored on disk,
+    so the parent never holds more than the final texture.
+    """
+    level = 0
+    while len(fns) > 1:
+        pairs = [(fns[i], fns[i+1], '{}-reduce{}-{}.npz'.format(prefix, level, i // 2)) for i in range(0, len(fns) - 1, 2)]
+        merged = mapper(_uvrender_merge, pairs)
+        if len(fns) % 2 == 1:
+            merged.append(fns[-1])
+        fns = merged
+        level += 1
+    return fns[0]
 
 def uvrender(args, ws):
     uvproj_dir = pathlib.Path(ws.local_ws(_UVPROJ_SCRATCH))
-    uvproj_list = sorted(list(uvproj_dir.glob('uv_batch-*.hdf5')) + list(uvproj_dir.glob('uv_batch-*.hdf5.xz')))
-    ncpu = os.cpu_count()
-    pgpu = multiprocessing.Pool(processes=4)
-
-    uv_chunks = partt.chunk_it(uvproj_list, ncpu)
-    uv_args = [(ws.local_ws(), chunk, 'rob') for chunk in uv_chunks]
-    uv_args +=[(ws.local_ws(), chunk, 'env') for chunk in uv_chunks]
-    util.log('[uvrender] uv_args {}'.format(uv_args))
+    uvproj_list = sorted([str(p) for p in list(uvproj_dir.glob('uv_batch-*.hdf5')) + list(uvproj_dir.glob('uv_batch-*.hdf5.xz'))])
+    puzzle_fn = ws.local_ws(util.TRAINING_DIR, util.PUZZLE_CFG_FILE)
     # USE_MP = False
     USE_MP = True
     if USE_MP:
-        tup_list = pgpu.map(_uvrender_worker, uv_args)
+        pool = renderer_pool.pool_for(ws, len(uvproj_list))
+        mapper = lambda func, args_list: pool.apply(puzzle_fn, func, args_list)
+        nchunk = pool.processes
     else:
-        tup_list = []
-        for a in uv_args:
-            tup_list.append(_uvrender_worker(a))
-    # util.log('[tup_list] {}'.format(tup_list))
+        r = util.create_offscreen_renderer(puzzle_fn)
+        mapper = lambda func, args_list: [func(r, *a) for a in args_list]
+        nchunk = 1
+
+    """
+    Checkpoints are only valid for the same list of input files and the same partition.
+    """
+    ckpt_dir = ws.local_ws(_UVRENDER_SCRATCH)
+    manifest_fn = join(ckpt_dir, 'manifest.json')
+    manifest = None
+    if os.path.isfile(manifest_fn):
+        with open(manifest_fn, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('files') != uvproj_list:
+            util.warn('[uvrender] input files changed, discarding checkpoints under {}'.format(ckpt_dir))
+            manifest = None
+        else:
+            nchunk = manifest['chunks']
+            util.log('[uvrender] resuming from checkpoints under {}'.format(ckpt_dir))
+    if manifest is None:
+        shutil.rmtree(ckpt_dir, ignore_errors=True)
+        os.makedirs(ckpt_dir)
+        with open(manifest_fn, 'w') as f:
+            json.dump({'files': uvproj_list, 'chunks': nchunk}, f)
+    nchunk = max(1, min(nchunk, len(uvproj_list)))
+    uv_chunks = partt.chunk_it(uvproj_list, nchunk)
+    uv_args = []
     for rname in ['rob', 'env']:
-        afb = None
-        afb_uw = None # Uniform weight
-        for dent in tup_list:
-            if rname not in dent:
-                continue
-            w, uniform_weight = dent[rname]
-            if w is None or uniform_weight is None:
-                continue
-            # util.warn('[uvrender] w {} uniform_weight {}'.format(w.shape, uniform_weight.shape))
-            if afb is None:
-                afb = w
-                afb_uw = uniform_weight
-            else:
-                afb += w
-                afb_uw += uniform_weight
-                np.clip(afb_uw, 0, 1.0, out=afb_uw) # afb_uw is supposed to be binary
+        uv_args += [(ws.local_ws(), chunk, rname, join(ckpt_dir, '{}-chunk{}.npz'.format(rname, i))) for i, chunk in enumerate(uv_chunks)]
+    util.log('[uvrender] uv_args {}'.format(uv_args))
+    t_start = time.time()
+    tup_list = mapper(_uvrender_worker, uv_args)
+    elapsed = time.time() - t_start
+    nface = sum([tup[1] for tup in tup_list])
+    util.ack('[uvrender] {} faces rendered in {:.2f} sec. ({:.1f} faces/s)'.format(nface, elapsed, nface / elapsed if elapsed > 0 else 0.0))
+    partials = {'rob': [], 'env': []}
+    for a, (ckpt_fn, _, _) in zip(uv_args, tup_list):
+        partials[a[2]].append(ckpt_fn)
+    for rname in ['rob', 'env']:
+        final_fn = _uvrender_reduce(mapper, partials[rname], join(ckpt_dir, rname))
+        afb, afb_uw, _ = _uvrender_load_partial(final_fn)
         chart_fn = ws.local_ws(util.TRAINING_DIR, '{}_chart.npz'.format(rname))
         if not DUMMY:
             np.savez(chart_fn,
@@ -361,6 +538,9 @@ def uvrender(args, ws):
             rgb[...,1] = afb_uw
             imsave(ws.local_ws(util.TRAINING_DIR, '{}_chart_uniform_weight.png'.format(rname)), rgb)
         util.ack('[uvrender] {} rendered'.format(chart_fn))
+    if USE_MP:
+        pool.report()
+    shutil.rmtree(ckpt_dir, ignore_errors=True)
 
 def _debug_uvrender(args, ws):
     import pyosr
@@ -401,16 +581,13 @@ def screen_weight(args, ws):
         img = d['WEIGHTED'] # Unlike condor_touch_configuration, we only have one file here
         LOOPS = 2 # Emperical number
         for i in range(LOOPS):
-            nzi = np.nonzero(img)
-            print("[screen_weight] geo {} loop {}: nz count {}".format(geo_type, i, len(nzi[0])))
-            nz = img[nzi]
-            m = np.mean(nz)
-            img[img < m] = 0.0
+            print("[screen_weight] geo {} loop {}: nz count {}".format(geo_type, i, np.count_nonzero(img)))
+            atlas_kernels.screen(img, threshold='mean')
             print("[screen_weight] geo {} loop {}: sum {}".format(geo_type, i+1, np.sum(img)))
         rgb = np.zeros(list(img.shape) + [3])
         rgb[...,1] = img
         imsave(ws.local_ws(util.TRAINING_DIR, '{}_chart_screened.png'.format(geo_type)), rgb)
-        rgb[np.nonzero(rgb)] = 1.0
+        rgb[rgb != 0] = 1.0
         fn = ws.local_ws(util.TRAINING_DIR, '{}_chart_screened_uniform.png'.format(geo_type))
         imsave(fn, rgb)
         '''
@@ -427,6 +604,7 @@ function_dict = {
         'group_touch' : group_touch,
         'isect_geometry' : isect_geometry,
         'uvproject' : uvproject,
+        'isect_uvproject' : isect_uvproject,
         'uvrender' : uvrender,
         'screen_weight' : screen_weight,
         '_debug_uvrender' : _debug_uvrender,
@@ -443,6 +621,7 @@ def setup_parser(subparsers):
                    metavar='')
     p.add_argument('--only_wait', action='store_true')
     p.add_argument('--task_id', help='Feed $(Process) from HTCondor', type=int, default=None)
+    p.add_argument('--keep_isect', help='isect_uvproject: also keep the intersection meshes (for debugging)', action='store_true')
     util.set_common_arguments(p)
 
 
@@ -466,9 +645,15 @@ def remote_group_touch(ws):
     _remote_command(ws, 'group_touch')
 
 def remote_isect_geometry(ws):
-    _remote_command(ws, 'isect_geometry')
+    if _fused_uvproject(ws):
+        _remote_command(ws, 'isect_uvproject')
+    else:
+        _remote_command(ws, 'isect_geometry')
 
 def remote_uvproject(ws):
+    if _fused_uvproject(ws):
+        util.log('[uvproject] skipped, already done by isect_uvproject (FusedUVProject = yes)')
+        return
     _remote_command(ws, 'uvproject')
 
 def autorun(args):
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+remote.py -- command channels to the GPU/HTCondor nodes
+
+SSHChannel keeps one multiplexed OpenSSH control connection (ControlMaster)
+per host, and every command, including the rsync transfers of wsync.py, is
+run through it. Hence only the first command to a host pays for the TCP and
+authentication handshakes.
+
+LocalChannel runs the same scripts with the local bash, for hosts listed in
+[SYSTEM] LoopbackHosts. This allows to exercise the whole remote code path
+(remote_command, deploy/fetch) on one machine.
+
+Commands are wrapped so that the remote side prints its exit status after the
+command finishes. A command whose status line never arrives is considered as
+interrupted by a broken connection (CommandResult.connection_lost), no matter
+what the exit code of ssh is, and the channel reconnects before the next command.
+'''
+
+import os
+import sys
+import time
+import shlex
+import tempfile
+import subprocess
+
+from . import util
+
+_STATUS_MARKER = '__PUZZLE_REMOTE_STATUS__'
+SSH_EXIT_CONNECTION = 255
+
+class CommandResult(object):
+    def __init__(self, host, script, returncode, connection_lost, duration):
+        self.host = host
+        self.script = script
+        self.returncode = returncode
+        self.connection_lost = connection_lost
+        self.duration = duration
+
+    @property
+    def ok(self):
+        return not self.connection_lost and self.returncode == 0
+
+    def __repr__(self):
+        return 'CommandResult(host={}, returncode={}, connection_lost={}, duration={:.2f})'.format(
+                self.host, self.returncode, self.connection_lost, self.duration)
+
+def _wrap(script):
+    # Subshell so that 'exit' in the script still reaches the status line
+    return '( {}\n) ; echo "{} $?"'.format(script, _STATUS_MARKER)
+
+def _stream(argv, host, script, log_fn=None):
+    '''
+    Run argv, forward its output line by line to stdout (and log_fn), and
+    parse the status line printed by _wrap().
+    '''
+    t_start = time.monotonic()
+    status = None
+    logf = open(log_fn, 'a') if log_fn is not None else None
+    try:
+        p = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                             universal_newlines=True, errors='replace', bufsize=1)
+        for line in p.stdout:
+            if line.startswith(_STATUS_MARKER):
+                try:
+                    status = int(line.split()[1])
+                except (IndexError, ValueError):
+                    pass
+                continue
+            sys.stdout.write(line)
+            sys.stdout.flush()
+            if logf is not None:
+                logf.write(line)
+        ret = p.wait()
+    finally:
+        if logf is not None:
+            logf.close()
+    duration = time.monotonic() - t_start
+    if status is None:
+        return CommandResult(host, script, ret, True, duration)
+    return CommandResult(host, script, status, False, duration)
+
+class LocalChannel(object):
+    def __init__(self, host):
+        self.host = host
+
+    @property
+    def rsync_host(self):
+        '''
+        Host part of rsync paths. None means local paths.
+        '''
+        return None
+
+    @property
+    def rsync_shell(self):
+        return None
+
+    def run(self, script, tty=False, log_fn=None):
+        util.log('[{}] (loopback) {}'.format(self.host, script))
+        if tty:
+            # tmux needs the terminal, and the output cannot be captured
+            t_start = time.monotonic()
+            ret = subprocess.call(['bash', '-c', script])
+            return CommandResult(self.host, script, ret, False, time.monotonic() - t_start)
+        return _stream(['bash', '-c', _wrap(script)], self.host, script, log_fn=log_fn)
+
+    def reconnect(self):
+        pass
+
+    def close(self):
+        pass
+
+class SSHChannel(object):
+    '''
+    control_dir: where the control sockets are placed. The socket path must
+                 be short (< 108 bytes), so it defaults to a directory in /tmp.
+    persist: seconds to keep the control connection alive after the last use.
+    '''
+    def __init__(self, host, control_dir=None, persist=600):
+        self.host = host
+        if control_dir is None:
+            control_dir = os.path.join(tempfile.gettempdir(), 'puzzle-ssh-{}'.format(os.getuid()))
+        os.makedirs(control_dir, mode=0o700, exist_ok=True)
+        self.control_path = os.path.join(control_dir, '%C')
+        self.persist = persist
+
+    @property
+    def ssh_options(self):
+        return ['-o', 'ControlMaster=auto',
+                '-o', 'ControlPath={}'.format(self.control_path),
+                '-o', 'ControlPersist={}'.format(self.persist)]
+
+    @property
+    def rsync_host(self):
+        return self.host
+
+    @property
+    def rsync_shell(self):
+        '''
+        For rsync -e, so the transfers reuse the control connection
+        '''
+        return ' '.join(['ssh'] + [shlex.quote(o) for o in self.ssh_options])
+
+    def _ssh(self, *args):
+        return ['ssh'] + self.ssh_options + list(args)
+
+    def is_connected(self):
+        return subprocess.call(self._ssh('-O', 'check', self.host),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
+
+    def run(self, script, tty=False, log_fn=None):
+        util.log('[{}] {}'.format(self.host, script))
+        if tty:
+            t_start = time.monotonic()
+            ret = subprocess.call(self._ssh('-t', self.host, script))
+            return CommandResult(self.host, script, ret, ret == SSH_EXIT_CONNECTION,
+                                 time.monotonic() - t_start)
+        res = _stream(self._ssh(self.host, _wrap(script)), self.host, script, log_fn=log_fn)
+        if res.connection_lost:
+            # The master may be stale, make sure the next command starts a new one
+            self.reconnect()
+        return res
+
+    def reconnect(self):
+        subprocess.call(self._ssh('-O', 'exit', self.host),
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def close(self):
+        self.reconnect()
+
+def create_channel(host, loopback_hosts=[], persist=600):
+    if host in loopback_hosts:
+        return LocalChannel(host)
+    return SSHChannel(host, persist=persist)
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+renderer_pool.py -- long-lived offscreen renderers shared by pipeline stages
+
+Creating an offscreen renderer (util.create_offscreen_renderer) is expensive:
+a new EGL context, mesh loading, and texture uploading. This module keeps a
+number of worker processes alive, each of which caches its renderers keyed by
+(puzzle file, resolution, renderer flags). Requests are sent to the workers
+in batches, and rendered images are returned through shared memory instead of
+being pickled through the pipe.
+
+Two kinds of requests are supported:
+    RendererPool.render: render a batch of states with given rendering flags,
+                         and return the requested framebuffers (mvrgb, mvdepth,
+                         mvuv, mvpid, mvnormal) stacked along the first axis.
+    RendererPool.apply:  call a module-level function func(r, *args) with the
+                         cached renderer r, for stateful usages like
+                         add_barycentric/render_barycentric.
+
+Hosts without GPU render nodes (e.g. headless CI) use Mesa's software
+rasterizer (llvmpipe) through the surfaceless EGL platform. The glvnd vendor
+file of Mesa is distribution specific, set it with [SYSTEM] EGLVendorFile or
+the PUZZLE_EGL_VENDOR_FILE environment variable if glvnd does not pick Mesa.
+
+Workers that die (e.g. a crash in the EGL driver) fail their requests with
+RuntimeError, and are replaced by new workers.
+'''
+
+import os
+import glob
+import time
+import atexit
+import itertools
+import queue
+import traceback
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+from . import util
+
+SOFTWARE_RENDERING_ENV = {
+        'EGL_PLATFORM': 'surfaceless',
+        'LIBGL_ALWAYS_SOFTWARE': '1',
+        'GALLIUM_DRIVER': 'llvmpipe',
+}
+EGL_VENDOR_ENV = 'PUZZLE_EGL_VENDOR_FILE'
+DEFAULT_PROCESSES = 4
+# Seconds between two liveness checks of the workers while waiting for results
+POLL_INTERVAL = 5.0
+
+RENDERER_FLAGS = ['avi', 'flat_surface', 'default_depth']
+
+def need_software_rendering():
+    if os.environ.get('PUZZLE_SOFTWARE_RENDERING', '') == '1':
+        return True
+    if glob.glob('/dev/dri/renderD*'):
+        return False
+    if os.path.exists('/dev/nvidiactl'):
+        return False
+    return True
+
+def renderer_key(puzzle_file, resolution=256, **flags):
+    for k in flags:
+        assert k in RENDERER_FLAGS, f'Unknown renderer flag {k}, possible flags {RENDERER_FLAGS}'
+    return (os.path.abspath(puzzle_file), int(resolution), tuple(sorted(flags.items())))
+
+def _create_renderer(key):
+    puzzle_file, resolution, flags = key
+    r = util.create_offscreen_renderer(puzzle_file, resolution)
+    for k, v in flags:
+        setattr(r, k, v)
+    return r
+
+def _to_shared_memory(arrays):
+    '''
+    Pack a dict of np.ndarray into shared memory blocks.
+    The receiver is responsible to unlink the blocks.
+    '''
+    ret = {}
+    for name, a in arrays.items():
+        shm = shared_memory.SharedMemory(create=True, size=max(1, a.nbytes))
+        np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)[...] = a
+        ret[name] = (shm.name, a.shape, a.dtype.str)
+        shm.close()
+        try:
+            # The block is handed over to the receiver, do not let the
+            # resource tracker of this process unlink it when we exit.
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+    return ret
+
+def _from_shared_memory(desc):
+    ret = {}
+    for name, (shm_name, shape, dtype) in desc.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        ret[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf).copy()
+        shm.close()
+        shm.unlink()
+    return ret
+
+def _render_states(r, states, render_flags, outputs):
+    shape = (r.pbufferWidth, r.pbufferHeight)
+    buffers = {}
+    n = states.shape[0]
+    for i, q in enumerate(states):
+        r.state = q
+        r.render_mvrgbd(render_flags)
+        for name in outputs:
+            fb = getattr(r, name)
+            fb = fb.reshape(shape + (-1,))
+            if name not in buffers:
+                buffers[name] = np.empty((n,) + fb.shape, dtype=fb.dtype)
+            buffers[name][i] = fb
+    return _to_shared_memory(buffers)
+
+def _worker_main(wid, inbox, outbox, software, egl_vendor_file):
+    if software:
+        os.environ.update(SOFTWARE_RENDERING_ENV)
+        if egl_vendor_file:
+            os.environ['__EGL_VENDOR_LIBRARY_FILENAMES'] = egl_vendor_file
+    cache = {}
+    while True:
+        req = inbox.get()
+        if req is None:
+            break
+        rid, key, func, args = req
+        setup_time = 0.0
+        try:
+            if key not in cache:
+                t_start = time.time()
+                cache[key] = _create_renderer(key)
+                setup_time = time.time() - t_start
+            r = cache[key]
+            t_start = time.time()
+            ret = func(r, *args) if func is not None else None
+            outbox.put((rid, wid, key, True, ret, setup_time, time.time() - t_start))
+        except Exception:
+            outbox.put((rid, wid, key, False, traceback.format_exc(), setup_time, 0.0))
+
+class RendererPool(object):
+    '''
+    Arguments:
+        processes: number of worker processes. Default to 4 (capped by the
+                   number of CPUs), which was the size of the process pool
+                   used by uvrender before this module.
+        software: force (True) or disable (False) the software rasterizer.
+                  None means auto detection through need_software_rendering()
+        egl_vendor_file: glvnd vendor file of the software rasterizer,
+                         default to $PUZZLE_EGL_VENDOR_FILE. Not set if
+                         neither is given.
+    '''
+    def __init__(self, processes=None, software=None, egl_vendor_file=None):
+        if processes is None:
+            processes = min(DEFAULT_PROCESSES, os.cpu_count())
+        if software is None:
+            software = need_software_rendering()
+        if not egl_vendor_file:
+            egl_vendor_file = os.environ.get(EGL_VENDOR_ENV, '')
+        self.software = software
+        self._egl_vendor_file = egl_vendor_file
+        # fork() does not play well with EGL contexts
+        self._ctx = multiprocessing.get_context('spawn')
+        self._outbox = self._ctx.Queue()
+        self._inboxes = []
+        self._workers = []
+        self.grow(processes)
+        self._rid = itertools.count()
+        self._stats = {}
+        util.log('[RendererPool] started {} workers (software rendering: {})'.format(processes, software))
+
+    def _spawn(self, wid):
+        inbox = self._ctx.Queue()
+        p = self._ctx.Process(target=_worker_main,
+                              args=(wid, inbox, self._outbox, self.software, self._egl_vendor_file),
+                              daemon=True)
+        p.start()
+        return inbox, p
+
+    def grow(self, processes):
+        '''
+        Start workers until there are at least processes of them
+        '''
+        while len(self._workers) < processes:
+            inbox, p = self._spawn(len(self._workers))
+            self._inboxes.append(inbox)
+            self._workers.append(p)
+        self._next_worker = itertools.cycle(range(len(self._workers)))
+
+    @property
+    def processes(self):
+        return len(self._workers)
+
+    def _record(self, key, setup_time, busy_time, frames):
+        if key not in self._stats:
+            self._stats[key] = {'setups': 0, 'setup_seconds': 0.0,
+                                'requests': 0, 'frames': 0, 'busy_seconds': 0.0}
+        st = self._stats[key]
+        if setup_time > 0:
+            st['setups'] += 1
+            st['setup_seconds'] += setup_time
+        st['requests'] += 1
+        st['frames'] += frames
+        st['busy_seconds'] += busy_time
+
+    def _run(self, key, requests, frames=None, broadcast=False):
+        '''
+        requests: list of (func, args)
+        Return results in the same order of requests
+        '''
+        pending = {}
+        for i, (func, args) in enumerate(requests):
+            rid = next(self._rid)
+            wid = i if broadcast else next(self._next_worker)
+            self._inboxes[wid].put((rid, key, func, args))
+            pending[rid] = (i, wid)
+        ret = [None] * len(requests)
+        errors = []
+        while pending:
+            try:
+                rid, wid, rkey, ok, value, setup_time, busy_time = self._outbox.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                errors += self._reap(pending)
+                continue
+            if rid not in pending:
+                # Late result of a request that was given up
+                continue
+            i, _ = pending.pop(rid)
+            self._record(rkey, setup_time, busy_time, 0 if frames is None else frames[i])
+            if ok:
+                ret[i] = value
+            else:
+                errors.append('[worker {}] {}'.format(wid, value))
+        if errors:
+            msg = '[RendererPool] {} request(s) failed\n'.format(len(errors)) + '\n'.join(errors)
+            util.fatal(msg)
+            raise RuntimeError(msg)
+        return ret
+
+    def _reap(self, pending):
+        '''
+        Fail the pending requests of dead workers, and replace the workers.
+        Return the error messages, one per worker that lost any request.
+        Workers that died without pending requests are replaced silently.
+        '''
+        errors = []
+        for wid, p in enumerate(self._workers):
+            if p.is_alive():
+                continue
+            lost = [rid for rid, (_, w) in pending.items() if w == wid]
+            for rid in lost:
+                del pending[rid]
+            if lost:
+                errors.append('[worker {}] died with exit code {}, {} request(s) lost'.format(wid, p.exitcode, len(lost)))
+            else:
+                util.log('[RendererPool] worker {} died with exit code {}, restarting it'.format(wid, p.exitcode))
+            self._inboxes[wid], self._workers[wid] = self._spawn(wid)
+        return errors
+
+    def warmup(self, puzzle_file, resolution=256, **flags):
+        '''
+        Create the renderer in every worker ahead of time.
+        '''
+        key = renderer_key(puzzle_file, resolution, **flags)
+        self._run(key, [(None, ())] * self.processes, broadcast=True)
+
+    def render(self, puzzle_file, states, render_flags=0,
+               outputs=('mvrgb', 'mvdepth'), resolution=256, **flags):
+        '''
+        states: (N, 7) unit states
+        Return: dict from output names to arrays of shape (N, resolution, resolution, C)
+        '''
+        key = renderer_key(puzzle_file, resolution, **flags)
+        states = np.asarray(states)
+        if states.ndim == 1:
+            states = states.reshape((1, -1))
+        n = states.shape[0]
+        nchunk = max(1, min(n, self.processes))
+        bounds = np.linspace(0, n, nchunk + 1).astype(int)
+        chunks = [states[bounds[i]:bounds[i+1]] for i in range(nchunk)]
+        requests = [(_render_states, (chunk, render_flags, tuple(outputs))) for chunk in chunks]
+        descs = self._run(key, requests, frames=[chunk.shape[0] for chunk in chunks])
+        parts = [_from_shared_memory(desc) for desc in descs]
+        return {name: np.concatenate([p[name] for p in parts if name in p]) for name in outputs}
+
+    def apply(self, puzzle_file, func, args_list, resolution=256, **flags):
+        '''
+        Call func(r, *args) for each args in args_list on the workers.
+
+        func must be a module-level function so it can be pickled.
+        '''
+        key = renderer_key(puzzle_file, resolution, **flags)
+        requests = [(func, tuple(args)) for args in args_list]
+        return self._run(key, requests, frames=[1] * len(requests))
+
+    def stats(self):
+        '''
+        Return the instrumented numbers keyed by renderer key:
+            setups, setup_seconds: number of renderers created and time spent
+            requests, frames, busy_seconds: workload after setup
+            frames_per_second: throughput excluding the setup cost
+        '''
+        ret = {}
+        for key, st in self._stats.items():
+            st = dict(st)
+            st['frames_per_second'] = st['frames'] / st['busy_seconds'] if st['busy_seconds'] > 0 else 0.0
+            ret[key] = st
+        return ret
+
+    def report(self):
+        for key, st in self.stats().items():
+            util.log('[RendererPool] {}@{} {}: {} setups in {:.3f} sec., {} frames at {:.2f} fps'.format(
+                     key[0], key[1], dict(key[2]),
+                     st['setups'], st['setup_seconds'],
+                     st['frames'], st['frames_per_second']))
+
+    def close(self):
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for p in self._workers:
+            p.join(timeout=60)
+            if p.is_alive():
+                p.terminate()
+        self._inboxes = []
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+_shared_pool = None
+
+def get_pool(processes=None, software=None, egl_vendor_file=None):
+    '''
+    Return the pool shared by all pipeline stages in this process.
+    The pool is created on first use and closed at exit. It grows if a later
+    caller asks for more processes.
+    '''
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = RendererPool(processes=processes, software=software, egl_vendor_file=egl_vendor_file)
+        def _close():
+            _shared_pool.report()
+            _shared_pool.close()
+        atexit.register(_close)
+    elif processes is not None and processes > _shared_pool.processes:
+        _shared_pool.grow(processes)
+    return _shared_pool
+
+def pool_for(ws, tasks):
+    '''
+    get_pool() with one worker per task, up to the default size, and the
+    EGL vendor file of [SYSTEM] EGLVendorFile
+    '''
+    processes = max(1, min(int(tasks), DEFAULT_PROCESSES, os.cpu_count()))
+    return get_pool(processes=processes,
+                    egl_vendor_file=ws.config.get('SYSTEM', 'EGLVendorFile', fallback=''))
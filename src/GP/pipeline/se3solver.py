@@ -14,6 +14,10 @@ from progressbar import progressbar
 
 from . import util
 from . import matio
+from . import taskindex
+from . import forest_store
+from . import telemetry
+from . import pds_share
 sys.path.insert(0, os.getcwd())
 try:
     import pyse3ompl as plan
@@ -98,9 +102,26 @@ def add_performance_numbers_to_dic(driver, dic):
     dic['PF_LOG_DCHECK_N'] = pn.motion_discrete_state_check
     dic['PF_LOG_KNN_QUERY_T'] = pn.knn_query_time
     dic['PF_LOG_KNN_DELETE_T'] = pn.knn_delete_time
+    dic['PF_LOG_SETUP_T'] = pn.setup_time
+    dic['PF_LOG_TERMINATION'] = pn.termination
+
+def _setup_telemetry(driver, args):
+    fn = getattr(args, 'telemetry_out', None)
+    if not fn and getattr(args, 'telemetry', False):
+        outputs = [o for o in [args.bloom_out, args.trajectory_out, args.out] if o]
+        if outputs:
+            fn = telemetry.telemetry_file(outputs[0])
+        elif 'out' in args.istate_dic:
+            fn = join(args.istate_dic['out'], 'telemetry-{}{}'.format(args.istate_dic['offset'], telemetry.SUFFIX))
+        else:
+            util.warn('[solve] --telemetry needs an output file or --telemetry_out, telemetry disabled')
+    if fn:
+        driver.set_telemetry(fn, interval=args.telemetry_interval, stagnation_limit=args.stagnation_limit)
+        util.log('[solve] telemetry written to {}'.format(fn))
 
 def solve(args):
     driver = create_driver(args)
+    _setup_telemetry(driver, args)
     ccd = (args.cdres <= 0.0)
     if args.samset2:
         current = int(args.samset2[0])
@@ -108,18 +129,26 @@ def solve(args):
         prefix = args.samset2[2]
         args.samset = '{}{}.npz'.format(prefix, current % total)
     if args.samset:
-        d = np.load(args.samset)
-        Q = d['Q']
-        driver.set_sample_set(Q)
+        d = None
+        if args.pds_share:
+            try:
+                d = pds_share.load(args.samset, root=args.pds_share_root)
+                set_q, set_qf, set_edges = driver.set_sample_set_view, driver.set_sample_set_flags_view, driver.set_sample_set_edges_view
+            except OSError as e:
+                util.warn('[solve] cannot share {}, loading it instead: {}'.format(args.samset, e))
+        if d is None:
+            d = np.load(args.samset)
+            set_q, set_qf, set_edges = driver.set_sample_set, driver.set_sample_set_flags, driver.set_sample_set_edges
+        set_q(d['Q'])
         if 'QF' in d:
-            QF = d['QF']
-            driver.set_sample_set_flags(QF)
+            set_qf(d['QF'])
         record_compact_tree = True
         if args.use_blooming_tree:
             assert 'QB' in d
             assert 'QE' in d
             assert 'QEB' in d
-            driver.set_sample_set_edges(QB=d['QB'], QE=d['QE'], QEB=d['QEB'])
+            set_edges(QB=d['QB'], QE=d['QE'], QEB=d['QEB'])
+        del d
     else:
         record_compact_tree = False
     if args.use_roots_from:
@@ -148,7 +177,7 @@ def solve(args):
             dic = { 'OMPL_TRAJECTORY' : driver.latest_solution,
                     'FLAG_IS_COMPLETE' : is_complete }
             add_performance_numbers_to_dic(driver, dic)
-            np.savez(args.trajectory_out, **dic)
+            matio.savez(args.trajectory_out, **dic)
         return
 
     h5traj = None
@@ -160,11 +189,12 @@ def solve(args):
         index = pds_tree_index
         if args.samset2:
             index = current
-        ssc_fn = '{}/ssc-{}.mat'.format(pds_out_dir, index)
-        tree_fn = '{}/compact_tree-{}.mat'.format(pds_out_dir, index)
-        if args.samset and args.skip_existing:
-            if os.path.exists(ssc_fn) and os.path.exists(tree_fn):
-                print("skipping exising file {} and {}".format(ssc_fn, tree_fn))
+        store_fn = forest_store.store_file(pds_out_dir)
+        if args.samset and args.skip_existing and os.path.exists(store_fn):
+            with forest_store.ForestStore(store_fn) as store:
+                existing = index in store
+            if existing:
+                print("skipping exising root {} in {}".format(index, store_fn))
                 continue
         return_ve = bool(args.bloom_out is not None or args.trajectory_out)
         V,E = driver.solve(args.days, return_ve=return_ve, ec_budget=args.ec_budget, record_compact_tree=record_compact_tree, continuous_motion_validator=ccd)
@@ -185,13 +215,12 @@ def solve(args):
                 complete_list.append(gs_index)
         if args.samset:
             ssc_data = driver.get_sample_set_connectivity()
-            savemat(ssc_fn, dict(C=ssc_data), do_compression=True)
-            # np.savez_compressed(ssc_fn+'.npz', C=ssc_data)
-            util.log("saving ssc matrix {}, shape {}".format(ssc_fn, ssc_data.shape))
-        if record_compact_tree:
-            CNVI, CNV, CE = driver.get_compact_graph()
-            savemat(tree_fn, dict(CNVI=CNVI, CNV=CNV, CE=CE), do_compression=True)
-            util.log("saving compact tree {}".format(tree_fn))
+            if record_compact_tree:
+                CNVI, CNV, CE = driver.get_compact_graph()
+            else:
+                CNVI, CNV, CE = None, None, None
+            forest_store.append(store_fn, index, ssc_data, CNVI=CNVI, CNV=CNV, CE=CE)
+            util.log("saving ssc matrix of shape {} and compact tree of root {} to {}".format(ssc_data.shape, index, store_fn))
         if args.bloom_out:
             '''
             _, _, CE = driver.get_compact_graph()
@@ -203,7 +232,8 @@ def solve(args):
                     'GS_INDICES': driver.get_graph_gstate_indices()
                   }
             add_performance_numbers_to_dic(driver, dic)
-            np.savez(args.bloom_out, **dic)
+            matio.savez(args.bloom_out, **dic)
+            taskindex.record(args.bloom_out)
             util.log("saving bloom results to {}".format(args.bloom_out))
     if h5traj is not None:
         matio.hdf5_overwrite(h5traj, 'COMPLETE_TUPLE', complete_tuple)
@@ -236,6 +266,10 @@ def merge_forest(args):
 merge_blooming_forest:
     Merge the forest from blooming algorithm
 '''
+def pds_purge(args):
+    for path in pds_share.purge(root=args.root, keep=args.keep):
+        util.log('[pds_purge] removed {}'.format(path))
+
 def merge_blooming_forest(args):
     print('running merge_blooming_forest with {}'.format(vars(args)))
     puzzle = args.puzzle
@@ -258,7 +292,8 @@ def merge_blooming_forest(args):
     if args.out is not None:
         dic = { 'INTER_BLOOMING_TREE_EDGES': inter_tree_edges }
         add_performance_numbers_to_dic(driver, dic)
-        np.savez(args.out, **dic)
+        matio.savez(args.out, **dic)
+        taskindex.record(args.out)
     if args.algo_version >= 2:
         return
     import networkx as nx
@@ -272,23 +307,93 @@ def merge_blooming_forest(args):
         print('Failed to solve with KNN')
 
 def presample(args):
-    args.planner = plan.PLANNER_PRM
+    """
+    Write args.nsamples states to args.out (.npz or .hdf5) in chunks, so tens
+    of millions of states can be sampled with bounded memory.
+
+    The states are drawn by OmplDriver.presample_blocks in parallel. The
+    output only depends on the seed, not on the number of threads or the
+    chunk size.
+    """
+    args.planner_id = plan.PLANNER_PRM
+    args.sampler_id = args.sampler
     args.saminj = ''
     args.rdt_k = 0
     driver = create_driver(args)
-    Q = driver.presample(args.nsamples)
-    np.savez(args.out, Q=Q)
+    uw = util.create_unit_world(args.puzzle) if args.entangled_only else None
+    seed = args.seed if args.seed is not None else random.getrandbits(63)
+    util.log('[presample] seed {}'.format(seed))
+    nblocks = max(1, args.chunk // plan.PRESAMPLE_BLOCK)
+    block = 0
+    empty_chunks = 0
+    with matio.StreamWriter(args.out, 'Q', (args.nsamples, 7),
+                            extra={'seed': seed, 'valid_only': args.valid_only,
+                                   'entangled_only': args.entangled_only}) as writer:
+        while writer.rows < args.nsamples:
+            Q = driver.presample_blocks(block, nblocks, seed,
+                                        valid_only=args.valid_only,
+                                        nthreads=args.threads)
+            block += nblocks
+            if uw is not None and Q.shape[0] > 0:
+                Q = Q[uw.are_disentangled(uw.translate_ompl_to_unit(Q)) == 0]
+            empty_chunks = empty_chunks + 1 if Q.shape[0] == 0 else 0
+            if empty_chunks >= 64:
+                msg = '[presample] no sample passes the filters in {} candidates'.format(block * plan.PRESAMPLE_BLOCK)
+                util.fatal(msg)
+                raise RuntimeError(msg)
+            writer.write(Q[:args.nsamples - writer.rows])
+            util.log('[presample] {}/{} samples from {} candidates'.format(writer.rows, args.nsamples, block * plan.PRESAMPLE_BLOCK))
+
+def benchmark_setup(args):
+    """
+    Setup time (ms) of OmplDriver calls, with and without reusing the
+    planning context.
+
+    The first call of each round loads the meshes and builds the collision
+    hierarchy. With reuse, later solve calls only reset the planner, and
+    validate_* calls reuse everything.
+    """
+    args.planner_id = plan.PLANNER_RDT
+    args.sampler_id = 0
+    driver = create_driver(args)
+    Q = driver.presample(2 * args.nstates)
+    qs0, qs1 = Q[:args.nstates], Q[args.nstates:]
+    calls = [
+            ('solve', lambda: driver.solve(args.days, ec_budget=args.ec_budget)),
+            ('validate_states', lambda: driver.validate_states(qs0)),
+            ('validate_motion_pairs', lambda: driver.validate_motion_pairs(qs0, qs1)),
+    ]
+    report = {}
+    for reuse in [False, True]:
+        driver.set_context_reuse(reuse)
+        for name, call in calls:
+            times = []
+            for i in range(args.repeat):
+                call()
+                times.append(driver.latest_performance_numbers.setup_time)
+            report[(name, reuse)] = np.array(times)
+    print('{:<24} {:>14} {:>14} {:>9}'.format('Call', 'No reuse (ms)', 'Reuse (ms)', 'Speedup'))
+    for name, _ in calls:
+        before = np.mean(report[(name, False)])
+        # The first call with reuse still builds the context
+        after = np.mean(report[(name, True)][1:]) if args.repeat > 1 else np.mean(report[(name, True)])
+        print('{:<24} {:>14.3f} {:>14.3f} {:>8.1f}x'.format(name, before, after, before / max(after, 1e-9)))
+    if args.out:
+        np.savez(args.out, **{'{}_{}'.format(name, 'reuse' if reuse else 'noreuse'): v for (name, reuse), v in report.items()})
 
 def merge_pdsc(args):
-    fnl = []
-    for i in itertools.count(start=0, step=1):
-        fn = '{}/ssc-{}.mat'.format(args.dir, i)
-        if not os.path.isfile(fn):
-            break
-        fnl.append(fn)
-    cl = []
-    for fn in fnl:
-        cl.append(loadmat(fn)['C'])
     # merged connectivity matrix
-    mc = sparse.vstack(cl)
-    savemat(args.out, dict(MC=mc), do_compression=True)
+    with forest_store.open_forest(args.dir) as forest:
+        mc = forest.connectivity_matrix()
+        if args.out.endswith('.npz'):
+            sparse.save_npz(args.out, mc)
+        else:
+            savemat(args.out, dict(MC=mc), do_compression=True)
+
+def forest_to_mat(args):
+    """
+    Convert the forest store of args.dir to ssc-<root>.mat and
+    compact_tree-<root>.mat files
+    """
+    n = forest_store.export_mat(args.dir, outdir=args.out)
+    util.log('[forest_to_mat] {} roots written to {}'.format(n, args.out if args.out else args.dir))
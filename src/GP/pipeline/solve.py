@@ -28,6 +28,8 @@ from . import matio
 from . import atlas
 from . import texture_format
 from . import parse_ompl
+from . import forest_store
+from . import pds_share
 
 ALGORITHM_VERSION_PHASE2_WITH_BLOOMING_TREE = 5
 
@@ -237,9 +239,7 @@ def _sample_pds_old(args, ws):
             uQ = uw.translate_ompl_to_unit(Q)
             n = Q.shape[0]
             QF = np.zeros((n, 1), dtype=np.uint32)
-            for j, uq in enumerate(uQ):
-                if uw.is_disentangled(uq):
-                    QF[j] = se3solver.PDS_FLAG_TERMINATE
+            QF[uw.are_disentangled(uQ) != 0] = se3solver.PDS_FLAG_TERMINATE
             fn = _puzzle_pds(ws, puzzle_name, i)
             np.savez(fn, Q=Q, QF=QF)
             util.log('[sample_pds] samples stored at {}'.format(fn))
@@ -374,6 +374,7 @@ def forest_rdt(args, ws):
                 'file={},key=KEYQ_OMPL,offset=$$([$(Process)]),size=1,out={}'.format(key_fn, scratch_dir)]
         if args.algorithm_version == ALGORITHM_VERSION_PHASE2_WITH_BLOOMING_TREE:
             condor_job_args += ['--use_blooming_tree']
+        condor_job_args += pds_share.solver_arguments(ws)
         condor_job_args += [puzzle_fn,
                 util.RDT_FOREST_ALGORITHM_ID,
                 1.0]
@@ -406,7 +407,11 @@ def forest_edges(args, ws):
         shell_script = './pds_edge.py --pdsflags '
         shell_script += _puzzle_pds(ws, puzzle_name, ws.current_trial)
         shell_script += ' --out {}'.format(ws.local_ws(rel_scratch_dir, algoprefix + 'edges.hdf5'))
-        shell_script += ' `ls -v {}/ssc-*.mat`'.format(ws.local_ws(rel_scratch_dir))
+        store_fn = forest_store.store_file(ws.local_ws(rel_scratch_dir))
+        if os.path.isfile(store_fn):
+            shell_script += ' {}'.format(store_fn)
+        else:
+            shell_script += ' `ls -v {}/ssc-*.mat`'.format(ws.local_ws(rel_scratch_dir))
         util.shell(['bash', '-c', shell_script])
 
 def connect_forest(args, ws):
@@ -28,6 +28,7 @@ from . import matio
 from . import atlas
 from . import texture_format
 from . import parse_ompl
+from . import telemetry
 from .solve import (
         setup_parser as original_setup_parser
 )
@@ -119,7 +120,8 @@ def least_visible_keyconf_fixed(args, ws):
         # Get the original indices
         top_k += util.RDT_FOREST_INIT_AND_GOAL_RESERVATIONS
         top_oskey = oskey[top_k,:]
-        np.savez(fl.downsampled_key_fn, KEYQ_OMPL=top_oskey)
+        matio.savez(fl.downsampled_key_fn, KEYQ_OMPL=top_oskey)
+        ws.record_meta([fl.downsampled_key_fn])
         util.ack(f'[least_visible_keyconf_fixed] save top {K} key to {fl.downsampled_key_fn}, shape {top_oskey.shape}')
 
 def assemble_raw_keyconf(args, ws):
@@ -155,7 +157,8 @@ def assemble_raw_keyconf(args, ws):
         base_list.append(base)
         save_dic['KEYQ_OMPL'] = util.safe_concatente(keyq_list)
         save_dic['BASES_WITH_END'] = base_list
-        np.savez(fl.assembled_raw_key_fn, **save_dic)
+        matio.savez(fl.assembled_raw_key_fn, **save_dic)
+        ws.record_meta([fl.assembled_raw_key_fn])
         util.ack(f'[assemble_raw_keyconf] save {save_dic["KEYQ_OMPL"].shape} to {fl.assembled_raw_key_fn}')
 
 def screen_keyconf(args, ws):
@@ -293,7 +296,8 @@ def assemble_roots(args, ws):
             util.log("[screen_keyconf][{}][scheme {scheme}] Screened {} roots into {}".format(
                       puzzle_name,
                       rtup[1] - rtup[0] + util.RDT_FOREST_INIT_AND_GOAL_RESERVATIONS, screened.shape, scheme=scheme))
-            np.savez_compressed(fl.screened_key_fn, KEYQ_OMPL=screened)
+            matio.savez(fl.screened_key_fn, compressed=True, KEYQ_OMPL=screened)
+            ws.record_meta([fl.screened_key_fn])
             util.ack("[screen_keyconf][scheme {scheme}] Save screened roots {} to {}".format(screened.shape, fl.screened_key_fn, scheme=scheme))
 
 """
@@ -327,9 +331,10 @@ def blooming(args, ws):
                 all_keys = matio.load(fl.cmb_screened_key_fn)['KEYQ_OMPL']
                 total_quota = bloom_quota * all_keys.shape[0]
                 bloom_quota = total_quota // nkey + int(not not (total_quota % nkey))
+            outputs = fl.bloom_outputs
             for i in progressbar(range(nkey)):
                 outfn = join(fl.bloom, f'bloom-from_{i}.npz')
-                if os.path.isfile(outfn):
+                if outputs.finished(i):
                     continue
                 util.log(f'<{args.current_trial}> [blooming][{puzzle_name}] rerun task {i}')
                 shell_args = ['python3',
@@ -340,7 +345,7 @@ def blooming(args, ws):
                         '--replace_istate',
                         f'file={key_fn},key=KEYQ_OMPL,offset={i},size=1,out={fl.bloom}',
                         '--bloom_out',
-                        outfn,
+                        outfn] + telemetry.solver_arguments(ws) + [
                         puzzle_fn,
                         util.RDT_FOREST_ALGORITHM_ID,
                         0.1,
@@ -366,7 +371,7 @@ def blooming(args, ws):
                     '--replace_istate',
                     f'file={key_fn},key=KEYQ_OMPL,offset=$$([$(Process)]),size=1,out={fl.bloom}',
                     '--bloom_out',
-                    join(fl.bloom, 'bloom-from_$(Process).npz'),
+                    join(fl.bloom, 'bloom-from_$(Process).npz')] + telemetry.solver_arguments(ws) + [
                     puzzle_fn,
                     util.RDT_FOREST_ALGORITHM_ID,
                     0.1,
@@ -433,15 +438,17 @@ def assemble_blooming(args, ws):
         if QE_list:
             QE = np.concatenate(QE_list, axis=0)
             assert QE.shape[0] == Q.shape[0] - len(tree_base_list), 'San check failed. Broken tree edges'
-            np.savez_compressed(pds_fn, Q=Q, QF=QF, QB=tree_base_list,
-                                QE=QE, QEB=edge_base_list,
-                                BLOOM_NO_TO_INDEX=BLOOM_NO_TO_INDEX,
-                                INDEX_TO_BLOOM_NO=INDEX_TO_BLOOM_NO)
+            matio.savez(pds_fn, compressed=True, Q=Q, QF=QF, QB=tree_base_list,
+                        QE=QE, QEB=edge_base_list,
+                        BLOOM_NO_TO_INDEX=BLOOM_NO_TO_INDEX,
+                        INDEX_TO_BLOOM_NO=INDEX_TO_BLOOM_NO)
         else:
-            np.savez_compressed(pds_fn, Q=Q, QF=QF, QB=tree_base_list,
-                                BLOOM_NO_TO_INDEX=BLOOM_NO_TO_INDEX,
-                                INDEX_TO_BLOOM_NO=INDEX_TO_BLOOM_NO)
+            matio.savez(pds_fn, compressed=True, Q=Q, QF=QF, QB=tree_base_list,
+                        BLOOM_NO_TO_INDEX=BLOOM_NO_TO_INDEX,
+                        INDEX_TO_BLOOM_NO=INDEX_TO_BLOOM_NO)
         util.log('[assemble_blooming] samples stored at {}'.format(pds_fn))
+        # Blooming outputs come with manifests written by se3solver
+        ws.record_meta(fn_list + [pds_fn])
 
 '''
 knn_forest:
@@ -453,9 +460,10 @@ def pairwise_knn(args, ws):
             key_fn = fl.screened_key_fn
             keys = matio.load(key_fn)['KEYQ_OMPL']
             nkey = keys.shape[0]
+            outputs = fl.knn_outputs
             for i in progressbar(range(nkey)):
                 fl.update_task_id(i)
-                if os.path.isfile(fl.knn_fn):
+                if outputs.finished(i):
                     continue
                 util.log(f'\n<{args.current_trial}> [pairwise_knn][{puzzle_name}] rerun task {i}')
                 util.shell(['./facade.py',
@@ -508,13 +516,19 @@ def pairwise_knn(args, ws):
 
 def assemble_knn(args, ws):
     for puzzle_fn, puzzle_name, fl in valid_puzzle_generator(ws, args):
+        nkey = matio.safeload(fl.screened_key_fn, key='KEYQ_OMPL').shape[0]
+        gaps = fl.knn_outputs.gaps(expected=nkey)
+        if gaps:
+            util.fatal(f'<{args.current_trial}> [assemble_knn][{puzzle_name}] missing pairwise_knn outputs of tasks {gaps}. Rerun them with --rerun')
+            raise FileNotFoundError(f'{fl.knn}: pairwise_knn_edges-{gaps[0]}.npz')
         ITE_array = [matio.load(fn)['INTER_BLOOMING_TREE_EDGES'] for _,fn in fl.knn_fn_gen]
         ITE = util.safe_concatente(ITE_array, axis=0)
         if ITE.shape[0] != 0:
             dedupITE = np.unique(ITE[:,[0,2]], axis=0)
         else:
             dedupITE = np.array([], dtype=ITE.dtype)
-        np.savez_compressed(fl.ibte_fn, INTER_BLOOMING_TREE_EDGES=ITE, DEDUP_INTER_BLOOMING_TREE_EDGES=dedupITE)
+        matio.savez(fl.ibte_fn, compressed=True, INTER_BLOOMING_TREE_EDGES=ITE, DEDUP_INTER_BLOOMING_TREE_EDGES=dedupITE)
+        ws.record_meta([fn for _,fn in fl.knn_fn_gen] + [fl.ibte_fn])
 
 VIRTUAL_OPEN_SPACE_NODE = 1j
 OPENSPACE_FLAG = 1
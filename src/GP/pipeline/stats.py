@@ -11,6 +11,10 @@ import pyse3ompl as plan
 from . import util
 from . import matio
 from . import condor
+from . import condor_log
+from . import condor_profile
+from . import perftrace
+from . import telemetry
 from .file_locations import FEAT_PRED_SCHEMES, KEY_PRED_SCHEMES, FileLocations
 
 def human_format(num):
@@ -149,21 +153,21 @@ def conclude(args):
                     puzzle_kps_rob = util.access_keypoints(d_rob, 'rob').shape[0]
                     if os.path.exists(overkp_fn):
                         puzzle_method = 'GK+NN'
-                        puzzle_roots_from_nn = matio.load(overkp_fn)['KEYQ_OMPL'].shape[0]
+                        puzzle_roots_from_nn = matio.load_safeshape(overkp_fn, 'KEYQ_OMPL', index=ws.meta_index)[0]
                         puzzle_roots_from_gk = None
                         FMT = util.GEOMETRIK_KEY_PREDICTION_FMT
                         kfn = ws.keyconf_file_from_fmt(puzzle_name, FMT)
-                        puzzle_roots_from_gk = matio.load(kfn)['KEYQ_OMPL'].shape[0]
+                        puzzle_roots_from_gk = matio.load_safeshape(kfn, 'KEYQ_OMPL', index=ws.meta_index)[0]
                         kfn = ws.keyconf_prediction_file(puzzle_name)
-                        puzzle_roots_from_nn = matio.load(kfn)['KEYQ_OMPL'].shape[0]
+                        puzzle_roots_from_nn = matio.load_safeshape(kfn, 'KEYQ_OMPL', index=ws.meta_index)[0]
                 else:
                     puzzle_method = 'NN'
                     puzzle_rot = ws.config.getint('Prediction', 'NumberOfRotations')
                     puzzle_kps_env = -1
                     puzzle_kps_rob = -1
                 kq_fn = ws.screened_keyconf_prediction_file(puzzle_name)
-                puzzle_roots = matio.load(kq_fn)['KEYQ_OMPL'].shape[0]
-                puzzle_pds = matio.load(pds_fn)['Q'].shape[0]
+                puzzle_roots = matio.load_safeshape(kq_fn, 'KEYQ_OMPL', index=ws.meta_index)[0]
+                puzzle_pds = matio.load_safeshape(pds_fn, 'Q', index=ws.meta_index)[0]
                 sol_fn = ws.solution_file(puzzle_name, type_name='unit')
                 if os.path.exists(sol_fn):
                     puzzle_success = 'Y'
@@ -237,6 +241,10 @@ def _detect_single_puzzle(ws):
         return last_puzzle_name
     return None
 
+'''
+Legacy parser of performance_log/log.<trial>, only needed for logs written
+before perftrace was introduced.
+'''
 def _parse_log(logfn, single_puzzle):
     ret_dic = {}
     breaker = ' cost '
@@ -467,7 +475,7 @@ class FeatStatTabler(Tabler):
         for geo_type in ['env', 'rob']:
             keyfn = fl.get_feat_pts_fn(geo_type)
             key = fl.feat_npz_key
-            yield geo_type, matio.load_safeshape(keyfn, key)[0]
+            yield geo_type, matio.load_safeshape(keyfn, key, index=fl.meta_index)[0]
 
     """
     raw_data_gen: generate raw data from (dir, trial, puzzle_fn) tuples
@@ -603,9 +611,9 @@ class KeyStatTabler(FeatStatTabler):
         super().__init__(args)
 
     def _fl_to_raw_data(self, fl):
-        v1 = matio.load_safeshape(fl.raw_key_fn, 'KEYQ_OMPL')[0]
+        v1 = matio.load_safeshape(fl.raw_key_fn, 'KEYQ_OMPL', index=fl.meta_index)[0]
         v1 = v1 - util.RDT_FOREST_INIT_AND_GOAL_RESERVATIONS if v1 is not None else v1
-        v2 = matio.load_safeshape(fl.screened_key_fn, 'KEYQ_OMPL')[0]
+        v2 = matio.load_safeshape(fl.screened_key_fn, 'KEYQ_OMPL', index=fl.meta_index)[0]
         v2 = v2 - util.RDT_FOREST_INIT_AND_GOAL_RESERVATIONS if v2 is not None else v2
         yield 'raw', v1
         yield 'screened', v2
@@ -654,7 +662,7 @@ class SolveStatTabler(FeatStatTabler):
         if fl.scheme in KEY_PRED_SCHEMES:
             if os.path.isfile(fl.unit_out_fn):
                 yield 'solve', 1
-            elif os.path.isfile(fl.performance_log):
+            elif os.path.isfile(fl.performance_trace) or os.path.isfile(fl.performance_log):
                 yield 'solve', 0
             else:
                 yield 'solve', None
@@ -665,12 +673,12 @@ class SolveStatTabler(FeatStatTabler):
                 cur_ec_time = 0
                 for i, bloom_fn in fl.bloom_fn_gen:
                     # util.warn(f'loading {bloom_fn}')
-                    d = matio.load(bloom_fn)
+                    d = matio.load_counters(bloom_fn, index=fl.meta_index)
                     cur_ec += int(d['PF_LOG_MCHECK_N'])
                     cur_ec_time += float(d['PF_LOG_MCHECK_T'])
                 for i, knn_fn in fl.knn_fn_gen:
                     # util.warn(f'loading {knn_fn}')
-                    d = matio.load(knn_fn)
+                    d = matio.load_counters(knn_fn, index=fl.meta_index)
                     cur_ec += int(d['PF_LOG_MCHECK_N'])
                     cur_ec_time += float(d['PF_LOG_MCHECK_T'])
             except Exception as e:
@@ -696,7 +704,7 @@ class SolveStatTabler(FeatStatTabler):
             solution_list = []
             for fn in fl.get_baseline_files(baseline_dir):
                 try:
-                    if matio.load(fn, key='FLAG_IS_COMPLETE') != 0:
+                    if matio.load_value(fn, 'FLAG_IS_COMPLETE') != 0:
                         solution_list.append(1)
                     else:
                         solution_list.append(0)
@@ -835,12 +843,12 @@ class PlannerTimingTabler(FeatStatTabler):
         Data from blooming tree
         """
         for i, fn in fl.bloom_fn_gen:
-            d = matio.safeopen(fn)
+            d = matio.load_counters(fn, index=fl.meta_index, safe=True)
             for k in self.PF_KEYS:
                 if k in d:
                     yield k, d[k]
         for i, fn in fl.knn_fn_gen:
-            d = matio.safeopen(fn)
+            d = matio.load_counters(fn, index=fl.meta_index, safe=True)
             for k in self.PF_KEYS:
                 if k in d:
                     yield k, d[k]
@@ -898,8 +906,7 @@ class CondorHours(FeatStatTabler):
         total = 0
         for i, fn in fl.bloom_fn_gen:
             try:
-                d = matio.load(fn)
-                total += d['PF_LOG_PLAN_T']
+                total += matio.load_value(fn, 'PF_LOG_PLAN_T', index=fl.meta_index)
             except:
                 pass
         yield 'Blooming', total
@@ -910,8 +917,7 @@ class CondorHours(FeatStatTabler):
         total = 0
         for i, fn in fl.knn_fn_gen:
             try:
-                d = matio.load(fn)
-                total += d['PF_LOG_PLAN_T']
+                total += matio.load_value(fn, 'PF_LOG_PLAN_T', index=fl.meta_index)
             except:
                 pass
         yield 'KNN', total
@@ -948,6 +954,32 @@ def condor_hours(args):
     tabler = CondorHours(args)
     tabler.print()
 
+def _legacy_cost_in_msec(logfn):
+    BREAKER = ' cost '
+    cost_dic = OrderedDict()
+    with open(logfn, 'r') as f:
+        for line in f:
+            loc = line.find(BREAKER)
+            if loc < 0:
+                continue
+            cost_str = line[loc+len(BREAKER):].strip()
+            line = line.replace('[', ' ')
+            line = line.replace(']', ' ')
+            split = line.split()
+            stage_name = split[0]
+            day_break = cost_str.find('+')
+            hr_break = cost_str.find(':')
+            mi_break = cost_str.find(':', hr_break+1)
+            sec_break = cost_str.find(':', mi_break+1)
+            days = int(cost_str[:day_break])
+            hrs = int(cost_str[day_break+1:hr_break])
+            mins = int(cost_str[hr_break+1:mi_break])
+            sec = float(cost_str[mi_break+1:])
+            cost_in_msec = 1e3 * (3600*24*days + 3600 * hrs+ 60 * mins + sec)
+            # util.log(f'stage {stage_name} cost {cost_str} ({cost_in_msec} in msec)')
+            cost_dic[stage_name] = cost_in_msec
+    return cost_dic
+
 class WallclockBreakdownTimer(FeatStatTabler):
     # SCHEMES = KEY_PRED_SCHEMES
     SCHEMES = ['cmb']
@@ -958,37 +990,24 @@ class WallclockBreakdownTimer(FeatStatTabler):
         self.stage_list = []
 
     def _fl_to_raw_data(self, fl):
+        tracefn = fl.performance_trace
         logfn = fl.performance_log
-        if not os.path.isfile(logfn):
+        if os.path.isfile(tracefn):
+            util.log(f'reading {tracefn}')
+            cost_dic = {}
+            for costs in perftrace.stage_costs(tracefn).values():
+                for stage_name, sec in costs.items():
+                    cost_dic[stage_name] = 1e3 * sec
+        elif os.path.isfile(logfn):
+            util.log(f'reading legacy log {logfn}')
+            cost_dic = _legacy_cost_in_msec(logfn)
+        else:
             yield None, None
             return
-        util.log(f'reading {logfn}')
-        BREAKER = ' cost '
-        cost_dic = {}
-        with open(logfn, 'r') as f:
-            for line in f:
-                loc = line.find(BREAKER)
-                if loc < 0:
-                    continue
-                cost_str = line[loc+len(BREAKER):].strip()
-                line = line.replace('[', ' ')
-                line = line.replace(']', ' ')
-                split = line.split()
-                stage_name = split[0]
-                day_break = cost_str.find('+')
-                hr_break = cost_str.find(':')
-                mi_break = cost_str.find(':', hr_break+1)
-                sec_break = cost_str.find(':', mi_break+1)
-                days = int(cost_str[:day_break])
-                hrs = int(cost_str[day_break+1:hr_break])
-                mins = int(cost_str[hr_break+1:mi_break])
-                sec = float(cost_str[mi_break+1:])
-                cost_in_msec = 1e3 * (3600*24*days + 3600 * hrs+ 60 * mins + sec)
-                if stage_name not in self.stage_set:
-                    self.stage_set.add(stage_name)
-                    self.stage_list.append(stage_name)
-                # util.log(f'stage {stage_name} cost {cost_str} ({cost_in_msec} in msec)')
-                cost_dic[stage_name] = cost_in_msec
+        for stage_name in cost_dic:
+            if stage_name not in self.stage_set:
+                self.stage_set.add(stage_name)
+                self.stage_list.append(stage_name)
         for stage_name in self.stage_list:
             # util.log(f'yielding {stage_name} cost_dic[stage_name]')
             yield stage_name, cost_dic[stage_name] if stage_name in cost_dic else None
@@ -1073,6 +1092,78 @@ def _print_latex(matrix, float_fmt="{0:.2f}", file=None, align=4):
             end = "&"
         print("\\\\", file=f)
 
+def condor_jobs(args):
+    for iodir in args.iodirs:
+        log_fn = os.path.join(iodir, 'log') if os.path.isdir(iodir) else iodir
+        ulog = condor_log.parse(log_fn)
+        print('{}: {}'.format(log_fn, ulog.progress()))
+        if args.out:
+            with open(args.out, 'a') as f:
+                writer = csv.writer(f)
+                for row in ulog.rows():
+                    writer.writerow([log_fn] + row)
+        else:
+            for row in ulog.rows():
+                print('\t'.join([str(e) for e in row]))
+
+def condor_profile_tool(args):
+    all_samples = []
+    for iodir in args.iodirs:
+        log_fn = os.path.join(iodir, 'log') if os.path.isdir(iodir) else iodir
+        samples = condor_profile.samples_from_log(condor_log.parse(log_fn), margin=args.margin, request_mb=args.request_memory)
+        all_samples += samples
+        print('{}: {} samples, request_memory = {} MiB, request_cpus = {}'.format(
+              log_fn, len(samples),
+              condor_profile.estimate_memory(samples, margin=args.margin, quantile=args.quantile),
+              condor_profile.estimate_cpus(samples, args.max_cpus)))
+    if len(args.iodirs) > 1:
+        print('All: {} samples, request_memory = {} MiB, request_cpus = {}'.format(
+              len(all_samples),
+              condor_profile.estimate_memory(all_samples, margin=args.margin, quantile=args.quantile),
+              condor_profile.estimate_cpus(all_samples, args.max_cpus)))
+
+def trace(args):
+    trial_list = util.rangestring_to_list(args.trial_range)
+    fns = []
+    for ws_dir in args.dirs:
+        ws = util.Workspace(ws_dir)
+        for trial in trial_list:
+            fn = ws.performance_trace_file(trial_override=trial)
+            if not os.path.isfile(fn):
+                util.log("{} does not exist, skipping".format(fn))
+                continue
+            fns.append(fn)
+    n = perftrace.export_chrome(fns, args.out)
+    util.log(f'{n} trace events from {len(fns)} files written to {args.out}, open it with chrome://tracing or https://ui.perfetto.dev')
+
+def telemetry_tool(args):
+    fns = telemetry.find_files(args.paths)
+    if not fns:
+        util.fatal('No telemetry ({}) files found under {}'.format(telemetry.SUFFIX, args.paths))
+    groups = OrderedDict()
+    for fn in fns:
+        try:
+            summaries = telemetry.summarize(fn)
+        except (OSError, ValueError) as e:
+            util.warn('Skipping {}: {}'.format(fn, e))
+            continue
+        groups.setdefault(os.path.dirname(fn), []).extend(summaries)
+    if args.out:
+        with open(args.out, 'w') as f:
+            writer = csv.writer(f)
+            keys = ['file', 'attempt', 'call'] + telemetry.SUMMARY_COLUMNS + ['discrete_check', 'samples', 'end']
+            writer.writerow(keys)
+            for summaries in groups.values():
+                for s in summaries:
+                    writer.writerow([s[k] for k in keys])
+        util.ack('Per-call telemetry summaries written to {}'.format(args.out))
+    print('{:<12} {:>12} {:>12} {:>12}'.format('', 'median', 'p90', 'max'))
+    for d, summaries in groups.items():
+        agg = telemetry.aggregate(summaries)
+        print('{}: {} solve calls, ended by {}'.format(d, len(summaries), agg['end']))
+        for col in telemetry.SUMMARY_COLUMNS:
+            print('{:<12} {}'.format(col, ' '.join(['{:>12.4g}'.format(v) for v in agg[col]])))
+
 function_dict = {
         'conclude' : conclude,
         'breakdown' : breakdown,
@@ -1083,6 +1174,10 @@ function_dict = {
         'solve' : solve,
         'timing_the_planner' : timing_the_planner,
         'condor_hours' : condor_hours,
+        'trace' : trace,
+        'condor_jobs' : condor_jobs,
+        'condor_profile' : condor_profile_tool,
+        'telemetry' : telemetry_tool,
 }
 
 def setup_parser(subparsers):
@@ -1150,5 +1245,25 @@ def setup_parser(subparsers):
     p.add_argument('dirs', help='Archived workspace directory, must include condor log files',
                    nargs='+')
 
+    p = toolp.add_parser('trace', help='Export the performance trace to Chrome/Perfetto trace format')
+    p.add_argument('--trial_range', help='range of trials', type=str, required=True)
+    p.add_argument('--out', help='Output JSON file', default='trace.json')
+    p.add_argument('dirs', help='Workspace directory', nargs='+')
+
+    p = toolp.add_parser('condor_jobs', help='Show the per-job states, wall/CPU time, memory and hold reasons from HTCondor logs')
+    p.add_argument('--out', help='Append the per-job table to this CSV file instead of printing it', default='')
+    p.add_argument('iodirs', help='HTCondor log files, or directories that contain the log file', nargs='+')
+
+    p = toolp.add_parser('condor_profile', help='Estimate request_memory/request_cpus from recorded HTCondor logs')
+    p.add_argument('--margin', help='Safety margin over the measured peak memory', type=float, default=1.25)
+    p.add_argument('--quantile', help='Quantile of the per-job peak memory', type=float, default=0.99)
+    p.add_argument('--max_cpus', help='Threads the stage can use', type=int, default=1)
+    p.add_argument('--request_memory', help='request_memory (MiB) of the jobs held for exceeding it', type=int, default=condor_profile.DEFAULT_MEMORY_MB)
+    p.add_argument('iodirs', help='HTCondor log files, or directories that contain the log file', nargs='+')
+
+    p = toolp.add_parser('telemetry', help='Summarize the solver telemetry (.tlm) of se3solver.py solve --telemetry, aggregated per directory (i.e. per stage)')
+    p.add_argument('--out', help='Also write the per-call summaries to this CSV file', default='')
+    p.add_argument('paths', help='Telemetry files, or directories to search recursively', nargs='+')
+
 def run(args):
     function_dict[args.tool_name](args)
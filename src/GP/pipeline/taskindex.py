@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+taskindex.py -- registry of per-task output files
+
+Each HTCondor task appends one line (task_id, file name, size) to
+<output directory>/.task_outputs.jsonl after writing its output, and readers
+get the complete set from this file instead of probing prefix0suffix,
+prefix1suffix, ... one by one, which costs one metadata round trip per file
+on network file systems and stops at the first missing index.
+
+Directories written before the registry existed (or by tasks that do not
+record their outputs) are listed with a single os.scandir.
+'''
+
+import os
+import re
+import json
+
+INDEX_FILE = '.task_outputs.jsonl'
+
+_TRAILING_ID = re.compile(r'(\d+)\D*$')
+
+def index_file(indir):
+    return os.path.join(indir, INDEX_FILE)
+
+def record(fn, task_id=None):
+    '''
+    Register fn as the output of task_id, which defaults to the last integer
+    in the file name (e.g. 7 for bloom-from_7.npz). Files without any integer
+    in the name are not registered.
+    '''
+    fn = str(fn)
+    base = os.path.basename(fn)
+    if task_id is None:
+        m = _TRAILING_ID.search(base)
+        if m is None:
+            return False
+        task_id = int(m.group(1))
+    line = json.dumps({'task_id': int(task_id), 'path': base, 'size': os.path.getsize(fn)}) + '\n'
+    import fcntl
+    # lockf (unlike flock) is also honored by NFS clients on other hosts
+    with open(index_file(os.path.dirname(os.path.abspath(fn))), 'a') as f:
+        fcntl.lockf(f, fcntl.LOCK_EX)
+        try:
+            f.write(line)
+            f.flush()
+        finally:
+            fcntl.lockf(f, fcntl.LOCK_UN)
+    return True
+
+class TaskOutputs(object):
+    '''
+    Output files of the tasks in one directory, keyed by task id.
+    source: 'index', 'scandir', or 'index+scandir' if the registry had gaps
+            and was completed by scanning the directory.
+    '''
+    def __init__(self, indir, files, source, sizes=None):
+        self.indir = indir
+        self._files = files
+        self.source = source
+        self._sizes = {} if sizes is None else sizes
+
+    def __len__(self):
+        return len(self._files)
+
+    def __contains__(self, task_id):
+        return task_id in self._files
+
+    @property
+    def indices(self):
+        return sorted(self._files.keys())
+
+    @property
+    def files(self):
+        return [self._files[i] for i in self.indices]
+
+    @property
+    def end(self):
+        '''
+        One past the largest task id, i.e. the number of tasks if complete
+        '''
+        return max(self._files.keys()) + 1 if self._files else 0
+
+    def path(self, task_id):
+        return self._files[task_id]
+
+    def finished(self, task_id):
+        '''
+        True if task_id is in the registry, and its output is still there
+        with the recorded size. Outputs deleted or truncated after they were
+        recorded, or only found by scanning the directory, do not count.
+        '''
+        if task_id not in self._sizes:
+            return False
+        try:
+            return os.path.getsize(self._files[task_id]) == self._sizes[task_id]
+        except OSError:
+            return False
+
+    def gaps(self, expected=None):
+        '''
+        Missing task ids in [0, expected), expected defaults to end
+        '''
+        total = self.end if expected is None else expected
+        return [i for i in range(total) if i not in self._files]
+
+    def contiguous(self):
+        '''
+        Files of tasks 0, 1, ... up to the first gap
+        '''
+        ret = []
+        for i in range(self.end):
+            if i not in self._files:
+                break
+            ret.append(self._files[i])
+        return ret
+
+def _match(prefix, suffix):
+    return re.compile('^' + re.escape(prefix) + r'(\d+)' + re.escape(suffix) + '$')
+
+def _read_index(indir, pattern, sizes=None):
+    ret = {}
+    try:
+        with open(index_file(indir), 'r') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                m = pattern.match(rec['path'])
+                if m is None or int(m.group(1)) != rec['task_id']:
+                    continue
+                # Later records are from reruns
+                ret[rec['task_id']] = os.path.join(indir, rec['path'])
+                if sizes is not None:
+                    sizes[rec['task_id']] = rec.get('size')
+    except OSError:
+        return None
+    return ret
+
+def _scan(indir, pattern):
+    ret = {}
+    with os.scandir(indir) as it:
+        for entry in it:
+            m = pattern.match(entry.name)
+            if m is not None:
+                ret[int(m.group(1))] = os.path.join(indir, entry.name)
+    return ret
+
+def discover(indir, prefix, suffix, expected=None, rescan=False):
+    '''
+    Return TaskOutputs of files named <prefix><task id><suffix> under indir.
+
+    expected: number of tasks. If the registry misses any of them, the
+              directory is scanned in case some outputs were not recorded.
+    rescan: always scan the directory
+    '''
+    pattern = _match(prefix, suffix)
+    sizes = {}
+    files = None if rescan else _read_index(indir, pattern, sizes)
+    if files is None:
+        if not os.path.isdir(indir):
+            return TaskOutputs(indir, {}, 'scandir')
+        return TaskOutputs(indir, _scan(indir, pattern), 'scandir')
+    ret = TaskOutputs(indir, files, 'index', sizes)
+    if ret.gaps(expected):
+        files.update(_scan(indir, pattern))
+        ret = TaskOutputs(indir, files, 'index+scandir', sizes)
+    return ret
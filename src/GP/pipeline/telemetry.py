@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+telemetry.py -- time series of OmplDriver.solve counters
+
+With `se3solver.py solve --telemetry`, the driver samples its counters every
+--telemetry_interval seconds into <output>.tlm (see lib/pyse3ompl/telemetry.h
+for the layout): tree size, motion checks (valid/invalid), discrete state
+checks, time spent in motion checks and KNN queries, and the resident memory.
+Records are flushed one by one, so jobs killed by HTCondor still leave their
+series behind.
+
+Reruns append to the same file, and each run of se3solver.py tags its records
+with an attempt id (the UNIX time it started), since call numbers restart
+from 0. Files written before the attempt column existed are read as a single
+attempt 0.
+
+`facade.py stats telemetry` summarizes each solve call of each attempt:
+
+    mc_rate: motion checks per second
+    reject: fraction of checked motions that are invalid
+    mc_share, knn_share: fraction of the wall time in motion checks and in
+                         KNN queries. The rest is tree bookkeeping and sampling
+    stalled: longest interval (seconds) without new motion checks
+    end: how the call ended, STAGNATION, BUDGET, FINAL (solved or out of
+         time), or 'killed' if the series stops before the end of the call
+
+and aggregates them over the calls (e.g. the HTCondor tasks of a stage).
+'''
+
+import os
+import struct
+import numpy as np
+
+SUFFIX = '.tlm'
+_MAGIC = b'OSRTLM1\0'
+
+EVENT_NAMES = {0: 'SAMPLE', 1: 'STAGNATION', 2: 'BUDGET', 3: 'FINAL'}
+
+def telemetry_file(out_fn):
+    '''
+    Telemetry file next to the output file (or in the output directory)
+    '''
+    if os.path.isdir(out_fn):
+        return os.path.join(out_fn, 'telemetry' + SUFFIX)
+    return os.path.splitext(out_fn)[0] + SUFFIX
+
+def solver_arguments(ws):
+    '''
+    Arguments of se3solver.py solve that enable the telemetry, according to
+    [Solver] Telemetry and TelemetryInterval
+    '''
+    if not ws.config.getboolean('Solver', 'Telemetry', fallback=True):
+        return []
+    return ['--telemetry', '--telemetry_interval', ws.config.getfloat('Solver', 'TelemetryInterval', fallback=10.0)]
+
+def load(fn):
+    '''
+    Records of fn as a structured array, with one field per column
+    '''
+    with open(fn, 'rb') as f:
+        data = f.read()
+    if data[:len(_MAGIC)] != _MAGIC:
+        raise ValueError('{} is not a telemetry file'.format(fn))
+    pos = len(_MAGIC)
+    ncol, = struct.unpack_from('<I', data, pos)
+    pos += 4
+    names = []
+    for _ in range(ncol):
+        end = data.index(b'\0', pos)
+        names.append(data[pos:end].decode())
+        pos = end + 1
+    dtype = np.dtype([(name, '<f8') for name in names])
+    # Drop the partial record of a killed job
+    nrec = (len(data) - pos) // dtype.itemsize
+    return np.frombuffer(data, dtype=dtype, count=nrec, offset=pos)
+
+def _longest_stall(rec):
+    if rec.shape[0] < 2:
+        return 0.0
+    changed = np.concatenate(([True], np.diff(rec['motion_check']) != 0))
+    t = rec['time'][changed]
+    t = np.append(t, rec['time'][-1])
+    return float(np.max(np.diff(t)))
+
+def _end_event(events):
+    events = set(events.astype(int).tolist())
+    for e in [1, 2, 3]:
+        if e in events:
+            return EVENT_NAMES[e]
+    return 'killed'
+
+def summarize(fn):
+    '''
+    One dict per solve call in fn, in the order of (attempt, call)
+    '''
+    records = load(fn)
+    if 'attempt' in records.dtype.names:
+        attempts = records['attempt']
+    else:
+        attempts = np.zeros(records.shape[0])
+    ret = []
+    keys = sorted(set(zip(attempts.tolist(), records['call'].tolist())))
+    for attempt, call in keys:
+        rec = records[(attempts == attempt) & (records['call'] == call)]
+        last = rec[-1]
+        wall = max(last['time'], 1e-9)
+        checked = last['motion_valid'] + last['motion_invalid']
+        ret.append({
+            'file': fn,
+            'attempt': attempt,
+            'call': int(call),
+            'seconds': float(last['time']),
+            'samples': int(rec.shape[0]),
+            'tree_size': int(last['tree_size']),
+            'motion_check': int(last['motion_check']),
+            'discrete_check': int(last['discrete_check']),
+            'mc_rate': float(last['motion_check'] / wall),
+            'reject': float(last['motion_invalid'] / checked) if checked > 0 else 0.0,
+            'mc_share': float(last['motion_check_time'] * 1e-3 / wall),
+            'knn_share': float(last['knn_query_time'] * 1e-3 / wall),
+            'peak_rss_mb': float(np.max(rec['rss_mb'])),
+            'stalled': _longest_stall(rec),
+            'end': _end_event(rec['event']),
+        })
+    return ret
+
+def find_files(paths):
+    '''
+    Telemetry files in paths, searching directories recursively
+    '''
+    ret = []
+    for p in paths:
+        if os.path.isdir(p):
+            for root, _, files in os.walk(p):
+                ret += [os.path.join(root, fn) for fn in files if fn.endswith(SUFFIX)]
+        else:
+            ret.append(p)
+    return sorted(ret)
+
+SUMMARY_COLUMNS = ['seconds', 'tree_size', 'motion_check', 'mc_rate', 'reject',
+                   'mc_share', 'knn_share', 'peak_rss_mb', 'stalled']
+
+def aggregate(summaries, quantiles=(0.5, 0.9, 1.0)):
+    '''
+    {column: [quantiles]} of the summaries, plus counts of the end events
+    '''
+    ret = {}
+    for col in SUMMARY_COLUMNS:
+        values = np.array([s[col] for s in summaries], dtype=np.float64)
+        ret[col] = [float(np.quantile(values, q)) for q in quantiles] if values.size > 0 else []
+    ends = {}
+    for s in summaries:
+        ends[s['end']] = ends.get(s['end'], 0) + 1
+    ret['end'] = ends
+    return ret
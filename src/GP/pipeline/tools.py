@@ -686,6 +686,210 @@ def simplify(args):
         matio.savetxt(fl.sim_out_fn, unit_sim_q)
         util.log(f'Simplified trajectory written to {fl.sim_out_fn}')
 
+def benchmark_mesh_cache(args):
+    import time
+    import shutil
+    import tempfile
+    import pyosr
+    print('{:<40} {:>12} {:>12} {:>12} {:>9}'.format('Puzzle', 'No cache (s)', 'Cold (s)', 'Warm (s)', 'Speedup'))
+    for puzzle_fn in args.puzzle_fn:
+        cache_dir = tempfile.mkdtemp(prefix='meshcache-')
+        def measure(env):
+            os.environ['OSR_MESH_CACHE_DIR'] = env
+            best = None
+            for _ in range(args.repeat):
+                t = time.perf_counter()
+                util._create_unit_world(puzzle_fn)
+                d = time.perf_counter() - t
+                best = d if best is None else min(best, d)
+            return best
+        saved = os.environ.get('OSR_MESH_CACHE_DIR', None)
+        try:
+            nocache = measure('')
+            # The first load fills the cache
+            os.environ['OSR_MESH_CACHE_DIR'] = cache_dir
+            t = time.perf_counter()
+            util._create_unit_world(puzzle_fn)
+            cold = time.perf_counter() - t
+            warm = measure(cache_dir)
+        finally:
+            if saved is None:
+                del os.environ['OSR_MESH_CACHE_DIR']
+            else:
+                os.environ['OSR_MESH_CACHE_DIR'] = saved
+            shutil.rmtree(cache_dir)
+        print('{:<40} {:>12.3f} {:>12.3f} {:>12.3f} {:>8.1f}x'.format(puzzle_fn, nocache, cold, warm, nocache / warm))
+    print('Cache statistics {}'.format(pyosr.get_mesh_cache_statistics()))
+
+def benchmark_motion_check(args):
+    import time
+    import pyosr
+    uw = util.create_unit_world(args.puzzle_fn)
+    keys = matio.load(args.keys, key=args.key)
+    keys = uw.translate_ompl_to_unit(keys)
+    rng = np.random.default_rng(args.seed)
+    qs0 = keys[rng.integers(keys.shape[0], size=args.npairs)]
+    qs1 = keys[rng.integers(keys.shape[0], size=args.npairs)]
+    cres = uw.recommended_cres if args.cres is None else args.cres
+    modes = [('linear', pyosr.MOTION_CHECK_LINEAR),
+             ('bisection', pyosr.MOTION_CHECK_BISECTION),
+             ('distance', pyosr.MOTION_CHECK_DISTANCE)]
+    print('{:<12} {:>10} {:>16} {:>10}'.format('Mode', 'Valid', 'Checks/motion', 'Time (s)'))
+    reference = None
+    for name, mode in modes:
+        uw.motion_check_mode = mode
+        uw.reset_discrete_check_count()
+        t = time.perf_counter()
+        valid = uw.calculate_visibility_pair(qs0, True, qs1, True, cres, enable_mt=False)
+        d = time.perf_counter() - t
+        print('{:<12} {:>10} {:>16.2f} {:>10.3f}'.format(name, int(np.sum(valid)),
+              uw.discrete_check_count / args.npairs, d))
+        if reference is None:
+            reference = valid
+        elif not np.array_equal(reference, valid):
+            util.warn(f'[benchmark_motion_check] {name} disagrees with linear on {np.sum(reference != valid)} motions')
+
+def _uniform_ompl_states(rng, lo, hi, n):
+    tr = lo + (hi - lo) * rng.random((n, 3))
+    # Shoemake's uniform quaternion, w-last as OMPL
+    u1, u2, u3 = rng.random(n), 2 * np.pi * rng.random(n), 2 * np.pi * rng.random(n)
+    rot = np.stack([np.sqrt(1 - u1) * np.sin(u2), np.sqrt(1 - u1) * np.cos(u2),
+                    np.sqrt(u1) * np.sin(u3), np.sqrt(u1) * np.cos(u3)], axis=1)
+    return np.concatenate([tr, rot], axis=1)
+
+def _collision_state_sets(uw, puzzle_fn, n, seed):
+    '''
+    Deterministic free, colliding and contact-boundary unit states, like
+    collisionbench does
+    '''
+    _, config = parse_ompl.parse_simple(puzzle_fn)
+    lo = parse_ompl.read_xyz(config, 'problem', 'volume.min')
+    hi = parse_ompl.read_xyz(config, 'problem', 'volume.max')
+    rng = np.random.default_rng(seed)
+    free, colliding = [], []
+    attempts = 0
+    while (len(free) < n or len(colliding) < n) and attempts < 1000 * n:
+        for q in uw.translate_ompl_to_unit(_uniform_ompl_states(rng, lo, hi, n)):
+            target = free if uw.is_valid_state(q) else colliding
+            if len(target) < n:
+                target.append(q)
+        attempts += n
+    if not free or not colliding:
+        msg = f'[benchmark_collision] cannot sample both free and colliding states in the volume of {puzzle_fn}'
+        util.fatal(msg)
+        raise RuntimeError(msg)
+    free, colliding = np.array(free), np.array(colliding)
+    boundary = np.array([uw.transit_state_to_with_contact(q, colliding[i % len(colliding)], uw.recommended_cres)[0]
+                         for i, q in enumerate(free)])
+    return {'free': free, 'colliding': colliding, 'boundary': boundary}, attempts
+
+def benchmark_collision(args):
+    import time
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+    from . import solve2
+    uw = util.create_unit_world(args.puzzle_fn)
+    cres = uw.recommended_cres
+    sets, attempts = _collision_state_sets(uw, args.puzzle_fn, args.nstates, args.seed)
+    util.log(f'[benchmark_collision] {len(sets["free"])} free, {len(sets["colliding"])} colliding states from {attempts} samples')
+    free = sets['free']
+    motions = {
+            'free_to_free': (free, np.roll(free, -1, axis=0)),
+            'free_to_colliding': (free, sets['colliding'][np.arange(len(free)) % len(sets['colliding'])]),
+            'boundary_to_free': (sets['boundary'], free),
+    }
+    max_threads = args.threads if args.threads > 0 else os.cpu_count()
+    thread_counts = sorted(set([1 << i for i in range(max_threads.bit_length()) if (1 << i) < max_threads] + [max_threads]))
+    def best_of(f):
+        best = None
+        for _ in range(args.repeat):
+            t = time.perf_counter()
+            f()
+            d = time.perf_counter() - t
+            best = d if best is None else min(best, d)
+        return best
+    # pyosr releases the GIL in these calls, so Python threads run in parallel
+    def parallel(threads, func, n):
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            return best_of(lambda: list(executor.map(func, range(n), chunksize=max(1, n // (threads * 8)))))
+    records = []
+    def record(primitive, set_name, threads, queries, seconds, **extra):
+        rec = {'primitive': primitive, 'set': set_name, 'threads': threads, 'queries': queries,
+               'seconds': seconds, 'queries_per_second': queries / seconds if seconds > 0 else 0.0}
+        rec.update(extra)
+        records.append(rec)
+        util.log('[benchmark_collision] {:<28} {:<18} {:>3} threads {:>12.1f} queries/s'.format(primitive, set_name, threads, rec['queries_per_second']))
+    for threads in thread_counts:
+        for name, qs in sets.items():
+            record('isValid', name, threads, len(qs), parallel(threads, lambda i: uw.is_valid_state(qs[i]), len(qs)))
+            record('isDisentangled', name, threads, len(qs), parallel(threads, lambda i: uw.is_disentangled(qs[i]), len(qs)))
+        for name, (qs0, qs1) in motions.items():
+            record('transitStateToWithContact', name, threads, len(qs0),
+                   parallel(threads, lambda i: uw.transit_state_to_with_contact(qs0[i], qs1[i], cres), len(qs0)))
+    # calculateVisibilityMatrix2 and validateMotionPairs manage their own threads
+    n0 = min(256, len(sets['boundary']))
+    for enable_mt in [False, True]:
+        def vismat():
+            uw.reset_discrete_check_count()
+            uw.calculate_visibility_matrix2(sets['boundary'][:n0], True, free[:n0], True, cres, enable_mt=enable_mt)
+        seconds = best_of(vismat)
+        record('calculateVisibilityMatrix2', 'boundary_x_free', max_threads if enable_mt else 1, n0 * n0, seconds,
+               discrete_checks_per_query=uw.discrete_check_count / (n0 * n0))
+    driver = solve2.create_driver(args.puzzle_fn)
+    for name, (qs0, qs1) in motions.items():
+        ompl0, ompl1 = uw.translate_unit_to_ompl(qs0), uw.translate_unit_to_ompl(qs1)
+        record('validateMotionPairs', name, 1, len(ompl0), best_of(lambda: driver.validate_motion_pairs(ompl0, ompl1)))
+    report = {'puzzle': args.puzzle_fn, 'seed': args.seed, 'cres': cres, 'cpu_count': os.cpu_count(),
+              'sets': {'free': len(free), 'colliding': len(sets['colliding']),
+                       'boundary': len(sets['boundary']), 'attempts': attempts},
+              'results': records}
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        util.ack(f'[benchmark_collision] results written to {args.out}')
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+def benchmark_contact_geometry(args):
+    import time
+    import json
+    uw = util.create_unit_world(args.puzzle_fn)
+    sets, attempts = _collision_state_sets(uw, args.puzzle_fn, args.nstates, args.seed)
+    report = {'puzzle': args.puzzle_fn, 'seed': args.seed, 'results': []}
+    for name in ['boundary', 'colliding', 'free']:
+        qs = sets[name]
+        t = time.perf_counter()
+        single = [uw.intersecting_geometry(q, True) for q in qs]
+        t_single = time.perf_counter() - t
+        t = time.perf_counter()
+        V, F, voff, foff = uw.intersecting_geometry_batch(qs, True)
+        t_batch = time.perf_counter() - t
+        mismatch = sum([1 for i, (SV, SF) in enumerate(single) if SF.shape[0] != foff[i+1] - foff[i]])
+        t = time.perf_counter()
+        for q in qs:
+            uw.intersecting_segments(q)
+        t_seg_single = time.perf_counter() - t
+        t = time.perf_counter()
+        uw.intersecting_segments_batch(qs)
+        t_seg_batch = time.perf_counter() - t
+        rec = {'set': name, 'states': len(qs),
+               'geometry_seconds': t_single, 'geometry_batch_seconds': t_batch,
+               'segments_seconds': t_seg_single, 'segments_batch_seconds': t_seg_batch,
+               'face_count_mismatches': mismatch}
+        report['results'].append(rec)
+        util.log('[benchmark_contact_geometry] {:<10} {:>6} states, mesh boolean {:.3f} -> {:.3f} sec., segments {:.3f} -> {:.3f} sec.'.format(
+                 name, len(qs), t_single, t_batch, t_seg_single, t_seg_batch))
+        if mismatch > 0:
+            util.warn(f'[benchmark_contact_geometry] {mismatch} states of the {name} set have different numbers of faces in the batched results')
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        util.ack(f'[benchmark_contact_geometry] results written to {args.out}')
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
 def dump_training_data(args):
     ws = util.Workspace(args.dir)
     from . import hg_launcher
@@ -816,6 +1020,10 @@ function_dict = {
         'animate' : animate,
         'blender' : blender_entrance,
         'simplify' : simplify,
+        'benchmark_mesh_cache' : benchmark_mesh_cache,
+        'benchmark_motion_check' : benchmark_motion_check,
+        'benchmark_collision' : benchmark_collision,
+        'benchmark_contact_geometry' : benchmark_contact_geometry,
         'dump_training_data' : dump_training_data,
         'debug' : debug,
 }
@@ -961,6 +1169,32 @@ def setup_parser(subparsers):
     p.add_argument('--days', help='Time limit of optimization', type=float, default=0.01)
     p.add_argument('dir', help='Workspace directory')
 
+    p = toolp.add_parser('benchmark_mesh_cache', help='Compare the time to create UnitWorld objects with and without the binary mesh cache')
+    p.add_argument('--repeat', help='Report the best of this many loads', type=int, default=3)
+    p.add_argument('puzzle_fn', help='OMPL config of puzzles', nargs='+')
+
+    p = toolp.add_parser('benchmark_motion_check', help='Compare the discrete checks per motion of UnitWorld motion validation engines')
+    p.add_argument('--key', help='Key of the configurations in the keys file', default='KEYQ_OMPL')
+    p.add_argument('--npairs', help='Number of random motions b/w the configurations', type=int, default=1000)
+    p.add_argument('--cres', help='Collision resolution, default to the recommended one of the puzzle', type=float, default=None)
+    p.add_argument('--seed', help='Random seed', type=int, default=0)
+    p.add_argument('puzzle_fn', help='OMPL config')
+    p.add_argument('keys', help='File of OMPL configurations, e.g. the output of keyconf')
+
+    p = toolp.add_parser('benchmark_collision', help='Micro-benchmarks of collision checking and motion validation primitives, in JSON. The C++ counterpart is bin/collisionbench')
+    p.add_argument('--nstates', help='Number of states in each of the free, colliding and contact-boundary sets', type=int, default=1024)
+    p.add_argument('--threads', help='Maximal number of threads, default to all cores', type=int, default=0)
+    p.add_argument('--repeat', help='Report the best of this many runs', type=int, default=3)
+    p.add_argument('--seed', help='Random seed of the state sets', type=int, default=0)
+    p.add_argument('--out', help='JSON output file, default to stdout', default=None)
+    p.add_argument('puzzle_fn', help='OMPL config')
+
+    p = toolp.add_parser('benchmark_contact_geometry', help='Compare the per-state and batched extraction of intersecting geometries and segments')
+    p.add_argument('--nstates', help='Number of states in each of the free, colliding and contact-boundary sets', type=int, default=256)
+    p.add_argument('--seed', help='Random seed of the state sets', type=int, default=0)
+    p.add_argument('--out', help='JSON output file, default to stdout', default=None)
+    p.add_argument('puzzle_fn', help='OMPL config')
+
     p = toolp.add_parser('debug', help='Temporary debugging code. Eveything should be hardcoded')
     p.add_argument('arguments', help='Custom arguments', nargs='*')
 
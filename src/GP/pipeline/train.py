@@ -144,6 +144,78 @@ def wait_for_training(args, ws):
         util.log("[wait_for_training] {} (pid: {}) waited".format(geo_type, pid))
         write_pidfile(pidfile, -1)
 
+"""
+Freeze the trained checkpoint into an inference-only graph for CPU prediction.
+
+The weight format is controlled by Prediction.FrozenGraphWeights (fp32, fp16 or int8).
+"""
+def _freeze(args, ws, geo_type):
+    weight_type = ws.config.get('Prediction', 'FrozenGraphWeights', fallback='') or 'fp32'
+    if ws.nn_tags:
+        params, ws.nn_profile = hg_launcher.create_config_from_tagstring(ws.nn_tags)
+    elif ws.nn_profile:
+        params = hg_launcher.create_config_from_profile(ws.nn_profile)
+    else:
+        params = hg_launcher.create_default_config()
+    all_omplcfgs = []
+    cfg_to_puzzle_names = {}
+    all_puzzle_names = []
+    for puzzle_fn, puzzle_name in ws.training_puzzle_generator():
+        all_omplcfgs.append(puzzle_fn)
+        pnames = [f'{puzzle_name}.piece1', f'{puzzle_name}.piece2']
+        cfg_to_puzzle_names[puzzle_fn] = pnames
+        all_puzzle_names += pnames
+    params['all_ompl_configs'] = all_omplcfgs
+    params['all_puzzle_names'] = all_puzzle_names
+    params['cfg_to_puzzle_names'] = cfg_to_puzzle_names
+    params['what_to_render'] = geo_type
+    params['checkpoint_dir'] = ws.checkpoint_dir(geo_type) + '/'
+    params['dataset_name'] = f'{ws.dir}.{geo_type}'
+    if args.load_epoch is not None:
+        params['epoch_to_load'] = args.load_epoch
+    ws.timekeeper_start('freeze_{}'.format(geo_type))
+    # Same as prediction, TF graphs are built in a separate process
+    proc = Process(target=hg_launcher.export_frozen_with_params, args=(params, None, weight_type))
+    proc.start()
+    proc.join()
+    ws.timekeeper_finish('freeze_{}'.format(geo_type))
+
+def freeze_rob(args, ws):
+    _freeze(args, ws, 'rob')
+
+def freeze_env(args, ws):
+    _freeze(args, ws, 'env')
+
+def freeze_both(args, ws):
+    _freeze(args, ws, 'both')
+
+def _apply_frozen_graph(ws, params):
+    weight_type = ws.config.get('Prediction', 'FrozenGraphWeights', fallback='')
+    if not weight_type:
+        return
+    epoch = hg_launcher.resolve_epoch(params['checkpoint_dir'], params['epoch_to_load'])
+    if epoch is None:
+        util.warn(f'[prediction] no checkpoint under {params["checkpoint_dir"]}, cannot use a frozen graph')
+        return
+    # Predictions are tagged with the hash of this checkpoint, the frozen
+    # graph must come from the same one
+    params['epoch_to_load'] = epoch
+    graph_fn = hg_launcher.frozen_graph_file(params['checkpoint_dir'], epoch, weight_type)
+    if not hg_launcher.frozen_graph_is_current(graph_fn, params['checkpoint_dir'], epoch):
+        util.log(f'[prediction] frozen graph {graph_fn} is missing or stale, freezing epoch {epoch}')
+        proc = Process(target=hg_launcher.export_frozen_with_params,
+                       args=(copy.deepcopy(params), graph_fn, weight_type))
+        proc.start()
+        proc.join()
+        if not hg_launcher.frozen_graph_is_current(graph_fn, params['checkpoint_dir'], epoch):
+            util.warn(f'[prediction] cannot freeze {graph_fn} (exit code {proc.exitcode}), restoring from the checkpoint instead')
+            return
+    params['frozen_graph'] = graph_fn
+    params['prediction_batch_size'] = ws.config.getint('Prediction', 'PredictionBatchSize', fallback=0)
+    params['intra_op_threads'] = ws.config.getint('Prediction', 'IntraOpThreads', fallback=0)
+    params['inter_op_threads'] = ws.config.getint('Prediction', 'InterOpThreads', fallback=0)
+    util.log(f'[prediction] using frozen graph {graph_fn}')
+
 """
 Note: we separate geo_type and checkpoint_geo_type.
 geo_type controls what to render as the testing image
@@ -200,6 +272,7 @@ def _predict_surface(args, ws, geo_type, generator, checkpoint_geo_type=None):
             params['output_dir'] = ws.checkpoint_dir(checkpoint_geo_type) + '/'
             params['prediction_output'] = ws.atex_prediction_file(puzzle_fn, geo_type)
         params['dataset_name'] = puzzle_name # Enforce the generated filename
+        _apply_frozen_graph(ws, params)
         util.log("[prediction] Predicting {}:{}".format(puzzle_fn, geo_type))
         # NEVER call launch_with_params in the same process for multiple times
         # TODO: add assertion to handle this problem
@@ -258,6 +331,7 @@ def _multinet_predict_surface(args, ws, geo_type):
             params['output_dir'] = ws.checkpoint_dir(checkpoint_geo_type) + '/'
             params['prediction_output'] = ws.atex_prediction_file(puzzle_fn, geo_type, netid=netid)
             params['dataset_name'] = puzzle_name # Enforce the generated filename
+            _apply_frozen_graph(ws, params)
 
             pred_name = 'predict_{}_with_netgroup#{}'.format(geo_type, netid)
             ws.timekeeper_start(pred_name, puzzle_name)
@@ -276,6 +350,39 @@ def _multinet_predict_surface(args, ws, geo_type):
             """
             ws.timekeeper_finish(pred_name, puzzle_name)
 
+"""
+Compare the checkpoint restoring path against the frozen graph on the first
+testing puzzle. Prediction.FrozenGraphWeights selects the frozen graph.
+"""
+def benchmark_predictor(args, ws):
+    weight_type = ws.config.get('Prediction', 'FrozenGraphWeights', fallback='') or 'fp32'
+    geo_type = 'rob'
+    checkpoint_geo_type = 'both' if os.path.isdir(ws.checkpoint_dir('both')) else geo_type
+    if ws.nn_tags:
+        params, ws.nn_profile = hg_launcher.create_config_from_tagstring(ws.nn_tags)
+    elif ws.nn_profile:
+        params = hg_launcher.create_config_from_profile(ws.nn_profile)
+    else:
+        params = hg_launcher.create_default_config()
+    puzzle_fn, puzzle_name = next(ws.test_puzzle_generator(args.puzzle_name if args.puzzle_name else ''))
+    pnames = [f'{puzzle_name}.piece1', f'{puzzle_name}.piece2']
+    params['all_puzzle_names'] = pnames
+    params['cfg_to_puzzle_names'] = {puzzle_fn: pnames}
+    params['all_ompl_configs'] = [puzzle_fn]
+    params['what_to_render'] = geo_type
+    params['checkpoint_dir'] = ws.checkpoint_dir(checkpoint_geo_type) + '/'
+    params['dataset_name'] = puzzle_name
+    params['prediction_epoch_size'] = 64
+    if args.load_epoch is not None:
+        params['epoch_to_load'] = args.load_epoch
+    params['prediction_batch_size'] = ws.config.getint('Prediction', 'PredictionBatchSize', fallback=0)
+    params['intra_op_threads'] = ws.config.getint('Prediction', 'IntraOpThreads', fallback=0)
+    params['inter_op_threads'] = ws.config.getint('Prediction', 'InterOpThreads', fallback=0)
+    graph_fn = hg_launcher.frozen_graph_file(params['checkpoint_dir'], params['epoch_to_load'], weight_type)
+    assert hg_launcher.frozen_graph_is_current(graph_fn, params['checkpoint_dir'], params['epoch_to_load']), \
+           f'{graph_fn} does not exist or comes from an older checkpoint, run freeze_{checkpoint_geo_type} first'
+    hg_launcher.benchmark_with_params(params, graph_fn)
+
 def multinet_predict(args, ws):
     global_gpu_lock(ws)
     _multinet_predict_surface(args, ws, 'rob')
@@ -293,6 +400,10 @@ function_dict = {
         'multinet_predict' : multinet_predict,
         'validate_rob' : validate_rob,
         'validate_env' : validate_env,
+        'freeze_rob' : freeze_rob,
+        'freeze_env' : freeze_env,
+        'freeze_both' : freeze_both,
+        'benchmark_predictor' : benchmark_predictor,
 }
 
 def setup_parser(subparsers):
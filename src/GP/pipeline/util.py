@@ -10,16 +10,22 @@ import subprocess
 import colorama
 import itertools
 import numpy as np
-import random
 from datetime import datetime;
 
 from . import parse_ompl
+from . import perftrace
+from . import matio
+from . import wsync
+from . import remote
+from . import taskindex
+from . import compress
 
 # CAVEAT: sys.executable is empty string on Condor Worker node.
 PYTHON = sys.executable
 #assert PYTHON is not None and PYTHON != '', 'Cannot find python through sys.executable, which is {}'.format(PYTHON)
 
 WORKSPACE_SIGNATURE_FILE = '.puzzle_workspace'
+SYNC_MANIFEST_DIR = '.wsync'
 # Core files
 WORKSPACE_CONFIG_FILE = 'config'
 CONDOR_TEMPLATE = 'template.condor'
@@ -116,7 +122,24 @@ workspace/
 |   |   +-- pds/        # Predefined sample set
 '''
 
+MESH_CACHE_DIR = '.meshcache'
+
+def mesh_cache_dir(puzzle_file):
+    '''
+    Directory of the binary mesh cache (see lib/osr/mesh_cache.h) for the
+    puzzle, next to the puzzle file so that all HTCondor tasks of the puzzle
+    share it.
+
+    The OSR_MESH_CACHE_DIR environment variable overrides it, and an empty
+    value disables the cache.
+    '''
+    if 'OSR_MESH_CACHE_DIR' in os.environ:
+        return os.environ['OSR_MESH_CACHE_DIR']
+    return os.path.join(os.path.dirname(os.path.abspath(puzzle_file)), MESH_CACHE_DIR)
+
 def _load_unit_world(uw, puzzle_file):
+    import pyosr
+    pyosr.set_mesh_cache_dir(mesh_cache_dir(puzzle_file))
     puzzle, config = parse_ompl.parse_simple(puzzle_file)
     uw.loadModelFromFile(puzzle.env_fn)
     uw.loadRobotFromFile(puzzle.rob_fn)
@@ -124,7 +147,37 @@ def _load_unit_world(uw, puzzle_file):
     uw.angleModel(0.0, 0.0)
     uw.recommended_cres = uw.scene_scale * config.getfloat('problem', 'collision_resolution', fallback=0.001)
 
+_world_cache = None
+
+'''
+Keep UnitWorld objects created by create_unit_world, keyed by the puzzle file.
+Used by persistent HTCondor workers (condor_worker.py), which run many tasks
+of the same puzzle in one process.
+
+The cached objects are never returned. Callers get copies made by
+UnitWorld.setupFrom, which shares the meshes but not the state.
+'''
+def enable_world_cache():
+    global _world_cache
+    if _world_cache is None:
+        _world_cache = {}
+
 def create_unit_world(puzzle_file):
+    if _world_cache is not None:
+        key = os.path.abspath(puzzle_file)
+        if key not in _world_cache:
+            _world_cache[key] = _create_unit_world(puzzle_file)
+        return _copy_unit_world(_world_cache[key])
+    return _create_unit_world(puzzle_file)
+
+def _copy_unit_world(proto):
+    import pyosr
+    uw = pyosr.UnitWorld()
+    uw.setupFrom(proto)
+    uw.recommended_cres = proto.recommended_cres
+    return uw
+
+def _create_unit_world(puzzle_file):
     # Well this is against PEP 08 but we do not always need pyosr
     # (esp in later pipeline stages)
     # Note pyosr is a heavy-weight module with
@@ -157,25 +210,14 @@ def create_offscreen_renderer(puzzle_file, resolution=256):
     _load_unit_world(r, puzzle_file)
     return r
 
-def _rsync(from_host, from_pather, to_host, to_pather, *paths):
-    # Note: do NOT use single target multiple source syntax
-    #       the target varies among source paths.
-    from_prefix = '' if from_host is None else from_host+':'
-    to_prefix = '' if to_host is None else to_host+':'
-    for rel_path in paths:
-        while True:
-            ret = shell(['rsync', '-aR',
-                         '{}{}/./{}'.format(from_prefix, from_pather(), rel_path),
-                         '{}{}/'.format(to_prefix, to_pather())])
-            if ret == 0:
-                break
-            to = random.uniform(3,7)
-            log(f"rsync failed. retry after {to} seconds")
-            time.sleep(to)
+def _rsync(from_host, from_pather, to_host, to_pather, *paths, manifest_fn=None, rsh=None):
+    # All paths are sent by a single rsync process, see wsync.py
+    wsync.sync(from_host, from_pather(), to_host, to_pather(), paths, manifest_fn=manifest_fn, rsh=rsh)
 
 def set_common_arguments(p):
     p.add_argument('--current_trial', help='Trial to solve the puzzle', type=int, default=0)
     p.add_argument('--override_config', help='Override the options. Syntax: SECTION.OPTION=VALUE Separated with semicolon (;)', type=str, default=None)
+    p.add_argument('--force_sync', help='Ignore the upload manifests under .wsync/ and let rsync compare every file, e.g. after the remote workspace was modified', action='store_true')
     p.add_argument('dir', help='Workspace directory')
 
 def update_config_with_dict(config, dic):
@@ -199,12 +241,17 @@ class Workspace(object):
         self._current_trial = 0
         self.nn_profile = ''
         self.nn_tags = ''
-        self._timekeeper = {}
+        self._tracer = None
+        self._meta_index = None
+        self._channels = {}
         # self._override_condor_host = None
         self._extra_condor_hosts = None
         self._override_config_string = None
         self._training_groups = None
         self._piece_list = None
+        # Upload manifests not to trust, see _deploy
+        self.force_sync = False
+        self._forced_manifests = set()
 
     def get_path(self, optname):
         return self.config.get('SYSTEM', optname)
@@ -351,6 +398,24 @@ class Workspace(object):
             self._uw_dic[puzzle_dir] = create_unit_world(self.condor_ws(puzzle_dir, PUZZLE_CFG_FILE))
         return self._uw_dic[puzzle_dir]
 
+    @property
+    def loopback_hosts(self):
+        hostlist = self.config.get('SYSTEM', 'LoopbackHosts', fallback='')
+        return [h.strip() for h in hostlist.split(',') if h.strip()]
+
+    def remote_channel(self, host):
+        '''
+        Return the command channel to host, which is shared by all remote
+        commands and transfers of this workspace. See remote.py
+        '''
+        if host not in self._channels:
+            persist = self.config.getint('SYSTEM', 'SSHControlPersist', fallback=600)
+            self._channels[host] = remote.create_channel(host, self.loopback_hosts, persist=persist)
+        return self._channels[host]
+
+    def remote_log_file(self, host):
+        return self.local_ws(PERFORMANCE_LOG_DIR, 'remote.{}.{}.log'.format(host, self.current_trial))
+
     def remote_command(self, host, exec_path, ws_path,
                        pipeline_part, cmd,
                        auto_retry=True,
@@ -375,39 +440,70 @@ class Workspace(object):
         if extra_args:
             script += ' {} '.format(extra_args)
         script += ' {ws}'.format(ws=ws_path)
-        if in_tmux:
-            # tmux needs a terminal
-            remoter = ['ssh', '-t', host]
-        else:
-            remoter = ['ssh', host]
-        ret = shell(remoter + [script])
-        while ret == 255:
-            if not auto_retry:
-                return ret
-            print("SSH Connection to {} is probably broken, retry after 5 secs".format(host))
-            time.sleep(5)
-            ret = shell(['ssh', host, script + ' --only_wait'])
-        if ret != 0:
+        channel = self.remote_channel(host)
+        log_fn = self.remote_log_file(host)
+        os.makedirs(os.path.dirname(log_fn), exist_ok=True)
+        with perftrace.span('remote_command', host=host, stage=cmd):
+            res = channel.run(script, tty=in_tmux, log_fn=log_fn)
+            while res.connection_lost:
+                if not auto_retry:
+                    return remote.SSH_EXIT_CONNECTION
+                print("SSH Connection to {} is probably broken, retry after 5 secs".format(host))
+                time.sleep(5)
+                res = channel.run(script + ' --only_wait', log_fn=log_fn)
+        if res.returncode != 0:
             print("Remote error, exiting")
             exit()
-        return ret
+        return res.returncode
 
     '''
     Note: directory must end with /
+
+    Uploads skip files that are unchanged since the last deployment to the same
+    remote workspace, according to the manifest under .wsync/ of the local
+    workspace. Use force=True, or --force_sync on the command line, if the
+    remote copy was modified or removed.
     '''
-    def deploy_to_condor(self, *paths):
-        shell(['ssh', self.condor_host, 'mkdir', '-p', self.condor_ws()])
-        _rsync(None, self.local_ws, self.condor_host, self.condor_ws, *paths)
+    def sync_manifest_file(self, host, remote_root):
+        name = '{}{}'.format(host, remote_root).replace('/', '_').replace(':', '_')
+        return self.local_ws(SYNC_MANIFEST_DIR, name + '.json')
+
+    def _deploy(self, host, pather, paths, force):
+        channel = self.remote_channel(host)
+        res = channel.run('mkdir -p {}'.format(pather()))
+        if res.connection_lost:
+            # run() has reset the master connection
+            res = channel.run('mkdir -p {}'.format(pather()))
+        if res.returncode != 0:
+            msg = '[deploy] cannot create {} on {} (exit code {})'.format(pather(), host, res.returncode)
+            fatal(msg)
+            raise RuntimeError(msg)
+        manifest_fn = self.sync_manifest_file(host, pather())
+        # --force_sync drops each manifest once, later uploads of the same
+        # process can trust the one rebuilt by the first
+        if self.force_sync and manifest_fn not in self._forced_manifests:
+            self._forced_manifests.add(manifest_fn)
+            force = True
+        if force and os.path.isfile(manifest_fn):
+            os.unlink(manifest_fn)
+        _rsync(None, self.local_ws, channel.rsync_host, pather, *paths,
+               manifest_fn=manifest_fn, rsh=channel.rsync_shell)
+
+    def _fetch(self, host, pather, paths):
+        channel = self.remote_channel(host)
+        _rsync(channel.rsync_host, pather, None, self.local_ws, *paths, rsh=channel.rsync_shell)
+
+    def deploy_to_condor(self, *paths, force=False):
+        self._deploy(self.condor_host, self.condor_ws, paths, force)
 
     def fetch_condor(self, *paths):
-        _rsync(self.condor_host, self.condor_ws, None, self.local_ws, *paths)
+        self._fetch(self.condor_host, self.condor_ws, paths)
 
-    def deploy_to_gpu(self, *paths):
-        shell(['ssh', self.gpu_host, 'mkdir', '-p', self.gpu_ws()])
-        _rsync(None, self.local_ws, self.gpu_host, self.gpu_ws, *paths)
+    def deploy_to_gpu(self, *paths, force=False):
+        self._deploy(self.gpu_host, self.gpu_ws, paths, force)
 
     def fetch_gpu(self, *paths):
-        _rsync(self.gpu_host, self.gpu_ws, None, self.local_ws, *paths)
+        self._fetch(self.gpu_host, self.gpu_ws, paths)
 
     def checkpoint_dir(self, geo_type):
         if self.nn_profile:
@@ -540,26 +636,67 @@ class Workspace(object):
         os.makedirs(self.local_ws(PERFORMANCE_LOG_DIR), exist_ok=True)
         return open(self.local_ws(PERFORMANCE_LOG_DIR, 'log.{}'.format(self.current_trial)), 'a')
 
+    def performance_trace_file(self, trial_override=None):
+        trial = self.current_trial if trial_override is None else trial_override
+        return self.local_ws(PERFORMANCE_LOG_DIR, perftrace.TRACE_FMT.format(trial))
+
+    @property
+    def tracer(self):
+        '''
+        Tracer of the current trial. It also becomes the active tracer of
+        this process, which records spans from perftrace.span()
+        '''
+        if self._tracer is None or self._tracer.trial != self.current_trial:
+            self._tracer = perftrace.Tracer(self.performance_trace_file(), trial=self.current_trial)
+        perftrace.activate(self._tracer)
+        return self._tracer
+
+    def meta_index_file(self, trial_override=None):
+        trial = self.current_trial if trial_override is None else trial_override
+        return self.local_ws(PERFORMANCE_LOG_DIR, 'meta_index.{}.json'.format(trial))
+
+    @property
+    def meta_index(self):
+        '''
+        Aggregated manifests of the current trial, for matio.load_meta
+        '''
+        if self._meta_index is None or self._meta_index[0] != self.current_trial:
+            index = matio.load_meta_index(self.meta_index_file(), self.dir)
+            self._meta_index = (self.current_trial, index)
+        return self._meta_index[1]
+
+    def record_meta(self, fns):
+        n = matio.update_meta_index(self.meta_index_file(), self.dir, fns)
+        self._meta_index = None
+        return n
+
     def timekeeper_start(self, stage_name, puzzle_name='*'):
-        with self.open_performance_log() as f:
-            t = datetime.utcnow()
-            print('[{}][{}] starting at {}'.format(stage_name, puzzle_name, t.isoformat()), file=f)
-        self._timekeeper[stage_name] = t
+        self.tracer.start(stage_name, puzzle_name)
+
+    '''
+    Compress fn to fn.xz in the background, with the level and threads of
+    the stage in the [Compression] section.
+    '''
+    def xz(self, fn, stage):
+        level = self.config.getint('Compression', stage,
+                                   fallback=self.config.getint('Compression', 'Level', fallback=compress.DEFAULT_LEVEL))
+        threads = self.config.getint('Compression', 'Threads', fallback=compress.DEFAULT_THREADS)
+        log('[{}] compressing {} in the background (level {}, {} threads)'.format(stage, fn, level, threads))
+        return compress.service().submit(fn, level=level, threads=threads, stage=stage)
 
     def timekeeper_finish(self, stage_name, puzzle_name='*'):
-        t = datetime.utcnow()
-        if stage_name in self._timekeeper:
-            delta = t - self._timekeeper[stage_name]
-        else:
-            delta = None
-        with self.open_performance_log() as f:
-            print('[{}][{}] finished at {}'.format(stage_name, puzzle_name, t.isoformat()), file=f)
-            print(f'[{stage_name}][{puzzle_name}] cost {delta.days}+{delta.seconds//3600}:{delta.seconds % 3600 // 60}:{delta.seconds % 60}.{delta.microseconds:06d}', file=f)
+        compress.flush()
+        span = self.tracer.finish(stage_name, puzzle_name)
+        if span is not None:
+            log('[{}][{}] cost {:.3f} sec. (CPU {:.3f} sec.)'.format(stage_name, puzzle_name,
+                span['duration'], span['cpu_time']))
 
 def create_workspace_from_args(args):
     ws = Workspace(args.dir)
     ws.current_trial = args.current_trial
     ws.override_config(args.override_config)
+    ws.force_sync = args.force_sync
+    ws.tracer # Records spans of Condor waves, rsync, etc. in this process
     return ws
 
 def trim_suffix(fn):
@@ -618,7 +755,8 @@ def rangestring_to_list(x):
     return result
 
 def xz(fn):
-    shell(['xz', '-f', fn])
+    log('Compressing {}'.format(fn))
+    compress.compress_file(fn)
 
 def safe_concatente(nparray_list, axis=0):
     true_list = []
@@ -657,15 +795,20 @@ def access_keypoints(d, geo_type):
                 kps = nps
     return kps
 
+'''
+Return the output files of tasks 0, 1, ... and the number of them.
+Files are listed from the task output registry (see taskindex.py), and tasks
+missing in the middle are reported instead of silently ending the list.
+'''
 def lsv2(indir, prefix, suffix):
-    ret = []
-    for i in itertools.count(0):
-        fn = "{}/{}{}{}".format(indir, prefix, i, suffix)
-        if not os.path.exists(fn):
-            if not ret:
-                raise FileNotFoundError("Cannot even locate the a single file under {}. Complete path: {}".format(indir, fn))
-            return ret, i
-        ret.append(fn)
+    outputs = taskindex.discover(indir, prefix, suffix)
+    ret = outputs.contiguous()
+    if not ret:
+        raise FileNotFoundError("Cannot even locate the a single file under {}. Complete path: {}".format(indir, "{}/{}{}{}".format(indir, prefix, 0, suffix)))
+    gaps = outputs.gaps()
+    if gaps:
+        warn("[lsv] {}/{}*{}: tasks {} are missing, only the first {} files are used".format(indir, prefix, suffix, gaps, len(ret)))
+    return ret, len(ret)
 
 def lsv(indir, prefix, suffix):
     return lsv2(indir, prefix, suffix)[0]
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+wsync.py -- batched workspace synchronization
+
+All paths of one Workspace.deploy_to_*/fetch_* call are transferred by a
+single rsync process with a --files-from list, so the ssh handshake is paid
+once per call rather than once per path.
+
+For uploads, a local manifest records (path, size, mtime, hash) of every
+file at the time it was last sent to a destination. Files that did not
+change since then are not listed, and if nothing changed no rsync (and no
+remote directory walk) happens at all. Content hashes are recorded for sent
+files, and only compared for files whose mtime changed but size did not, to
+tell touched files from modified ones.
+
+Empty directories are recorded with size -1 and listed like files, so they
+are created on the destination as well.
+
+The manifest cannot see changes made on the destination. Workspace uploads
+accept force=True (--force_sync on the command line) to drop it.
+
+Failed transfers are retried with bounded exponential backoff.
+
+Either side may be local (host None), so sync() between two local
+directories behaves exactly like a deployment to a remote host.
+'''
+
+import os
+import json
+import time
+import random
+import hashlib
+import tempfile
+import subprocess
+
+from . import util
+from . import perftrace
+
+RSYNC = 'rsync'
+MAX_RETRIES = 6
+BASE_DELAY = 2.0
+MAX_DELAY = 120.0
+
+def _hash(fn):
+    h = hashlib.blake2b(digest_size=16)
+    with open(fn, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def scan(root, paths):
+    '''
+    Return {relative file path: (size, mtime_ns)} of all files under paths,
+    and the list of paths that do not exist.
+
+    Empty directories are included as (-1, 0).
+    '''
+    ret = {}
+    missing = []
+    for rel in paths:
+        rel = os.path.normpath(rel)
+        full = os.path.join(root, rel)
+        if os.path.isfile(full):
+            st = os.stat(full)
+            ret[rel] = (st.st_size, st.st_mtime_ns)
+        elif os.path.isdir(full):
+            for dirpath, dirnames, filenames in os.walk(full):
+                if not dirnames and not filenames:
+                    ret[os.path.relpath(dirpath, root)] = (-1, 0)
+                for fn in filenames:
+                    ffn = os.path.join(dirpath, fn)
+                    st = os.stat(ffn)
+                    ret[os.path.relpath(ffn, root)] = (st.st_size, st.st_mtime_ns)
+        else:
+            missing.append(rel)
+    return ret, missing
+
+class Manifest(object):
+    '''
+    Files last sent to one destination: {path: [size, mtime_ns, hash]}
+    Empty directories are recorded as [-1, 0, ''].
+    '''
+    def __init__(self, fn):
+        self.fn = fn
+        try:
+            with open(fn, 'r') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def changed(self, root, files):
+        '''
+        files: output of scan()
+        Return the list of changed paths. The mtime of touched but unmodified files is updated.
+        '''
+        ret = []
+        for rel, (size, mtime) in files.items():
+            ent = self.entries.get(rel)
+            if ent is None or ent[0] != size:
+                ret.append(rel)
+                continue
+            if ent[1] == mtime:
+                continue
+            if ent[2] == _hash(os.path.join(root, rel)):
+                # Touched but not modified
+                ent[1] = mtime
+                continue
+            ret.append(rel)
+        return ret
+
+    def update(self, root, files, rels):
+        for rel in rels:
+            size, mtime = files[rel]
+            h = _hash(os.path.join(root, rel)) if size >= 0 else ''
+            self.entries[rel] = [size, mtime, h]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.fn), exist_ok=True)
+        tmp = self.fn + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.fn)
+
+def _prefixed(host, root):
+    return root if host is None else '{}:{}'.format(host, root)
+
+def _run_with_backoff(cmd, max_retries, base_delay, max_delay):
+    for attempt in range(max_retries + 1):
+        util.log('Running {}'.format(cmd))
+        ret = subprocess.call(cmd)
+        if ret == 0:
+            return 0
+        if attempt == max_retries:
+            break
+        delay = min(max_delay, base_delay * (2 ** attempt)) * random.uniform(0.5, 1.0)
+        util.log("rsync failed with {}. retry {}/{} after {:.1f} seconds".format(ret, attempt + 1, max_retries, delay))
+        time.sleep(delay)
+    return ret
+
+def sync(from_host, from_root, to_host, to_root, paths,
+         manifest_fn=None, rsh=None,
+         max_retries=MAX_RETRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    '''
+    Copy paths (relative to from_root) to to_root, keeping the relative paths.
+
+    manifest_fn: only used for uploads (from_host is None). Unchanged files
+                 since the last successful sync with the same manifest are
+                 skipped.
+    rsh: remote shell command for rsync -e, e.g. ssh with the options of
+         the multiplexed connection (see remote.py)
+    Return the number of entries passed to rsync (0 means nothing to do).
+    Raise RuntimeError if rsync still fails after max_retries retries.
+    '''
+    paths = list(paths)
+    if not paths:
+        return 0
+    manifest = None
+    if from_host is None and manifest_fn is not None:
+        files, missing = scan(from_root, paths)
+        for rel in missing:
+            util.warn('[wsync] {} does not exist under {}'.format(rel, from_root))
+        manifest = Manifest(manifest_fn)
+        entries = sorted(manifest.changed(from_root, files))
+        util.log('[wsync] {}/{} files changed since the last sync to {}'.format(
+                 len(entries), len(files), _prefixed(to_host, to_root)))
+        if not entries:
+            manifest.save()
+            return 0
+        # Listing files and empty directories only, so rsync does not walk
+        # any directory
+        recursive = []
+    else:
+        entries = [os.path.normpath(p) for p in paths]
+        recursive = ['-r']
+    with tempfile.NamedTemporaryFile('w', prefix='wsync-', suffix='.list', delete=False) as f:
+        for rel in entries:
+            print(rel, file=f)
+        list_fn = f.name
+    cmd = [RSYNC, '-a'] + recursive
+    if rsh is not None:
+        cmd += ['-e', rsh]
+    cmd += ['-R', '--files-from={}'.format(list_fn),
+           _prefixed(from_host, from_root) + '/',
+           _prefixed(to_host, to_root) + '/']
+    try:
+        with perftrace.span('rsync', src=from_host, dst=to_host, entries=len(entries)):
+            ret = _run_with_backoff(cmd, max_retries, base_delay, max_delay)
+    finally:
+        os.unlink(list_fn)
+    if ret != 0:
+        msg = '[wsync] rsync from {} to {} failed after {} retries'.format(
+              _prefixed(from_host, from_root), _prefixed(to_host, to_root), max_retries)
+        util.fatal(msg)
+        raise RuntimeError(msg)
+    if manifest is not None:
+        manifest.update(from_root, files, entries)
+        manifest.save()
+    return len(entries)
@@ -5,7 +5,7 @@ sys.path.append(os.getcwd())
 import argparse
 import subprocess
 
-from pipeline.se3solver import solve, merge_forest, presample, merge_pdsc, merge_blooming_forest
+from pipeline.se3solver import solve, merge_forest, presample, merge_pdsc, forest_to_mat, pds_purge, merge_blooming_forest, benchmark_setup
 
 def main():
     # subprocess.call(['/usr/bin/env'])
@@ -44,6 +44,12 @@ A -1 size selects all states in the file.
 ''',
             type=str, default=None)
     parser.add_argument('--replace_gstate', help='''Same syntax with replace_istate, but replaces goal state''', type=str, default=None)
+    parser.add_argument('--telemetry', help='Sample the solver counters into a .tlm file next to the output, see pipeline/telemetry.py', action='store_true')
+    parser.add_argument('--telemetry_out', help='Telemetry file, implies --telemetry', default=None)
+    parser.add_argument('--telemetry_interval', help='Seconds between two telemetry samples', type=float, default=10.0)
+    parser.add_argument('--stagnation_limit', help='With --ec_budget, give up if no motion is checked in this many seconds', type=float, default=900.0)
+    parser.add_argument('--pds_share', help='Map the PDS from a copy shared by all tasks of this host instead of loading it, see pipeline/pds_share.py', action='store_true')
+    parser.add_argument('--pds_share_root', help='Directory of the shared copies, default to /dev/shm', default=None)
     parser.add_argument('--bvresize', help='''add this number to the bounding volume defined by the puzzle''', type=float, default=0.0)
     parser.add_argument('solver_option_vector', help='Option vectors passed over to OMPL planner', nargs=argparse.REMAINDER, type=str, default=[])
     # Subcommand 'merge_forest'
@@ -58,14 +64,37 @@ If a directory is provided, all .mat files in this directory will be loaded''',
     parser = subparsers.add_parser("presample", help='Presample a set of samples.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('puzzle', help='Configure file generated by OMPL GUI')
     parser.add_argument('nsamples', help='Total Number of samples', type=int)
-    parser.add_argument('out', help='Output file for samples')
+    parser.add_argument('out', help='Output file for samples, .npz or .hdf5')
     parser.add_argument('--sampler', help='Valid state sampler', type=int, default=0)
     parser.add_argument('--cdres', help='Collision detection resolution', type=float, default=0.005)
+    parser.add_argument('--seed', help='Seed of the samples. Default to a random one, which is printed', type=int, default=None)
+    parser.add_argument('--valid_only', help='Only keep collision free samples', action='store_true')
+    parser.add_argument('--entangled_only', help='Drop the samples that are disentangled (robot out of the bounding box of env)', action='store_true')
+    parser.add_argument('--chunk', help='Candidates drawn per chunk, which bounds the memory usage', type=int, default=1 << 20)
+    parser.add_argument('--threads', help='Number of sampling threads, 0 means all cores', type=int, default=0)
+    # Subcommand 'benchmark_setup'
+    parser = subparsers.add_parser("benchmark_setup", help='Measure the setup time per OmplDriver call with and without reusing the planning context', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('puzzle', help='Configure file generated by OMPL GUI')
+    parser.add_argument('--repeat', help='Calls of each kind', type=int, default=10)
+    parser.add_argument('--nstates', help='Number of states (pairs) passed to validate_states (validate_motion_pairs)', type=int, default=16)
+    parser.add_argument('--days', help='Time limit of each solve call', type=float, default=1e-6)
+    parser.add_argument('--ec_budget', help='Budget of edge connections of each solve call', type=int, default=16)
+    parser.add_argument('--cdres', help='Collision detection resolution', type=float, default=0.005)
+    parser.add_argument('--out', help='Save the setup times to this .npz file', default=None)
     # Subcommand 'merge_pdsc'
     parser = subparsers.add_parser("merge_pdsc", help='Merge connectivity matrix created from PreDefined set of samples.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('pdsf', help='Pre-Defined Sample set (PDS) File')
     parser.add_argument('dir', help='''Directory that stores the connectivity sparse matrices''')
-    parser.add_argument('out', help='''output file''')
+    parser.add_argument('out', help='''output file, .mat or .npz (scipy.sparse)''')
+    # Subcommand 'forest_to_mat'
+    parser = subparsers.add_parser("forest_to_mat", help='Convert the forest store (forest.fst) written by solve to ssc-*.mat and compact_tree-*.mat files', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('dir', help='''Directory that stores forest.fst''')
+    parser.add_argument('--out', help='''Output directory, default to dir''', default=None)
+
+    # Subcommand 'pds_purge'
+    parser = subparsers.add_parser("pds_purge", help='Remove the PDS copies shared by solve --pds_share on this host', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--root', help='Directory of the shared copies, default to /dev/shm', default=None)
+    parser.add_argument('--keep', help='PDS files whose copies are kept', nargs='*', default=[])
 
     # Subcommand 'merge_blooming_forest'
     parser = subparsers.add_parser("merge_blooming_forest", help='Merge the forest from blooming algorithm')
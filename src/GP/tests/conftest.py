@@ -0,0 +1,22 @@
+import os
+import sys
+
+# The pipeline package lives in src/GP
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+# Bundled puzzles
+RES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))), 'res')
+
+def make_workspace(ws_dir, **system):
+    '''
+    Create a minimal workspace whose [SYSTEM] section holds the given options,
+    e.g. LoopbackHosts so the remote code paths run locally (see remote.py)
+    '''
+    os.makedirs(ws_dir, exist_ok=True)
+    open(os.path.join(ws_dir, '.puzzle_workspace'), 'w').close()
+    with open(os.path.join(ws_dir, 'config'), 'w') as f:
+        print('[SYSTEM]', file=f)
+        for k, v in system.items():
+            print('{} = {}'.format(k, v), file=f)
+    return ws_dir
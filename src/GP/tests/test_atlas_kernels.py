@@ -0,0 +1,119 @@
+'''
+atlas_kernels must reproduce the code paths of atlas.py and
+preprocess_surface.py it replaced. The _old_* functions below are copied
+from these paths.
+'''
+
+import os
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from pipeline import atlas_kernels
+
+from conftest import DATA_DIR
+
+def _chart():
+    return np.load(os.path.join(DATA_DIR, 'atlas', 'chart.npz'))['WEIGHTED']
+
+def _old_bilinear(raster, u, v):
+    # atlas._uv_to_pix and atlas._bilinear
+    pix = np.array([u, v]) * np.array(raster.shape)
+    pixi = np.floor(pix).astype(int) # Pix Integer
+    r = pix - pixi # Remainder
+    def _sample(x, y, no_data=0.0):
+        if x < 0 or x >= raster.shape[0]:
+            return no_data
+        if y < 0 or y >= raster.shape[1]:
+            return no_data
+        return raster[x, y]
+    return _sample(pixi[0], pixi[1]) * (1.0 - r[0]) * (1.0 - r[1]) + \
+           _sample(pixi[0] + 1, pixi[1]) * r[0] * (1.0 - r[1]) + \
+           _sample(pixi[0], pixi[1]+1) * (1.0 - r[0]) * r[1] + \
+           _sample(pixi[0] + 1, pixi[1] + 1) * r[0] * r[1]
+
+def _old_normalize(atlas):
+    # SingleChannelAtlasSampler.__init__
+    np.clip(atlas, a_min=0.0, a_max=None, out=atlas)
+    atlas /= np.max(atlas)
+    atlas *= 255.0
+    atlas = atlas.astype(np.uint).astype(np.float32)
+    atlas[atlas < 32.0] = 0.0
+    return atlas
+
+def _old_screen_weight(img, loops):
+    # preprocess_surface.screen_weight
+    for i in range(loops):
+        nzi = np.nonzero(img)
+        nz = img[nzi]
+        m = np.mean(nz)
+        img[img < m] = 0.0
+    return img
+
+def _old_screen_median(fatlas):
+    # SingleChannelAtlasSampler.debug_surface_sampler
+    nzmedian = np.median(fatlas[fatlas.nonzero()])
+    fatlas[fatlas < nzmedian] = 0.0
+    return fatlas
+
+def _uv_points():
+    rng = np.random.default_rng(0)
+    # Include points outside of [0, 1) to cover the no_data texels
+    uv = rng.uniform(-0.05, 1.05, size=(500, 2))
+    return np.concatenate([uv, [[0.0, 0.0], [1.0, 1.0], [0.5, 0.25]]])
+
+def test_bilinear_matches_old(monkeypatch):
+    raster = _chart().astype(np.float64)
+    uv = _uv_points()
+    expected = np.array([_old_bilinear(raster, u, v) for u, v in uv])
+    np.testing.assert_array_equal(atlas_kernels.bilinear(raster, uv), expected)
+    for u, v in uv[:20]:
+        assert atlas_kernels.bilinear(raster, [u, v]) == _old_bilinear(raster, u, v)
+    # The NumPy fallback as well, if numba was used above
+    monkeypatch.setattr(atlas_kernels, '_bilinear_compiled', None)
+    np.testing.assert_array_equal(atlas_kernels.bilinear(raster, uv), expected)
+
+@pytest.mark.parametrize('threshold', ['mean', 'median'])
+def test_nonzero_threshold_matches_old(threshold):
+    img = _chart()
+    nz = img[np.nonzero(img)]
+    expected = np.mean(nz) if threshold == 'mean' else np.median(nz)
+    assert atlas_kernels.nonzero_threshold(img, threshold) == expected
+    assert atlas_kernels.nonzero_threshold(np.zeros((4, 4)), threshold) == 0.0
+
+def test_screen_matches_old():
+    expected = _old_screen_weight(_chart(), loops=2)
+    np.testing.assert_array_equal(atlas_kernels.screen(_chart(), threshold='mean', loops=2), expected)
+    expected = _old_screen_median(_chart())
+    np.testing.assert_array_equal(atlas_kernels.screen(_chart(), threshold='median'), expected)
+
+def test_normalize_weights_matches_old():
+    expected = _old_normalize(_chart())
+    actual = atlas_kernels.normalize_weights(_chart(), cutoff=32.0)
+    assert actual.dtype == expected.dtype
+    np.testing.assert_array_equal(actual, expected)
+
+def test_discrete_sampler_matches_choice():
+    atlas = _old_normalize(_chart())
+    nzpix = np.nonzero(atlas)
+    weight = atlas[nzpix]
+    weight /= np.sum(weight)
+    idx = np.arange(len(nzpix[0]), dtype=np.int32)
+    np.random.seed(7)
+    expected = [np.random.choice(idx, p=weight) for _ in range(200)]
+    sampler = atlas_kernels.DiscreteSampler(weight)
+    np.random.seed(7)
+    actual = [idx[sampler.draw()] for _ in range(200)]
+    assert actual == expected
+
+def test_nonzero_distribution_matches_old():
+    atlas = _old_normalize(_chart())
+    nzpix, weight, nzsum = atlas_kernels.nonzero_distribution(atlas.copy())
+    old_nzpix = np.nonzero(atlas)
+    old_weight = atlas[old_nzpix]
+    old_sum = np.sum(old_weight)
+    old_weight /= old_sum
+    assert nzsum == old_sum
+    for a, b in zip(nzpix, old_nzpix):
+        np.testing.assert_array_equal(a, b)
+    np.testing.assert_array_equal(weight, old_weight)
@@ -0,0 +1,89 @@
+'''
+Micro-benchmarks of the collision checking primitives, the pytest-benchmark
+counterpart of bin/collisionbench and `facade.py tools benchmark_collision`.
+
+    pytest tests/test_benchmark_collision.py --benchmark-json=collision.json
+
+Skipped unless pytest-benchmark and the pyosr/pyse3ompl modules are available.
+'''
+
+import os
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+pytest.importorskip('pyosr')
+pytest.importorskip('pyse3ompl')
+np = pytest.importorskip('numpy')
+
+from pipeline import util
+from pipeline import tools
+
+from conftest import RES_DIR
+
+PUZZLE = os.path.join(RES_DIR, 'dual', 'dual-g9.cfg')
+NSTATES = 256
+SEED = 0
+SETS = ['free', 'colliding', 'boundary']
+MOTIONS = ['free_to_free', 'free_to_colliding', 'boundary_to_free']
+
+@pytest.fixture(scope='module')
+def world():
+    return util.create_unit_world(PUZZLE)
+
+@pytest.fixture(scope='module')
+def state_sets(world):
+    sets, _ = tools._collision_state_sets(world, PUZZLE, NSTATES, SEED)
+    return sets
+
+@pytest.fixture(scope='module')
+def motions(state_sets):
+    free, colliding = state_sets['free'], state_sets['colliding']
+    return {
+            'free_to_free': (free, np.roll(free, -1, axis=0)),
+            'free_to_colliding': (free, colliding[np.arange(len(free)) % len(colliding)]),
+            'boundary_to_free': (state_sets['boundary'], free),
+    }
+
+def _per_query(benchmark, queries):
+    benchmark.extra_info['queries'] = queries
+
+def test_state_sets_are_deterministic(world, state_sets):
+    again, _ = tools._collision_state_sets(world, PUZZLE, NSTATES, SEED)
+    for name in SETS:
+        np.testing.assert_array_equal(state_sets[name], again[name])
+
+@pytest.mark.parametrize('set_name', SETS)
+def test_is_valid(benchmark, world, state_sets, set_name):
+    qs = state_sets[set_name]
+    _per_query(benchmark, len(qs))
+    benchmark(lambda: [world.is_valid_state(q) for q in qs])
+
+@pytest.mark.parametrize('set_name', SETS)
+def test_is_disentangled(benchmark, world, state_sets, set_name):
+    qs = state_sets[set_name]
+    _per_query(benchmark, len(qs))
+    benchmark(lambda: [world.is_disentangled(q) for q in qs])
+
+@pytest.mark.parametrize('motion', MOTIONS)
+def test_transit_state_to_with_contact(benchmark, world, motions, motion):
+    qs0, qs1 = motions[motion]
+    cres = world.recommended_cres
+    _per_query(benchmark, len(qs0))
+    benchmark(lambda: [world.transit_state_to_with_contact(q0, q1, cres) for q0, q1 in zip(qs0, qs1)])
+
+@pytest.mark.parametrize('enable_mt', [False, True])
+def test_calculate_visibility_matrix2(benchmark, world, state_sets, enable_mt):
+    n = min(64, len(state_sets['boundary']))
+    boundary, free = state_sets['boundary'][:n], state_sets['free'][:n]
+    cres = world.recommended_cres
+    _per_query(benchmark, n * n)
+    benchmark(lambda: world.calculate_visibility_matrix2(boundary, True, free, True, cres, enable_mt=enable_mt))
+
+@pytest.mark.parametrize('motion', MOTIONS)
+def test_validate_motion_pairs(benchmark, world, motions, motion):
+    from pipeline import solve2
+    driver = solve2.create_driver(PUZZLE)
+    qs0, qs1 = motions[motion]
+    ompl0, ompl1 = world.translate_unit_to_ompl(qs0), world.translate_unit_to_ompl(qs1)
+    _per_query(benchmark, len(ompl0))
+    benchmark(lambda: driver.validate_motion_pairs(ompl0, ompl1))
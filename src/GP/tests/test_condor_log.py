@@ -0,0 +1,90 @@
+import os
+
+from pipeline import condor_log
+
+from conftest import DATA_DIR
+
+def _events(name):
+    '''
+    Events of a recorded user log, each one terminated by '...'
+    '''
+    with open(os.path.join(DATA_DIR, 'condor_log', name)) as f:
+        text = f.read()
+    return [e + '...\n' for e in text.split('...\n') if e.strip()]
+
+class _GrowingLog(object):
+    '''
+    User log that HTCondor appends to while local_wait polls it
+    '''
+    def __init__(self, tmp_path, name):
+        self.events = _events(name)
+        self.fn = str(tmp_path / 'log')
+        open(self.fn, 'w').close()
+        self.ulog = condor_log.UserLog(self.fn)
+
+    def append(self, n):
+        with open(self.fn, 'a') as f:
+            for _ in range(n):
+                f.write(self.events.pop(0))
+        self.ulog.poll()
+
+def test_hold_release_hold(tmp_path):
+    log = _GrowingLog(tmp_path, 'hold_release.log')
+    log.append(4)                   # submitted, executing, image size, held
+    job = log.ulog.jobs[(4242, 0)]
+    assert job.state == condor_log.HELD
+    assert job.hold_code == (3, 0)
+    assert log.ulog.jobs_to_release(3) == [job]
+    # local_wait issued condor_release
+    job.release_pending = True
+    log.ulog.poll()
+    assert log.ulog.jobs_to_release(3) == []
+    assert log.ulog.exhausted_jobs(3) == []
+    assert job.releases == 0
+    log.append(1)                   # released
+    assert job.state == condor_log.IDLE
+    assert job.releases == 1
+    assert not job.release_pending
+    log.append(2)                   # executing, held again
+    assert job.state == condor_log.HELD
+    assert job.holds == 2
+    assert log.ulog.jobs_to_release(3) == [job]
+
+def test_max_release_cutoff(tmp_path):
+    log = _GrowingLog(tmp_path, 'max_release.log')
+    log.append(len(log.events))
+    held = log.ulog.jobs[(4300, 0)]
+    done = log.ulog.jobs[(4300, 1)]
+    assert done.state == condor_log.DONE
+    assert done.memory_mb == 1200
+    assert done.memory_request_mb == 3072
+    assert held.state == condor_log.HELD
+    assert held.holds == 4
+    assert held.releases == 3
+    assert held.hold_code == (34, 0)
+    assert 'memory' in held.hold_reason
+    assert log.ulog.jobs_to_release(3) == []
+    assert log.ulog.exhausted_jobs(3) == [held]
+    assert log.ulog.jobs_to_release(4) == [held]
+    assert not log.ulog.all_finished()
+
+def test_release_event_parsing():
+    events = _events('hold_release.log')
+    ulog = condor_log.UserLog('/nonexistent')
+    # Feed the release event in two pieces, it only counts once complete
+    release = events[4]
+    assert release.startswith('013 ')
+    ulog.feed(''.join(events[:4]))
+    job = ulog.jobs[(4242, 0)]
+    job.release_pending = True
+    assert ulog.feed(release[:20]) == 0
+    assert job.releases == 0
+    assert job.state == condor_log.HELD
+    assert ulog.feed(release[20:]) == 1
+    assert job.releases == 1
+    assert job.state == condor_log.IDLE
+    assert not job.release_pending
+    # Issuing condor_release does not count by itself
+    ulog.feed(''.join(events[5:]))
+    assert job.releases == 1
+    assert job.holds == 2
@@ -0,0 +1,71 @@
+import os
+import shutil
+
+from pipeline import condor_log
+from pipeline import condor_profile
+
+from conftest import DATA_DIR
+
+def _log(name):
+    return condor_log.parse(os.path.join(DATA_DIR, 'condor_log', name))
+
+def test_hold_not_for_memory():
+    ulog = _log('hold_release.log')
+    job = ulog.jobs[(4242, 0)]
+    assert not condor_profile.held_for_memory(job)
+    # Held jobs only count if they exceeded the memory limit
+    assert condor_profile.samples_from_log(ulog, request_mb=3072) == []
+    assert condor_profile.estimate_memory([]) == condor_profile.DEFAULT_MEMORY_MB
+
+def test_samples_from_log():
+    ulog = _log('max_release.log')
+    # The held job never reported its request
+    samples = condor_profile.samples_from_log(ulog)
+    assert samples == [{'memory_mb': 1200, 'cpu_time': 192.0, 'wall_time': 196.0, 'held': False}]
+    samples = condor_profile.samples_from_log(ulog, margin=1.25, request_mb=3072)
+    assert sorted(s['memory_mb'] for s in samples) == [1200, 3840]
+    assert [s['held'] for s in samples if s['memory_mb'] == 3840] == [True]
+
+def test_estimate_memory():
+    ulog = _log('max_release.log')
+    # 1200 * 1.25 rounded up to 256
+    assert condor_profile.estimate_memory(condor_profile.samples_from_log(ulog)) == 1536
+    samples = condor_profile.samples_from_log(ulog, request_mb=3072)
+    # 0.99 quantile of [1200, 3840] = 3813.6, * 1.25 = 4767
+    assert condor_profile.estimate_memory(samples) == 4864
+    # median 2520 * 1.25 = 3150
+    assert condor_profile.estimate_memory(samples, quantile=0.5) == 3328
+    assert condor_profile.estimate_memory(samples, ceiling=4096) == 4096
+    assert condor_profile.estimate_memory([{'memory_mb': 10}]) == condor_profile.MIN_MEMORY_MB
+    # CPU time / wall time < 1
+    assert condor_profile.estimate_cpus(samples, max_cpus=4) == 1
+
+def test_raised_memory_on_eviction():
+    job = _log('max_release.log').jobs[(4300, 0)]
+    assert condor_profile.held_for_memory(job)
+    assert condor_profile.raised_memory(job, request_mb=3072) == 3840
+    # Without a known request, the default one was used
+    assert condor_profile.raised_memory(job) == 3840
+    # local_wait records the new request after condor_qedit, another
+    # eviction raises it again
+    job.memory_request_mb = 3840
+    assert condor_profile.raised_memory(job, request_mb=3072) == 4864
+    # The measured peak counts if it is above the request
+    job.memory_mb = 5000
+    assert condor_profile.raised_memory(job, request_mb=3072) == 6400
+    assert condor_profile.raised_memory(job, margin=1.0) == 5120
+
+def test_record_wave(tmp_path):
+    iodir = str(tmp_path)
+    store_fn = str(tmp_path / 'profiles' / condor_profile.PROFILE_FILE)
+    shutil.copy(os.path.join(DATA_DIR, 'condor_log', 'max_release.log'), os.path.join(iodir, 'log'))
+    req = condor_profile.Request(store_fn, 'se3solver.solve', 'dual-g9', 3072, 1, 0, 1.25)
+    req.write_sidecar(iodir)
+    assert condor_profile.collect(iodir) == 2
+    # Recorded jobs are skipped
+    assert condor_profile.collect(iodir) == 0
+    samples = condor_profile.ProfileStore(store_fn).samples('se3solver.solve', 'dual-g9')
+    assert sorted(s['memory_mb'] for s in samples) == [1200, 3840]
+    # Other puzzles fall back to the same stage
+    assert len(condor_profile.ProfileStore(store_fn).samples('se3solver.solve', 'other')) == 2
+    assert condor_profile.ProfileStore(store_fn).samples('se3solver.plan', 'dual-g9') == []
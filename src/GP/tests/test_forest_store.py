@@ -0,0 +1,43 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+sparse = pytest.importorskip('scipy.sparse')
+
+from pipeline import forest_store
+
+def _connectivity(root, ncols=5):
+    C = np.zeros((1, ncols), dtype=np.int32)
+    C[0, root % ncols] = 1
+    return sparse.csr_matrix(C)
+
+def test_connectivity_matrix_rows_are_roots(tmp_path):
+    fn = str(tmp_path / forest_store.STORE_FILE)
+    for root in [1, 0, 2]:
+        forest_store.append(fn, root, _connectivity(root))
+    with forest_store.ForestStore(fn) as store:
+        mc = store.connectivity_matrix().toarray()
+        assert store.pds_size == 5
+    assert mc.shape == (3, 5)
+    for root in range(3):
+        assert mc[root, root] == 1
+
+def test_connectivity_matrix_rejects_missing_roots(tmp_path):
+    fn = str(tmp_path / forest_store.STORE_FILE)
+    for root in [0, 2]:
+        forest_store.append(fn, root, _connectivity(root))
+    with forest_store.ForestStore(fn) as store:
+        assert store.missing_roots() == [1]
+        with pytest.raises(ValueError):
+            store.connectivity_matrix()
+        # Explicit roots are still allowed
+        assert store.connectivity_matrix(roots=[0, 2]).shape == (2, 5)
+
+def test_zero_length_store_is_empty(tmp_path):
+    fn = str(tmp_path / forest_store.STORE_FILE)
+    open(fn, 'wb').close()
+    open(fn + forest_store.INDEX_SUFFIX, 'wb').close()
+    with forest_store.ForestStore(fn) as store:
+        assert len(store) == 0
+        assert 0 not in store
+        assert store.pds_size == 0
+        assert store.connectivity_matrix().shape == (0, 0)
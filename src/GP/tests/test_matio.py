@@ -0,0 +1,54 @@
+import os
+import shutil
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from pipeline import matio
+
+def _saved(tmp_path, mtime_ns=1583049605123456789):
+    fn = str(tmp_path / 'data.npz')
+    matio.savez(fn, A=np.arange(6).reshape(2, 3), N=np.int64(7))
+    # Pin the mtime to one with nanosecond digits, and rewrite the manifest
+    os.utime(fn, ns=(mtime_ns, mtime_ns))
+    matio.write_meta(fn, {'A': np.arange(6).reshape(2, 3), 'N': np.int64(7)})
+    return fn
+
+def _copy(fn, dst, mtime_ns):
+    shutil.copy(fn, dst)
+    shutil.copy(matio.meta_file(fn), matio.meta_file(dst))
+    os.utime(dst, ns=(mtime_ns, mtime_ns))
+    return dst
+
+def test_load_meta(tmp_path):
+    fn = _saved(tmp_path)
+    meta = matio.load_meta(fn)
+    assert meta['values'] == {'N': 7}
+    assert meta['arrays']['A'] == {'shape': [2, 3], 'dtype': np.dtype(int).str}
+    assert matio.load_value(fn, 'N') == 7
+
+@pytest.mark.parametrize('mtime_ns', [1583049605000000000, 1583049605123456000])
+def test_load_meta_of_truncated_copy(tmp_path, mtime_ns):
+    # tar and rsync keep whole seconds, network filesystems microseconds
+    fn = _saved(tmp_path)
+    dst = _copy(fn, str(tmp_path / 'copy.npz'), mtime_ns)
+    assert matio.load_meta(dst) is not None
+
+@pytest.mark.parametrize('mtime_ns', [
+    1583049605123456790,    # Rewritten within the same second
+    1583049606000000000,    # Next second
+    1583049604000000000,
+    1583049605123457000,    # Next microsecond
+    ])
+def test_load_meta_of_modified_file(tmp_path, mtime_ns):
+    fn = _saved(tmp_path)
+    os.utime(fn, ns=(mtime_ns, mtime_ns))
+    assert matio.load_meta(fn) is None
+
+def test_load_meta_of_resized_file(tmp_path):
+    fn = _saved(tmp_path)
+    st = os.stat(fn)
+    with open(fn, 'ab') as f:
+        f.write(b'\0')
+    os.utime(fn, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert matio.load_meta(fn) is None
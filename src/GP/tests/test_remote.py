@@ -0,0 +1,96 @@
+import os
+import sys
+import stat
+import pytest
+
+pytest.importorskip('numpy')
+
+from pipeline import util
+from pipeline import remote
+
+from conftest import make_workspace
+
+# Stands in for facade.py on the remote side. Records its arguments, and
+# unless --only_wait is given, kills the shell that runs the wrapped command
+# before the status line is printed, as a dropped ssh connection would.
+FAKE_FACADE = '''#!{python}
+import os, sys, signal
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calls.txt'), 'a') as f:
+    print(' '.join(sys.argv[1:]), file=f)
+if '--only_wait' not in sys.argv:
+    pid, target = os.getppid(), None
+    while pid > 1:
+        with open('/proc/{{}}/cmdline'.format(pid), 'rb') as f:
+            if b'{marker}' in f.read():
+                target = pid
+        with open('/proc/{{}}/stat'.format(pid)) as f:
+            pid = int(f.read().rsplit(')', 1)[1].split()[1])
+    os.kill(target, signal.SIGKILL)
+'''
+
+def test_status_of_success(tmp_path):
+    log_fn = str(tmp_path / 'remote.log')
+    res = remote.LocalChannel('loop').run('echo hello', log_fn=log_fn)
+    assert res.ok
+    assert res.returncode == 0
+    assert not res.connection_lost
+    with open(log_fn) as f:
+        log = f.read()
+    # The status line is parsed, not forwarded
+    assert log == 'hello\n'
+
+@pytest.mark.parametrize('script', ['exit 3', 'false; (exit 3)', 'sh -c "exit 3"'])
+def test_status_of_failure(script):
+    res = remote.LocalChannel('loop').run(script)
+    assert res.returncode == 3
+    assert not res.connection_lost
+    assert not res.ok
+
+def test_missing_status_is_connection_lost():
+    # $$ is the shell that prints the status line of _wrap()
+    res = remote.LocalChannel('loop').run('kill -9 $$')
+    assert res.connection_lost
+    assert not res.ok
+
+def test_ssh_channel_reconnects_after_lost_connection(tmp_path, monkeypatch):
+    ch = remote.SSHChannel('loop', control_dir=str(tmp_path))
+    # Run the ssh command lines with the local bash instead
+    monkeypatch.setattr(ch, '_ssh', lambda *args: ['bash', '-c', args[-1]])
+    reconnects = []
+    monkeypatch.setattr(ch, 'reconnect', lambda: reconnects.append(1))
+    assert ch.run('exit 2').returncode == 2
+    assert reconnects == []
+    res = ch.run('kill -9 $$')
+    assert res.connection_lost
+    assert reconnects == [1]
+
+@pytest.fixture
+def loopback_ws(tmp_path, monkeypatch):
+    exec_dir = tmp_path / 'exec'
+    exec_dir.mkdir()
+    facade = exec_dir / 'facade.py'
+    facade.write_text(FAKE_FACADE.format(python=sys.executable, marker=remote._STATUS_MARKER))
+    facade.chmod(facade.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setattr(util.time, 'sleep', lambda secs: None)
+    # remote_command sources ~/.bashrc
+    monkeypatch.setenv('HOME', str(tmp_path))
+    ws = util.Workspace(make_workspace(str(tmp_path / 'ws'), CondorHost='loop', LoopbackHosts='loop'))
+    return ws, str(exec_dir)
+
+def _calls(exec_dir):
+    with open(os.path.join(exec_dir, 'calls.txt')) as f:
+        return f.read().split('\n')[:-1]
+
+def test_remote_command_retries_with_only_wait(loopback_ws):
+    ws, exec_dir = loopback_ws
+    assert ws.remote_command('loop', exec_dir, '/remote/ws', 'solve', 'run') == 0
+    calls = _calls(exec_dir)
+    assert len(calls) == 2
+    assert '--only_wait' not in calls[0]
+    assert calls[1].split() == calls[0].split() + ['--only_wait']
+
+def test_remote_command_without_retry(loopback_ws):
+    ws, exec_dir = loopback_ws
+    ret = ws.remote_command('loop', exec_dir, '/remote/ws', 'solve', 'run', auto_retry=False)
+    assert ret == remote.SSH_EXIT_CONNECTION
+    assert len(_calls(exec_dir)) == 1
@@ -0,0 +1,55 @@
+'''
+Light subcommands must not import the heavy modules (pyosr, TensorFlow, ...)
+on startup, see pipeline/commands.py
+'''
+
+import os
+import sys
+import json
+import subprocess
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('six')
+
+from pipeline import commands
+
+GP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Subcommands that only manage workspaces or run queued tasks
+LIGHT_COMMANDS = ['init', 'mimic', 'add_puzzle', 'add_extra', 'copy_training_data', 'condor_worker']
+
+def _top_level(modules):
+    return set([m.split('.')[0] for m in modules])
+
+def _heavy(modules):
+    return sorted(_top_level(modules) & set(commands.HEAVY_MODULES))
+
+@pytest.mark.parametrize('command', LIGHT_COMMANDS)
+def test_light_command_imports(command):
+    rep = commands._measure(command)
+    assert 'error' not in rep, rep.get('error')
+    assert _heavy(rep['modules']) == []
+    assert rep['heavy'] == []
+
+def test_facade_help_of_light_command():
+    '''
+    facade.py registers the other subcommands as placeholders only
+    '''
+    pytest.importorskip('colorama')
+    code = ('import sys, json, runpy\n'
+            'base = set(sys.modules)\n'
+            "sys.argv = ['facade.py', 'init', '-h']\n"
+            'try:\n'
+            "    runpy.run_path('facade.py', run_name='__main__')\n"
+            'except SystemExit:\n'
+            '    pass\n'
+            'sys.stderr.write(json.dumps(sorted(set(sys.modules) - base)))\n')
+    p = subprocess.run([sys.executable, '-c', code], cwd=GP_DIR,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert p.returncode == 0, p.stderr
+    modules = json.loads(p.stderr.strip().split('\n')[-1])
+    assert _heavy(modules) == []
+    assert 'pipeline.init' in modules
+    assert 'pipeline.solve2' not in modules
+    assert 'pipeline.train' not in modules
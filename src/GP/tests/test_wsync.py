@@ -0,0 +1,126 @@
+import os
+import json
+import shutil
+import subprocess
+import pytest
+
+pytest.importorskip('numpy')
+
+from pipeline import util
+from pipeline import wsync
+
+from conftest import make_workspace
+
+HAS_RSYNC = shutil.which(wsync.RSYNC) is not None
+needs_rsync = pytest.mark.skipif(not HAS_RSYNC, reason='rsync is not installed')
+
+class RsyncCalls(object):
+    '''
+    Records the entries of each --files-from list passed to rsync. The
+    transfer itself only happens if rsync is installed.
+    '''
+    def __init__(self, returncodes=None):
+        self.entries = []
+        self.returncodes = returncodes
+        self._call = subprocess.call
+
+    def __call__(self, cmd):
+        list_fn = [a for a in cmd if a.startswith('--files-from=')][0].split('=', 1)[1]
+        with open(list_fn) as f:
+            self.entries.append(sorted(f.read().split()))
+        if self.returncodes is not None:
+            return self.returncodes.pop(0)
+        return self._call(cmd) if HAS_RSYNC else 0
+
+@pytest.fixture
+def rsync_calls(monkeypatch):
+    calls = RsyncCalls()
+    monkeypatch.setattr(wsync.subprocess, 'call', calls)
+    return calls
+
+@pytest.fixture
+def src(tmp_path):
+    root = tmp_path / 'src'
+    (root / 'a').mkdir(parents=True)
+    (root / 'a' / 'x.txt').write_text('x')
+    (root / 'a' / 'y.txt').write_text('y')
+    (root / 'a' / 'empty').mkdir()
+    (root / 'z.txt').write_text('z')
+    return str(root)
+
+def _sync(src, dst, manifest_fn, **kwargs):
+    return wsync.sync(None, src, None, dst, ['a', 'z.txt'], manifest_fn=manifest_fn, **kwargs)
+
+def _mtime_ns(fn):
+    return os.stat(fn).st_mtime_ns
+
+def test_unchanged_files_are_not_listed(src, tmp_path, rsync_calls):
+    dst, manifest_fn = str(tmp_path / 'dst'), str(tmp_path / 'manifest.json')
+    assert _sync(src, dst, manifest_fn) == 4
+    assert _sync(src, dst, manifest_fn) == 0
+    with open(os.path.join(src, 'a', 'x.txt'), 'a') as f:
+        f.write('more')
+    assert _sync(src, dst, manifest_fn) == 1
+    assert rsync_calls.entries == [['a/empty', 'a/x.txt', 'a/y.txt', 'z.txt'], ['a/x.txt']]
+
+def test_touched_files_are_skipped(src, tmp_path, rsync_calls):
+    dst, manifest_fn = str(tmp_path / 'dst'), str(tmp_path / 'manifest.json')
+    _sync(src, dst, manifest_fn)
+    fn = os.path.join(src, 'z.txt')
+    mtime = _mtime_ns(fn) + 5 * 10**9
+    os.utime(fn, ns=(mtime, mtime))
+    assert _sync(src, dst, manifest_fn) == 0
+    assert len(rsync_calls.entries) == 1
+    # The new mtime is recorded, so the file is not hashed again
+    with open(manifest_fn) as f:
+        assert json.load(f)['z.txt'][1] == mtime
+
+def test_empty_directories_are_listed(src, tmp_path, rsync_calls):
+    dst, manifest_fn = str(tmp_path / 'dst'), str(tmp_path / 'manifest.json')
+    _sync(src, dst, manifest_fn)
+    assert 'a/empty' in rsync_calls.entries[0]
+    with open(manifest_fn) as f:
+        assert json.load(f)['a/empty'] == [-1, 0, '']
+
+@needs_rsync
+def test_sync_between_local_dirs(src, tmp_path):
+    dst, manifest_fn = str(tmp_path / 'dst'), str(tmp_path / 'manifest.json')
+    os.makedirs(dst)
+    _sync(src, dst, manifest_fn)
+    assert os.path.isdir(os.path.join(dst, 'a', 'empty'))
+    for rel in ['a/x.txt', 'a/y.txt', 'z.txt']:
+        with open(os.path.join(src, rel)) as f0, open(os.path.join(dst, rel)) as f1:
+            assert f0.read() == f1.read()
+
+def test_failures_retry_then_raise(src, tmp_path, monkeypatch):
+    dst, manifest_fn = str(tmp_path / 'dst'), str(tmp_path / 'manifest.json')
+    calls = RsyncCalls(returncodes=[12] * 4)
+    monkeypatch.setattr(wsync.subprocess, 'call', calls)
+    with pytest.raises(RuntimeError):
+        _sync(src, dst, manifest_fn, max_retries=3, base_delay=0.0)
+    assert len(calls.entries) == 4
+    # Nothing was sent, nothing is recorded
+    assert not os.path.exists(manifest_fn)
+
+def test_retry_recovers(src, tmp_path, monkeypatch):
+    dst, manifest_fn = str(tmp_path / 'dst'), str(tmp_path / 'manifest.json')
+    calls = RsyncCalls(returncodes=[12, 12, 0])
+    monkeypatch.setattr(wsync.subprocess, 'call', calls)
+    assert _sync(src, dst, manifest_fn, max_retries=3, base_delay=0.0) == 4
+    assert len(calls.entries) == 3
+    assert os.path.isfile(manifest_fn)
+
+def test_force_drops_manifest(src, tmp_path, rsync_calls):
+    dst = str(tmp_path / 'dst')
+    os.makedirs(dst)
+    ws = util.Workspace(make_workspace(src, CondorHost='loop', LoopbackHosts='loop',
+                                       CondorWorkspacePath=dst))
+    ws.deploy_to_condor('a', 'z.txt')
+    ws.deploy_to_condor('a', 'z.txt')
+    ws.deploy_to_condor('a', 'z.txt', force=True)
+    assert [len(e) for e in rsync_calls.entries] == [4, 4]
+    # --force_sync drops the manifest for the first upload only
+    ws.force_sync = True
+    ws.deploy_to_condor('a', 'z.txt')
+    ws.deploy_to_condor('a', 'z.txt')
+    assert [len(e) for e in rsync_calls.entries] == [4, 4, 4]
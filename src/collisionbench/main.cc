@@ -0,0 +1,396 @@
+/*
+ * collisionbench -- micro-benchmarks of the collision checking primitives
+ *
+ * Measures the raw cost of UnitWorld::isValid, isDisentangled,
+ * transitStateToWithContact, calculateVisibilityMatrix2 and
+ * CDModel::collideForDetails on one puzzle, so optimizations of these
+ * primitives can be evaluated without running the whole pipeline.
+ *
+ * The states are generated from a seeded PRNG, so two runs with the same
+ * options check exactly the same queries:
+ *      free: uniform states within the volume of the puzzle, collision free
+ *      colliding: uniform states that collide with the environment
+ *      boundary: the last free state from a free state to a colliding one,
+ *                i.e. free states within the collision resolution of a contact
+ *
+ * Motions are free->free, free->colliding and boundary->free pairs.
+ *
+ * Every benchmark is run with 1, 2, 4, ... up to -t threads (OpenMP), and
+ * the best time of -r repeats is reported. BVH statistics (BV overlap tests
+ * and triangle tests per query) come from CDModel::collideWithStatistics.
+ * Results are written as JSON to stdout, or to the file given by -o.
+ *
+ * The Python counterpart, which also covers OmplDriver::validateMotionPairs,
+ * is `facade.py tools benchmark_collision`.
+ */
+#include <osr/unit_world.h>
+#include <osr/cdmodel.h>
+#include <omp.h>
+#include <unistd.h>
+#include <stdlib.h>
+#include <chrono>
+#include <cmath>
+#include <fstream>
+#include <iostream>
+#include <limits>
+#include <random>
+#include <string>
+#include <thread>
+#include <vector>
+#include <boost/property_tree/ptree.hpp>
+#include <boost/property_tree/ini_parser.hpp>
+
+namespace {
+
+using std::endl;
+using std::string;
+using std::vector;
+using osr::UnitWorld;
+using osr::StateVector;
+using osr::ArrayOfStates;
+
+void usage()
+{
+	std::cerr << "Usage: collisionbench [-n states] [-t max threads] [-r repeat] [-s seed] [-o out.json] <puzzle .cfg file>" << endl
+	          << "\t-n: number of states in each set, default to 1024" << endl
+	          << "\t-t: maximal number of threads, default to all cores" << endl
+	          << "\t-r: repeat each benchmark and report the best, default to 3" << endl
+	          << "\t-s: seed of the state generator, default to 0" << endl;
+}
+
+struct Puzzle {
+	string env_fn;
+	string rob_fn;
+	Eigen::Vector3d vmin, vmax;
+	double cres;
+};
+
+Puzzle
+load_puzzle(const string& fn)
+{
+	namespace pt = boost::property_tree;
+	pt::ptree tree;
+	pt::ini_parser::read_ini(fn, tree);
+	// Keys like volume.min.x contain dots
+	auto get = [&tree](const string& key) -> string {
+		return tree.get<string>(pt::ptree::path_type("problem/" + key, '/'));
+	};
+	auto getd = [&get](const string& key) -> double {
+		return std::stod(get(key));
+	};
+	string dir = ".";
+	auto slash = fn.rfind('/');
+	if (slash != string::npos)
+		dir = fn.substr(0, slash);
+	Puzzle ret;
+	ret.env_fn = dir + "/" + get("world");
+	ret.rob_fn = dir + "/" + get("robot");
+	const char* axes[] = {"x", "y", "z"};
+	for (int i = 0; i < 3; i++) {
+		ret.vmin(i) = getd(string("volume.min.") + axes[i]);
+		ret.vmax(i) = getd(string("volume.max.") + axes[i]);
+	}
+	ret.cres = tree.get<double>(pt::ptree::path_type("problem/collision_resolution", '/'), 0.001);
+	return ret;
+}
+
+/*
+ * Uniform states in OMPL format (x, y, z, qx, qy, qz, qw)
+ */
+ArrayOfStates
+uniform_states(std::mt19937& gen, const Puzzle& puzzle, int n)
+{
+	std::uniform_real_distribution<double> dis(0.0, 1.0);
+	ArrayOfStates qs(n, osr::kStateDimension);
+	for (int i = 0; i < n; i++) {
+		for (int j = 0; j < 3; j++)
+			qs(i, j) = puzzle.vmin(j) + (puzzle.vmax(j) - puzzle.vmin(j)) * dis(gen);
+		// Shoemake's uniform quaternion
+		double u1 = dis(gen), u2 = dis(gen) * 2 * M_PI, u3 = dis(gen) * 2 * M_PI;
+		qs(i, 3) = std::sqrt(1 - u1) * std::sin(u2);
+		qs(i, 4) = std::sqrt(1 - u1) * std::cos(u2);
+		qs(i, 5) = std::sqrt(u1) * std::sin(u3);
+		qs(i, 6) = std::sqrt(u1) * std::cos(u3);
+	}
+	return qs;
+}
+
+struct StateSets {
+	vector<StateVector> free, colliding, boundary;
+	unsigned long attempts = 0;
+};
+
+StateSets
+generate_states(UnitWorld& uw, const Puzzle& puzzle, int n, unsigned seed)
+{
+	std::mt19937 gen(seed);
+	StateSets ret;
+	const unsigned long max_attempts = 1000UL * n;
+	while ((int(ret.free.size()) < n || int(ret.colliding.size()) < n) && ret.attempts < max_attempts) {
+		ArrayOfStates unit = uw.translateOMPLStateToUnitState(uniform_states(gen, puzzle, n));
+		for (int i = 0; i < unit.rows(); i++) {
+			StateVector q = unit.row(i).transpose();
+			auto& set = uw.isValid(q) ? ret.free : ret.colliding;
+			if (int(set.size()) < n)
+				set.emplace_back(q);
+		}
+		ret.attempts += n;
+	}
+	if (ret.free.empty() || ret.colliding.empty())
+		throw std::runtime_error("Cannot sample both free and colliding states in the volume");
+	for (size_t i = 0; i < ret.free.size(); i++) {
+		const auto& to = ret.colliding[i % ret.colliding.size()];
+		ret.boundary.emplace_back(std::get<0>(uw.transitStateToWithContact(ret.free[i], to, uw.getRecommendedCres())));
+	}
+	return ret;
+}
+
+struct Record {
+	string primitive;
+	string set;
+	int threads;
+	long queries;
+	double seconds;
+	double discrete_checks = -1.0; // per query, < 0 if not applicable
+	double bv_tests = -1.0;        // per query
+	double leaf_tests = -1.0;      // per query
+};
+
+double
+now()
+{
+	using namespace std::chrono;
+	return duration<double>(steady_clock::now().time_since_epoch()).count();
+}
+
+/*
+ * Best wall time of f(0) ... f(n-1) over repeat runs with nthreads
+ */
+template<typename F>
+double
+time_parallel(int nthreads, int n, int repeat, F f)
+{
+	double best = std::numeric_limits<double>::max();
+	omp_set_num_threads(nthreads);
+	for (int r = 0; r < repeat; r++) {
+		double t0 = now();
+#pragma omp parallel for schedule(dynamic, 16)
+		for (int i = 0; i < n; i++)
+			f(i);
+		best = std::min(best, now() - t0);
+	}
+	return best;
+}
+
+vector<int>
+thread_counts(int max_threads)
+{
+	vector<int> ret;
+	for (int t = 1; t < max_threads; t *= 2)
+		ret.emplace_back(t);
+	ret.emplace_back(max_threads);
+	return ret;
+}
+
+void
+bvh_statistics(const UnitWorld& uw, const vector<StateVector>& qs, Record& rec)
+{
+	auto env = uw.getCDModel(UnitWorld::GEO_ENV);
+	auto rob = uw.getCDModel(UnitWorld::GEO_ROB);
+	unsigned long total_bv = 0, total_leaf = 0;
+	for (const auto& q : qs) {
+		osr::Transform envTf, robTf;
+		std::tie(envTf, robTf) = uw.getCDTransforms(q);
+		unsigned long bv, leaf;
+		osr::CDModel::collideWithStatistics(*env, envTf, *rob, robTf, bv, leaf);
+		total_bv += bv;
+		total_leaf += leaf;
+	}
+	rec.bv_tests = double(total_bv) / qs.size();
+	rec.leaf_tests = double(total_leaf) / qs.size();
+}
+
+void
+write_json(std::ostream& fout,
+           const string& puzzle_fn,
+           const UnitWorld& uw,
+           unsigned seed,
+           const StateSets& sets,
+           const vector<Record>& records)
+{
+	fout.precision(9);
+	fout << "{" << endl
+	     << "  \"puzzle\": \"" << puzzle_fn << "\"," << endl
+	     << "  \"seed\": " << seed << "," << endl
+	     << "  \"cres\": " << uw.getRecommendedCres() << "," << endl
+	     << "  \"hardware_concurrency\": " << std::thread::hardware_concurrency() << "," << endl
+	     << "  \"sets\": {\"free\": " << sets.free.size()
+	     << ", \"colliding\": " << sets.colliding.size()
+	     << ", \"boundary\": " << sets.boundary.size()
+	     << ", \"attempts\": " << sets.attempts << "}," << endl
+	     << "  \"results\": [" << endl;
+	const char* sep = "";
+	for (const auto& rec : records) {
+		fout << sep << "    {\"primitive\": \"" << rec.primitive << "\""
+		     << ", \"set\": \"" << rec.set << "\""
+		     << ", \"threads\": " << rec.threads
+		     << ", \"queries\": " << rec.queries
+		     << ", \"seconds\": " << rec.seconds
+		     << ", \"queries_per_second\": " << (rec.seconds > 0 ? rec.queries / rec.seconds : 0.0);
+		if (rec.discrete_checks >= 0)
+			fout << ", \"discrete_checks_per_query\": " << rec.discrete_checks;
+		if (rec.bv_tests >= 0)
+			fout << ", \"bv_tests_per_query\": " << rec.bv_tests
+			     << ", \"leaf_tests_per_query\": " << rec.leaf_tests;
+		fout << "}";
+		sep = ",\n";
+	}
+	fout << endl << "  ]" << endl << "}" << endl;
+}
+
+}
+
+int main(int argc, char* argv[])
+{
+	int nstates = 1024;
+	int max_threads = std::max(1, omp_get_num_procs());
+	int repeat = 3;
+	unsigned seed = 0;
+	string out_fn;
+	int opt;
+	while ((opt = getopt(argc, argv, "n:t:r:s:o:h")) != -1) {
+		switch (opt) {
+			case 'n':
+				nstates = atoi(optarg);
+				break;
+			case 't':
+				max_threads = atoi(optarg);
+				break;
+			case 'r':
+				repeat = atoi(optarg);
+				break;
+			case 's':
+				seed = strtoul(optarg, nullptr, 10);
+				break;
+			case 'o':
+				out_fn = optarg;
+				break;
+			default:
+				usage();
+				return -1;
+		}
+	}
+	if (optind >= argc || nstates <= 0 || max_threads <= 0 || repeat <= 0) {
+		usage();
+		return -1;
+	}
+	string puzzle_fn = argv[optind];
+	Puzzle puzzle = load_puzzle(puzzle_fn);
+
+	UnitWorld uw;
+	uw.loadModelFromFile(puzzle.env_fn);
+	uw.loadRobotFromFile(puzzle.rob_fn);
+	uw.scaleToUnit();
+	uw.angleModel(0.0, 0.0);
+	uw.setRecommendedCres(uw.getSceneScale() * puzzle.cres);
+	const double cres = uw.getRecommendedCres();
+
+	auto sets = generate_states(uw, puzzle, nstates, seed);
+	std::cerr << "[collisionbench] " << sets.free.size() << " free, "
+	          << sets.colliding.size() << " colliding states from "
+	          << sets.attempts << " samples" << endl;
+
+	vector<std::pair<string, const vector<StateVector>*>> state_sets = {
+		{"free", &sets.free},
+		{"colliding", &sets.colliding},
+		{"boundary", &sets.boundary},
+	};
+	struct MotionSet {
+		string name;
+		vector<StateVector> from, to;
+	};
+	vector<MotionSet> motion_sets(3);
+	motion_sets[0].name = "free_to_free";
+	motion_sets[1].name = "free_to_colliding";
+	motion_sets[2].name = "boundary_to_free";
+	for (size_t i = 0; i < sets.free.size(); i++) {
+		motion_sets[0].from.emplace_back(sets.free[i]);
+		motion_sets[0].to.emplace_back(sets.free[(i + 1) % sets.free.size()]);
+		motion_sets[1].from.emplace_back(sets.free[i]);
+		motion_sets[1].to.emplace_back(sets.colliding[i % sets.colliding.size()]);
+		motion_sets[2].from.emplace_back(sets.boundary[i]);
+		motion_sets[2].to.emplace_back(sets.free[i]);
+	}
+
+	vector<Record> records;
+	for (int threads : thread_counts(max_threads)) {
+		for (const auto& ss : state_sets) {
+			const auto& qs = *ss.second;
+			int n = qs.size();
+			Record rec{"isValid", ss.first, threads, n};
+			rec.seconds = time_parallel(threads, n, repeat, [&](int i) { uw.isValid(qs[i]); });
+			if (threads == 1)
+				bvh_statistics(uw, qs, rec);
+			records.emplace_back(rec);
+
+			Record rec2{"isDisentangled", ss.first, threads, n};
+			rec2.seconds = time_parallel(threads, n, repeat, [&](int i) { uw.isDisentangled(qs[i]); });
+			records.emplace_back(rec2);
+		}
+		{
+			const auto& qs = sets.colliding;
+			int n = qs.size();
+			auto env = uw.getCDModel(UnitWorld::GEO_ENV);
+			auto rob = uw.getCDModel(UnitWorld::GEO_ROB);
+			Record rec{"collideForDetails", "colliding", threads, n};
+			rec.seconds = time_parallel(threads, n, repeat, [&](int i) {
+				osr::Transform envTf, robTf;
+				std::tie(envTf, robTf) = uw.getCDTransforms(qs[i]);
+				Eigen::Matrix<int, -1, 2> facePairs;
+				osr::CDModel::collideForDetails(*env, envTf, *rob, robTf, facePairs);
+			});
+			records.emplace_back(rec);
+		}
+		for (const auto& ms : motion_sets) {
+			int n = ms.from.size();
+			Record rec{"transitStateToWithContact", ms.name, threads, n};
+			rec.seconds = time_parallel(threads, n, repeat, [&](int i) {
+				uw.transitStateToWithContact(ms.from[i], ms.to[i], cres);
+			});
+			records.emplace_back(rec);
+		}
+		{
+			// calculateVisibilityMatrix2 parallelizes by itself
+			ArrayOfStates qs0(sets.boundary.size(), osr::kStateDimension);
+			ArrayOfStates qs1(sets.free.size(), osr::kStateDimension);
+			for (size_t i = 0; i < sets.boundary.size(); i++)
+				qs0.row(i) = sets.boundary[i].transpose();
+			for (size_t i = 0; i < sets.free.size(); i++)
+				qs1.row(i) = sets.free[i].transpose();
+			// Keep the matrix around 64K motions
+			int n0 = std::min<int>(qs0.rows(), 256);
+			qs0.conservativeResize(n0, Eigen::NoChange);
+			qs1.conservativeResize(n0, Eigen::NoChange);
+			omp_set_num_threads(threads);
+			Record rec{"calculateVisibilityMatrix2", "boundary_x_free", threads, long(n0) * n0};
+			rec.seconds = std::numeric_limits<double>::max();
+			for (int r = 0; r < repeat; r++) {
+				uw.resetDiscreteCheckCount();
+				double t0 = now();
+				uw.calculateVisibilityMatrix2(qs0, true, qs1, true, cres, threads > 1);
+				rec.seconds = std::min(rec.seconds, now() - t0);
+			}
+			rec.discrete_checks = double(uw.getDiscreteCheckCount()) / rec.queries;
+			records.emplace_back(rec);
+		}
+		std::cerr << "[collisionbench] " << threads << " thread(s) done" << endl;
+	}
+
+	if (out_fn.empty()) {
+		write_json(std::cout, puzzle_fn, uw, seed, sets, records);
+	} else {
+		std::ofstream fout(out_fn);
+		write_json(fout, puzzle_fn, uw, seed, sets, records);
+	}
+	return 0;
+}